@@ -0,0 +1,158 @@
+"""In-process access to the Aronnax core.
+
+The core is also built as a shared library, libaronnax.so, which this
+module loads with ctypes.  A run through it takes its parameters as
+namelist text and its input fields as numpy arrays, and hands back its
+final state and layer diagnostics as numpy arrays, with no subprocess
+and no input or output files.  This suits parameter sweeps over small
+grids, whose cost would otherwise be dominated by starting the core
+and passing data through the file system.
+"""
+
+import ctypes
+import os
+import os.path as p
+
+import numpy as np
+
+self_path = p.dirname(p.abspath(__file__))
+root_path = p.dirname(self_path)
+
+library_name = "libaronnax.so"
+
+_library = None
+
+def load_library():
+    """Load the shared library of the core, once per process.
+
+    The library must already have been built, with `make libaronnax.so`
+    in the root of the repository."""
+    global _library
+    if _library is None:
+        # The core writes its error messages to unit 17, which the
+        # Fortran runtime reads from the environment when it is loaded
+        os.environ.setdefault("GFORTRAN_STDERR_UNIT", "17")
+        # MPI needs its symbols to be visible to the libraries it loads
+        library = ctypes.CDLL(p.join(root_path, library_name),
+                              mode=ctypes.RTLD_GLOBAL)
+        c_int_p = ctypes.POINTER(ctypes.c_int)
+        c_double_p = ctypes.POINTER(ctypes.c_double)
+        library.aronnax_setup.argtypes = [ctypes.c_char_p, ctypes.c_int]
+        library.aronnax_setup.restype = None
+        library.aronnax_grid.argtypes = [c_int_p]*5
+        library.aronnax_grid.restype = None
+        library.aronnax_set_field.argtypes = [
+            ctypes.c_char_p, ctypes.c_int, c_double_p, c_int_p]
+        library.aronnax_set_field.restype = None
+        library.aronnax_run.argtypes = [c_double_p]*5
+        library.aronnax_run.restype = None
+        library.aronnax_release.argtypes = []
+        library.aronnax_release.restype = None
+        _library = library
+    return _library
+
+def field_shapes(nx, ny, layers, nTimeSteps):
+    """The shapes, without the halo, of the fields a run can be given.
+
+    The arrays are laid out as the input generators in `aronnax.core`
+    make them, with the layer first and x last."""
+    return {
+        "h"                    : (layers, ny, nx),
+        "u"                    : (layers, ny, nx+1),
+        "v"                    : (layers, ny+1, nx),
+        "eta"                  : (1, ny, nx),
+        "depth"                : (1, ny, nx),
+        "wetmask"              : (1, ny, nx),
+        "fu"                   : (1, ny, nx+1),
+        "fv"                   : (1, ny+1, nx),
+        "base_wind_x"          : (1, ny, nx+1),
+        "base_wind_y"          : (1, ny+1, nx),
+        "wind_mag_time_series" : (nTimeSteps,),
+        "spongeHTimeScale"     : (layers, ny, nx),
+        "spongeUTimeScale"     : (layers, ny, nx+1),
+        "spongeVTimeScale"     : (layers, ny+1, nx),
+        "spongeH"              : (layers, ny, nx),
+        "spongeU"              : (layers, ny, nx+1),
+        "spongeV"              : (layers, ny+1, nx),
+    }
+
+def model_run(parameters, fields):
+    """Run the Aronnax core in this process.
+
+        :param str parameters: Namelists for the run, as in parameters.in
+        :param dict fields: Input fields by name (see `field_shapes`),
+            which replace those read from the files the namelists name,
+            or the defaults if they name none
+
+    Returns a dictionary holding the final `h`, `u` and `v`, and `eta`
+    unless the run is reduced gravity, in the same staggered (x, y,
+    layers) arrays as `aronnax.core.interpret_raw_file` reads from the
+    output files.  Its `diagnostics` entry holds the mean, maximum,
+    minimum and standard deviation of each layer of the final `h`,
+    `u` and `v` over the wet points, as a (layers, 4) array for each.
+    These are only for the end of the run: the time series that the
+    diagnostic files hold at intervals of `diagFreq`, and the pressure
+    solver and time step statistics, are not available in process.
+
+    The run writes no output, diagnostic or checkpoint files, and must
+    be on a single process (`nProcX` = `nProcY` = 1).  Input fields of
+    the wrong name or shape, and a negative depth field, raise
+    ValueError.  Any other failure stops the whole process, as the
+    core does; `aronnax.driver.simulate_in_process` checks the number
+    of processes and the depth before starting the core."""
+    library = load_library()
+    parameters = parameters.encode("ascii")
+    library.aronnax_setup(parameters, len(parameters))
+
+    grid = [ctypes.c_int() for _ in range(5)]
+    library.aronnax_grid(*[ctypes.byref(n) for n in grid])
+    nx, ny, layers, nTimeSteps, red_grav = [n.value for n in grid]
+    shapes = field_shapes(nx, ny, layers, nTimeSteps)
+
+    # Check all the fields before handing any of them over, so that a
+    # mistake leaves the core ready for the next run
+    arrays = {}
+    for name, values in fields.items():
+        if name not in shapes:
+            library.aronnax_release()
+            raise ValueError("Aronnax has no input field %s" % (name,))
+        values = np.ascontiguousarray(values, dtype=np.float64)
+        if values.size != np.prod(shapes[name]):
+            library.aronnax_release()
+            raise ValueError("%s should have shape %s, but has shape %s"
+                             % (name, shapes[name], values.shape))
+        if name == "depth" and not red_grav and np.amin(values) < 0:
+            library.aronnax_release()
+            raise ValueError("Depths must be positive.")
+        arrays[name] = values
+    for name, values in arrays.items():
+        status = ctypes.c_int()
+        library.aronnax_set_field(name.encode("ascii"), len(name),
+                                  as_pointer(values), ctypes.byref(status))
+        assert status.value == 0
+
+    h = np.empty((layers, ny+2, nx+2))
+    u = np.empty((layers, ny+2, nx+2))
+    v = np.empty((layers, ny+2, nx+2))
+    eta = np.empty((1, ny+2, nx+2))
+    diagnostics = np.empty((3, layers, 4))
+    library.aronnax_run(as_pointer(h), as_pointer(u), as_pointer(v),
+                        as_pointer(eta), as_pointer(diagnostics))
+
+    # Drop the halo, but keep the faces on both edges of the domain
+    result = {
+        "h": h[:, 1:ny+1, 1:nx+1].transpose(),
+        "u": u[:, 1:ny+1, 1:nx+2].transpose(),
+        "v": v[:, 1:ny+2, 1:nx+1].transpose(),
+        "diagnostics": {
+            "h": diagnostics[0],
+            "u": diagnostics[1],
+            "v": diagnostics[2],
+        },
+    }
+    if not red_grav:
+        result["eta"] = eta[:, 1:ny+1, 1:nx+1].transpose()
+    return result
+
+def as_pointer(array):
+    return array.ctypes.data_as(ctypes.POINTER(ctypes.c_double))
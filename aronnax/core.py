@@ -7,7 +7,10 @@ Core
 This file contains all of the classes for the module.
 """
 
+from collections import OrderedDict
+import ConfigParser as par
 from contextlib import contextmanager
+import os
 import os.path as p
 import re
 
@@ -70,6 +73,40 @@ def interpret_raw_file(name, nx, ny, layers):
     Hence, the parameters nx, ny, and layers, as well as the file
     naming convetion, suffice to interpret the content (assuming it
     was generated on the same system)."""
+    dx, dy, layers = raw_file_staggering(name, layers)
+    with fortran_file(name, 'r') as f:
+        return f.read_reals(dtype=np.float64) \
+                    .reshape(layers, ny+dy, nx+dx).transpose()
+
+def memmap_raw_file(name, nx, ny, layers):
+    """Memory-map an output file dumped by the Aronnax core.
+
+    Returns the same array as `interpret_raw_file`, but as a read-only
+    view onto the file rather than a copy of it.  Nothing is read
+    until the array is used, and then only the pages that are needed,
+    so taking one layer or one section from each of a long series of
+    outputs is much cheaper than reading them all in full."""
+    dx, dy, layers = raw_file_staggering(name, layers)
+    shape = (layers, ny+dy, nx+dx)
+    # The array is the payload of a single Fortran record, between
+    # two markers that hold its length in bytes.
+    marker = np.dtype(np.uint32)
+    size = int(np.prod(shape))*np.dtype(np.float64).itemsize
+    with open(name, 'rb') as f:
+        head = np.fromfile(f, dtype=marker, count=1)
+    if (len(head) != 1 or head[0] != size
+        or p.getsize(name) != size + 2*marker.itemsize):
+        raise ValueError("{0} does not hold a {1} by {2} by {3} array"
+            .format(name, nx+dx, ny+dy, layers))
+    return np.memmap(name, dtype=np.float64, mode='r',
+        offset=marker.itemsize, shape=shape).transpose()
+
+def raw_file_staggering(name, layers):
+    """Work out where on the grid the array in an output file lives.
+
+    Returns the number of extra points in x and y (1 for fields on
+    the cell faces, 0 at the tracer points) and the number of layers
+    in the file, which is 1 for barotropic and surface fields."""
     # Note: This depends on inspection of the output writing code in
     # the Aronnax core, to align array sizes and dimensions.  In
     # particular, Fortran arrays are indexed in decreasing order of
@@ -121,9 +158,137 @@ def interpret_raw_file(name, nx, ny, layers):
         dx = 1
     if file_part.startswith("debug.dvdt"):
         dy = 1
-    with fortran_file(name, 'r') as f:
-        return f.read_reals(dtype=np.float64) \
-                    .reshape(layers, ny+dy, nx+dx).transpose()
+    return dx, dy, layers
+
+output_file_rx = re.compile(r'^((?:snap|av|debug)\.\w+)\.(\d+)$')
+
+def open_output(work_dir=".", config_path="aronnax-merged.conf",
+                output_path="output", cache_size=64):
+    """Open the raw output of a simulation for lazy reading.
+
+    The grid size and time step are read from the configuration
+    saved by `simulate` in `work_dir`, and every output file in the
+    output directory is found.  Returns an `Output`, which maps each
+    kind of output, such as 'snap.h', 'av.u' or 'debug.dvdt', to an
+    `OutputField` over all the times at which it was written.
+
+    Nothing is read from the output files until a field is indexed.
+    Each field then keeps up to `cache_size` layers of its output in
+    memory, discarding the least recently used first."""
+    config = par.RawConfigParser()
+    config.optionxform = str
+    with open(p.join(work_dir, config_path)) as f:
+        config.readfp(f)
+    nx = config.getint("grid", "nx")
+    ny = config.getint("grid", "ny")
+    layers = config.getint("grid", "layers")
+    dt = config.getfloat("numerics", "dt")
+
+    output_dir = p.join(work_dir, output_path)
+    files = {}
+    for file_part in sorted(os.listdir(output_dir)):
+        m = re.match(output_file_rx, file_part)
+        if m:
+            files.setdefault(m.group(1), []).append(
+                (int(m.group(2)), p.join(output_dir, file_part)))
+    fields = {}
+    for name, found in files.iteritems():
+        fields[name] = OutputField(name, [f for (_, f) in sorted(found)],
+            np.array(sorted(n for (n, _) in found)), dt,
+            nx, ny, layers, cache_size)
+    return Output(nx, ny, layers, dt, fields)
+
+class Output(object):
+    """All the raw output of a simulation, as returned by `open_output`.
+
+    Indexing with the name of a kind of output gives its
+    `OutputField`; `keys` lists the names available."""
+
+    def __init__(self, nx, ny, layers, dt, fields):
+        self.nx = nx
+        self.ny = ny
+        self.layers = layers
+        self.dt = dt
+        self.fields = fields
+
+    def __getitem__(self, name):
+        return self.fields[name]
+
+    def __contains__(self, name):
+        return name in self.fields
+
+    def keys(self):
+        return sorted(self.fields.keys())
+
+class OutputField(object):
+    """One kind of output at all the times it was written.
+
+    Indexes like a numpy array of shape (time, x, y, layers), with
+    the same staggering in x and y as `interpret_raw_file`.  Integers,
+    slices and lists may be used in each dimension.  Only the layers
+    of the output times that are selected are read, one layer of one
+    file at a time, and the most recently read are cached.
+
+    The iteration number of each output is in `iter`, and the model
+    time in seconds, taken as `iter` times `dt`, is in `time`.  With
+    an adaptive time step this is only nominal."""
+
+    def __init__(self, name, files, iters, dt, nx, ny, layers, cache_size):
+        self.name = name
+        self.files = files
+        self.iter = iters
+        self.time = iters*dt
+        dx, dy, layers = raw_file_staggering(name, layers)
+        self.nx = nx
+        self.ny = ny
+        self.shape = (len(files), nx+dx, ny+dy, layers)
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) > self.ndim:
+            raise IndexError("too many indices for " + self.name)
+        key = key + (slice(None),)*(self.ndim - len(key))
+        t_key, x_key, y_key, k_key = key
+        times = np.arange(self.shape[0])[t_key]
+        layers = np.arange(self.shape[3])[k_key]
+        section_shape = np.empty(self.shape[1:3], dtype=bool)[x_key, y_key] \
+                          .shape
+
+        result = np.empty((np.size(times), np.size(layers)) + section_shape)
+        for i, t in enumerate(np.atleast_1d(times)):
+            for j, k in enumerate(np.atleast_1d(layers)):
+                result[i, j] = self._layer(t, k)[x_key, y_key]
+        # Put the layers last, as in the output files
+        result = np.rollaxis(result, 1, result.ndim)
+        if np.ndim(layers) == 0:
+            result = result[..., 0]
+        if np.ndim(times) == 0:
+            result = result[0]
+        return result
+
+    def _layer(self, t, k):
+        """One layer of one output, from the cache if it is there."""
+        chunk = (t, k)
+        if chunk in self._cache:
+            values = self._cache.pop(chunk)
+        else:
+            mapped = memmap_raw_file(self.files[t], self.nx, self.ny,
+                                     self.shape[3])
+            values = np.array(mapped[:, :, k])
+        self._cache[chunk] = values
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return values
 
 
 ### General input construction helpers
@@ -215,7 +380,7 @@ def rectangular_pool(grid, field_layers):
     """The wet mask file for a maximal rectangular pool."""
     assert field_layers == 1
     nx = grid.nx; ny = grid.ny
-    wetmask = np.ones((nx, ny), dtype=np.float64)
+    wetmask = np.ones((ny, nx), dtype=np.float64)
     wetmask[ 0, :] = 0
     wetmask[-1, :] = 0
     wetmask[ :, 0] = 0
@@ -261,8 +426,8 @@ def interpret_requested_data(requested_data, shape, config):
     - A string giving the path to a raw Fortran array file, whose
       content will be used as-is;
 
-    - TODO A numpy array in memory, whose content will be used as-is,
-      or TODO interpolated; or
+    - A numpy array in memory, whose content will be used as-is, or
+      TODO interpolated; or
 
     - A string specifying auto-generation of the required data, in this format:
       :<generator_func_name>:arg1,arg2,...argn
@@ -291,6 +456,8 @@ def interpret_requested_data(requested_data, shape, config):
             # Assume Fortran file name
             with fortran_file(requested_data, 'r') as f:
                 return f.read_reals(dtype=np.float64)
+    elif isinstance(requested_data, np.ndarray):
+        return requested_data
     else:
         if shape == "2dT" or shape == "3dT":
             return tracer_point_variable(grid, field_layers, *requested_data)
@@ -4,14 +4,19 @@ import os.path as p
 import subprocess as sub
 import time
 
+import numpy as np
+
+from aronnax.bindings import model_run
 from aronnax.core import fortran_file
 from aronnax.core import interpret_requested_data
+from aronnax.postprocess import Task, postprocess, to_netcdf
 from aronnax.utils import working_directory
 
 self_path = p.dirname(p.abspath(__file__))
 root_path = p.dirname(self_path)
 
-def simulate(work_dir=".", config_path="aronnax.conf", **options):
+def simulate(work_dir=".", config_path="aronnax.conf", postprocessing=None,
+             **options):
     """Main entry point for running an Aronnax simulation.
 
     A simulation occurs in the working directory given by the
@@ -30,6 +35,8 @@ def simulate(work_dir=".", config_path="aronnax.conf", **options):
           in Fortran raw array format
         - output/ - subdirectory where Aronnax will save output field files
           in Fortran raw array format
+        - netcdf-output/ - subdirectory where Aronnax will save its output
+          in NetCDF format, if `output_format` is 2
 
     The process for a simulation is to
 
@@ -40,6 +47,8 @@ def simulate(work_dir=".", config_path="aronnax.conf", **options):
         5. Write parameters.in
         6. Execute the Fortran core, which writes progress messages
            to standard output and raw-format output fields into output/
+        7. Carry out the `postprocessing` tasks, if any are given (see
+           `aronnax.postprocess.postprocess`)
 
     All the simulation parameters can be controlled from the
     configuration file aronnax.conf, and additionally can be
@@ -62,17 +71,70 @@ def simulate(work_dir=".", config_path="aronnax.conf", **options):
         # sub.check_call(["rm", "-rf", "output/"])
         sub.check_call(["mkdir", "-p", "output/"])
         sub.check_call(["mkdir", "-p", "checkpoints/"])
+        sub.check_call(["mkdir", "-p", "netcdf-output/"])
         with working_directory("input"):
             generate_input_data_files(config)
         generate_parameters_file(config)
         then = time.time()
         run_executable(config)
         core_run_time = time.time() - then
-        sub.check_call(["rm", "-rf", "netcdf-output/"])
-        sub.check_call(["mkdir", "-p", "netcdf-output/"])
-        convert_output_to_netcdf(config)
+        if postprocessing:
+            postprocess(postprocessing)
         return core_run_time
 
+def simulate_in_process(work_dir=".", config_path="aronnax.conf", **options):
+    """Run an Aronnax simulation inside this Python process.
+
+    The configuration is computed as for `simulate`, but the Fortran
+    core is run through its shared library (see `aronnax.bindings`)
+    rather than as a separate program.  The input fields are handed
+    to it as arrays, and nothing is written to input/ or output/, nor
+    are aronnax-merged.conf and parameters.in.  Input fields may also
+    be given as numpy arrays, laid out as the input generators make
+    them.
+
+    Returns the final state and layer diagnostics, as described in
+    `aronnax.bindings.model_run`.  This avoids the cost of starting the
+    core and of passing its input and output through files, which
+    dominates small runs such as those of a parameter sweep.  The run
+    must be on a single process, and can not write output during the
+    run or checkpoints.
+
+    Raises ValueError, before the core is started, if the configuration
+    asks for more than one process or for a negative depth, which would
+    otherwise stop the whole Python process.
+    """
+    config_file = p.join(work_dir, config_path)
+    config = default_configuration()
+    config.read(config_file)
+    merge_config(config, options)
+    procs = [config.getint("pressure_solver", name)
+             if config.has_option("pressure_solver", name) else 1
+             for name in ["nProcX", "nProcY"]]
+    if procs != [1, 1]:
+        raise ValueError("An in-process simulation must have nProcX = nProcY"
+                         " = 1, not nProcX = %d and nProcY = %d" % tuple(procs))
+    red_grav = (config.has_option("model", "RedGrav")
+                and config.getboolean("model", "RedGrav"))
+    with working_directory(work_dir):
+        compile_library()
+        fields = {}
+        # Input files are named relative to input/, as for `simulate`
+        with working_directory("input"):
+            for name, field in input_fields.iteritems():
+                section = section_map[name]
+                if not config.has_option(section, name):
+                    continue
+                fields[field] = interpret_requested_data(
+                    config.get(section, name), data_types[name], config)
+        # Without a depth field, the core uses H0 everywhere
+        if (not red_grav and "depth" not in fields
+            and config.has_option("model", "H0")
+            and config.getfloat("model", "H0") < 0):
+            raise ValueError("Depths must be positive, but H0 is %s"
+                             % (config.get("model", "H0"),))
+        return model_run(parameters_namelist(config, in_memory=True), fields)
+
 def default_configuration():
     """Configuration defaults before parsing aronnax.conf.
 
@@ -101,6 +163,7 @@ section_map = {
     "dumpFreq"             : "numerics",
     "avFreq"               : "numerics",
     "checkpointFreq"       : "numerics",
+    "keep_checkpoints"     : "numerics",
     "diagFreq"             : "numerics",
     "hmin"                 : "numerics",
     "maxits"               : "numerics",
@@ -108,14 +171,24 @@ section_map = {
     "freesurfFac"          : "numerics",
     "thickness_error"      : "numerics",
     "debug_level"          : "numerics",
+    "output_format"        : "numerics",
+    "deflate_level"        : "numerics",
     "hAdvecScheme"         : "numerics",
+    "tendency_algorithm"   : "numerics",
     "TS_algorithm"         : "numerics",
+    "adaptive_dt"          : "numerics",
+    "dt_min"               : "numerics",
+    "dt_max"               : "numerics",
+    "max_cfl"              : "numerics",
     "hmean"                : "model",
     "depthFile"            : "model",
     "H0"                   : "model",
     "RedGrav"              : "model",
     "nProcX"               : "pressure_solver",
     "nProcY"               : "pressure_solver",
+    "solver_algorithm"     : "pressure_solver",
+    "solver_first_guess"   : "pressure_solver",
+    "barotropic_substeps"  : "pressure_solver",
     "spongeHTimeScaleFile" : "sponge",
     "spongeUTimeScaleFile" : "sponge",
     "spongeVTimeScaleFile" : "sponge",
@@ -132,6 +205,8 @@ section_map = {
     "fUfile"               : "grid",
     "fVfile"               : "grid",
     "wetMaskFile"          : "grid",
+    "periodicX"            : "grid",
+    "periodicY"            : "grid",
     "initUfile"            : "initial_conditions",
     "initVfile"            : "initial_conditions",
     "initHfile"            : "initial_conditions",
@@ -145,6 +220,7 @@ section_map = {
     "exe"                  : "executable",
     "valgrind"             : "executable",
     "perf"                 : "executable",
+    "threads"              : "executable",
 }
 
 def merge_config(config, options):
@@ -156,8 +232,8 @@ def merge_config(config, options):
             section = section_map[k]
             if not config.has_section(section):
                 config.add_section(section)
-            if v == True: v = "yes"
-            if v == False: v = "no"
+            if isinstance(v, bool):
+                v = "yes" if v else "no"
             config.set(section, k, v)
         else:
             raise Exception("Unrecognized option", k)
@@ -168,6 +244,11 @@ def compile_core(config):
     with working_directory(root_path):
         sub.check_call(["make", core_name])
 
+def compile_library():
+    """Compile the shared library of the Aronnax core, if needed."""
+    with working_directory(root_path):
+        sub.check_call(["make", "libaronnax.so"])
+
 data_types = {
     "depthFile"            : "2dT",
     "spongeHTimeScaleFile" : "3dT",
@@ -188,6 +269,27 @@ data_types = {
     "wind_mag_time_series_file" : "time",
 }
 
+# The fields of the core that the input file options fill in
+input_fields = {
+    "depthFile"            : "depth",
+    "spongeHTimeScaleFile" : "spongeHTimeScale",
+    "spongeUTimeScaleFile" : "spongeUTimeScale",
+    "spongeVTimeScaleFile" : "spongeVTimeScale",
+    "spongeHFile"          : "spongeH",
+    "spongeUFile"          : "spongeU",
+    "spongeVFile"          : "spongeV",
+    "fUfile"               : "fu",
+    "fVfile"               : "fv",
+    "wetMaskFile"          : "wetmask",
+    "initUfile"            : "u",
+    "initVfile"            : "v",
+    "initHfile"            : "h",
+    "initEtaFile"          : "eta",
+    "zonalWindFile"        : "base_wind_x",
+    "meridionalWindFile"   : "base_wind_y",
+    "wind_mag_time_series_file" : "wind_mag_time_series",
+}
+
 def is_file_name_option(name):
     return name.endswith("File") or name.endswith("file")
 
@@ -219,8 +321,11 @@ def fortran_option_string(section, name, config):
             return "'%s'" % (p.join("input", name + '.bin'),)
         else:
             return "''"
-    if name in ["RedGrav", "DumpWind", "RelativeWind"]:
-        if config.getboolean(section, name):
+    if name in ["RedGrav", "DumpWind", "RelativeWind", "adaptive_dt",
+                "periodicX", "periodicY"]:
+        if not config.has_option(section, name):
+            return None
+        elif config.getboolean(section, name):
             return ".TRUE."
         else:
             return ".FALSE."
@@ -232,27 +337,45 @@ def fortran_option_string(section, name, config):
 
 def generate_parameters_file(config):
     with open('parameters.in', 'w') as f:
-        for section in config.sections():
-            if section not in sections:
-                raise Exception("Detected unexpected section name %s", section)
-            f.write(' &')
-            f.write(section.upper())
-            f.write('\n')
-            for (name, section1) in section_map.iteritems():
-                if section1 != section: continue
+        f.write(parameters_namelist(config))
+
+def parameters_namelist(config, in_memory=False):
+    """Render the configuration as the Fortran namelists the core reads.
+
+    If `in_memory` is true, the input fields will be handed to the core
+    directly, so no input files are named."""
+    lines = []
+    for section in config.sections():
+        if section not in sections:
+            raise Exception("Detected unexpected section name %s", section)
+        lines.append(' &' + section.upper())
+        for (name, section1) in section_map.iteritems():
+            if section1 != section: continue
+            if in_memory and is_file_name_option(name):
+                val = "''"
+            else:
                 val = fortran_option_string(section, name, config)
-                if val is not None:
-                    f.write(' %s = %s,\n' % (name, val))
-            f.write(' /\n')
+            if val is not None:
+                lines.append(' %s = %s,' % (name, val))
+        lines.append(' /')
+    return '\n'.join(lines) + '\n'
 
 def run_executable(config):
     """Run the compiled Fortran core, possibly in a test or debug regime."""
     core_name = config.get("executable", "exe")
     env = dict(os.environ, GFORTRAN_STDERR_UNIT="17")
+    # One process for each tile of the domain decomposition
+    num_procs = str(config.getint("pressure_solver", "nProcX")
+                    * config.getint("pressure_solver", "nProcY"))
+    # OpenMP threads for each process. If not given, the OpenMP
+    # runtime decides, or honours OMP_NUM_THREADS from the environment.
+    if config.has_option("executable", "threads"):
+        threads = config.get("executable", "threads")
+        if threads: env["OMP_NUM_THREADS"] = str(threads)
     if config.getboolean("executable", "valgrind") \
        or 'ARONNAX_TEST_VALGRIND_ALL' in os.environ:
         assert not config.getboolean("executable", "perf")
-        sub.check_call(["mpirun", "-np", "1",
+        sub.check_call(["mpirun", "-np", num_procs,
             "valgrind", "--error-exitcode=5", p.join(root_path, core_name)],
             env=env)
     elif config.getboolean("executable", "perf"):
@@ -264,8 +387,15 @@ def run_executable(config):
             "-e", "branch-instructions", "-e", "branch-misses"]
         sub.check_call(perf_cmds + [p.join(root_path, core_name)], env=env)
     else:
-        sub.check_call(["mpirun", "-np", "1", p.join(root_path, core_name)], env=env)
+        sub.check_call(["mpirun", "-np", num_procs,
+            p.join(root_path, core_name)], env=env)
+
+def convert_output_to_netcdf(work_dir=".", processes=None):
+    """Convert the raw output of a simulation to NetCDF, one file per output.
 
-def convert_output_to_netcdf(config):
-    # TODO Issue #30
-    pass
+    The files are written to netcdf-output/, named after the raw files
+    with a .nc extension.  With `output_format` = 2 the core writes
+    NetCDF files itself, and this is not needed."""
+    tasks = [Task(to_netcdf, "output/%s.*" % prefix, "netcdf-output/{name}.nc")
+             for prefix in ["snap", "av", "debug"]]
+    return postprocess(tasks, work_dir, processes)
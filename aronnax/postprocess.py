@@ -0,0 +1,172 @@
+"""Post-processing of Aronnax output.
+
+Post-processing turns each of a set of raw output files into a new
+file, for example converting it to NetCDF, reducing it to a few
+numbers, or rendering it as an image.  The files are processed in
+parallel, and work that has already been done is not repeated, so an
+interrupted or extended run can be post-processed again cheaply.
+"""
+
+import ConfigParser as par
+import glob
+from multiprocessing import Pool
+import os
+import os.path as p
+import re
+
+from aronnax.core import Grid
+from aronnax.core import interpret_raw_file
+from aronnax.core import raw_file_staggering
+
+class Task(object):
+    """Something to do with each of a set of output files.
+
+        :param func: Function to apply, called as func(infile, outfile, grid)
+        :param str pattern: Glob matching the files to process, relative
+            to the working directory, such as "output/snap.h.*"
+        :param str target: Name of the file to write for each of them,
+            in which "{name}" is replaced by the name of the output file,
+            such as "netcdf-output/{name}.nc"
+
+    `func` is called with the path of an output file, the path it
+    should write its result to, and a `Grid` for the simulation.  As
+    it runs in a separate process, it must be defined at the top level
+    of a module."""
+
+    def __init__(self, func, pattern, target):
+        self.func = func
+        self.pattern = pattern
+        self.target = target
+
+def postprocess(tasks, work_dir=".", processes=None,
+                config_path="aronnax-merged.conf"):
+    """Carry out the given post-processing `tasks` on the output of a simulation.
+
+    The tasks for all the matching files are shared among `processes`
+    worker processes, which defaults to the number of CPUs on the
+    machine.  A file is skipped if its target is already newer than
+    it, and each target is written under a temporary name and renamed
+    once it is complete, so a post-processing run that is interrupted
+    can just be run again.
+
+    Returns a list with, for each task, the targets for all its files,
+    in the order of the files."""
+    config = par.RawConfigParser()
+    config.optionxform = str
+    with open(p.join(work_dir, config_path)) as f:
+        config.readfp(f)
+    grid = Grid(config.getint("grid", "nx"), config.getint("grid", "ny"),
+                config.getint("grid", "layers"),
+                config.getfloat("grid", "dx"), config.getfloat("grid", "dy"))
+
+    targets = []
+    jobs = []
+    for task in tasks:
+        infiles = sorted(glob.glob(p.join(work_dir, task.pattern)))
+        outfiles = [p.join(work_dir, task.target.format(name=p.basename(f)))
+                    for f in infiles]
+        targets.append(outfiles)
+        for infile, outfile in zip(infiles, outfiles):
+            if not is_up_to_date(outfile, infile):
+                jobs.append((task.func, infile, outfile, grid))
+
+    if processes == 1 or len(jobs) <= 1:
+        for job in jobs:
+            run_job(job)
+    else:
+        pool = Pool(processes)
+        try:
+            # Ordered, so that failures are reported for the earliest file
+            for _ in pool.imap(run_job, jobs):
+                pass
+        finally:
+            pool.close()
+            pool.join()
+    return targets
+
+def is_up_to_date(outfile, infile):
+    return p.exists(outfile) and p.getmtime(outfile) >= p.getmtime(infile)
+
+def run_job(job):
+    """Write one target, under a temporary name until it is complete."""
+    (func, infile, outfile, grid) = job
+    out_dir, out_name = p.split(outfile)
+    if out_dir and not p.isdir(out_dir):
+        try:
+            os.makedirs(out_dir)
+        except OSError:
+            # Another worker may have just made it
+            if not p.isdir(out_dir):
+                raise
+    # Keep the extension, which some writers use to choose the format
+    tmpfile = p.join(out_dir, ".tmp." + out_name)
+    try:
+        func(infile, tmpfile, grid)
+        os.rename(tmpfile, outfile)
+    finally:
+        if p.exists(tmpfile):
+            os.remove(tmpfile)
+    return outfile
+
+### Tasks
+
+def to_netcdf(infile, outfile, grid):
+    """Convert a raw output file to NetCDF.
+
+    The file has the same layout as the NetCDF output of the core,
+    with one record along the `time` dimension, holding the field
+    named after the output file, such as `h` for snap.h.0000000201.
+    The iteration number is in `iter`; `time` is left out, as the raw
+    output does not record it."""
+    import netCDF4
+
+    file_part = p.basename(infile)
+    m = re.match(r'^(?:(?:snap|av|debug)\.)?(\w+)\.(\d+)$', file_part)
+    name = m.group(1)
+    # Fields with a single level come back with one layer, whatever
+    # number of layers is passed in
+    dx, dy, layers = raw_file_staggering(file_part, 0)
+    data = interpret_raw_file(infile, grid.nx, grid.ny, grid.layers)
+
+    with netCDF4.Dataset(outfile, 'w') as ds:
+        ds.title = 'Aronnax output ' + file_part
+        ds.createDimension('x', grid.nx)
+        ds.createDimension('xp1', grid.nx+1)
+        ds.createDimension('y', grid.ny)
+        ds.createDimension('yp1', grid.ny+1)
+        ds.createDimension('layers', grid.layers)
+        ds.createDimension('time', None)
+        for axis in ['x', 'xp1', 'y', 'yp1']:
+            var = ds.createVariable(axis, 'f8', (axis,))
+            var.units = 'm'
+            var[:] = getattr(grid, axis)
+        ds.createVariable('iter', 'i4', ('time',))[0] = int(m.group(2))
+
+        x_dim = 'xp1' if dx else 'x'
+        y_dim = 'yp1' if dy else 'y'
+        if layers == 1:
+            ds.createVariable(name, 'f8', ('time', y_dim, x_dim))[0] = \
+                data[:, :, 0].transpose()
+        else:
+            ds.createVariable(name, 'f8',
+                ('time', 'layers', y_dim, x_dim))[0] = data.transpose()
+
+def plot_top_layer(infile, outfile, grid):
+    """Render the top layer of a raw output file as an image."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    dx, dy, _ = raw_file_staggering(infile, grid.layers)
+    data = interpret_raw_file(infile, grid.nx, grid.ny, grid.layers)
+    x = grid.xp1 if dx else grid.x
+    y = grid.yp1 if dy else grid.y
+
+    plt.figure()
+    plt.pcolormesh(x/1e3, y/1e3, data[:, :, 0].transpose(), cmap='RdBu_r')
+    plt.colorbar()
+    plt.xlabel('x (km)')
+    plt.ylabel('y (km)')
+    plt.title(p.basename(infile))
+    plt.savefig(outfile, dpi=150, bbox_inches='tight')
+    plt.close()
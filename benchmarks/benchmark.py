@@ -132,14 +132,66 @@ def benchmark_gaussian_bump(grid_points):
     benchmark_gaussian_bump_plot()
 
 
+def benchmark_hypre_per_step_save(grid_points, short_run=52, long_run=502):
+    """Separate the one-off cost of setting up the Hypre solver from the
+    cost of each time step, by timing a short and a long run at every
+    resolution. The marginal cost of the extra steps is the per-step
+    cost of the pressure solve with the reused solver."""
+    run_time_short = np.zeros(len(grid_points))
+    run_time_long = np.zeros(len(grid_points))
+
+    def bump(X, Y):
+        return 500. + 20*np.exp(-((6e5-X)**2 + (5e5-Y)**2)/(2*1e5**2))
+
+    with working_directory(p.join(self_path, "beta_plane_bump")):
+        aro_exec = "aronnax_external_solver"
+        for counter, nx in enumerate(grid_points):
+            run_time_short[counter] = aro.simulate(
+                exe=aro_exec, initHfile=[bump, lambda X, Y: 2000. - bump(X, Y)],
+                nx=nx, ny=nx, nTimeSteps=short_run)
+            run_time_long[counter] = aro.simulate(
+                exe=aro_exec, initHfile=[bump, lambda X, Y: 2000. - bump(X, Y)],
+                nx=nx, ny=nx, nTimeSteps=long_run)
+
+        per_step = (run_time_long - run_time_short)/(long_run - short_run)
+        setup = run_time_short - short_run*per_step
+
+        with open("hypre_times.pkl", "w") as f:
+            pkl.dump((grid_points, per_step, setup), f)
+
+def benchmark_hypre_per_step_plot():
+    with working_directory(p.join(self_path, "beta_plane_bump")):
+        with open("hypre_times.pkl", "r") as f:
+            (grid_points, per_step, setup) = pkl.load(f)
+
+        plt.figure()
+        plt.loglog(grid_points, per_step*1000,
+            '-o', label='per time step')
+        plt.loglog(grid_points, setup*1000,
+            '-o', label='one-off setup and I/O')
+        plt.legend()
+        plt.xlabel('Resolution (grid cells on one side)')
+        plt.ylabel('Time (ms)')
+        plt.title('Cost of a 2-layer Aronnax simulation with the Hypre solver')
+        plt.savefig('beta_plane_bump_hypre_per_step.png', dpi=150)
+
+
+def benchmark_hypre_per_step(grid_points):
+    benchmark_hypre_per_step_save(grid_points)
+    benchmark_hypre_per_step_plot()
+
+
 if __name__ == '__main__':
     if len(sys.argv) > 1:
         if sys.argv[1] == "save":
             benchmark_gaussian_bump_red_grav_save(np.array([10, 20, 40, 60, 80, 100, 150, 200, 300, 400, 500]))
             benchmark_gaussian_bump_save(np.array([10, 20, 40, 60, 80, 100, 120]))
+            benchmark_hypre_per_step_save(np.array([10, 20, 40, 60, 80, 100, 120]))
         else:
             benchmark_gaussian_bump_red_grav_plot()
             benchmark_gaussian_bump_plot()
+            benchmark_hypre_per_step_plot()
     else:
         benchmark_gaussian_bump_red_grav(np.array([10, 20, 40, 60, 80, 100, 150, 200, 300, 400, 500]))
         benchmark_gaussian_bump(np.array([10, 20, 40, 60, 80, 100, 120]))
+        benchmark_hypre_per_step(np.array([10, 20, 40, 60, 80, 100, 120]))
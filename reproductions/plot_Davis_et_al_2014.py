@@ -80,17 +80,11 @@ def plt_state(simulation=None):
     plt.close()
 
 def plot_channel_transport(simulation=None):
-    h_files = sorted(glob.glob("{0}output/snap.h.*".format(simulation)))
-    v_files = sorted(glob.glob("{0}output/snap.v.*".format(simulation)))
-
-    transport = np.zeros(len(h_files))
-
-    for i in xrange(len(v_files)):
-        h = aro.interpret_raw_file(h_files[i], 102, 182, 1)
-        v = aro.interpret_raw_file(v_files[i], 102, 182, 1)
-
+    run = aro.open_output(simulation)
+    h = run['snap.h'][:,:,70,0]
+    v = run['snap.v'][:,:,53:55,0]
 
-        transport[i] = np.sum(h[:,70,0]*(v[:,53,0]+v[:,54,0])/2.)*grid.dx/1e6
+    transport = np.sum(h*(v[:,:,0]+v[:,:,1])/2., axis=1)*grid.dx/1e6
 
     plt.figure()
 
@@ -1,108 +1,301 @@
 module adams_bashforth
+  use kinds
   implicit none
 
+  ! The tendencies from the last AB_order time steps are kept in
+  ! dXdt(:,:,:,1:AB_order), which is used as a ring buffer. slot(1) is
+  ! where the tendency for the current time step goes, and slot(p) for
+  ! p > 1 holds the tendency from p-1 time steps ago. After each time
+  ! step cycle_AB_slots moves the slots along by one, so the history is
+  ! never copied.
+
   contains
 
-  
+  ! ---------------------------------------------------------------------------
+  !> Move the tendency history along by one time step. The newest
+  !! tendency becomes the second, and the slot holding the oldest one is
+  !! reused for the next time step.
+
+  subroutine cycle_AB_slots(slot, AB_order)
+    implicit none
+
+    integer, intent(inout) :: slot(AB_order)
+    integer, intent(in)    :: AB_order
+
+    slot = cshift(slot, -1)
+
+  end subroutine cycle_AB_slots
+
+  ! ---------------------------------------------------------------------------
+  !> Order in which to write the tendency history to a checkpoint, so
+  !! that the checkpoint holds the newest tendency first, then the older
+  !! ones in turn. This is the same whichever slots they are in.
+
+  subroutine checkpoint_AB_slots(checkpoint_slot, slot, AB_order)
+    implicit none
+
+    integer, intent(out) :: checkpoint_slot(AB_order)
+    integer, intent(in)  :: slot(AB_order)
+    integer, intent(in)  :: AB_order
+
+    checkpoint_slot = slot
+    checkpoint_slot(1) = slot(min(2, AB_order))
+
+  end subroutine checkpoint_AB_slots
+
   ! ---------------------------------------------------------------------------
   !> A first-order Forward Euler algorithm
   !! This is not a good algorithm. Don't use it, except to show how
   !! how bad it is.
 
-  subroutine ForwardEuler(X_new, dXdt, X, dt, nx, ny, layers, AB_order)
+  subroutine ForwardEuler(X_new, dXdt, X, dt, nx, ny, layers, AB_order, slot)
     implicit none
 
-    double precision, intent(out) :: X_new(0:nx+1, 0:ny+1, layers)
-    double precision, intent(inout) :: dXdt(0:nx+1, 0:ny+1, layers, AB_order)
-    double precision, intent(in) :: X(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(out) :: X_new(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in) :: dXdt(0:nx+1, 0:ny+1, layers, AB_order)
+    real(wp),         intent(in) :: X(0:nx+1, 0:ny+1, layers)
     double precision, intent(in) :: dt
     integer,          intent(in) :: nx, ny, layers, AB_order
+    integer,          intent(in) :: slot(AB_order)
 
-    X_new = X + dt*dXdt(:,:,:,1)
+    integer :: i, j, k, s1
+
+    s1 = slot(1)
+
+    !$omp parallel do collapse(2) private(i)
+    do k = 1, layers
+      do j = 0, ny+1
+        do i = 0, nx+1
+          X_new(i,j,k) = X(i,j,k) + dt*dXdt(i,j,k,s1)
+        end do
+      end do
+    end do
+    !$omp end parallel do
 
   end subroutine ForwardEuler
 
 ! ---------------------------------------------------------------------------
   !> A second-order Adams-Bashforth algorithm
-  subroutine AB2(X_new, dXdt, X, dt, nx, ny, layers, AB_order)
+  subroutine AB2(X_new, dXdt, X, dt, nx, ny, layers, AB_order, slot)
     implicit none
 
-    double precision, intent(out) :: X_new(0:nx+1, 0:ny+1, layers)
-    double precision, intent(inout) :: dXdt(0:nx+1, 0:ny+1, layers, AB_order)
-    double precision, intent(in) :: X(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(out) :: X_new(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in) :: dXdt(0:nx+1, 0:ny+1, layers, AB_order)
+    real(wp),         intent(in) :: X(0:nx+1, 0:ny+1, layers)
     double precision, intent(in) :: dt
     integer,          intent(in) :: nx, ny, layers, AB_order
+    integer,          intent(in) :: slot(AB_order)
+
+    integer :: i, j, k, s1, s2
 
-    X_new = X + dt*(3d0*dXdt(:,:,:,1) - 1d0*dXdt(:,:,:,2))/2d0
+    s1 = slot(1)
+    s2 = slot(2)
+
+    !$omp parallel do collapse(2) private(i)
+    do k = 1, layers
+      do j = 0, ny+1
+        do i = 0, nx+1
+          X_new(i,j,k) = X(i,j,k) + dt*(3d0*dXdt(i,j,k,s1) &
+              - 1d0*dXdt(i,j,k,s2))/2d0
+        end do
+      end do
+    end do
+    !$omp end parallel do
 
-    ! Cycle tendencies
-    dXdt(:,:,:,2) = dXdt(:,:,:,1)
-    
   end subroutine AB2
 
 ! ---------------------------------------------------------------------------
   !> A third-order Adams-Bashforth algorithm
-  subroutine AB3(X_new, dXdt, X, dt, nx, ny, layers, AB_order)
+  subroutine AB3(X_new, dXdt, X, dt, nx, ny, layers, AB_order, slot)
     implicit none
 
-    double precision, intent(out) :: X_new(0:nx+1, 0:ny+1, layers)
-    double precision, intent(inout) :: dXdt(0:nx+1, 0:ny+1, layers, AB_order)
-    double precision, intent(in) :: X(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(out) :: X_new(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in) :: dXdt(0:nx+1, 0:ny+1, layers, AB_order)
+    real(wp),         intent(in) :: X(0:nx+1, 0:ny+1, layers)
     double precision, intent(in) :: dt
     integer,          intent(in) :: nx, ny, layers, AB_order
+    integer,          intent(in) :: slot(AB_order)
+
+    integer :: i, j, k, s1, s2, s3
+
+    s1 = slot(1)
+    s2 = slot(2)
+    s3 = slot(3)
 
-    X_new = X + dt*(23d0*dXdt(:,:,:,1) - 16d0*dXdt(:,:,:,2) + &
-                    5d0*dXdt(:,:,:,3))/12d0
+    !$omp parallel do collapse(2) private(i)
+    do k = 1, layers
+      do j = 0, ny+1
+        do i = 0, nx+1
+          X_new(i,j,k) = X(i,j,k) + dt*(23d0*dXdt(i,j,k,s1) &
+              - 16d0*dXdt(i,j,k,s2) + 5d0*dXdt(i,j,k,s3))/12d0
+        end do
+      end do
+    end do
+    !$omp end parallel do
 
-    ! Cycle tendencies
-    dXdt(:,:,:,3) = dXdt(:,:,:,2)
-    dXdt(:,:,:,2) = dXdt(:,:,:,1)
-    
   end subroutine AB3
 
 ! ---------------------------------------------------------------------------
   !> A fourth-order Adams-Bashforth algorithm
-  subroutine AB4(X_new, dXdt, X, dt, nx, ny, layers, AB_order)
+  subroutine AB4(X_new, dXdt, X, dt, nx, ny, layers, AB_order, slot)
     implicit none
 
-    double precision, intent(out) :: X_new(0:nx+1, 0:ny+1, layers)
-    double precision, intent(inout) :: dXdt(0:nx+1, 0:ny+1, layers, AB_order)
-    double precision, intent(in) :: X(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(out) :: X_new(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in) :: dXdt(0:nx+1, 0:ny+1, layers, AB_order)
+    real(wp),         intent(in) :: X(0:nx+1, 0:ny+1, layers)
     double precision, intent(in) :: dt
     integer,          intent(in) :: nx, ny, layers, AB_order
+    integer,          intent(in) :: slot(AB_order)
+
+    integer :: i, j, k, s1, s2, s3, s4
+
+    s1 = slot(1)
+    s2 = slot(2)
+    s3 = slot(3)
+    s4 = slot(4)
 
-    X_new = X + dt*(55d0*dXdt(:,:,:,1) - 59d0*dXdt(:,:,:,2) + &
-                    37d0*dXdt(:,:,:,3) - 9d0*dXdt(:,:,:,4))/24d0
+    !$omp parallel do collapse(2) private(i)
+    do k = 1, layers
+      do j = 0, ny+1
+        do i = 0, nx+1
+          X_new(i,j,k) = X(i,j,k) + dt*(55d0*dXdt(i,j,k,s1) &
+              - 59d0*dXdt(i,j,k,s2) + 37d0*dXdt(i,j,k,s3) &
+              - 9d0*dXdt(i,j,k,s4))/24d0
+        end do
+      end do
+    end do
+    !$omp end parallel do
 
-    ! Cycle tendencies
-    dXdt(:,:,:,4) = dXdt(:,:,:,3)
-    dXdt(:,:,:,3) = dXdt(:,:,:,2)
-    dXdt(:,:,:,2) = dXdt(:,:,:,1)
-    
   end subroutine AB4
 
 
 ! ---------------------------------------------------------------------------
   !> A fifth-order Adams-Bashforth algorithm
-  subroutine AB5(X_new, dXdt, X, dt, nx, ny, layers, AB_order)
+  subroutine AB5(X_new, dXdt, X, dt, nx, ny, layers, AB_order, slot)
     implicit none
 
-    double precision, intent(out) :: X_new(0:nx+1, 0:ny+1, layers)
-    double precision, intent(inout) :: dXdt(0:nx+1, 0:ny+1, layers, AB_order)
-    double precision, intent(in) :: X(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(out) :: X_new(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in) :: dXdt(0:nx+1, 0:ny+1, layers, AB_order)
+    real(wp),         intent(in) :: X(0:nx+1, 0:ny+1, layers)
     double precision, intent(in) :: dt
     integer,          intent(in) :: nx, ny, layers, AB_order
+    integer,          intent(in) :: slot(AB_order)
 
-    X_new = X + dt*(1901d0*dXdt(:,:,:,1) - 2774d0*dXdt(:,:,:,2) + &
-                    2616d0*dXdt(:,:,:,3) - 1274d0*dXdt(:,:,:,4) + &
-                    251d0*dXdt(:,:,:,5))/720d0
+    integer :: i, j, k, s1, s2, s3, s4, s5
+
+    s1 = slot(1)
+    s2 = slot(2)
+    s3 = slot(3)
+    s4 = slot(4)
+    s5 = slot(5)
+
+    !$omp parallel do collapse(2) private(i)
+    do k = 1, layers
+      do j = 0, ny+1
+        do i = 0, nx+1
+          X_new(i,j,k) = X(i,j,k) + dt*(1901d0*dXdt(i,j,k,s1) &
+              - 2774d0*dXdt(i,j,k,s2) + 2616d0*dXdt(i,j,k,s3) &
+              - 1274d0*dXdt(i,j,k,s4) + 251d0*dXdt(i,j,k,s5))/720d0
+        end do
+      end do
+    end do
+    !$omp end parallel do
 
-    ! Cycle tendencies
-    dXdt(:,:,:,5) = dXdt(:,:,:,4)
-    dXdt(:,:,:,4) = dXdt(:,:,:,3)
-    dXdt(:,:,:,3) = dXdt(:,:,:,2)
-    dXdt(:,:,:,2) = dXdt(:,:,:,1)
-    
   end subroutine AB5
 
+! ---------------------------------------------------------------------------
+  !> Weights of the Adams-Bashforth scheme of order AB_order for steps
+  !! of varying length. dt_history(1) is the step about to be taken, and
+  !! dt_history(p) for p > 1 is the step taken p-1 time steps ago. The
+  !! weights integrate the polynomial through the tendencies over the
+  !! next step exactly, and reduce to dt times the usual coefficients
+  !! when the steps are all the same length.
+
+  subroutine variable_AB_weights(weights, dt_history, AB_order)
+    implicit none
+
+    double precision, intent(out) :: weights(AB_order)
+    double precision, intent(in)  :: dt_history(AB_order)
+    integer,          intent(in)  :: AB_order
+
+    ! the system sum_p weights(p)*s(p)**m = 1/(m+1), for m = 0 to
+    ! AB_order-1, with the times of the tendencies s scaled by the step
+    double precision :: matrix(AB_order, AB_order)
+    double precision :: s(AB_order)
+    double precision :: row(AB_order), factor, rhs_swap
+    integer :: p, m, pivot
+
+    s(1) = 0d0
+    do p = 2, AB_order
+      s(p) = s(p-1) - dt_history(p)/dt_history(1)
+    end do
+
+    do m = 1, AB_order
+      do p = 1, AB_order
+        matrix(m, p) = s(p)**(m-1)
+      end do
+      weights(m) = 1d0/dble(m)
+    end do
+
+    ! Gaussian elimination with partial pivoting
+    do m = 1, AB_order
+      pivot = m - 1 + maxloc(abs(matrix(m:AB_order, m)), 1)
+      if (pivot .ne. m) then
+        row = matrix(m, :)
+        matrix(m, :) = matrix(pivot, :)
+        matrix(pivot, :) = row
+        rhs_swap = weights(m)
+        weights(m) = weights(pivot)
+        weights(pivot) = rhs_swap
+      end if
+      do p = m+1, AB_order
+        factor = matrix(p, m)/matrix(m, m)
+        matrix(p, m:) = matrix(p, m:) - factor*matrix(m, m:)
+        weights(p) = weights(p) - factor*weights(m)
+      end do
+    end do
+
+    do m = AB_order, 1, -1
+      weights(m) = (weights(m) &
+          - sum(matrix(m, m+1:AB_order)*weights(m+1:AB_order)))/matrix(m, m)
+    end do
+
+    weights = weights*dt_history(1)
+
+  end subroutine variable_AB_weights
+
+! ---------------------------------------------------------------------------
+  !> An Adams-Bashforth algorithm for steps of varying length, with the
+  !! weights from variable_AB_weights
+
+  subroutine AB_variable(X_new, dXdt, X, weights, nx, ny, layers, &
+      AB_order, slot)
+    implicit none
+
+    real(wp),         intent(out) :: X_new(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in) :: dXdt(0:nx+1, 0:ny+1, layers, AB_order)
+    real(wp),         intent(in) :: X(0:nx+1, 0:ny+1, layers)
+    double precision, intent(in) :: weights(AB_order)
+    integer,          intent(in) :: nx, ny, layers, AB_order
+    integer,          intent(in) :: slot(AB_order)
+
+    integer :: i, j, k, p
+    double precision :: increment
+
+    !$omp parallel do collapse(2) private(i, p, increment)
+    do k = 1, layers
+      do j = 0, ny+1
+        do i = 0, nx+1
+          increment = 0d0
+          do p = 1, AB_order
+            increment = increment + weights(p)*dXdt(i,j,k,slot(p))
+          end do
+          X_new(i,j,k) = X(i,j,k) + increment
+        end do
+      end do
+    end do
+    !$omp end parallel do
+
+  end subroutine AB_variable
+
 end module adams_bashforth
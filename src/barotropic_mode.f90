@@ -3,6 +3,8 @@ module barotropic_mode
   use vorticity
   use boundaries
   use enforce_thickness
+  use multigrid
+  use spectral_solver
   
   implicit none
 
@@ -15,8 +17,8 @@ module barotropic_mode
     implicit none
 
     double precision, intent(out) :: ub(nx+1, ny)
-    double precision, intent(in)  :: u(0:nx+1, 0:ny+1, layers)
-    double precision, intent(in)  :: h(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in)  :: u(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in)  :: h(0:nx+1, 0:ny+1, layers)
     double precision, intent(in)  :: eta(0:nx+1, 0:ny+1)
     double precision, intent(in)  :: freesurfFac
     integer, intent(in) :: nx, ny, layers
@@ -48,8 +50,8 @@ module barotropic_mode
     implicit none
 
     double precision, intent(out) :: vb(nx, ny+1)
-    double precision, intent(in)  :: v(0:nx+1, 0:ny+1, layers)
-    double precision, intent(in)  :: h(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in)  :: v(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in)  :: h(0:nx+1, 0:ny+1, layers)
     double precision, intent(in)  :: eta(0:nx+1, 0:ny+1)
     double precision, intent(in)  :: freesurfFac
     integer, intent(in) :: nx, ny, layers
@@ -102,29 +104,63 @@ module barotropic_mode
       end do
     end do
 
-    call wrap_fields_2D(etastar, nx, ny)
+    call update_halos_2D(etastar, nx, ny)
 
     return
   end subroutine calc_eta_star
 
+  ! ---------------------------------------------------------------------------
+  !> Calculate the sum of the absolute residuals of A eta = rhs
+
+  subroutine calc_residual_norm(norm, a, eta, rhs, nx, ny)
+    implicit none
+
+    double precision, intent(out) :: norm
+    double precision, intent(in)  :: a(5, nx, ny)
+    double precision, intent(in)  :: eta(0:nx+1, 0:ny+1)
+    double precision, intent(in)  :: rhs(nx, ny)
+    integer, intent(in) :: nx, ny
+
+    integer i, j
+
+    norm = 0.d0
+    do j = 1, ny
+      do i = 1, nx
+        norm = norm + abs( &
+            a(1,i,j)*eta(i+1,j) &
+            + a(2,i,j)*eta(i,j+1) &
+            + a(3,i,j)*eta(i-1,j) &
+            + a(4,i,j)*eta(i,j-1) &
+            + a(5,i,j)*eta(i,j)   &
+            - rhs(i,j))
+      end do
+    end do
+
+    return
+  end subroutine calc_residual_norm
+
   ! ---------------------------------------------------------------------------
   !> Use the successive over-relaxation algorithm to solve the backwards
   !! Euler timestepping for the free surface anomaly, or for the surface
   !! pressure required to keep the barotropic flow nondivergent.
+  !! Only the wet points, listed column by column in wet, are swept.
 
-  subroutine SOR_solver(a, etanew, etastar, nx, ny, dt, &
-      rjac, eps, maxits, n)
+  subroutine SOR_solver(a, etanew, etastar, etaguess, wet, nx, ny, dt, &
+      rjac, eps, maxits, n, iterations)
     implicit none
 
     double precision, intent(in)  :: a(5, nx, ny)
     double precision, intent(out) :: etanew(0:nx+1, 0:ny+1)
     double precision, intent(in)  :: etastar(0:nx+1, 0:ny+1)
+    double precision, intent(in)  :: etaguess(0:nx+1, 0:ny+1)
+    type(wet_spans), intent(in) :: wet
     integer, intent(in) :: nx, ny
     double precision, intent(in) :: dt
     double precision, intent(in) :: rjac, eps
     integer, intent(in) :: maxits, n
+    integer, intent(out) :: iterations
 
-    integer i, j, nit
+    integer i, j, nit, s
     double precision rhs(nx, ny)
     double precision res(nx, ny)
     double precision norm, norm0
@@ -132,7 +168,7 @@ module barotropic_mode
 
     rhs = -etastar(1:nx,1:ny)/dt**2
     ! first guess for etanew
-    etanew = etastar
+    etanew = etaguess
 
     relax_param = 1.d0 ! successive over-relaxation parameter
 
@@ -140,24 +176,8 @@ module barotropic_mode
     ! current residual = norm0*eps
     norm0 = 0.d0
     do i = 1, nx
-      do j = 1, ny
-        res(i,j) = &
-            a(1,i,j)*etanew(i+1,j) &
-            + a(2,i,j)*etanew(i,j+1) &
-            + a(3,i,j)*etanew(i-1,j) &
-            + a(4,i,j)*etanew(i,j-1) &
-            + a(5,i,j)*etanew(i,j)   &
-            - rhs(i,j)
-        norm0 = norm0 + abs(res(i,j))
-        etanew(i,j) = etanew(i,j)-relax_param*res(i,j)/a(5,i,j)
-      end do
-    end do
-
-
-    do nit = 1, maxits
-      norm = 0.d0
-      do i = 1, nx
-        do j = 1, ny
+      do s = wet%first(i), wet%first(i+1) - 1
+        do j = max(wet%lo(s), 1), min(wet%hi(s), ny)
           res(i,j) = &
               a(1,i,j)*etanew(i+1,j) &
               + a(2,i,j)*etanew(i,j+1) &
@@ -165,8 +185,35 @@ module barotropic_mode
               + a(4,i,j)*etanew(i,j-1) &
               + a(5,i,j)*etanew(i,j)   &
               - rhs(i,j)
-          norm = norm + abs(res(i,j))
-          etanew(i,j) = etanew(i,j)-relax_param*res(i,j)/(a(5,i,j))
+          norm0 = norm0 + abs(res(i,j))
+          etanew(i,j) = etanew(i,j)-relax_param*res(i,j)/a(5,i,j)
+        end do
+      end do
+    end do
+
+    ! A first guess other than etastar has a smaller initial residual,
+    ! so measure convergence against the residual of etastar instead.
+    ! Otherwise a better first guess would not save any iterations.
+    if (any(etaguess .ne. etastar)) then
+      call calc_residual_norm(norm0, a, etastar, rhs, nx, ny)
+    end if
+
+
+    do nit = 1, maxits
+      norm = 0.d0
+      do i = 1, nx
+        do s = wet%first(i), wet%first(i+1) - 1
+          do j = max(wet%lo(s), 1), min(wet%hi(s), ny)
+            res(i,j) = &
+                a(1,i,j)*etanew(i+1,j) &
+                + a(2,i,j)*etanew(i,j+1) &
+                + a(3,i,j)*etanew(i-1,j) &
+                + a(4,i,j)*etanew(i,j-1) &
+                + a(5,i,j)*etanew(i,j)   &
+                - rhs(i,j)
+            norm = norm + abs(res(i,j))
+            etanew(i,j) = etanew(i,j)-relax_param*res(i,j)/(a(5,i,j))
+          end do
         end do
       end do
       if (nit.eq.1) then
@@ -179,16 +226,144 @@ module barotropic_mode
 
       if (nit.gt.1.and.norm.lt.eps*norm0) then
 
+        iterations = nit
         return
 
       end if
     end do
 
+    iterations = maxits
     write(17, "(A, I0)") 'Warning: maximum SOR iterations exceeded at time step ', n
 
     return
   end subroutine SOR_solver
 
+  ! ---------------------------------------------------------------------------
+  !> Use successive over-relaxation with red-black (checkerboard)
+  !! ordering to solve for the free surface anomaly. Points of one
+  !! colour only depend on points of the other colour, so each half
+  !! sweep is split across OpenMP threads. The sweeps run along i,
+  !! which is contiguous in memory. Each process sweeps its own tile
+  !! and exchanges halos after every half sweep, with the colours set
+  !! by the global indices so that they match across tiles. Only the
+  !! wet points, listed row by row in wet, are swept.
+
+  subroutine SOR_red_black_solver(a, etanew, etastar, etaguess, wet, &
+      nx, ny, dt, rjac, eps, maxits, n, iterations)
+    implicit none
+
+    double precision, intent(in)  :: a(5, nx, ny)
+    double precision, intent(out) :: etanew(0:nx+1, 0:ny+1)
+    double precision, intent(in)  :: etastar(0:nx+1, 0:ny+1)
+    double precision, intent(in)  :: etaguess(0:nx+1, 0:ny+1)
+    type(wet_spans), intent(in) :: wet
+    integer, intent(in) :: nx, ny
+    double precision, intent(in) :: dt
+    double precision, intent(in) :: rjac, eps
+    integer, intent(in) :: maxits, n
+    integer, intent(out) :: iterations
+
+    integer i, j, nit, colour, s, istart
+    double precision rhs(nx, ny)
+    double precision res
+    double precision norm, norm0
+    double precision relax_param
+
+    ! the parity of the global indices of the tile's first point
+    integer parity
+
+    parity = mod(x_offset + y_offset, 2)
+
+    rhs = -etastar(1:nx,1:ny)/dt**2
+    ! first guess for etanew
+    etanew = etaguess
+
+    relax_param = 1.d0 ! successive over-relaxation parameter
+
+    ! Calculate initial residual, so that we can stop the loop when the
+    ! current residual = norm0*eps
+    norm0 = 0.d0
+    do colour = 0, 1
+      !$omp parallel do private(i, s, istart, res) reduction(+:norm0)
+      do j = 1, ny
+        do s = wet%first(j), wet%first(j+1) - 1
+          istart = max(wet%lo(s), 1)
+          istart = istart + mod(istart+j+colour+parity, 2)
+          do i = istart, min(wet%hi(s), nx), 2
+            res = &
+                a(1,i,j)*etanew(i+1,j) &
+                + a(2,i,j)*etanew(i,j+1) &
+                + a(3,i,j)*etanew(i-1,j) &
+                + a(4,i,j)*etanew(i,j-1) &
+                + a(5,i,j)*etanew(i,j)   &
+                - rhs(i,j)
+            norm0 = norm0 + abs(res)
+            etanew(i,j) = etanew(i,j)-relax_param*res/a(5,i,j)
+          end do
+        end do
+      end do
+      !$omp end parallel do
+      call update_halos_2D(etanew, nx, ny)
+    end do
+    norm0 = global_sum(norm0)
+
+    ! A first guess other than etastar has a smaller initial residual,
+    ! so measure convergence against the residual of etastar instead.
+    ! Otherwise a better first guess would not save any iterations.
+    if (global_max(maxval(abs(etaguess - etastar))) .gt. 0d0) then
+      call calc_residual_norm(norm0, a, etastar, rhs, nx, ny)
+      norm0 = global_sum(norm0)
+    end if
+
+    do nit = 1, maxits
+      norm = 0.d0
+      do colour = 0, 1
+        !$omp parallel do private(i, s, istart, res) reduction(+:norm)
+        do j = 1, ny
+          do s = wet%first(j), wet%first(j+1) - 1
+            istart = max(wet%lo(s), 1)
+            istart = istart + mod(istart+j+colour+parity, 2)
+            do i = istart, min(wet%hi(s), nx), 2
+              res = &
+                  a(1,i,j)*etanew(i+1,j) &
+                  + a(2,i,j)*etanew(i,j+1) &
+                  + a(3,i,j)*etanew(i-1,j) &
+                  + a(4,i,j)*etanew(i,j-1) &
+                  + a(5,i,j)*etanew(i,j)   &
+                  - rhs(i,j)
+              norm = norm + abs(res)
+              etanew(i,j) = etanew(i,j)-relax_param*res/a(5,i,j)
+            end do
+          end do
+        end do
+        !$omp end parallel do
+
+        ! Chebyshev acceleration, updated after every half sweep
+        if (nit .eq. 1 .and. colour .eq. 0) then
+          relax_param = 1.d0/(1.d0-0.5d0*rjac**2)
+        else
+          relax_param = 1.d0/(1.d0-0.25d0*rjac**2*relax_param)
+        end if
+
+        ! the other colour needs the updated halo values
+        call update_halos_2D(etanew, nx, ny)
+      end do
+      norm = global_sum(norm)
+
+      if (nit.gt.1.and.norm.lt.eps*norm0) then
+
+        iterations = nit
+        return
+
+      end if
+    end do
+
+    iterations = maxits
+    write(17, "(A, I0)") 'Warning: maximum SOR iterations exceeded at time step ', n
+
+    return
+  end subroutine SOR_red_black_solver
+
   ! ---------------------------------------------------------------------------
 
   subroutine create_Hypre_grid(MPI_COMM_WORLD, hypre_grid, ilower, iupper, &
@@ -212,7 +387,9 @@ module barotropic_mode
     call HYPRE_StructGridSetExtents(hypre_grid, ilower(myid,:),iupper(myid,:), ierr)
     !end do
 
-    call HYPRE_StructGridSetPeriodic(hypre_grid, [nx, ny], ierr)
+    ! a period of zero means the grid is not periodic in that direction
+    call HYPRE_StructGridSetPeriodic(hypre_grid, &
+        [merge(nx, 0, periodic_x), merge(ny, 0, periodic_y)], ierr)
 
     call HYPRE_StructGridAssemble(hypre_grid, ierr)
 #endif
@@ -268,8 +445,9 @@ module barotropic_mode
 
     do i = 1, nx
       do j = 1, ny
-        indicies(1) = i
-        indicies(2) = j
+        ! a is held on this process's tile
+        indicies(1) = i + x_offset
+        indicies(2) = j + y_offset
 
         call HYPRE_StructMatrixSetValues(hypre_A, &
             indicies, 1, 0, &
@@ -299,78 +477,38 @@ module barotropic_mode
   end subroutine create_Hypre_A_matrix
 
   ! ---------------------------------------------------------------------------
+  !> Create the Hypre PCG solver, the BoomerAMG preconditioner and the
+  !! right-hand side and solution vectors. The matrix does not change
+  !! during a run, so the setup is done once here and reused by
+  !! Ext_solver on every time step.
 
-  subroutine Ext_solver(MPI_COMM_WORLD, hypre_A, hypre_grid, myid, num_procs, &
-      ilower, iupper, etastar, &
-      etanew, nx, ny, dt, maxits, eps, ierr)
+  subroutine create_Hypre_solver(MPI_COMM_WORLD, hypre_grid, hypre_A, &
+      hypre_solver, hypre_precond, hypre_b, hypre_x, maxits, eps, ierr)
     implicit none
 
     integer,          intent(in)  :: MPI_COMM_WORLD
-    integer*8,        intent(in)  :: hypre_A
     integer*8,        intent(in)  :: hypre_grid
-    integer,          intent(in)  :: myid
-    integer,          intent(in)  :: num_procs
-    integer,          intent(in)  :: ilower(0:num_procs-1,2)
-    integer,          intent(in)  :: iupper(0:num_procs-1,2)
-    double precision, intent(in)  :: etastar(0:nx+1, 0:ny+1)
-    double precision, intent(out) :: etanew(0:nx+1, 0:ny+1)
-    integer,          intent(in)  :: nx, ny
-    double precision, intent(in)  :: dt
+    integer*8,        intent(in)  :: hypre_A
+    integer*8,        intent(out) :: hypre_solver
+    integer*8,        intent(out) :: hypre_precond
+    integer*8,        intent(out) :: hypre_b
+    integer*8,        intent(out) :: hypre_x
     integer,          intent(in)  :: maxits
     double precision, intent(in)  :: eps
     integer,          intent(out) :: ierr
 
-    integer          :: i, j ! loop variables
-    integer*8        :: hypre_b
-    integer*8        :: hypre_x
-    integer*8        :: hypre_solver
-    integer*8        :: precond
-    double precision, dimension(:),     allocatable :: values
-
-    integer :: nx_tile, ny_tile
-
-    nx_tile = iupper(myid,1)-ilower(myid,1) + 1
-    ny_tile = iupper(myid,2)-ilower(myid,2) + 1
-
-    allocate(values(nx_tile*ny_tile))
-    ! just nx*ny for the tile this processor owns
-
-
-    ! A currently unused variable that can be used to
-    ! print information from the solver - see comments below.
-  !  double precision :: hypre_out(2)
-
-
-    ! wrap this code in preprocessing flags to allow the model to be compiled without the external library, if desired.
 #ifdef useExtSolver
-    ! Create the rhs vector, b
+    ! Create the rhs vector, b, and the solution vector, x. Their values
+    ! are set on every time step in Ext_solver.
     call HYPRE_StructVectorCreate(MPI_COMM_WORLD, hypre_grid, hypre_b, ierr)
     call HYPRE_StructVectorInitialize(hypre_b, ierr)
-
-    ! set rhs values (vector b)
-    do j = ilower(myid,2), iupper(myid,2) ! loop over every grid point
-      do i = ilower(myid,1), iupper(myid,1)
-    ! the 2D array is being laid out like
-    ! [x1y1, x2y1, x3y1, x1y2, x2y2, x3y2, x1y3, x2y3, x3y3]
-      values( ((j-1)*nx_tile + i) ) = -etastar(i,j)/dt**2
-      end do
-    end do
-
-    call HYPRE_StructVectorSetBoxValues(hypre_b, &
-      ilower(myid,:), iupper(myid,:), values, ierr)
-
     call HYPRE_StructVectorAssemble(hypre_b, ierr)
 
-    ! now create the x vector
     call HYPRE_StructVectorCreate(MPI_COMM_WORLD, hypre_grid, hypre_x, ierr)
     call HYPRE_StructVectorInitialize(hypre_x, ierr)
-
-    call HYPRE_StructVectorSetBoxValues(hypre_x, &
-      ilower(myid,:), iupper(myid,:), values, ierr)
-
     call HYPRE_StructVectorAssemble(hypre_x, ierr)
 
-    ! now create the solver and solve the equation.
+    ! now create the solver
     ! Choose the solver
     call HYPRE_StructPCGCreate(MPI_COMM_WORLD, hypre_solver, ierr)
 
@@ -386,40 +524,138 @@ module barotropic_mode
     call HYPRE_StructPCGSetLogging(hypre_solver, 1);
 
     ! use an algebraic multigrid preconditioner
-    call HYPRE_BoomerAMGCreate(precond, ierr)
+    call HYPRE_BoomerAMGCreate(hypre_precond, ierr)
     ! values taken from hypre library example number 5
     ! print less solver info since a preconditioner
-    call HYPRE_BoomerAMGSetPrintLevel(precond, 1, ierr);
+    call HYPRE_BoomerAMGSetPrintLevel(hypre_precond, 1, ierr);
     ! Falgout coarsening
-    call HYPRE_BoomerAMGSetCoarsenType(precond, 6, ierr)
+    call HYPRE_BoomerAMGSetCoarsenType(hypre_precond, 6, ierr)
     ! old defaults
-    call HYPRE_BoomerAMGSetOldDefault(precond, ierr)
+    call HYPRE_BoomerAMGSetOldDefault(hypre_precond, ierr)
     ! SYMMETRIC G-S/Jacobi hybrid relaxation
-    call HYPRE_BoomerAMGSetRelaxType(precond, 6, ierr)
+    call HYPRE_BoomerAMGSetRelaxType(hypre_precond, 6, ierr)
     ! Sweeeps on each level
-    call HYPRE_BoomerAMGSetNumSweeps(precond, 1, ierr)
+    call HYPRE_BoomerAMGSetNumSweeps(hypre_precond, 1, ierr)
     ! conv. tolerance
-    call HYPRE_BoomerAMGSetTol(precond, 0.0d0, ierr)
+    call HYPRE_BoomerAMGSetTol(hypre_precond, 0.0d0, ierr)
     ! do only one iteration!
-    call HYPRE_BoomerAMGSetMaxIter(precond, 1, ierr)
+    call HYPRE_BoomerAMGSetMaxIter(hypre_precond, 1, ierr)
 
     ! set amg as the pcg preconditioner
-    call HYPRE_StructPCGSetPrecond(hypre_solver, 2, precond, ierr)
-
+    call HYPRE_StructPCGSetPrecond(hypre_solver, 2, hypre_precond, ierr)
 
-    ! now we set the system up and do the actual solve!
+    ! Set the system up. This builds the multigrid hierarchy, which
+    ! only depends on the matrix, so it is done once per run.
     call HYPRE_StructPCGSetup(hypre_solver, hypre_A, hypre_b, &
                               hypre_x, ierr)
+#endif
+
+    return
+  end subroutine create_Hypre_solver
+
+  ! ---------------------------------------------------------------------------
+  !> Free the Hypre solver, preconditioner and vectors at the end of a run
+
+  subroutine destroy_Hypre_solver(hypre_solver, hypre_precond, &
+      hypre_b, hypre_x, ierr)
+    implicit none
+
+    integer*8,        intent(in)  :: hypre_solver
+    integer*8,        intent(in)  :: hypre_precond
+    integer*8,        intent(in)  :: hypre_b
+    integer*8,        intent(in)  :: hypre_x
+    integer,          intent(out) :: ierr
+
+#ifdef useExtSolver
+    call HYPRE_StructPCGDestroy(hypre_solver, ierr)
+    call HYPRE_BoomerAMGDestroy(hypre_precond, ierr)
+    call HYPRE_StructVectorDestroy(hypre_x, ierr)
+    call HYPRE_StructVectorDestroy(hypre_b, ierr)
+#endif
+
+    return
+  end subroutine destroy_Hypre_solver
+
+  ! ---------------------------------------------------------------------------
+  !> Solve for the free surface with the external solver. The solver,
+  !! preconditioner and vectors are created by create_Hypre_solver;
+  !! only the right-hand side and first guess are updated here.
+
+  subroutine Ext_solver(MPI_COMM_WORLD, hypre_A, hypre_grid, myid, num_procs, &
+      ilower, iupper, etastar, etaguess, &
+      etanew, nx, ny, dt, hypre_solver, hypre_b, hypre_x, iterations, ierr)
+    implicit none
 
+    integer,          intent(in)  :: MPI_COMM_WORLD
+    integer*8,        intent(in)  :: hypre_A
+    integer*8,        intent(in)  :: hypre_grid
+    integer,          intent(in)  :: myid
+    integer,          intent(in)  :: num_procs
+    integer,          intent(in)  :: ilower(0:num_procs-1,2)
+    integer,          intent(in)  :: iupper(0:num_procs-1,2)
+    double precision, intent(in)  :: etastar(0:nx+1, 0:ny+1)
+    double precision, intent(in)  :: etaguess(0:nx+1, 0:ny+1)
+    double precision, intent(out) :: etanew(0:nx+1, 0:ny+1)
+    integer,          intent(in)  :: nx, ny
+    double precision, intent(in)  :: dt
+    integer*8,        intent(in)  :: hypre_solver
+    integer*8,        intent(in)  :: hypre_b
+    integer*8,        intent(in)  :: hypre_x
+    integer,          intent(out) :: iterations
+    integer,          intent(out) :: ierr
+
+    integer          :: i, j ! loop variables
+    double precision, dimension(:),     allocatable :: values
+
+    ! etastar, etaguess and etanew are held on the tile this processor
+    ! owns, which spans ilower(myid,:) to iupper(myid,:) in the global grid
+    allocate(values(nx*ny))
+
+
+    ! A currently unused variable that can be used to
+    ! print information from the solver - see comments below.
+  !  double precision :: hypre_out(2)
+
+
+    iterations = 0
+
+    ! wrap this code in preprocessing flags to allow the model to be compiled without the external library, if desired.
+#ifdef useExtSolver
+    ! set rhs values (vector b)
+    do j = 1, ny ! loop over every grid point
+      do i = 1, nx
+    ! the 2D array is being laid out like
+    ! [x1y1, x2y1, x3y1, x1y2, x2y2, x3y2, x1y3, x2y3, x3y3]
+      values( ((j-1)*nx + i) ) = -etastar(i,j)/dt**2
+      end do
+    end do
+
+    call HYPRE_StructVectorSetBoxValues(hypre_b, &
+      ilower(myid,:), iupper(myid,:), values, ierr)
+
+    call HYPRE_StructVectorAssemble(hypre_b, ierr)
+
+    ! set the first guess for x
+    do j = 1, ny
+      do i = 1, nx
+      values( ((j-1)*nx + i) ) = etaguess(i,j)
+      end do
+    end do
+
+    call HYPRE_StructVectorSetBoxValues(hypre_x, &
+      ilower(myid,:), iupper(myid,:), values, ierr)
+
+    call HYPRE_StructVectorAssemble(hypre_x, ierr)
+
+    ! now do the actual solve, reusing the setup from create_Hypre_solver
     call HYPRE_ParCSRPCGSolve(hypre_solver, hypre_A, hypre_b, &
                               hypre_x, ierr)
 
+    call HYPRE_ParCSRPCGGetNumIterations(hypre_solver, iterations, ierr)
+
     ! code for printing out results from the external solver
     ! Not being used, but left here since the manual isn't very helpful
     ! and this may be useful in the future.
-    ! call HYPRE_ParCSRPCGGetNumIterations(hypre_solver, &
-    !   hypre_out(1), ierr)
-    ! print *, 'num iterations = ', hypre_out(1)
 
     ! call HYPRE_ParCSRPCGGetFinalRelative(hypre_solver, &
     !   hypre_out(2), ierr)
@@ -428,30 +664,168 @@ module barotropic_mode
     call HYPRE_StructVectorGetBoxValues(hypre_x, &
       ilower(myid,:), iupper(myid,:), values, ierr)
 
-    do j = ilower(myid,2), iupper(myid,2) ! loop over every grid point
-      do i = ilower(myid,1), iupper(myid,1)
-      etanew(i,j) = values( ((j-1)*nx_tile + i) )
+    do j = 1, ny ! loop over every grid point
+      do i = 1, nx
+      etanew(i,j) = values( ((j-1)*nx + i) )
       end do
     end do
 
+    call update_halos_2D(etanew, nx, ny)
+
     ! debugging commands from hypre library - dump out a single
     ! copy of these two variables. Can be used to check that the
     ! values have been properly allocated.
     ! call HYPRE_StructVectorPrint(hypre_x, ierr)
     ! call HYPRE_StructMatrixPrint(hypre_A, ierr)
 
-    call HYPRE_StructPCGDestroy(hypre_solver, ierr)
-    call HYPRE_BoomerAMGDestroy(precond, ierr)
-    call HYPRE_StructVectorDestroy(hypre_x, ierr)
-    call HYPRE_StructVectorDestroy(hypre_b, ierr)
-
 #endif
 
     return
   end subroutine Ext_solver
 
   ! ---------------------------------------------------------------------------
+  !> Choose the number of barotropic substeps per time step for the
+  !! split-explicit scheme, from the CFL limit of external gravity waves
+
+  subroutine calc_barotropic_substeps(substeps, requested, depth, wetmask, &
+      g, dx, dy, dt, nx, ny)
+    implicit none
+
+    integer, intent(out) :: substeps
+    integer, intent(in)  :: requested
+    double precision, intent(in) :: depth(0:nx+1, 0:ny+1)
+    double precision, intent(in) :: wetmask(0:nx+1, 0:ny+1)
+    double precision, intent(in) :: g, dx, dy, dt
+    integer, intent(in) :: nx, ny
+
+    ! The forward-backward scheme is stable up to a Courant number of one
+    double precision, parameter :: cfl = 0.8d0
+    double precision :: max_dtau
+    integer :: min_substeps
+
+    max_dtau = cfl/(sqrt(g*global_max(maxval(depth*wetmask))) &
+        *sqrt(1d0/dx**2 + 1d0/dy**2))
+    min_substeps = max(ceiling(dt/max_dtau), 1)
+
+    if (requested .gt. 0) then
+      substeps = requested
+      if (substeps .lt. min_substeps) then
+        write(17, "(A, I0, A)") 'Warning: barotropic_substeps is below ', &
+            min_substeps, ', which is needed for stability'
+      end if
+    else
+      substeps = min_substeps
+    end if
+
+    return
+  end subroutine calc_barotropic_substeps
+
+  ! ---------------------------------------------------------------------------
+  !> Step the linearised barotropic shallow water equations forward with
+  !! short substeps instead of solving the implicit problem. This is the
+  !! same system that the elliptic solvers integrate with one backward
+  !! Euler step, starting from the transport without the surface
+  !! pressure gradient and the free surface at the start of the time
+  !! step. It only needs local operations, but the substeps must
+  !! resolve the external gravity waves.
+  !!
+  !! The substeps use the forward-backward scheme and continue to twice
+  !! the length of the time step, so that the new free surface can be
+  !! a Hann-filtered average centred on the end of the step, which
+  !! removes gravity waves that the baroclinic time step cannot
+  !! resolve. The layer velocities are accelerated by the mean free
+  !! surface over the time step itself, etabar, which makes the layer
+  !! transports match the barotropic transport at the end of the step.
+
+  subroutine split_explicit_solver(etanew, etabar, eta, ub, vb, depth, &
+      wetmask, hfacW, hfacS, g, freesurfFac, dx, dy, dt, substeps, nx, ny)
+    implicit none
+
+    double precision, intent(out) :: etanew(0:nx+1, 0:ny+1)
+    double precision, intent(out) :: etabar(0:nx+1, 0:ny+1)
+    double precision, intent(in)  :: eta(0:nx+1, 0:ny+1)
+    double precision, intent(in)  :: ub(nx+1, ny)
+    double precision, intent(in)  :: vb(nx, ny+1)
+    double precision, intent(in)  :: depth(0:nx+1, 0:ny+1)
+    double precision, intent(in)  :: wetmask(0:nx+1, 0:ny+1)
+    double precision, intent(in)  :: hfacW(0:nx+1, 0:ny+1)
+    double precision, intent(in)  :: hfacS(0:nx+1, 0:ny+1)
+    double precision, intent(in)  :: g, freesurfFac, dx, dy, dt
+    integer, intent(in) :: substeps, nx, ny
+
+    double precision :: uflux(0:nx+1, 0:ny+1)
+    double precision :: vflux(0:nx+1, 0:ny+1)
+    double precision :: hu(0:nx+1, 0:ny+1)
+    double precision :: hv(0:nx+1, 0:ny+1)
+    double precision :: etasub(0:nx+1, 0:ny+1)
+    double precision :: dtau, weight, weight_sum, pi
+    integer :: i, j, m
+
+    pi = 4d0*atan(1d0)
+    dtau = dt/dble(substeps)
+
+    uflux = 0d0
+    vflux = 0d0
+    uflux(1:nx, 1:ny) = ub(1:nx, 1:ny)
+    vflux(1:nx, 1:ny) = vb(1:nx, 1:ny)
+    call update_halos_2D(uflux, nx, ny)
+    call update_halos_2D(vflux, nx, ny)
+
+    ! depth at the velocity points, zero across walls
+    hu = 0d0
+    hv = 0d0
+    do j = 1, ny
+      do i = 1, nx
+        hu(i,j) = 0.5d0*(depth(i,j) + depth(i-1,j))*hfacW(i,j)
+        hv(i,j) = 0.5d0*(depth(i,j) + depth(i,j-1))*hfacS(i,j)
+      end do
+    end do
+    call update_halos_2D(hu, nx, ny)
+    call update_halos_2D(hv, nx, ny)
+
+    etasub = eta*wetmask
+    etabar = 0d0
+    etanew = 0d0
+    weight_sum = 0d0
+
+    do m = 1, 2*substeps
+      ! continuity, forward in time
+      do j = 1, ny
+        do i = 1, nx
+          etasub(i,j) = etasub(i,j) - dtau/freesurfFac*( &
+              (uflux(i+1,j) - uflux(i,j))/dx &
+              + (vflux(i,j+1) - vflux(i,j))/dy)
+        end do
+      end do
+      call update_halos_2D(etasub, nx, ny)
+
+      ! momentum, backward in time using the new free surface
+      do j = 1, ny
+        do i = 1, nx
+          uflux(i,j) = uflux(i,j) &
+              - dtau*g*hu(i,j)*(etasub(i,j) - etasub(i-1,j))/dx
+          vflux(i,j) = vflux(i,j) &
+              - dtau*g*hv(i,j)*(etasub(i,j) - etasub(i,j-1))/dy
+        end do
+      end do
+      call update_halos_2D(uflux, nx, ny)
+      call update_halos_2D(vflux, nx, ny)
+
+      if (m .le. substeps) then
+        etabar = etabar + etasub/dble(substeps)
+      end if
 
+      weight = 1d0 - cos(pi*dble(m)/dble(substeps))
+      etanew = etanew + weight*etasub
+      weight_sum = weight_sum + weight
+    end do
+
+    etanew = etanew/weight_sum
+
+    return
+  end subroutine split_explicit_solver
+
+  ! ---------------------------------------------------------------------------
   !> Update velocities using the barotropic tendency due to the pressure
   !> gradient.
 
@@ -459,7 +833,7 @@ module barotropic_mode
       xstep, ystep, dspace, dt, nx, ny, layers)
     implicit none
 
-    double precision, intent(inout) :: array(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(inout) :: array(0:nx+1, 0:ny+1, layers)
     double precision, intent(in) :: etanew(0:nx+1, 0:ny+1)
     double precision, intent(in) :: g_vec(layers)
     integer, intent(in) :: xstep, ystep
@@ -524,30 +898,134 @@ module barotropic_mode
     return
   end subroutine calc_A_matrix
 
+  ! ---------------------------------------------------------------------------
+  !> Assemble the operator for the pressure solver on the whole domain,
+  !! from the geometry held on every process's tile
+
+  subroutine calc_global_A_matrix(a_global, depth, g, dx, dy, nx, ny, &
+            freesurfFac, dt, hfacW, hfacE, hfacS, hfacN)
+    implicit none
+
+    double precision, intent(out) :: a_global(5, nx_global, ny_global)
+    double precision, intent(in)  :: depth(0:nx+1, 0:ny+1)
+    double precision, intent(in)  :: g, dx, dy
+    integer, intent(in)           :: nx, ny
+    double precision, intent(in)  :: freesurfFac
+    double precision, intent(in)  :: dt
+    double precision, intent(in)  :: hfacW(0:nx+1, 0:ny+1)
+    double precision, intent(in)  :: hfacE(0:nx+1, 0:ny+1)
+    double precision, intent(in)  :: hfacN(0:nx+1, 0:ny+1)
+    double precision, intent(in)  :: hfacS(0:nx+1, 0:ny+1)
+
+    double precision, allocatable :: depth_global(:,:)
+    double precision, allocatable :: hfacW_global(:,:), hfacE_global(:,:)
+    double precision, allocatable :: hfacN_global(:,:), hfacS_global(:,:)
+
+    allocate(depth_global(0:nx_global+1, 0:ny_global+1))
+    allocate(hfacW_global(0:nx_global+1, 0:ny_global+1))
+    allocate(hfacE_global(0:nx_global+1, 0:ny_global+1))
+    allocate(hfacN_global(0:nx_global+1, 0:ny_global+1))
+    allocate(hfacS_global(0:nx_global+1, 0:ny_global+1))
+
+    call gather_tiles(depth_global, depth, nx, ny, 1)
+    call gather_tiles(hfacW_global, hfacW, nx, ny, 1)
+    call gather_tiles(hfacE_global, hfacE, nx, ny, 1)
+    call gather_tiles(hfacN_global, hfacN, nx, ny, 1)
+    call gather_tiles(hfacS_global, hfacS, nx, ny, 1)
+
+    call calc_A_matrix(a_global, depth_global, g, dx, dy, &
+        nx_global, ny_global, freesurfFac, dt, &
+        hfacW_global, hfacE_global, hfacS_global, hfacN_global)
+
+    return
+  end subroutine calc_global_A_matrix
+
+  ! ---------------------------------------------------------------------------
+  !> Solve for the free surface on the whole domain with one of the
+  !! solvers that cannot work on a single tile
+
+  subroutine whole_domain_solver(solver_algorithm, a, etanew, etastar, &
+      etaguess, mg_levels, fft, nx, ny, dt, rjac, eps, maxits, n, iterations)
+    implicit none
+
+    integer,          intent(in)  :: solver_algorithm
+    double precision, intent(in)  :: a(5, nx, ny)
+    double precision, intent(out) :: etanew(0:nx+1, 0:ny+1)
+    double precision, intent(in)  :: etastar(0:nx+1, 0:ny+1)
+    double precision, intent(in)  :: etaguess(0:nx+1, 0:ny+1)
+    type(mg_level), allocatable, intent(inout) :: mg_levels(:)
+    type(spectral_plan), intent(in) :: fft
+    integer,          intent(in)  :: nx, ny
+    double precision, intent(in)  :: dt, rjac, eps
+    integer,          intent(in)  :: maxits, n
+    integer,          intent(out) :: iterations
+
+    if (solver_algorithm .eq. 1) then
+      ! lexicographic successive over-relaxation
+      call SOR_solver(a, etanew, etastar, etaguess, wet_columns_global, &
+         nx, ny, dt, rjac, eps, maxits, n, iterations)
+    else if (solver_algorithm .eq. 3) then
+      ! multigrid preconditioned conjugate gradient
+      call multigrid_solver(mg_levels, etanew, etastar, etaguess, nx, ny, &
+         dt, eps, maxits, n, iterations)
+    else if (solver_algorithm .eq. 4) then
+      if (fft%usable) then
+        ! direct solve with FFTs
+        call FFT_solver(fft, etanew, etastar, nx, ny, dt)
+        iterations = 0
+      else
+        ! the configuration is not suitable, so use multigrid instead
+        call multigrid_solver(mg_levels, etanew, etastar, etaguess, nx, ny, &
+           dt, eps, maxits, n, iterations)
+      end if
+    else
+      ! solver_algorithm not set correctly
+      call clean_stop(n, .FALSE.)
+    end if
+
+    return
+  end subroutine whole_domain_solver
+
   ! ---------------------------------------------------------------------------
   !> Do the isopycnal layer physics
 
-  subroutine barotropic_correction(hnew, unew, vnew, eta, etanew, depth, a, &
-      dx, dy, wetmask, hfacW, hfacS, dt, &
+  subroutine barotropic_correction(hnew, unew, vnew, eta, eta_prev, etanew, &
+      depth, a, a_global, dx, dy, wetmask, hfacW, hfacS, dt, &
+      solver_algorithm, solver_first_guess, solver_iterations, &
+      solver_initial_residual, solver_guess_residual, &
+      solver_final_residual, solver_time, &
+      mg_levels, fft, barotropic_substeps, &
       maxits, eps, rjac, freesurfFac, thickness_error, &
       debug_level, g_vec, nx, ny, layers, n, &
        MPI_COMM_WORLD, myid, num_procs, ilower, iupper, &
-       hypre_grid, hypre_A, ierr)
+       hypre_grid, hypre_A, hypre_solver, hypre_b, hypre_x, ierr)
 
     implicit none
 
-    double precision, intent(inout) :: hnew(0:nx+1, 0:ny+1, layers)
-    double precision, intent(inout) :: unew(0:nx+1, 0:ny+1, layers)
-    double precision, intent(inout) :: vnew(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(inout) :: hnew(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(inout) :: unew(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(inout) :: vnew(0:nx+1, 0:ny+1, layers)
     double precision, intent(in)    :: eta(0:nx+1, 0:ny+1)
+    double precision, intent(in)    :: eta_prev(0:nx+1, 0:ny+1)
     double precision, intent(out)   :: etanew(0:nx+1, 0:ny+1)
     double precision, intent(in)    :: depth(0:nx+1, 0:ny+1)
     double precision, intent(in)    :: a(5, nx, ny)
+    double precision, intent(in)    :: a_global(5, nx_global, ny_global)
     double precision, intent(in)    :: dx, dy
     double precision, intent(in)    :: wetmask(0:nx+1, 0:ny+1)
     double precision, intent(in)    :: hfacW(0:nx+1, 0:ny+1)
     double precision, intent(in)    :: hfacS(0:nx+1, 0:ny+1)
     double precision, intent(in)    :: dt
+    integer,          intent(in)    :: solver_algorithm
+    integer,          intent(in)    :: solver_first_guess
+    integer,          intent(out)   :: solver_iterations
+    double precision, intent(out)   :: solver_initial_residual
+    double precision, intent(out)   :: solver_guess_residual
+    double precision, intent(out)   :: solver_final_residual
+    double precision, intent(out)   :: solver_time
+    type(mg_level), allocatable, intent(inout) :: mg_levels(:)
+    type(spectral_plan), intent(in) :: fft
+    integer,          intent(in)    :: barotropic_substeps
     integer,          intent(in)    :: maxits
     double precision, intent(in)    :: eps, rjac, freesurfFac, thickness_error
     integer,          intent(in)    :: debug_level
@@ -559,33 +1037,42 @@ module barotropic_mode
     integer,          intent(in)    :: iupper(0:num_procs-1,2)
     integer*8,        intent(in)    :: hypre_grid
     integer*8,        intent(in)    :: hypre_A
+    integer*8,        intent(in)    :: hypre_solver
+    integer*8,        intent(in)    :: hypre_b
+    integer*8,        intent(in)    :: hypre_x
     integer,          intent(out) :: ierr
 
     ! barotropic velocity components (for pressure solver)
     double precision :: ub(nx+1, ny)
     double precision :: vb(nx, ny+1)
     double precision :: etastar(0:nx+1, 0:ny+1)
-
-    character(10)    :: num
+    ! first guess for the pressure solver
+    double precision :: etaguess(0:nx+1, 0:ny+1)
+    ! free surface that accelerates the flow over the time step
+    double precision :: etabar(0:nx+1, 0:ny+1)
+    double precision :: rhs(nx, ny)
+    integer*8        :: clock_start, clock_end, clock_rate
+    ! the problem on the whole domain, for the solvers that need it
+    double precision, allocatable :: etastar_global(:,:)
+    double precision, allocatable :: etaguess_global(:,:)
+    double precision, allocatable :: etanew_global(:,:)
+    ! barotropic velocities with a halo, for writing out
+    double precision :: baro_out(0:nx+1, 0:ny+1)
 
     ! Calculate the barotropic velocities
     call calc_baro_u(ub, unew, hnew, eta, freesurfFac, nx, ny, layers)
     call calc_baro_v(vb, vnew, hnew, eta, freesurfFac, nx, ny, layers)
     
     if (debug_level .ge. 4) then
-
-      write(num, '(i10.10)') n
-
-      ! Output the data to a file
-      open(unit=10, status='replace', file='output/'//'snap.ub.'//num, &
-          form='unformatted')
-      write(10) ub(1:nx+1, 1:ny)
-      close(10)
-
-      open(unit=10, status='replace', file='output/'//'snap.vb.'//num, &
-          form='unformatted')
-      write(10) vb(1:nx, 1:ny+1)
-      close(10)
+      baro_out = 0d0
+      baro_out(1:nx, 1:ny) = ub(1:nx, 1:ny)
+      call write_output_2d(baro_out, nx, ny, 1, 0, &
+        n, 'output/snap.ub.')
+
+      baro_out = 0d0
+      baro_out(1:nx, 1:ny) = vb(1:nx, 1:ny)
+      call write_output_2d(baro_out, nx, ny, 0, 1, &
+        n, 'output/snap.vb.')
     end if
 
 
@@ -601,17 +1088,76 @@ module barotropic_mode
     ! Prevent barotropic signals from bouncing around outside the
     ! wet region of the model.
     ! etastar = etastar*wetmask
+
+    if (solver_first_guess .eq. 1) then
+      ! the solver's own first guess
 #ifndef useExtSolver
-    call SOR_solver(a, etanew, etastar, nx, ny, &
-       dt, rjac, eps, maxits, n)
-    ! print *, maxval(abs(etanew))
+      etaguess = etastar
+#else
+      etaguess = -etastar/dt**2
 #endif
+    else if (solver_first_guess .eq. 2) then
+      ! the solution from the previous time step
+      etaguess = eta
+    else if (solver_first_guess .eq. 3) then
+      ! linear extrapolation from the previous two solutions
+      etaguess = 2d0*eta - eta_prev
+    else
+      ! solver_first_guess not set correctly
+      call clean_stop(n, .FALSE.)
+    end if
 
-#ifdef useExtSolver
-    call Ext_solver(MPI_COMM_WORLD, hypre_A, hypre_grid, myid, num_procs, &
-      ilower, iupper, etastar, &
-      etanew, nx, ny, dt, maxits, eps, ierr)
+    ! The solvers measure convergence against the residual of etastar,
+    ! whatever their first guess, so that is the initial residual. The
+    ! residual of the first guess shows how much a warm start helps.
+    rhs = -etastar(1:nx, 1:ny)/dt**2
+    call calc_residual_norm(solver_initial_residual, a, etastar, rhs, &
+        nx, ny)
+    solver_initial_residual = global_sum(solver_initial_residual)
+    call calc_residual_norm(solver_guess_residual, a, etaguess, rhs, &
+        nx, ny)
+    solver_guess_residual = global_sum(solver_guess_residual)
+    call system_clock(clock_start, clock_rate)
+
+    if (solver_algorithm .eq. 5) then
+      ! split-explicit subcycling, with no elliptic solve
+      call split_explicit_solver(etanew, etabar, eta, ub, vb, depth, &
+          wetmask, hfacW, hfacS, g_vec(1), freesurfFac, dx, dy, dt, &
+          barotropic_substeps, nx, ny)
+      solver_iterations = 2*barotropic_substeps
+    else
+#ifndef useExtSolver
+      if (solver_algorithm .eq. 2) then
+        ! red-black successive over-relaxation, on this process's tile
+        call SOR_red_black_solver(a, etanew, etastar, etaguess, wet_h, &
+           nx, ny, dt, rjac, eps, maxits, n, solver_iterations)
+      else
+        ! The other solvers need the whole domain, so every process
+        ! solves the gathered problem and keeps its own tile of the
+        ! solution
+        allocate(etastar_global(0:nx_global+1, 0:ny_global+1))
+        allocate(etaguess_global(0:nx_global+1, 0:ny_global+1))
+        allocate(etanew_global(0:nx_global+1, 0:ny_global+1))
+        call gather_tiles(etastar_global, etastar, nx, ny, 1)
+        call gather_tiles(etaguess_global, etaguess, nx, ny, 1)
+        call whole_domain_solver(solver_algorithm, a_global, etanew_global, &
+           etastar_global, etaguess_global, mg_levels, fft, &
+           nx_global, ny_global, dt, rjac, eps, maxits, n, solver_iterations)
+        call get_tile(etanew, etanew_global, nx, ny, 1)
+      end if
+      ! print *, maxval(abs(etanew))
+#else
+      call Ext_solver(MPI_COMM_WORLD, hypre_A, hypre_grid, myid, num_procs, &
+        ilower, iupper, etastar, etaguess, &
+        etanew, nx, ny, dt, hypre_solver, hypre_b, hypre_x, &
+        solver_iterations, ierr)
 #endif
+    end if
+
+    call system_clock(clock_end)
+    solver_time = dble(clock_end - clock_start)/dble(clock_rate)
+    call calc_residual_norm(solver_final_residual, a, etanew, rhs, nx, ny)
+    solver_final_residual = global_sum(solver_final_residual)
 
     if (debug_level .ge. 4) then
       call write_output_2d(etanew, nx, ny, 0, 0, &
@@ -620,13 +1166,21 @@ module barotropic_mode
 
     etanew = etanew*wetmask
 
-    call wrap_fields_2D(etanew, nx, ny)
+    call update_halos_2D(etanew, nx, ny)
+
+    if (solver_algorithm .ne. 5) then
+      ! the implicit solution applies for the whole time step
+      etabar = etanew
+    else
+      etabar = etabar*wetmask
+      call update_halos_2D(etabar, nx, ny)
+    end if
 
     ! Now update the velocities using the barotropic tendency due to
     ! the pressure gradient.
-    call update_velocities_for_barotropic_tendency(unew, etanew, g_vec, &
+    call update_velocities_for_barotropic_tendency(unew, etabar, g_vec, &
         1, 0, dx, dt, nx, ny, layers)
-    call update_velocities_for_barotropic_tendency(vnew, etanew, g_vec, &
+    call update_velocities_for_barotropic_tendency(vnew, etabar, g_vec, &
         0, 1, dy, dt, nx, ny, layers)
 
     ! We now have correct velocities at the next time step, but the
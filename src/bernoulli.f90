@@ -7,42 +7,48 @@ module bernoulli
 
   !> Evaluate the Bornoulli Potential for n-layer physics.
   !! B is evaluated at the tracer point, for each grid box.
-  subroutine evaluate_b_iso(b, h, u, v, nx, ny, layers, g_vec, depth)
+  subroutine evaluate_b_iso(b, h, u, v, nx, ny, layers, g_vec, depth, wet)
     implicit none
 
     ! Evaluate the baroclinic component of the Bernoulli Potential
     ! (u dot u + Montgomery potential) in the n-layer physics, at centre
     ! of grid box
 
-    double precision, intent(out) :: b(0:nx+1, 0:ny+1, layers) !< Bernoulli Potential
-    double precision, intent(in)  :: h(0:nx+1, 0:ny+1, layers) !< layer thicknesses
-    double precision, intent(in)  :: u(0:nx+1, 0:ny+1, layers) !< zonal velocities
-    double precision, intent(in)  :: v(0:nx+1, 0:ny+1, layers) !< meridional velocities
+    real(wp),         intent(out) :: b(0:nx+1, 0:ny+1, layers) !< Bernoulli Potential
+    real(wp),         intent(in)  :: h(0:nx+1, 0:ny+1, layers) !< layer thicknesses
+    real(wp),         intent(in)  :: u(0:nx+1, 0:ny+1, layers) !< zonal velocities
+    real(wp),         intent(in)  :: v(0:nx+1, 0:ny+1, layers) !< meridional velocities
     integer, intent(in) :: nx !< number of x grid points
     integer, intent(in) :: ny !< number of y grid points
     integer, intent(in) :: layers !< number of layers
     double precision, intent(in)  :: g_vec(layers) !< reduced gravity at each interface
     double precision, intent(in)  :: depth(0:nx+1, 0:ny+1) !< total depth of fluid
+    type(wet_spans), intent(in) :: wet !< points to evaluate b at
 
-    integer i, j, k
+    integer i, j, k, s
     double precision z(0:nx+1, 0:ny+1, layers)
     double precision M(0:nx+1, 0:ny+1, layers)
 
-    ! Calculate layer interface locations
-    z = 0d0
-    z(:, :, layers) = -depth
-
-    do k = 1, layers-1
-      z(:, :, layers - k) = z(:, :, layers-k+1) + h(:, :, layers-k+1)
-    end do
+    ! Calculate layer interface locations, and from them the baroclinic
+    ! Montgomery potential in each layer. Each water column is
+    ! independent, so the columns are shared out between threads.
+    !$omp parallel do private(i, k, s)
+    do j = y_shared_start, ny
+      do s = wet%first(j), wet%first(j+1) - 1
+        do i = max(wet%lo(s), x_shared_start), min(wet%hi(s), nx)
+          z(i,j,layers) = -depth(i,j)
+          do k = 1, layers-1
+            z(i,j,layers-k) = z(i,j,layers-k+1) + h(i,j,layers-k+1)
+          end do
 
-    ! Calculate Montogmery potential
-    ! The following loop is to get the baroclinic Montgomery potential
-    ! in each layer
-    M = 0d0
-    do k = 2, layers
-      M(:, :, k) = M(:, :, k-1) + g_vec(k) * z(:, :, k-1)
+          M(i,j,1) = 0d0
+          do k = 2, layers
+            M(i,j,k) = M(i,j,k-1) + g_vec(k) * z(i,j,k-1)
+          end do
+        end do
+      end do
     end do
+    !$omp end parallel do
 
     b = 0d0
     ! No baroclinic pressure contribution to the first layer Bernoulli
@@ -54,66 +60,76 @@ module bernoulli
     !     end do
     ! end do
 
-    ! For the rest of the layers we get a baroclinic pressure contribution
+    ! For the rest of the layers we get a baroclinic pressure contribution.
+    ! The momentum tendencies also need it in the row and column to the
+    ! south and west of the tile, where it is found from the halos of h,
+    ! u and v rather than by exchanging it with the neighbouring tiles.
+    ! Beyond a wall the halo is land, and is left at zero.
+    !$omp parallel do collapse(2) private(i, s)
     do k = 1, layers ! move through the different layers of the model
-      do j = 1, ny ! move through longitude
-        do i = 1, nx ! move through latitude
-          b(i,j,k) = M(i,j,k) &
-              + (u(i,j,k)**2+u(i+1,j,k)**2+v(i,j,k)**2+v(i,j+1,k)**2)/4.0d0
-          ! Add the (u^2 + v^2)/2 term to the Montgomery Potential
+      do j = y_shared_start, ny ! move through longitude
+        do s = wet%first(j), wet%first(j+1) - 1
+          do i = max(wet%lo(s), x_shared_start), min(wet%hi(s), nx)
+            b(i,j,k) = M(i,j,k) &
+                + (u(i,j,k)**2+u(i+1,j,k)**2+v(i,j,k)**2+v(i,j+1,k)**2)/4.0d0
+            ! Add the (u^2 + v^2)/2 term to the Montgomery Potential
+          end do
         end do
       end do
     end do
-
-    call wrap_fields_3D(b, nx, ny, layers)
-
+    !$omp end parallel do
 
     return
   end subroutine evaluate_b_iso
 
   ! ---------------------------------------------------------------------------
 
-  subroutine evaluate_b_RedGrav(b, h, u, v, nx, ny, layers, gr)
+  subroutine evaluate_b_RedGrav(b, h, u, v, nx, ny, layers, gr, wet)
     implicit none
 
     ! Evaluate Bernoulli Potential at centre of grid box
-    double precision, intent(out) :: b(0:nx+1, 0:ny+1, layers)
-    double precision, intent(in)  :: h(0:nx+1, 0:ny+1, layers)
-    double precision, intent(in)  :: u(0:nx+1, 0:ny+1, layers)
-    double precision, intent(in)  :: v(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(out) :: b(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in)  :: h(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in)  :: u(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in)  :: v(0:nx+1, 0:ny+1, layers)
     integer, intent(in) :: nx, ny, layers
     double precision, intent(in)  :: gr(layers)
+    type(wet_spans), intent(in) :: wet
 
-    integer i, j, k, l, m
+    integer i, j, k, l, m, s
     double precision h_temp, b_proto
 
     b = 0d0
 
+    ! As in evaluate_b_iso, include the row and column to the south and
+    ! west of the tile
+    !$omp parallel do collapse(2) private(i, s, l, m, h_temp, b_proto)
     do k = 1, layers ! move through the different layers of the model
-      do j = 1, ny ! move through longitude
-        do i = 1, nx ! move through latitude
-          ! The following loops are to get the pressure term in the
-          ! Bernoulli Potential
-          b_proto = 0d0
-          do l = k, layers
-            h_temp = 0d0
-            do m = 1, l
-              h_temp = h_temp + h(i, j, m) ! sum up the layer thicknesses
+      do j = y_shared_start, ny ! move through longitude
+        do s = wet%first(j), wet%first(j+1) - 1
+          do i = max(wet%lo(s), x_shared_start), min(wet%hi(s), nx)
+            ! The following loops are to get the pressure term in the
+            ! Bernoulli Potential
+            b_proto = 0d0
+            do l = k, layers
+              h_temp = 0d0
+              do m = 1, l
+                h_temp = h_temp + h(i, j, m) ! sum up the layer thicknesses
+              end do
+              ! Sum up the product of reduced gravity and summed layer
+              ! thicknesses to form the pressure componenet of the
+              ! Bernoulli Potential term
+              b_proto = b_proto + gr(l)*h_temp
             end do
-            ! Sum up the product of reduced gravity and summed layer
-            ! thicknesses to form the pressure componenet of the
-            ! Bernoulli Potential term
-            b_proto = b_proto + gr(l)*h_temp
+            ! Add the (u^2 + v^2)/2 term to the pressure componenet of the
+            ! Bernoulli Potential
+            b(i,j,k) = b_proto &
+                + (u(i,j,k)**2+u(i+1,j,k)**2+v(i,j,k)**2+v(i,j+1,k)**2)/4.0d0
           end do
-          ! Add the (u^2 + v^2)/2 term to the pressure componenet of the
-          ! Bernoulli Potential
-          b(i,j,k) = b_proto &
-              + (u(i,j,k)**2+u(i+1,j,k)**2+v(i,j,k)**2+v(i,j+1,k)**2)/4.0d0
         end do
       end do
     end do
-
-    call wrap_fields_3D(b, nx, ny, layers)
+    !$omp end parallel do
 
     return
   end subroutine evaluate_b_RedGrav
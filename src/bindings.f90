@@ -0,0 +1,245 @@
+module bindings
+  use iso_c_binding
+  use model_setup
+  use declarations
+  use mpi
+
+  implicit none
+
+  contains
+
+  ! ---------------------------------------------------------------------------
+  !> Set up a run in this process from the namelists in parameters.
+  !! The fields are read from the input files that the parameters
+  !! name, or given their defaults, and can then be replaced with
+  !! aronnax_set_field. MPI is started on the first call, and left
+  !! running for the runs that follow.
+
+  subroutine aronnax_setup(parameters, length) bind(C, name='aronnax_setup')
+    implicit none
+
+    integer(c_int), value,  intent(in) :: length
+    character(kind=c_char), intent(in) :: parameters(length)
+
+    character(len=length) :: text
+    logical :: started
+    integer :: k
+
+    do k = 1, length
+      text(k:k) = parameters(k)
+    end do
+
+    call read_parameters(text)
+
+    call MPI_INITIALIZED(started, ierr)
+    if (.not. started) then
+      call MPI_INIT(ierr)
+    end if
+
+    call init_model()
+    call read_inputs()
+
+    return
+  end subroutine aronnax_setup
+
+  ! ---------------------------------------------------------------------------
+  !> Report the size of the domain of the run that has been set up,
+  !! and whether it is reduced gravity (1) or not (0)
+
+  subroutine aronnax_grid(nx_out, ny_out, layers_out, nTimeSteps_out, &
+      RedGrav_out) bind(C, name='aronnax_grid')
+    implicit none
+
+    integer(c_int), intent(out) :: nx_out, ny_out, layers_out, nTimeSteps_out
+    integer(c_int), intent(out) :: RedGrav_out
+
+    nx_out = nx
+    ny_out = ny
+    layers_out = layers
+    nTimeSteps_out = nTimeSteps
+    RedGrav_out = merge(1, 0, RedGrav)
+
+    return
+  end subroutine aronnax_grid
+
+  ! ---------------------------------------------------------------------------
+  !> Replace a field of the run that has been set up. values holds the
+  !! field without its halo, laid out as the input file for it would
+  !! be. status is 0 if the field was set, and 1 if there is no field
+  !! of that name.
+
+  subroutine aronnax_set_field(name, length, values, status) &
+      bind(C, name='aronnax_set_field')
+    implicit none
+
+    integer(c_int), value,  intent(in)  :: length
+    character(kind=c_char), intent(in)  :: name(length)
+    real(c_double),         intent(in)  :: values(*)
+    integer(c_int),         intent(out) :: status
+
+    character(len=length) :: field
+    integer :: k
+
+    do k = 1, length
+      field(k:k) = name(k)
+    end do
+
+    status = 0
+    select case (field)
+    case ('h')
+      call set_fieldH(h, values, nx, ny, layers)
+    case ('u')
+      call set_fieldU(u, values, nx, ny, layers)
+    case ('v')
+      call set_fieldV(v, values, nx, ny, layers)
+    case ('eta')
+      call set_fieldH(eta, values, nx, ny, 1)
+    case ('depth')
+      call set_fieldH(depth, values, nx, ny, 1)
+    case ('wetmask')
+      call set_fieldH(wetmask, values, nx, ny, 1)
+    case ('fu')
+      call set_fieldU(fu, values, nx, ny, 1)
+    case ('fv')
+      call set_fieldV(fv, values, nx, ny, 1)
+    case ('base_wind_x')
+      call set_fieldU(base_wind_x, values, nx, ny, 1)
+    case ('base_wind_y')
+      call set_fieldV(base_wind_y, values, nx, ny, 1)
+    case ('wind_mag_time_series')
+      wind_mag_time_series = values(1:nTimeSteps)
+    case ('spongeHTimeScale')
+      call set_fieldH(spongeHTimeScale, values, nx, ny, layers)
+    case ('spongeUTimeScale')
+      call set_fieldU(spongeUTimeScale, values, nx, ny, layers)
+    case ('spongeVTimeScale')
+      call set_fieldV(spongeVTimeScale, values, nx, ny, layers)
+    case ('spongeH')
+      call set_fieldH(spongeH, values, nx, ny, layers)
+    case ('spongeU')
+      call set_fieldU(spongeU, values, nx, ny, layers)
+    case ('spongeV')
+      call set_fieldV(spongeV, values, nx, ny, layers)
+    case default
+      status = 1
+    end select
+
+    return
+  end subroutine aronnax_set_field
+
+  ! ---------------------------------------------------------------------------
+  !> Run the model that has been set up, without writing any output,
+  !! and free it. The final state is handed back with its halo, along
+  !! with the mean, maximum, minimum and standard deviation of each
+  !! layer of h, u and v over the wet points, as in the diagnostic
+  !! files. The run must be on a single process, so that its tile is
+  !! the whole domain.
+
+  subroutine aronnax_run(h_out, u_out, v_out, eta_out, diagnostics) &
+      bind(C, name='aronnax_run')
+    implicit none
+
+    real(c_double), intent(out) :: h_out(0:nx+1, 0:ny+1, layers)
+    real(c_double), intent(out) :: u_out(0:nx+1, 0:ny+1, layers)
+    real(c_double), intent(out) :: v_out(0:nx+1, 0:ny+1, layers)
+    real(c_double), intent(out) :: eta_out(0:nx+1, 0:ny+1)
+    real(c_double), intent(out) :: diagnostics(4, layers, 3)
+
+    call run_model(.FALSE., h_out, u_out, v_out, eta_out)
+
+    call summarise_layers(diagnostics(:,:,1), h_out, 0, 0)
+    call summarise_layers(diagnostics(:,:,2), u_out, 1, 0)
+    call summarise_layers(diagnostics(:,:,3), v_out, 0, 1)
+
+    call release_model()
+
+    return
+  end subroutine aronnax_run
+
+  ! ---------------------------------------------------------------------------
+  !> Free the run that has been set up, without running it
+
+  subroutine aronnax_release() bind(C, name='aronnax_release')
+    implicit none
+
+    call release_model()
+
+    return
+  end subroutine aronnax_release
+
+  ! ---------------------------------------------------------------------------
+  !> Find the mean, maximum, minimum and standard deviation of each
+  !! layer of a field over the wet points of the domain
+
+  subroutine summarise_layers(summary, array, xstep, ystep)
+    implicit none
+
+    double precision, intent(out) :: summary(4, layers)
+    double precision, intent(in)  :: array(0:nx+1, 0:ny+1, layers)
+    integer,          intent(in)  :: xstep, ystep
+
+    double precision :: stats(5)
+    integer          :: k
+
+    do k = 1, layers
+      call layer_statistics(stats, array(:,:,k), wetmask, nx, ny, &
+          xstep, ystep)
+      summary(1, k) = stats(2)
+      summary(2, k) = stats(4)
+      summary(3, k) = stats(5)
+      summary(4, k) = sqrt(stats(3)/max(stats(1), 1d0))
+    end do
+
+    return
+  end subroutine summarise_layers
+
+  ! ---------------------------------------------------------------------------
+  !> Copy a field at the tracer points into the interior of array,
+  !! and fill in its halo, as read_input_fileH does
+
+  subroutine set_fieldH(array, values, nx, ny, layers)
+    implicit none
+
+    double precision, intent(inout) :: array(0:nx+1, 0:ny+1, layers)
+    double precision, intent(in)    :: values(nx, ny, layers)
+    integer,          intent(in)    :: nx, ny, layers
+
+    array(1:nx, 1:ny, :) = values
+    call wrap_fields_3D(array, nx, ny, layers)
+
+    return
+  end subroutine set_fieldH
+
+  ! ---------------------------------------------------------------------------
+  !> Copy a field at the u points into array, as read_input_fileU does
+
+  subroutine set_fieldU(array, values, nx, ny, layers)
+    implicit none
+
+    double precision, intent(inout) :: array(0:nx+1, 0:ny+1, layers)
+    double precision, intent(in)    :: values(nx+1, ny, layers)
+    integer,          intent(in)    :: nx, ny, layers
+
+    array(1:nx+1, 1:ny, :) = values
+    call wrap_fields_3D(array, nx, ny, layers)
+
+    return
+  end subroutine set_fieldU
+
+  ! ---------------------------------------------------------------------------
+  !> Copy a field at the v points into array, as read_input_fileV does
+
+  subroutine set_fieldV(array, values, nx, ny, layers)
+    implicit none
+
+    double precision, intent(inout) :: array(0:nx+1, 0:ny+1, layers)
+    double precision, intent(in)    :: values(nx, ny+1, layers)
+    integer,          intent(in)    :: nx, ny, layers
+
+    array(1:nx, 1:ny+1, :) = values
+    call wrap_fields_3D(array, nx, ny, layers)
+
+    return
+  end subroutine set_fieldV
+
+end module bindings
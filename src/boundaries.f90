@@ -1,9 +1,111 @@
 module boundaries
+  use kinds
 
   implicit none
 
+  !> Domain decomposition, set by init_decomposition. Each process owns
+  !! one tile of the global grid, and fills the halo of its arrays from
+  !! the four neighbouring tiles. In a periodic direction the tiles on
+  !! opposite edges of the domain are neighbours. In a closed direction
+  !! the domain ends in a wall: the halo beyond it is land, and is never
+  !! updated, and the tiles on the edge have no neighbour there
+  !! (MPI_PROC_NULL).
+  logical :: periodic_x = .TRUE., periodic_y = .TRUE.
+  integer :: nx_global = 0, ny_global = 0
+  !> global index of the tile's first grid point, minus one
+  integer :: x_offset = 0, y_offset = 0
+  integer :: decomp_comm = 0
+  integer :: decomp_rank = 0
+  integer :: decomp_size = 1
+  integer :: west_rank = 0, east_rank = 0
+  integer :: south_rank = 0, north_rank = 0
+  !> first index along x and y of the points that are this tile's or
+  !! are shared with a neighbouring tile: 0 if there is a neighbour to
+  !! the west or south, and 1 if the domain ends in a wall there
+  integer :: x_shared_start = 0, y_shared_start = 0
+  !> extents of every process's tile in global indices,
+  !! (:,1) for x and (:,2) for y
+  integer, allocatable :: tile_lower(:,:), tile_upper(:,:)
+
+  !> Runs of consecutive wet points along each row of a grid. The runs
+  !! on row j are first(j) to first(j+1)-1, and run s covers the points
+  !! lo(s) to hi(s). Loops over these skip the land, so their cost
+  !! scales with the area of ocean rather than the size of the grid.
+  type :: wet_spans
+    integer, allocatable :: first(:)
+    integer, allocatable :: lo(:), hi(:)
+  end type wet_spans
+
+  !> Points of this process's tile that the tendency kernels visit, set
+  !! by calc_wet_spans: the wet tracer points and the land within two
+  !! points of them
+  type(wet_spans) :: wet_margin
+  !> Wet tracer points of this process's tile, for the red-black SOR
+  !! solver
+  type(wet_spans) :: wet_h
+  !> Wet tracer points of the whole domain, by column rather than by
+  !! row, in the order that the lexicographic SOR solver visits them
+  type(wet_spans) :: wet_columns_global
+
   contains
 
+  !----------------------------------------------------------------------------
+  !> Record the tile owned by this process and the processes that own
+  !! the neighbouring tiles. Process myid owns tile
+  !! (mod(myid, nProcX), myid/nProcX).
+
+  subroutine init_decomposition(comm, myid, num_procs, nProcX, nProcY, &
+      periodicX, periodicY, ilower, iupper, nx, ny)
+    use mpi
+    implicit none
+
+    integer, intent(in) :: comm, myid, num_procs
+    integer, intent(in) :: nProcX, nProcY
+    logical, intent(in) :: periodicX, periodicY
+    integer, intent(in) :: ilower(0:num_procs-1, 2)
+    integer, intent(in) :: iupper(0:num_procs-1, 2)
+    integer, intent(in) :: nx, ny
+
+    integer :: px, py
+
+    periodic_x = periodicX
+    periodic_y = periodicY
+    decomp_comm = comm
+    decomp_rank = myid
+    decomp_size = num_procs
+    nx_global = nx
+    ny_global = ny
+
+    ! a process may run the model more than once
+    if (allocated(tile_lower)) deallocate(tile_lower, tile_upper)
+    allocate(tile_lower(0:num_procs-1, 2))
+    allocate(tile_upper(0:num_procs-1, 2))
+    tile_lower = ilower
+    tile_upper = iupper
+
+    x_offset = ilower(myid, 1) - 1
+    y_offset = ilower(myid, 2) - 1
+
+    px = mod(myid, nProcX)
+    py = myid/nProcX
+    west_rank  = mod(px - 1 + nProcX, nProcX) + py*nProcX
+    east_rank  = mod(px + 1, nProcX) + py*nProcX
+    south_rank = px + mod(py - 1 + nProcY, nProcY)*nProcX
+    north_rank = px + mod(py + 1, nProcY)*nProcX
+    if (.not. periodic_x) then
+      if (px .eq. 0) west_rank = MPI_PROC_NULL
+      if (px .eq. nProcX - 1) east_rank = MPI_PROC_NULL
+    end if
+    if (.not. periodic_y) then
+      if (py .eq. 0) south_rank = MPI_PROC_NULL
+      if (py .eq. nProcY - 1) north_rank = MPI_PROC_NULL
+    end if
+    x_shared_start = merge(1, 0, west_rank .eq. MPI_PROC_NULL)
+    y_shared_start = merge(1, 0, south_rank .eq. MPI_PROC_NULL)
+
+    return
+  end subroutine init_decomposition
+
   !----------------------------------------------------------------------------
   !> Define masks for boundary conditions in u and v.
   !! This finds locations where neighbouring grid boxes are not the same
@@ -44,7 +146,7 @@ module boundaries
     end do
 
     ! and now for all  western cells
-    hfacW(0, :) = hfacW(nx, :)
+    call update_halos_2D(hfacW, nx, ny)
 
     hfacE = 1d0
 
@@ -64,7 +166,7 @@ module boundaries
     end do
 
     ! and now for all  eastern cells
-    hfacE(nx+1, :) = hfacE(1, :)
+    call update_halos_2D(hfacE, nx, ny)
 
     hfacS = 1
 
@@ -84,7 +186,7 @@ module boundaries
     end do
 
     ! all southern cells
-    hfacS(:, 0) = hfacS(:, ny)
+    call update_halos_2D(hfacS, nx, ny)
 
     hfacN = 1
     temp = 0.0
@@ -102,18 +204,128 @@ module boundaries
       end do
     end do
     ! all northern cells
-    hfacN(:, ny+1) = hfacN(:, 1)
+    call update_halos_2D(hfacN, nx, ny)
 
     return
   end subroutine calc_boundary_masks
 
+  ! ---------------------------------------------------------------------------
+  !> Find the runs of points that the tendency kernels and the SOR
+  !! solvers iterate over. The kernels also visit the land within two
+  !! points of the coast, because the RK2 step reads the velocities on
+  !! the land side of the coast from its first tendency evaluation, and
+  !! those depend on the tendencies one point further inland. If
+  !! skip_land is false, every point is visited, so that the debug
+  !! output holds the values on land as well.
+
+  subroutine calc_wet_spans(wetmask, skip_land, nx, ny)
+    implicit none
+
+    double precision, intent(in) :: wetmask(0:nx+1, 0:ny+1)
+    logical, intent(in) :: skip_land
+    integer, intent(in) :: nx, ny
+
+    double precision :: wet(0:nx+1, 0:ny+1)
+    double precision :: margin(0:nx+1, 0:ny+1)
+    double precision :: widened(0:nx+1, 0:ny+1)
+    double precision, allocatable :: wet_global(:,:)
+    double precision, allocatable :: wet_by_column(:,:)
+    integer i, j, pass
+
+    if (skip_land) then
+      wet = wetmask
+    else
+      wet = 1d0
+    end if
+    call update_halos_2D(wet, nx, ny)
+
+    ! widen the wet region by one point in each pass
+    margin = wet
+    do pass = 1, 2
+      widened = margin
+      do j = 1, ny
+        do i = 1, nx
+          if (any(margin(i-1:i+1, j-1:j+1) .ne. 0d0)) then
+            widened(i,j) = 1d0
+          end if
+        end do
+      end do
+      call update_halos_2D(widened, nx, ny)
+      margin = widened
+    end do
+
+    call build_wet_spans(wet_margin, margin, nx, ny)
+    call build_wet_spans(wet_h, wet, nx, ny)
+
+    allocate(wet_global(0:nx_global+1, 0:ny_global+1))
+    allocate(wet_by_column(0:ny_global+1, 0:nx_global+1))
+    call gather_tiles(wet_global, wet, nx, ny, 1)
+    wet_by_column = transpose(wet_global)
+    call build_wet_spans(wet_columns_global, wet_by_column, &
+        ny_global, nx_global)
+
+    return
+  end subroutine calc_wet_spans
+
+  ! ---------------------------------------------------------------------------
+  !> Record the runs of nonzero points along each row of mask, including
+  !! its halo
+
+  subroutine build_wet_spans(spans, mask, nx, ny)
+    implicit none
+
+    type(wet_spans), intent(out) :: spans
+    double precision, intent(in) :: mask(0:nx+1, 0:ny+1)
+    integer, intent(in) :: nx, ny
+
+    integer i, j, s
+    logical wet, wet_before
+
+    ! count the runs first, so that the lists can be allocated
+    s = 0
+    do j = 0, ny+1
+      wet_before = .FALSE.
+      do i = 0, nx+1
+        wet = mask(i,j) .ne. 0d0
+        if (wet .and. .not. wet_before) then
+          s = s + 1
+        end if
+        wet_before = wet
+      end do
+    end do
+
+    allocate(spans%first(0:ny+2))
+    allocate(spans%lo(s))
+    allocate(spans%hi(s))
+
+    s = 0
+    do j = 0, ny+1
+      spans%first(j) = s + 1
+      wet_before = .FALSE.
+      do i = 0, nx+1
+        wet = mask(i,j) .ne. 0d0
+        if (wet .and. .not. wet_before) then
+          s = s + 1
+          spans%lo(s) = i
+        end if
+        if (wet) then
+          spans%hi(s) = i
+        end if
+        wet_before = wet
+      end do
+    end do
+    spans%first(ny+2) = s + 1
+
+    return
+  end subroutine build_wet_spans
+
   ! ---------------------------------------------------------------------------
   !> Apply the boundary conditions
 
   subroutine apply_boundary_conditions(array, hfac, wetmask, nx, ny, layers)
     implicit none
 
-    double precision, intent(inout) :: array(0:nx+1,0:ny+1,layers)
+    real(wp),         intent(inout) :: array(0:nx+1,0:ny+1,layers)
     double precision, intent(in) :: hfac(0:nx+1,0:ny+1)
     double precision, intent(in) :: wetmask(0:nx+1,0:ny+1)
     integer, intent(in) :: nx, ny, layers
@@ -135,7 +347,11 @@ module boundaries
   end subroutine apply_boundary_conditions
 
   !-----------------------------------------------------------------
-  !> Wrap 3D fields around for periodic boundary conditions
+  !> Fill the halo of a 3D field on the whole domain. The field is
+  !! wrapped around in periodic directions. In closed directions the
+  !! halo takes the value next to it, so that it holds sensible values
+  !! for the fields that are defined everywhere, such as the depth and
+  !! the layer thicknesses.
 
   subroutine wrap_fields_3D(array, nx, ny, layers)
     implicit none
@@ -143,17 +359,28 @@ module boundaries
     double precision, intent(inout) :: array(0:nx+1, 0:ny+1, layers)
     integer, intent(in) :: nx, ny, layers
 
-    ! wrap array around for periodicity
-    array(0, :, :) = array(nx, :, :)
-    array(nx+1, :, :) = array(1, :, :)
-    array(:, 0, :) = array(:, ny, :)
-    array(:, ny+1, :) = array(:, 1, :)
+    if (periodic_x) then
+      ! wrap array around for periodicity
+      array(0, :, :) = array(nx, :, :)
+      array(nx+1, :, :) = array(1, :, :)
+    else
+      array(0, :, :) = array(1, :, :)
+      array(nx+1, :, :) = array(nx, :, :)
+    end if
+    if (periodic_y) then
+      array(:, 0, :) = array(:, ny, :)
+      array(:, ny+1, :) = array(:, 1, :)
+    else
+      array(:, 0, :) = array(:, 1, :)
+      array(:, ny+1, :) = array(:, ny, :)
+    end if
 
     return
   end subroutine wrap_fields_3D
 
   !-----------------------------------------------------------------
-  !> Wrap 2D fields around for periodic boundary conditions
+  !> Fill the halo of a 2D field on the whole domain, as for
+  !! wrap_fields_3D
 
   subroutine wrap_fields_2D(array, nx, ny)
     implicit none
@@ -161,13 +388,371 @@ module boundaries
     double precision, intent(inout) :: array(0:nx+1, 0:ny+1)
     integer, intent(in) :: nx, ny
 
-    ! wrap array around for periodicity
-    array(0, :) = array(nx, :)
-    array(nx+1, :) = array(1, :)
-    array(:, 0) = array(:, ny)
-    array(:, ny+1) = array(:, 1)
+    if (periodic_x) then
+      ! wrap array around for periodicity
+      array(0, :) = array(nx, :)
+      array(nx+1, :) = array(1, :)
+    else
+      array(0, :) = array(1, :)
+      array(nx+1, :) = array(nx, :)
+    end if
+    if (periodic_y) then
+      array(:, 0) = array(:, ny)
+      array(:, ny+1) = array(:, 1)
+    else
+      array(:, 0) = array(:, 1)
+      array(:, ny+1) = array(:, ny)
+    end if
 
     return
   end subroutine wrap_fields_2D
 
+  !-----------------------------------------------------------------
+  !> Make the halo beyond the edges of the domain in closed directions
+  !! land, so that the domain ends in a wall there whatever the wetmask
+  !! holds along its edges. wetmask is on the whole domain.
+
+  subroutine close_domain_edges(wetmask, nx, ny)
+    implicit none
+
+    double precision, intent(inout) :: wetmask(0:nx+1, 0:ny+1)
+    integer, intent(in) :: nx, ny
+
+    if (.not. periodic_x) then
+      wetmask(0, :) = 0d0
+      wetmask(nx+1, :) = 0d0
+    end if
+    if (.not. periodic_y) then
+      wetmask(:, 0) = 0d0
+      wetmask(:, ny+1) = 0d0
+    end if
+
+    return
+  end subroutine close_domain_edges
+
+  !-----------------------------------------------------------------
+  !> Fill the halo of a 3D field on this process's tile from the
+  !! neighbouring tiles. On a single process this is the same as
+  !! wrapping the field around in the periodic directions. The halo
+  !! beyond a wall is left as it is.
+
+  subroutine update_halos_3D(array, nx, ny, layers)
+    use mpi
+    implicit none
+
+    real(wp),         intent(inout) :: array(0:nx+1, 0:ny+1, layers)
+    integer, intent(in) :: nx, ny, layers
+
+    real(wp)         :: send_x(ny, layers), recv_x(ny, layers)
+    real(wp)         :: send_y(0:nx+1, layers), recv_y(0:nx+1, layers)
+    integer :: ierr
+#ifdef useSinglePrecision
+    integer, parameter :: field_type = MPI_REAL
+#else
+    integer, parameter :: field_type = MPI_DOUBLE_PRECISION
+#endif
+
+    if (decomp_size .eq. 1) then
+      ! wrap the field around for periodicity
+      if (periodic_x) then
+        array(0, :, :) = array(nx, :, :)
+        array(nx+1, :, :) = array(1, :, :)
+      end if
+      if (periodic_y) then
+        array(:, 0, :) = array(:, ny, :)
+        array(:, ny+1, :) = array(:, 1, :)
+      end if
+      return
+    end if
+
+    ! east and west halos. Sending to or receiving from MPI_PROC_NULL,
+    ! across a wall, does nothing.
+    send_x = array(nx, 1:ny, :)
+    call MPI_Sendrecv(send_x, ny*layers, field_type, east_rank, 1, &
+        recv_x, ny*layers, field_type, west_rank, 1, &
+        decomp_comm, MPI_STATUS_IGNORE, ierr)
+    if (west_rank .ne. MPI_PROC_NULL) array(0, 1:ny, :) = recv_x
+
+    send_x = array(1, 1:ny, :)
+    call MPI_Sendrecv(send_x, ny*layers, field_type, west_rank, 2, &
+        recv_x, ny*layers, field_type, east_rank, 2, &
+        decomp_comm, MPI_STATUS_IGNORE, ierr)
+    if (east_rank .ne. MPI_PROC_NULL) array(nx+1, 1:ny, :) = recv_x
+
+    ! north and south halos, which carry the corners with them
+    send_y = array(:, ny, :)
+    call MPI_Sendrecv(send_y, (nx+2)*layers, field_type, &
+        north_rank, 3, recv_y, (nx+2)*layers, field_type, &
+        south_rank, 3, decomp_comm, MPI_STATUS_IGNORE, ierr)
+    if (south_rank .ne. MPI_PROC_NULL) array(:, 0, :) = recv_y
+
+    send_y = array(:, 1, :)
+    call MPI_Sendrecv(send_y, (nx+2)*layers, field_type, &
+        south_rank, 4, recv_y, (nx+2)*layers, field_type, &
+        north_rank, 4, decomp_comm, MPI_STATUS_IGNORE, ierr)
+    if (north_rank .ne. MPI_PROC_NULL) array(:, ny+1, :) = recv_y
+
+    return
+  end subroutine update_halos_3D
+
+  !-----------------------------------------------------------------
+  !> Fill the halo of a 2D field on this process's tile from the
+  !! neighbouring tiles
+
+  subroutine update_halos_2D(array, nx, ny)
+    use mpi
+    implicit none
+
+    double precision, intent(inout) :: array(0:nx+1, 0:ny+1)
+    integer, intent(in) :: nx, ny
+
+    double precision :: send_x(ny), recv_x(ny)
+    double precision :: send_y(0:nx+1), recv_y(0:nx+1)
+    integer :: ierr
+
+    if (decomp_size .eq. 1) then
+      ! wrap the field around for periodicity
+      if (periodic_x) then
+        array(0, :) = array(nx, :)
+        array(nx+1, :) = array(1, :)
+      end if
+      if (periodic_y) then
+        array(:, 0) = array(:, ny)
+        array(:, ny+1) = array(:, 1)
+      end if
+      return
+    end if
+
+    ! east and west halos
+    send_x = array(nx, 1:ny)
+    call MPI_Sendrecv(send_x, ny, MPI_DOUBLE_PRECISION, east_rank, 1, &
+        recv_x, ny, MPI_DOUBLE_PRECISION, west_rank, 1, &
+        decomp_comm, MPI_STATUS_IGNORE, ierr)
+    if (west_rank .ne. MPI_PROC_NULL) array(0, 1:ny) = recv_x
+
+    send_x = array(1, 1:ny)
+    call MPI_Sendrecv(send_x, ny, MPI_DOUBLE_PRECISION, west_rank, 2, &
+        recv_x, ny, MPI_DOUBLE_PRECISION, east_rank, 2, &
+        decomp_comm, MPI_STATUS_IGNORE, ierr)
+    if (east_rank .ne. MPI_PROC_NULL) array(nx+1, 1:ny) = recv_x
+
+    ! north and south halos, which carry the corners with them
+    send_y = array(:, ny)
+    call MPI_Sendrecv(send_y, nx+2, MPI_DOUBLE_PRECISION, north_rank, 3, &
+        recv_y, nx+2, MPI_DOUBLE_PRECISION, south_rank, 3, &
+        decomp_comm, MPI_STATUS_IGNORE, ierr)
+    if (south_rank .ne. MPI_PROC_NULL) array(:, 0) = recv_y
+
+    send_y = array(:, 1)
+    call MPI_Sendrecv(send_y, nx+2, MPI_DOUBLE_PRECISION, south_rank, 4, &
+        recv_y, nx+2, MPI_DOUBLE_PRECISION, north_rank, 4, &
+        decomp_comm, MPI_STATUS_IGNORE, ierr)
+    if (north_rank .ne. MPI_PROC_NULL) array(:, ny+1) = recv_y
+
+    return
+  end subroutine update_halos_2D
+
+  !-----------------------------------------------------------------
+  !> Assemble a field on the global grid from the tiles held by every
+  !! process. Every process receives the whole field. Its halo is
+  !! wrapped around in periodic directions, and beyond a wall it holds
+  !! the halo of the tile on that edge, as on a single process. 2D
+  !! fields are passed with nz = 1.
+
+  subroutine gather_tiles(global, array, nx, ny, nz)
+    use mpi
+    implicit none
+
+    double precision, intent(out) :: global(0:nx_global+1, 0:ny_global+1, nz)
+    double precision, intent(in)  :: array(0:nx+1, 0:ny+1, nz)
+    integer, intent(in) :: nx, ny, nz
+
+    double precision, allocatable :: send_buf(:), recv_buf(:), tile(:,:,:)
+    integer :: counts(0:decomp_size-1), displs(0:decomp_size-1)
+    integer :: r, tnx, tny, i_lo, i_hi, j_lo, j_hi, ierr
+
+    if (decomp_size .eq. 1) then
+      global = array
+      return
+    end if
+
+    ! each tile is sent with its halo
+    do r = 0, decomp_size - 1
+      counts(r) = (tile_upper(r,1) - tile_lower(r,1) + 3) &
+          *(tile_upper(r,2) - tile_lower(r,2) + 3)*nz
+    end do
+    displs(0) = 0
+    do r = 1, decomp_size - 1
+      displs(r) = displs(r-1) + counts(r-1)
+    end do
+
+    allocate(send_buf((nx+2)*(ny+2)*nz))
+    allocate(recv_buf(sum(counts)))
+    send_buf = reshape(array, [(nx+2)*(ny+2)*nz])
+
+    call MPI_Allgatherv(send_buf, (nx+2)*(ny+2)*nz, MPI_DOUBLE_PRECISION, &
+        recv_buf, counts, displs, MPI_DOUBLE_PRECISION, decomp_comm, ierr)
+
+    do r = 0, decomp_size - 1
+      tnx = tile_upper(r,1) - tile_lower(r,1) + 1
+      tny = tile_upper(r,2) - tile_lower(r,2) + 1
+      allocate(tile(0:tnx+1, 0:tny+1, nz))
+      tile = reshape(recv_buf(displs(r)+1:displs(r)+counts(r)), &
+          [tnx+2, tny+2, nz])
+
+      ! the interior, and the halo beyond a wall
+      i_lo = 1
+      i_hi = tnx
+      j_lo = 1
+      j_hi = tny
+      if (.not. periodic_x) then
+        if (tile_lower(r,1) .eq. 1) i_lo = 0
+        if (tile_upper(r,1) .eq. nx_global) i_hi = tnx + 1
+      end if
+      if (.not. periodic_y) then
+        if (tile_lower(r,2) .eq. 1) j_lo = 0
+        if (tile_upper(r,2) .eq. ny_global) j_hi = tny + 1
+      end if
+
+      global(tile_lower(r,1)-1+i_lo:tile_lower(r,1)-1+i_hi, &
+          tile_lower(r,2)-1+j_lo:tile_lower(r,2)-1+j_hi, :) = &
+          tile(i_lo:i_hi, j_lo:j_hi, :)
+      deallocate(tile)
+    end do
+
+    ! wrap the field around for periodicity
+    if (periodic_x) then
+      global(0, :, :) = global(nx_global, :, :)
+      global(nx_global+1, :, :) = global(1, :, :)
+    end if
+    if (periodic_y) then
+      global(:, 0, :) = global(:, ny_global, :)
+      global(:, ny_global+1, :) = global(:, 1, :)
+    end if
+
+    return
+  end subroutine gather_tiles
+
+  !-----------------------------------------------------------------
+  !> Copy this process's tile, with its halo, out of a field on the
+  !! global grid. The global field must already be wrapped around.
+
+  subroutine get_tile(array, global, nx, ny, nz)
+    implicit none
+
+    double precision, intent(out) :: array(0:nx+1, 0:ny+1, nz)
+    double precision, intent(in)  :: global(0:nx_global+1, 0:ny_global+1, nz)
+    integer, intent(in) :: nx, ny, nz
+
+    array = global(x_offset:x_offset+nx+1, y_offset:y_offset+ny+1, :)
+
+    return
+  end subroutine get_tile
+
+  !-----------------------------------------------------------------
+  !> Replace a 3D field on the global grid with this process's tile of it
+
+  subroutine restrict_to_tile_3D(array, nx, ny, layers)
+    implicit none
+
+    double precision, allocatable, intent(inout) :: array(:,:,:)
+    integer, intent(in) :: nx, ny, layers
+
+    double precision, allocatable :: tile(:,:,:)
+
+    if (decomp_size .eq. 1) return
+
+    allocate(tile(0:nx+1, 0:ny+1, layers))
+    call get_tile(tile, array, nx, ny, layers)
+    call move_alloc(tile, array)
+
+    return
+  end subroutine restrict_to_tile_3D
+
+  !-----------------------------------------------------------------
+  !> Replace a 2D field on the global grid with this process's tile of it
+
+  subroutine restrict_to_tile_2D(array, nx, ny)
+    implicit none
+
+    double precision, allocatable, intent(inout) :: array(:,:)
+    integer, intent(in) :: nx, ny
+
+    double precision, allocatable :: tile(:,:)
+
+    if (decomp_size .eq. 1) return
+
+    allocate(tile(0:nx+1, 0:ny+1))
+    call get_tile(tile, array, nx, ny, 1)
+    call move_alloc(tile, array)
+
+    return
+  end subroutine restrict_to_tile_2D
+
+  !-----------------------------------------------------------------
+  !> Collect n values from every process onto the first one, in the
+  !! order of the processes
+
+  subroutine gather_values(all_values, values, n)
+    use mpi
+    implicit none
+
+    double precision, intent(out) :: all_values(n, 0:decomp_size-1)
+    double precision, intent(in)  :: values(n)
+    integer, intent(in) :: n
+
+    integer :: ierr
+
+    if (decomp_size .eq. 1) then
+      all_values(:, 0) = values
+    else
+      call MPI_Gather(values, n, MPI_DOUBLE_PRECISION, all_values, n, &
+          MPI_DOUBLE_PRECISION, 0, decomp_comm, ierr)
+    end if
+
+    return
+  end subroutine gather_values
+
+  !-----------------------------------------------------------------
+  !> Sum a value over all processes
+
+  double precision function global_sum(x)
+    use mpi
+    implicit none
+
+    double precision, intent(in) :: x
+
+    integer :: ierr
+
+    if (decomp_size .eq. 1) then
+      global_sum = x
+    else
+      call MPI_Allreduce(x, global_sum, 1, MPI_DOUBLE_PRECISION, MPI_SUM, &
+          decomp_comm, ierr)
+    end if
+
+    return
+  end function global_sum
+
+  !-----------------------------------------------------------------
+  !> Find the largest value of x over all processes
+
+  double precision function global_max(x)
+    use mpi
+    implicit none
+
+    double precision, intent(in) :: x
+
+    integer :: ierr
+
+    if (decomp_size .eq. 1) then
+      global_max = x
+    else
+      call MPI_Allreduce(x, global_max, 1, MPI_DOUBLE_PRECISION, MPI_MAX, &
+          decomp_comm, ierr)
+    end if
+
+    return
+  end function global_max
+
 end module boundaries
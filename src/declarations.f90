@@ -6,6 +6,8 @@ module declarations
   ! Resolution
   integer :: nx !< number of x grid points
   integer :: ny !< number of y grid points
+  integer :: nx_tile !< number of x grid points on this process's tile
+  integer :: ny_tile !< number of y grid points on this process's tile
   integer :: layers !< number of active layers in the model
   ! Layer thickness (h)
   double precision, dimension(:,:,:), allocatable :: h
@@ -22,6 +24,8 @@ module declarations
   ! Grid
   double precision :: dx, dy
   double precision, dimension(:,:),   allocatable :: wetmask
+  ! whether the domain wraps around in x and y, or ends in walls
+  logical :: periodicX, periodicY
   ! Coriolis parameter at u and v grid-points respectively
   double precision, dimension(:,:),   allocatable :: fu
   double precision, dimension(:,:),   allocatable :: fv
@@ -35,11 +39,16 @@ module declarations
   double precision :: slip, hmin
   integer          :: niter0, nTimeSteps
   double precision :: dumpFreq, avFreq, checkpointFreq, diagFreq
+  integer          :: keep_checkpoints
+  integer          :: output_format, deflate_level
+  logical          :: adaptive_dt
+  double precision :: dt_min, dt_max, max_cfl
   double precision, dimension(:),     allocatable :: zeros
   integer maxits
   double precision :: eps, freesurfFac, thickness_error
   integer          :: debug_level
   integer          :: hAdvecScheme
+  integer          :: tendency_algorithm
   integer          :: TS_algorithm
   integer          :: AB_order
 
@@ -75,8 +84,11 @@ module declarations
   logical :: RelativeWind
   double precision :: Cd
 
-  ! External pressure solver variables
+  ! Pressure solver variables
   integer :: nProcX, nProcY
+  integer :: solver_algorithm
+  integer :: solver_first_guess
+  integer :: barotropic_substeps
 
 
   integer :: ierr
@@ -90,4 +102,139 @@ module declarations
 
   contains
 
+  ! ---------------------------------------------------------------------------
+  !> Read the parameters of a run from Fortran namelists held in text,
+  !! after setting the defaults for those that it leaves out
+
+  subroutine read_parameters(text)
+    implicit none
+
+    character(*), intent(in) :: text
+
+    namelist /NUMERICS/ au, kh, kv, ar, botDrag, dt, slip, &
+        niter0, nTimeSteps, hAdvecScheme, TS_algorithm, tendency_algorithm, &
+        dumpFreq, avFreq, checkpointFreq, diagFreq, hmin, maxits, &
+        freesurfFac, eps, thickness_error, debug_level, &
+        adaptive_dt, dt_min, dt_max, max_cfl, output_format, deflate_level, &
+        keep_checkpoints
+
+    namelist /MODEL/ hmean, depthFile, H0, RedGrav
+
+    namelist /PRESSURE_SOLVER/ nProcX, nProcY, solver_algorithm, &
+        solver_first_guess, barotropic_substeps
+
+    namelist /SPONGE/ spongeHTimeScaleFile, spongeUTimeScaleFile, &
+        spongeVTimeScaleFile, spongeHfile, spongeUfile, spongeVfile
+
+    namelist /PHYSICS/ g_vec, rho0
+
+    namelist /GRID/ nx, ny, layers, dx, dy, fUfile, fVfile, wetMaskFile, &
+        periodicX, periodicY
+
+    namelist /INITIAL_CONDITIONS/ initUfile, initVfile, initHfile, initEtaFile
+
+    namelist /EXTERNAL_FORCING/ zonalWindFile, meridionalWindFile, &
+        RelativeWind, Cd, &
+        DumpWind, wind_mag_time_series_file
+
+    ! Set default values here
+
+    ! io default frequencies
+    dumpFreq = 1d9
+    avFreq = 0d0
+    checkpointFreq = 0d0
+    diagFreq = 0d0
+
+
+    debug_level = 0
+
+    ! write raw output files, uncompressed if NetCDF is chosen
+    output_format = 1
+    deflate_level = 0
+
+    ! keep every checkpoint
+    keep_checkpoints = 0
+
+    ! keep the time step fixed. If it varies, the bounds default to a
+    ! tenth of dt and ten times dt
+    adaptive_dt = .FALSE.
+    dt_min = 0d0
+    dt_max = 0d0
+    max_cfl = 0.3d0
+
+    ! start from t = 0
+    niter0 = 0
+
+    ! use N/m^2
+    RelativeWind = .FALSE.
+
+    ! doubly periodic domain
+    periodicX = .TRUE.
+    periodicY = .TRUE.
+
+    ! use first-order centred differencing
+    hAdvecScheme = 1
+
+    ! use third-order AB time stepping
+    TS_algorithm = 3
+
+    ! evaluate the tendencies with a separate pass for each term
+    tendency_algorithm = 1
+
+    ! use lexicographic successive over-relaxation for the pressure solve
+    solver_algorithm = 1
+    ! start the pressure solver from its own first guess
+    solver_first_guess = 1
+    ! choose the number of split-explicit substeps from the CFL limit
+    barotropic_substeps = 0
+
+    ! No viscosity or diffusion
+    au = 0d0
+    ar = 0d0
+    kh = 0d0
+    kv = 0d0
+
+
+    read(text, nml=NUMERICS)
+    read(text, nml=MODEL)
+    read(text, nml=PRESSURE_SOLVER)
+    read(text, nml=SPONGE)
+    read(text, nml=PHYSICS)
+    read(text, nml=GRID)
+    read(text, nml=INITIAL_CONDITIONS)
+    read(text, nml=EXTERNAL_FORCING)
+
+    if (dt_min .le. 0d0) then
+      dt_min = 0.1d0*dt
+    end if
+    if (dt_max .le. 0d0) then
+      dt_max = 10d0*dt
+    end if
+
+    return
+  end subroutine read_parameters
+
+  ! ---------------------------------------------------------------------------
+  !> Read the parameters of a run from a namelist file
+
+  subroutine read_parameters_file(filename)
+    implicit none
+
+    character(*), intent(in) :: filename
+
+    character(len=:), allocatable :: text
+    integer :: length
+
+    open(unit=8, file=filename, status='OLD', access='stream', &
+        form='unformatted')
+    inquire(unit=8, size=length)
+    allocate(character(len=length) :: text)
+    read(8) text
+    close(unit=8)
+
+    call read_parameters(text)
+
+    return
+  end subroutine read_parameters_file
+
 end module declarations
@@ -1,4 +1,5 @@
 module end_run
+  use kinds
   implicit none
 
   contains
@@ -13,7 +14,7 @@ module end_run
     ! To stop the program if it detects a NaN in the variable being checked
 
     integer, intent(in) :: nx, ny, layers, n
-    double precision, intent(in) :: data(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in) :: data(0:nx+1, 0:ny+1, layers)
 
     integer :: i, j, k
 
@@ -35,18 +36,26 @@ module end_run
   !> finalise MPI and then stop the model
 
   subroutine clean_stop(n, happy)
+    use mpi
     implicit none
 
     integer, intent(in) :: n
     logical, intent(in) :: happy
     
     integer :: ierr
+    integer :: num_procs
 
     if (happy) then
       call MPI_Finalize(ierr)
       stop
     else
       print "(A, I0, A, I0, A)", "Unexpected termination at time step ", n
+      ! The other processes may be waiting to exchange halos with this
+      ! one, so they have to be stopped too
+      call MPI_Comm_size(MPI_COMM_WORLD, num_procs, ierr)
+      if (num_procs .gt. 1) then
+        call MPI_Abort(MPI_COMM_WORLD, 1, ierr)
+      end if
       call MPI_Finalize(ierr)
       stop 1
     end if
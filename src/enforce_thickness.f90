@@ -1,4 +1,5 @@
 module enforce_thickness
+  use kinds
 
   implicit none
 
@@ -11,7 +12,7 @@ module enforce_thickness
       freesurfFac, thickness_error, nx, ny, layers)
     implicit none
 
-    double precision, intent(inout) :: h(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(inout) :: h(0:nx+1, 0:ny+1, layers)
     double precision, intent(in) :: eta(0:nx+1, 0:ny+1)
     double precision, intent(in) :: depth(0:nx+1, 0:ny+1)
     double precision, intent(in) :: freesurfFac, thickness_error
@@ -39,7 +40,7 @@ module enforce_thickness
   subroutine enforce_minimum_layer_thickness(hnew, hmin, nx, ny, layers, n)
     implicit none
 
-    double precision, intent(inout) :: hnew(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(inout) :: hnew(0:nx+1, 0:ny+1, layers)
     double precision, intent(in) :: hmin
     integer, intent(in) :: nx, ny, layers, n
 
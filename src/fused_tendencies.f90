@@ -0,0 +1,350 @@
+module fused_tendencies
+  use end_run
+  use boundaries
+  implicit none
+
+  !> Size of the blocks of grid points that the fused kernel works
+  !! through. A block of every input and output field should fit in
+  !! cache.
+  integer, parameter :: block_nx = 64
+  integer, parameter :: block_ny = 16
+
+  contains
+
+  ! ---------------------------------------------------------------------------
+  !> Calculate the tendencies of h, u and v in one pass over the grid.
+  !! The grid is split into blocks of block_nx by block_ny points, and
+  !! all three tendencies are evaluated for one block before moving on
+  !! to the next. The Bernoulli potential and relative vorticity are
+  !! evaluated for each block and its one cell halo, rather than stored
+  !! for the whole domain. Within each block only the points listed in
+  !! wet are visited. This gives the same answer as evaluate_dhdt,
+  !! evaluate_dudt and evaluate_dvdt, but reads each field from memory
+  !! far fewer times.
+
+  subroutine evaluate_tendencies_fused(dhdt, dudt, dvdt, h, u, v, depth, &
+      dx, dy, wetmask, hfacW, hfacE, hfacN, hfacS, fu, fv, &
+      au, ar, botDrag, kh, kv, slip, &
+      RedGrav, hAdvecScheme, g_vec, rho0, wind_x, wind_y, &
+      RelativeWind, Cd, &
+      spongeHTimeScale, spongeH, &
+      spongeUTimeScale, spongeU, &
+      spongeVTimeScale, spongeV, &
+      wet, nx, ny, layers, n)
+    implicit none
+
+    real(wp),         intent(out) :: dhdt(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(out) :: dudt(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(out) :: dvdt(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in) :: h(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in) :: u(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in) :: v(0:nx+1, 0:ny+1, layers)
+    double precision, intent(in) :: depth(0:nx+1, 0:ny+1)
+    double precision, intent(in) :: dx, dy
+    double precision, intent(in) :: wetmask(0:nx+1, 0:ny+1)
+    double precision, intent(in) :: hfacW(0:nx+1, 0:ny+1)
+    double precision, intent(in) :: hfacE(0:nx+1, 0:ny+1)
+    double precision, intent(in) :: hfacN(0:nx+1, 0:ny+1)
+    double precision, intent(in) :: hfacS(0:nx+1, 0:ny+1)
+    double precision, intent(in) :: fu(0:nx+1, 0:ny+1)
+    double precision, intent(in) :: fv(0:nx+1, 0:ny+1)
+    double precision, intent(in) :: au, ar, botDrag
+    double precision, intent(in) :: kh(layers), kv
+    double precision, intent(in) :: slip
+    logical,          intent(in) :: RedGrav
+    integer,          intent(in) :: hAdvecScheme
+    double precision, intent(in) :: g_vec(layers)
+    double precision, intent(in) :: rho0
+    double precision, intent(in) :: wind_x(0:nx+1, 0:ny+1)
+    double precision, intent(in) :: wind_y(0:nx+1, 0:ny+1)
+    logical,          intent(in) :: RelativeWind
+    double precision, intent(in) :: Cd
+    double precision, intent(in) :: spongeHTimeScale(0:nx+1, 0:ny+1, layers)
+    double precision, intent(in) :: spongeH(0:nx+1, 0:ny+1, layers)
+    double precision, intent(in) :: spongeUTimeScale(0:nx+1, 0:ny+1, layers)
+    double precision, intent(in) :: spongeU(0:nx+1, 0:ny+1, layers)
+    double precision, intent(in) :: spongeVTimeScale(0:nx+1, 0:ny+1, layers)
+    double precision, intent(in) :: spongeV(0:nx+1, 0:ny+1, layers)
+    type(wet_spans),  intent(in) :: wet
+    integer, intent(in) :: nx, ny, layers
+    integer, intent(in) :: n
+
+    integer :: ib, jb
+
+    if (hAdvecScheme .ne. 1 .and. hAdvecScheme .ne. 2) then
+      call clean_stop(n, .FALSE.)
+    end if
+
+    dhdt = 0d0
+    dudt = 0d0
+    dvdt = 0d0
+
+    !$omp parallel do collapse(2) schedule(dynamic)
+    do jb = 1, ny, block_ny
+      do ib = 1, nx, block_nx
+        call tendencies_block(dhdt, dudt, dvdt, h, u, v, depth, &
+            dx, dy, wetmask, hfacW, hfacE, hfacN, hfacS, fu, fv, &
+            au, ar, botDrag, kh, kv, slip, &
+            RedGrav, hAdvecScheme, g_vec, rho0, wind_x, wind_y, &
+            RelativeWind, Cd, &
+            spongeHTimeScale, spongeH, &
+            spongeUTimeScale, spongeU, &
+            spongeVTimeScale, spongeV, &
+            wet, nx, ny, layers, &
+            ib, min(ib + block_nx - 1, nx), jb, min(jb + block_ny - 1, ny))
+      end do
+    end do
+    !$omp end parallel do
+
+    return
+  end subroutine evaluate_tendencies_fused
+
+  ! ---------------------------------------------------------------------------
+  !> Calculate the tendencies of h, u and v over the block of points
+  !! i0:i1, j0:j1. The terms are the same as those in evaluate_dhdt,
+  !! evaluate_dudt and evaluate_dvdt, and are added up in the same order.
+
+  subroutine tendencies_block(dhdt, dudt, dvdt, h, u, v, depth, &
+      dx, dy, wetmask, hfacW, hfacE, hfacN, hfacS, fu, fv, &
+      au, ar, botDrag, kh, kv, slip, &
+      RedGrav, hAdvecScheme, g_vec, rho0, wind_x, wind_y, &
+      RelativeWind, Cd, &
+      spongeHTimeScale, spongeH, &
+      spongeUTimeScale, spongeU, &
+      spongeVTimeScale, spongeV, &
+      wet, nx, ny, layers, i0, i1, j0, j1)
+    implicit none
+
+    real(wp),         intent(inout) :: dhdt(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(inout) :: dudt(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(inout) :: dvdt(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in) :: h(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in) :: u(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in) :: v(0:nx+1, 0:ny+1, layers)
+    double precision, intent(in) :: depth(0:nx+1, 0:ny+1)
+    double precision, intent(in) :: dx, dy
+    double precision, intent(in) :: wetmask(0:nx+1, 0:ny+1)
+    double precision, intent(in) :: hfacW(0:nx+1, 0:ny+1)
+    double precision, intent(in) :: hfacE(0:nx+1, 0:ny+1)
+    double precision, intent(in) :: hfacN(0:nx+1, 0:ny+1)
+    double precision, intent(in) :: hfacS(0:nx+1, 0:ny+1)
+    double precision, intent(in) :: fu(0:nx+1, 0:ny+1)
+    double precision, intent(in) :: fv(0:nx+1, 0:ny+1)
+    double precision, intent(in) :: au, ar, botDrag
+    double precision, intent(in) :: kh(layers), kv
+    double precision, intent(in) :: slip
+    logical,          intent(in) :: RedGrav
+    integer,          intent(in) :: hAdvecScheme
+    double precision, intent(in) :: g_vec(layers)
+    double precision, intent(in) :: rho0
+    double precision, intent(in) :: wind_x(0:nx+1, 0:ny+1)
+    double precision, intent(in) :: wind_y(0:nx+1, 0:ny+1)
+    logical,          intent(in) :: RelativeWind
+    double precision, intent(in) :: Cd
+    double precision, intent(in) :: spongeHTimeScale(0:nx+1, 0:ny+1, layers)
+    double precision, intent(in) :: spongeH(0:nx+1, 0:ny+1, layers)
+    double precision, intent(in) :: spongeUTimeScale(0:nx+1, 0:ny+1, layers)
+    double precision, intent(in) :: spongeU(0:nx+1, 0:ny+1, layers)
+    double precision, intent(in) :: spongeVTimeScale(0:nx+1, 0:ny+1, layers)
+    double precision, intent(in) :: spongeV(0:nx+1, 0:ny+1, layers)
+    type(wet_spans),  intent(in) :: wet
+    integer, intent(in) :: nx, ny, layers
+    integer, intent(in) :: i0, i1, j0, j1
+
+    integer :: i, j, k, l, m, s
+    double precision :: h_temp, b_proto
+    double precision :: dhdt_kh, dhdt_kv, dhdt_advec
+    ! Bernoulli potential for the block, and the row and column to the
+    ! south and west of it
+    double precision :: b(i0-1:i1, j0-1:j1, layers)
+    ! Relative vorticity for the block, and the row and column to the
+    ! north and east of it
+    double precision :: zeta(i0:i1+1, j0:j1+1, layers)
+    ! Layer interfaces and Montgomery potential of one water column
+    double precision :: z(layers), mont(layers)
+    ! Running sum of the thickness diffusion in the layers above the
+    ! lowest one, which balances it in n-layer physics
+    double precision :: kh_sum(i0:i1, j0:j1)
+
+    ! Bernoulli potential, as in evaluate_b_RedGrav and evaluate_b_iso.
+    ! The tendencies at the edge of the points listed in wet may read it
+    ! from further inland, but they are never used, so start from zero.
+    b = 0d0
+    do j = j0-1, j1
+      do s = wet%first(j), wet%first(j+1) - 1
+        do i = max(wet%lo(s), i0-1), min(wet%hi(s), i1)
+          if (RedGrav) then
+            do k = 1, layers
+              b_proto = 0d0
+              do l = k, layers
+                h_temp = 0d0
+                do m = 1, l
+                  h_temp = h_temp + h(i, j, m)
+                end do
+                b_proto = b_proto + g_vec(l)*h_temp
+              end do
+              b(i,j,k) = b_proto &
+                  + (u(i,j,k)**2+u(i+1,j,k)**2+v(i,j,k)**2+v(i,j+1,k)**2)/4.0d0
+            end do
+          else
+            z(layers) = -depth(i,j)
+            do k = 1, layers-1
+              z(layers-k) = z(layers-k+1) + h(i,j,layers-k+1)
+            end do
+            mont(1) = 0d0
+            do k = 2, layers
+              mont(k) = mont(k-1) + g_vec(k) * z(k-1)
+            end do
+            do k = 1, layers
+              b(i,j,k) = mont(k) &
+                  + (u(i,j,k)**2+u(i+1,j,k)**2+v(i,j,k)**2+v(i,j+1,k)**2)/4.0d0
+            end do
+          end if
+        end do
+      end do
+    end do
+
+    ! Relative vorticity, as in evaluate_zeta
+    do k = 1, layers
+      do j = j0, j1+1
+        do i = i0, i1+1
+          zeta(i,j,k) = (v(i,j,k)-v(i-1,j,k))/dx-(u(i,j,k)-u(i,j-1,k))/dy
+        end do
+      end do
+    end do
+
+    kh_sum = 0d0
+
+    do k = 1, layers
+      do j = j0, j1
+        do s = wet%first(j), wet%first(j+1) - 1
+          do i = max(wet%lo(s), i0), min(wet%hi(s), i1)
+
+            ! Thickness tendency, as in evaluate_dhdt
+            if (k .lt. layers .or. RedGrav) then
+              dhdt_kh = &
+                  kh(k)*(h(i+1,j,k)*wetmask(i+1,j)    &
+                    + (1d0 - wetmask(i+1,j))*h(i,j,k) &
+                    + h(i-1,j,k)*wetmask(i-1,j)       &
+                    + (1d0 - wetmask(i-1,j))*h(i,j,k) &
+                    - 2*h(i,j,k))/(dx*dx)             &
+
+                  + kh(k)*(h(i,j+1,k)*wetmask(i,j+1)  &
+                    + (1d0 - wetmask(i,j+1))*h(i,j,k) &
+                    + h(i,j-1,k)*wetmask(i,j-1)       &
+                    + (1d0 - wetmask(i,j-1))*h(i,j,k) &
+                    - 2*h(i,j,k))/(dy*dy)
+              kh_sum(i,j) = kh_sum(i,j) + dhdt_kh
+            else
+              dhdt_kh = -kh_sum(i,j)
+            end if
+
+            if (layers .eq. 1) then
+              if (RedGrav) then
+                dhdt_kv = kv/h(i,j,1)
+              else
+                dhdt_kv = 0d0
+              end if
+            else if (k .eq. 1) then
+              dhdt_kv = kv/h(i,j,k) - kv/h(i,j,k+1)
+            else if (k .eq. layers) then
+              dhdt_kv = kv/h(i,j,k) - kv/h(i,j,k-1)
+            else
+              dhdt_kv = 2d0*kv/h(i,j,k) -  &
+                  kv/h(i,j,k-1) - kv/h(i,j,k+1)
+            end if
+
+            if (hAdvecScheme .eq. 1) then
+              dhdt_advec = &
+                  - ((h(i,j,k)+h(i+1,j,k))*u(i+1,j,k) &
+                   - (h(i-1,j,k)+h(i,j,k))*u(i,j,k))/(dx*2d0) &
+                  - ((h(i,j,k)+h(i,j+1,k))*v(i,j+1,k) &
+                   - (h(i,j-1,k)+h(i,j,k))*v(i,j,k))/(dy*2d0)
+            else
+              dhdt_advec = &
+                  - ( h(i+1,j,k)*(u(i+1,j,k) - abs(u(i+1,j,k)))/2d0 &
+                    + h(i,j,k)*(u(i+1,j,k)   + abs(u(i+1,j,k)))/2d0 &
+                    - (h(i,j,k)*(u(i,j,k)   - abs(u(i,j,k)))/2d0 &
+                      + h(i-1,j,k)*(u(i,j,k) + abs(u(i,j,k)))/2d0) &
+                    )/dx &
+                  - ( h(i,j+1,k)*(v(i,j+1,k) - abs(v(i,j+1,k)))/2d0 &
+                    + h(i,j,k)*(v(i,j+1,k)   + abs(v(i,j+1,k)))/2d0 &
+                    - ( h(i,j,k)*(v(i,j,k)   - abs(v(i,j,k)))/2d0 &
+                      + h(i,j-1,k)*(v(i,j,k) + abs(v(i,j,k)))/2d0) &
+                    )/dy
+            end if
+
+            dhdt(i,j,k) = &
+                dhdt_kh + dhdt_kv + dhdt_advec &
+                + spongeHTimeScale(i,j,k)*(spongeH(i,j,k)-h(i,j,k))
+            dhdt(i,j,k) = dhdt(i,j,k) * wetmask(i,j)
+
+            ! Zonal velocity tendency, as in evaluate_dudt
+            dudt(i,j,k) = au*(u(i+1,j,k)+u(i-1,j,k)-2.0d0*u(i,j,k))/(dx*dx) &
+                + au*(u(i,j+1,k)+u(i,j-1,k)-2.0d0*u(i,j,k) &
+                  + (1.0d0 - 2.0d0*slip)*(1.0d0 - hfacN(i,j))*u(i,j,k) &
+                  + (1.0d0 - 2.0d0*slip)*(1.0d0 - hfacS(i,j))*u(i,j,k))/(dy*dy) &
+                + 0.25d0*(fu(i,j)+0.5d0*(zeta(i,j,k)+zeta(i,j+1,k))) &
+                  *(v(i-1,j,k)+v(i,j,k)+v(i-1,j+1,k)+v(i,j+1,k)) &
+                - (b(i,j,k) - b(i-1,j,k))/dx &
+                + spongeUTimeScale(i,j,k)*(spongeU(i,j,k)-u(i,j,k))
+
+            ! Meridional velocity tendency, as in evaluate_dvdt
+            dvdt(i,j,k) = &
+                au*(v(i+1,j,k)+v(i-1,j,k)-2.0d0*v(i,j,k) &
+                  + (1.0d0 - 2.0d0*slip)*(1.0d0 - hfacW(i,j))*v(i,j,k) &
+                  + (1.0d0 - 2.0d0*slip)*(1.0d0 - hfacE(i,j))*v(i,j,k))/(dx*dx) &
+                + au*(v(i,j+1,k) + v(i,j-1,k) - 2.0d0*v(i,j,k))/(dy*dy) &
+                - 0.25d0*(fv(i,j)+0.5d0*(zeta(i,j,k)+zeta(i+1,j,k))) &
+                  *(u(i,j-1,k)+u(i,j,k)+u(i+1,j-1,k)+u(i+1,j,k)) &
+                - (b(i,j,k)-b(i,j-1,k))/dy &
+                + spongeVTimeScale(i,j,k)*(spongeV(i,j,k)-v(i,j,k))
+
+            ! Wind forcing on the top layer
+            if (k .eq. 1) then
+              if (RelativeWind) then
+                dudt(i,j,k) = dudt(i,j,k) + (2d0*Cd* &
+                     (wind_x(i,j) - u(i,j,k))* &
+                  sqrt((wind_x(i,j) - u(i,j,k))**2 + &
+                       (wind_y(i,j) - v(i,j,k))**2))/((h(i,j,k) + h(i-1,j,k)))
+                dvdt(i,j,k) = dvdt(i,j,k) + (2d0*Cd* &
+                     (wind_y(i,j) - v(i,j,k))* &
+                  sqrt((wind_x(i,j) - u(i,j,k))**2 + &
+                       (wind_y(i,j) - v(i,j,k))**2))/((h(i,j,k) + h(i,j-1,k)))
+              else
+                dudt(i,j,k) = dudt(i,j,k) &
+                    + 2d0*wind_x(i,j)/(rho0*(h(i,j,k) + h(i-1,j,k)))
+                dvdt(i,j,k) = dvdt(i,j,k) &
+                    + 2d0*wind_y(i,j)/(rho0*(h(i,j,k) + h(i,j-1,k)))
+              end if
+            end if
+
+            ! Vertical momentum diffusion and bottom drag
+            if (layers .gt. 1) then
+              if (k .eq. 1) then
+                dudt(i,j,k) = dudt(i,j,k) - 1.0d0*ar*(u(i,j,k) - 1.0d0*u(i,j,k+1))
+                dvdt(i,j,k) = dvdt(i,j,k) - 1.0d0*ar*(v(i,j,k) - 1.0d0*v(i,j,k+1))
+              else if (k .eq. layers) then
+                dudt(i,j,k) = dudt(i,j,k) - 1.0d0*ar*(u(i,j,k) - 1.0d0*u(i,j,k-1))
+                dvdt(i,j,k) = dvdt(i,j,k) - 1.0d0*ar*(v(i,j,k) - 1.0d0*v(i,j,k-1))
+                if (.not. RedGrav) then
+                  dudt(i,j,k) = dudt(i,j,k) - 1.0d0*botDrag*(u(i,j,k))
+                  dvdt(i,j,k) = dvdt(i,j,k) - 1.0d0*botDrag*(v(i,j,k))
+                end if
+              else
+                dudt(i,j,k) = dudt(i,j,k) - &
+                    1.0d0*ar*(2.0d0*u(i,j,k) - 1.0d0*u(i,j,k-1) - 1.0d0*u(i,j,k+1))
+                dvdt(i,j,k) = dvdt(i,j,k) - &
+                    1.0d0*ar*(2.0d0*v(i,j,k) - 1.0d0*v(i,j,k-1) - 1.0d0*v(i,j,k+1))
+              end if
+            end if
+
+          end do
+        end do
+      end do
+    end do
+
+    return
+  end subroutine tendencies_block
+
+end module fused_tendencies
@@ -1,44 +1,104 @@
 module io
+  use iso_fortran_env, only: int64
   use end_run
   use boundaries
+  use adams_bashforth
+  use netcdf_output
   implicit none
 
+  !> unit for the pressure solver diagnostics, which stays open for the
+  !! whole run because it is written on every time step
+  integer, parameter :: solver_diag_unit = 18
+  !> unit for the record of the time step lengths, which is likewise
+  !! written on every time step
+  integer, parameter :: time_diag_unit = 19
+  !> units for the layerwise statistics of h, u, v and eta, which stay
+  !! open for the whole run
+  integer, parameter :: h_diag_unit = 20, u_diag_unit = 21
+  integer, parameter :: v_diag_unit = 22, eta_diag_unit = 23
+
+  !> Snapshots and averages are written asynchronously, so that the
+  !! model keeps stepping while the first process writes them to disk.
+  !! Each field is copied to one of output_slots buffers, which is
+  !! written on its own unit. Once every buffer is in use, the oldest
+  !! write is waited for before its buffer is reused, which bounds the
+  !! memory taken by output. flush_output waits for all of them.
+  integer, parameter :: output_slots = 8
+  !> unit of the first buffer, the others follow it
+  integer, parameter :: first_output_unit = 40
+
+  type output_buffer
+    double precision, allocatable :: data(:)
+    logical :: pending = .FALSE.
+  end type output_buffer
+
+  type(output_buffer), asynchronous, save :: output_queue(output_slots)
+  integer, save :: next_output_slot = 1
+
+  !> Checkpoints are kept in one file per time step, identified by
+  !! checkpoint_magic and the version of their layout
+  character(18), parameter :: checkpoint_magic = 'aronnax checkpoint'
+  integer, parameter :: checkpoint_version = 2
+  integer, save :: checkpoint_TS_algorithm = 0
+  !> the number of values in the header of a checkpoint
+  integer, parameter :: header_length = 9
+  !> time steps of the checkpoints written by this run that are kept,
+  !! oldest first, or -1. The run keeps as many as the array holds, and
+  !! all of them if it is empty.
+  integer, allocatable, save :: kept_checkpoints(:)
+
   contains
 
   ! ---------------------------------------------------------------------------
-  !> Write output if it's time
-
-  subroutine maybe_dump_output(h, hav, u, uav, v, vav, eta, etaav, &
-          dudt, dvdt, dhdt, AB_order, &
-          wind_x, wind_y, nx, ny, layers, &
-          n, nwrite, avwrite, checkpointwrite, diagwrite, &
+  !> Write the outputs that are due. hav, uav, vav and etaav hold the
+  !! sums of the fields over the averaging period, weighted by av_time,
+  !! which is the sum of the weights. model_time labels NetCDF output,
+  !! and is saved in checkpoints with the recent time steps, dt_history.
+
+  subroutine maybe_dump_output(h, hav, u, uav, v, vav, eta, etaav, av_time, &
+          dudt, dvdt, dhdt, AB_order, AB_slot, &
+          wind_x, wind_y, wetmask, nx, ny, layers, &
+          n, model_time, dt_history, &
+          dump_snapshot, dump_average, dump_checkpoint, dump_diagnostics, &
           RedGrav, DumpWind, debug_level)
     implicit none
 
-    double precision, intent(in)    :: h(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in)    :: h(0:nx+1, 0:ny+1, layers)
     double precision, intent(inout) :: hav(0:nx+1, 0:ny+1, layers)
-    double precision, intent(in)    :: u(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in)    :: u(0:nx+1, 0:ny+1, layers)
     double precision, intent(inout) :: uav(0:nx+1, 0:ny+1, layers)
-    double precision, intent(in)    :: v(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in)    :: v(0:nx+1, 0:ny+1, layers)
     double precision, intent(inout) :: vav(0:nx+1, 0:ny+1, layers)
     double precision, intent(in)    :: eta(0:nx+1, 0:ny+1)
     double precision, intent(inout) :: etaav(0:nx+1, 0:ny+1)
-    double precision, intent(in)    :: dudt(0:nx+1, 0:ny+1, layers, AB_order)
-    double precision, intent(in)    :: dvdt(0:nx+1, 0:ny+1, layers, AB_order)
-    double precision, intent(in)    :: dhdt(0:nx+1, 0:ny+1, layers, AB_order)
+    double precision, intent(inout) :: av_time
+    real(wp),         intent(in)    :: dudt(0:nx+1, 0:ny+1, layers, AB_order)
+    real(wp),         intent(in)    :: dvdt(0:nx+1, 0:ny+1, layers, AB_order)
+    real(wp),         intent(in)    :: dhdt(0:nx+1, 0:ny+1, layers, AB_order)
     integer,          intent(in)    :: AB_order
+    integer,          intent(in)    :: AB_slot(AB_order)
     double precision, intent(in)    :: wind_x(0:nx+1, 0:ny+1)
     double precision, intent(in)    :: wind_y(0:nx+1, 0:ny+1)
+    double precision, intent(in)    :: wetmask(0:nx+1, 0:ny+1)
     integer,          intent(in)    :: nx, ny, layers, n
-    integer,          intent(in)    :: nwrite, avwrite, checkpointwrite, diagwrite
+    double precision, intent(in)    :: model_time
+    double precision, intent(in)    :: dt_history(AB_order)
+    logical,          intent(in)    :: dump_snapshot, dump_average
+    logical,          intent(in)    :: dump_checkpoint, dump_diagnostics
     logical,          intent(in)    :: RedGrav, DumpWind
     integer,          intent(in)    :: debug_level
 
     logical       :: dump_output
+    ! the tendency arrays from newest to oldest
+    integer       :: checkpoint_slot(AB_order)
+    ! the newest tendency of one field, with its halo filled
+    real(wp), allocatable :: tendency(:,:,:)
 
+    call checkpoint_AB_slots(checkpoint_slot, AB_slot, AB_order)
+    call set_netcdf_output_time(n, model_time)
 
     ! Write snapshot to file?
-    if (mod(n-1, nwrite) .eq. 0) then
+    if (dump_snapshot) then
       dump_output = .TRUE.
     else if (debug_level .ge. 4) then
       dump_output = .TRUE.
@@ -48,11 +108,11 @@ module io
 
     if (dump_output) then 
       
-      call write_output_3d(h, nx, ny, layers, 0, 0, &
+      call write_output_3d(dble(h), nx, ny, layers, 0, 0, &
       n, 'output/snap.h.')
-      call write_output_3d(u, nx, ny, layers, 1, 0, &
+      call write_output_3d(dble(u), nx, ny, layers, 1, 0, &
       n, 'output/snap.u.')
-      call write_output_3d(v, nx, ny, layers, 0, 1, &
+      call write_output_3d(dble(v), nx, ny, layers, 0, 1, &
       n, 'output/snap.v.')
 
 
@@ -69,55 +129,49 @@ module io
       end if
 
       if (debug_level .ge. 1) then
-        call write_output_3d(dhdt(:,:,:,1), nx, ny, layers, 0, 0, &
-          n, 'output/debug.dhdt.')
-        call write_output_3d(dudt(:,:,:,1), nx, ny, layers, 1, 0, &
-          n, 'output/debug.dudt.')
-        call write_output_3d(dvdt(:,:,:,1), nx, ny, layers, 0, 1, &
-          n, 'output/debug.dvdt.')
+        ! The tendencies are only calculated on the tiles, but the
+        ! output includes the faces on the far edges of the domain
+        allocate(tendency(0:nx+1, 0:ny+1, layers))
+        tendency = dhdt(:,:,:,checkpoint_slot(1))
+        call update_halos_3D(tendency, nx, ny, layers)
+        call write_output_3d(dble(tendency), &
+          nx, ny, layers, 0, 0, n, 'output/debug.dhdt.')
+        tendency = dudt(:,:,:,checkpoint_slot(1))
+        call update_halos_3D(tendency, nx, ny, layers)
+        call write_output_3d(dble(tendency), &
+          nx, ny, layers, 1, 0, n, 'output/debug.dudt.')
+        tendency = dvdt(:,:,:,checkpoint_slot(1))
+        call update_halos_3D(tendency, nx, ny, layers)
+        call write_output_3d(dble(tendency), &
+          nx, ny, layers, 0, 1, n, 'output/debug.dvdt.')
+        deallocate(tendency)
       end if
 
-      ! Check if there are NaNs in the data
-      call break_if_NaN(h, nx, ny, layers, n)
-      ! call break_if_NaN(u, nx, ny, layers, n)
-      ! call break_if_NaN(v, nx, ny, layers, n)
-
     end if
 
     ! Write accumulated averages to file?
-    if (avwrite .eq. 0) then
-      ! OK
-    else if (mod(n-1, avwrite) .eq. 0) then
-
-      if (n .eq. 1) then
-        ! pass, since dumping averages after first timestep isn't helpful
-      else 
-        hav = hav/real(avwrite)
-        uav = uav/real(avwrite)
-        vav = vav/real(avwrite)
-        if (.not. RedGrav) then
-          etaav = etaav/real(avwrite)
-        end if
+    if (dump_average) then
 
-        call write_output_3d(hav, nx, ny, layers, 0, 0, &
-        n, 'output/av.h.')
-        call write_output_3d(uav, nx, ny, layers, 1, 0, &
-        n, 'output/av.u.')
-        call write_output_3d(vav, nx, ny, layers, 0, 1, &
-        n, 'output/av.v.')
+      hav = hav/av_time
+      uav = uav/av_time
+      vav = vav/av_time
+      if (.not. RedGrav) then
+        etaav = etaav/av_time
+      end if
 
+      call write_output_3d(hav, nx, ny, layers, 0, 0, &
+      n, 'output/av.h.')
+      call write_output_3d(uav, nx, ny, layers, 1, 0, &
+      n, 'output/av.u.')
+      call write_output_3d(vav, nx, ny, layers, 0, 1, &
+      n, 'output/av.v.')
 
-        if (.not. RedGrav) then
-          call write_output_2d(etaav, nx, ny, 0, 0, &
-            n, 'output/av.eta.')
-        end if
 
-        ! Check if there are NaNs in the data
-        call break_if_NaN(h, nx, ny, layers, n)
-        ! call break_if_NaN(u, nx, ny, layers, n)
-        ! call break_if_NaN(v, nx, ny, layers, n)
+      if (.not. RedGrav) then
+        call write_output_2d(etaav, nx, ny, 0, 0, &
+          n, 'output/av.eta.')
       end if
-      
+
       ! Reset average quantities
       hav = 0.0
       uav = 0.0
@@ -125,46 +179,48 @@ module io
       if (.not. RedGrav) then
         etaav = 0.0
       end if
+      av_time = 0d0
       ! h2av = 0.0
 
     end if
 
-    ! save a checkpoint?
-    if (checkpointwrite .eq. 0) then
-      ! not saving checkpoints, so move on
-    else if (mod(n-1, checkpointwrite) .eq. 0) then
-      call write_checkpoint_output(h, nx, ny, layers, 1, &
-      n, 'checkpoints/h.')
-      call write_checkpoint_output(u, nx, ny, layers, 1, &
-      n, 'checkpoints/u.')
-      call write_checkpoint_output(v, nx, ny, layers, 1, &
-      n, 'checkpoints/v.')
-
-      call write_checkpoint_output(dhdt, nx, ny, layers, AB_order, &
-        n, 'checkpoints/dhdt.')
-      call write_checkpoint_output(dudt, nx, ny, layers, AB_order, &
-        n, 'checkpoints/dudt.')
-      call write_checkpoint_output(dvdt, nx, ny, layers, AB_order, &
-        n, 'checkpoints/dvdt.')
-
-      if (.not. RedGrav) then
-        call write_checkpoint_output(eta, nx, ny, 1, 1, &
-          n, 'checkpoints/eta.')
+    ! Check if there are NaNs in the data, once per dump. If there are,
+    ! the output queued above is written out before the model stops, so
+    ! that it can be looked at.
+    if (dump_output .or. dump_average) then
+      if (global_max(merge(1d0, 0d0, &
+          any(h(1:nx, 1:ny, :) .ne. h(1:nx, 1:ny, :)))) .gt. 0d0) then
+        call flush_output()
+        call break_if_NaN(h, nx, ny, layers, n)
+        ! call break_if_NaN(u, nx, ny, layers, n)
+        ! call break_if_NaN(v, nx, ny, layers, n)
       end if
+    end if
 
+    ! save a checkpoint?
+    if (dump_checkpoint) then
+      call write_checkpoint(h, u, v, eta, dhdt, dudt, dvdt, checkpoint_slot, &
+          model_time, dt_history, nx, ny, layers, AB_order, RedGrav, n)
     end if
 
-    if (diagwrite .eq. 0) then
-      ! not saving diagnostics. Move one.
-    else if (mod(n-1, diagwrite) .eq. 0) then
-      call write_diag_output(h, nx, ny, layers, n, 'output/diagnostic.h.csv')
-      call write_diag_output(u, nx, ny, layers, n, 'output/diagnostic.u.csv')
-      call write_diag_output(v, nx, ny, layers, n, 'output/diagnostic.v.csv')
+    if (dump_diagnostics) then
+      call write_diag_output(dble(h), wetmask, nx, ny, layers, 0, 0, &
+          n, h_diag_unit)
+      call write_diag_output(dble(u), wetmask, nx, ny, layers, 1, 0, &
+          n, u_diag_unit)
+      call write_diag_output(dble(v), wetmask, nx, ny, layers, 0, 1, &
+          n, v_diag_unit)
       if (.not. RedGrav) then
-        call write_diag_output(eta, nx, ny, 1, n, 'output/diagnostic.eta.csv')
+        call write_diag_output(eta, wetmask, nx, ny, 1, 0, 0, &
+            n, eta_diag_unit)
       end if
     end if
 
+    ! the diagnostics up to a checkpoint are on disk before it is used
+    if (dump_checkpoint) then
+      call flush_diag_files(RedGrav)
+    end if
+
     return
   end subroutine maybe_dump_output
 
@@ -307,55 +363,487 @@ module io
     character(*),     intent(in) :: name
 
     character(10)  :: num
+    double precision, allocatable :: global(:,:,:)
+    integer        :: field
+
+    ! the first process writes the whole field
+    allocate(global(0:nx_global+1, 0:ny_global+1, layers))
+    call gather_tiles(global, array, nx, ny, layers)
+    if (decomp_rank .ne. 0) return
 
     write(num, '(i10.10)') n
 
-    ! Output the data to a file
-    open(unit=10, status='replace', file=name//num, &
-        form='unformatted')
-    write(10) array(1:nx+xstep, 1:ny+ystep, :)
-    close(10)
+    if (is_netcdf_field(name, field)) then
+      call write_netcdf_field(field, global(1:nx_global+xstep, &
+          1:ny_global+ystep, :), nx_global+xstep, ny_global+ystep, layers)
+      return
+    end if
+
+    call queue_output(reshape(global(1:nx_global+xstep, &
+        1:ny_global+ystep, :), [(nx_global+xstep)*(ny_global+ystep)*layers]), &
+        name//num)
 
     return
   end subroutine write_output_3d
 
   !-----------------------------------------------------------------
-  !> Write snapshot output of 3d field
+  !> Set how many checkpoints the run keeps, and the time stepping
+  !! scheme to record in them
 
-  subroutine write_checkpoint_output(array, nx, ny, layers, AB_order, &
-      n, name)
+  subroutine init_checkpoints(keep, TS_algorithm)
+    implicit none
+
+    integer, intent(in) :: keep
+    integer, intent(in) :: TS_algorithm
+
+    checkpoint_TS_algorithm = TS_algorithm
+    if (allocated(kept_checkpoints)) deallocate(kept_checkpoints)
+    allocate(kept_checkpoints(max(keep, 0)))
+    kept_checkpoints = -1
+
+    return
+  end subroutine init_checkpoints
+
+  ! ---------------------------------------------------------------------------
+  !> Write the state of the model at time step n to
+  !! checkpoints/checkpoint.n. The file starts with a header describing
+  !! the run, followed by the lengths of the recent time steps, h, u, v,
+  !! the tendency histories of h, u and v, newest first, and eta in
+  !! n-layer runs, all on the global grid with their halos. It ends with
+  !! a checksum of the header and everything after it. The file is
+  !! written under a temporary name and renamed once it is complete.
+
+  subroutine write_checkpoint(h, u, v, eta, dhdt, dudt, dvdt, slot, &
+      model_time, dt_history, nx, ny, layers, AB_order, RedGrav, n)
     implicit none
 
-    double precision, intent(in) :: array(0:nx+1, 0:ny+1, layers, AB_order)
+    real(wp),         intent(in) :: h(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in) :: u(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in) :: v(0:nx+1, 0:ny+1, layers)
+    double precision, intent(in) :: eta(0:nx+1, 0:ny+1)
+    real(wp),         intent(in) :: dhdt(0:nx+1, 0:ny+1, layers, AB_order)
+    real(wp),         intent(in) :: dudt(0:nx+1, 0:ny+1, layers, AB_order)
+    real(wp),         intent(in) :: dvdt(0:nx+1, 0:ny+1, layers, AB_order)
+    integer,          intent(in) :: slot(AB_order)
+    double precision, intent(in) :: model_time
+    double precision, intent(in) :: dt_history(AB_order)
     integer,          intent(in) :: nx, ny, layers, AB_order
+    logical,          intent(in) :: RedGrav
     integer,          intent(in) :: n
-    character(*),     intent(in) :: name
 
     character(10)  :: num
+    integer(int64) :: checksum(2)
 
     write(num, '(i10.10)') n
 
-    ! Output the data to a file
-    open(unit=10, status='replace', file=name//num, &
-        form='unformatted')
-    write(10) array
+    if (decomp_rank .eq. 0) then
+      open(unit=10, status='replace', form='unformatted', &
+          file='checkpoints/checkpoint.'//num//'.tmp')
+      write(10) checkpoint_magic, checkpoint_version, &
+          nx_global, ny_global, layers, AB_order, checkpoint_TS_algorithm, &
+          n, .not. RedGrav, model_time
+      write(10) dt_history
+    end if
+    checksum = 0
+    call update_checksum(checksum, checkpoint_header(checkpoint_version, &
+        nx_global, ny_global, layers, AB_order, checkpoint_TS_algorithm, n, &
+        .not. RedGrav, model_time), header_length)
+    call update_checksum(checksum, dt_history, AB_order)
+
+    call write_checkpoint_field(dble(h), nx, ny, layers, checksum)
+    call write_checkpoint_field(dble(u), nx, ny, layers, checksum)
+    call write_checkpoint_field(dble(v), nx, ny, layers, checksum)
+    call write_tendency_checkpoint(dhdt, slot, nx, ny, layers, AB_order, &
+        checksum)
+    call write_tendency_checkpoint(dudt, slot, nx, ny, layers, AB_order, &
+        checksum)
+    call write_tendency_checkpoint(dvdt, slot, nx, ny, layers, AB_order, &
+        checksum)
+    if (.not. RedGrav) then
+      call write_checkpoint_field(eta, nx, ny, 1, checksum)
+    end if
+
+    if (decomp_rank .ne. 0) return
+
+    write(10) checksum
     close(10)
+    call rename_file('checkpoints/checkpoint.'//num//'.tmp', &
+        'checkpoints/checkpoint.'//num)
+
+    ! Delete the oldest checkpoint that this run wrote, if there are
+    ! now more than it keeps. The final checkpoint may repeat the last
+    ! regular one.
+    if (size(kept_checkpoints) .gt. 0) then
+      if (all(kept_checkpoints .ne. n)) then
+        if (kept_checkpoints(1) .ge. 0) then
+          write(num, '(i10.10)') kept_checkpoints(1)
+          call delete_file('checkpoints/checkpoint.'//num)
+        end if
+        kept_checkpoints = [kept_checkpoints(2:), n]
+      end if
+    end if
+
+    return
+  end subroutine write_checkpoint
+
+  !-----------------------------------------------------------------
+  !> Write a field to the open checkpoint file. Checkpoints hold the
+  !! global fields, so that a run can be restarted with a different
+  !! decomposition.
+
+  subroutine write_checkpoint_field(array, nx, ny, nz, checksum)
+    implicit none
+
+    double precision, intent(in)    :: array(0:nx+1, 0:ny+1, nz)
+    integer,          intent(in)    :: nx, ny, nz
+    integer(int64),   intent(inout) :: checksum(2)
+
+    double precision, allocatable :: global(:,:,:)
+
+    allocate(global(0:nx_global+1, 0:ny_global+1, nz))
+    call gather_tiles(global, array, nx, ny, nz)
+    if (decomp_rank .ne. 0) return
+
+    write(10) global
+    call update_checksum(checksum, global, size(global))
 
     return
-  end subroutine write_checkpoint_output
+  end subroutine write_checkpoint_field
 
   ! ---------------------------------------------------------------------------
-  !> Load in checkpoint files when restarting a simulation
+  !> Write the tendency history to a checkpoint, newest first. The
+  !! history is kept in a ring buffer, so slot gives the order to write
+  !! the arrays in.
+
+  subroutine write_tendency_checkpoint(array, slot, nx, ny, layers, &
+      AB_order, checksum)
+    implicit none
+
+    real(wp),         intent(in)    :: array(0:nx+1, 0:ny+1, layers, AB_order)
+    integer,          intent(in)    :: slot(AB_order)
+    integer,          intent(in)    :: nx, ny, layers, AB_order
+    integer(int64),   intent(inout) :: checksum(2)
+
+    double precision, allocatable :: ordered(:,:,:,:)
+    integer :: p
+
+    allocate(ordered(0:nx+1, 0:ny+1, layers, AB_order))
+    do p = 1, AB_order
+      ordered(:,:,:,p) = array(:,:,:,slot(p))
+    end do
+
+    call write_checkpoint_field(ordered, nx, ny, layers*AB_order, checksum)
+
+    return
+  end subroutine write_tendency_checkpoint
+
+  !-----------------------------------------------------------------
+  !> The numbers in the header of a checkpoint, as the values that go
+  !! into its checksum
+
+  function checkpoint_header(version, nx, ny, layers, AB_order, &
+      TS_algorithm, n, has_eta, model_time) result(header)
+    implicit none
+
+    integer,          intent(in) :: version, nx, ny, layers, AB_order
+    integer,          intent(in) :: TS_algorithm, n
+    logical,          intent(in) :: has_eta
+    double precision, intent(in) :: model_time
+    double precision :: header(header_length)
+
+    header = [dble(version), dble(nx), dble(ny), dble(layers), &
+        dble(AB_order), dble(TS_algorithm), dble(n), &
+        merge(1d0, 0d0, has_eta), model_time]
+
+    return
+  end function checkpoint_header
+
+  !-----------------------------------------------------------------
+  !> Add values to a Fletcher checksum of their bit patterns, taken
+  !! 32 bits at a time
+
+  subroutine update_checksum(checksum, values, count)
+    implicit none
+
+    integer(int64),   intent(inout) :: checksum(2)
+    double precision, intent(in)    :: values(count)
+    integer,          intent(in)    :: count
+
+    ! the largest prime below 2**32
+    integer(int64), parameter :: modulus = 4294967291_int64
+    integer(int64) :: word
+    integer :: i
+
+    do i = 1, count
+      word = transfer(values(i), word)
+      checksum(1) = mod(checksum(1) + ibits(word, 0, 32), modulus)
+      checksum(2) = mod(checksum(2) + checksum(1), modulus)
+      checksum(1) = mod(checksum(1) + ibits(word, 32, 32), modulus)
+      checksum(2) = mod(checksum(2) + checksum(1), modulus)
+    end do
+
+    return
+  end subroutine update_checksum
+
+  !-----------------------------------------------------------------
+  !> Rename a file, replacing any file that has the new name. On POSIX
+  !! systems this is atomic, so the new name always refers to either
+  !! the old file or the new one.
+
+  subroutine rename_file(old_name, new_name)
+    use iso_c_binding, only: c_int, c_char, c_null_char
+    implicit none
+
+    character(*), intent(in) :: old_name, new_name
+
+    interface
+      integer(c_int) function c_rename(old, new) bind(C, name='rename')
+        import :: c_int, c_char
+        character(kind=c_char), intent(in) :: old(*), new(*)
+      end function c_rename
+    end interface
+
+    if (c_rename(old_name//c_null_char, new_name//c_null_char) &
+        .ne. 0) then
+      write(17, "(A)") "Could not rename "//old_name//" to "//new_name
+      call clean_stop(0, .FALSE.)
+    end if
+
+    return
+  end subroutine rename_file
+
+  !-----------------------------------------------------------------
+  !> Delete a file, if it exists
+
+  subroutine delete_file(name)
+    implicit none
+
+    character(*), intent(in) :: name
+
+    logical :: lex
+
+    INQUIRE(file=name, exist=lex)
+    if (lex) then
+      open(unit=10, status='old', file=name)
+      close(10, status='delete')
+    end if
+
+    return
+  end subroutine delete_file
+
+  ! ---------------------------------------------------------------------------
+  !> Read the model time and the lengths of the recent time steps from
+  !! checkpoints written before they were kept in one file. Checkpoints
+  !! from runs with a fixed time step do not have them, so they follow
+  !! from dt.
+
+  subroutine load_time_checkpoint(model_time, dt_history, dt, AB_order, &
+      niter0)
+    implicit none
+
+    double precision, intent(out) :: model_time
+    double precision, intent(out) :: dt_history(AB_order)
+    double precision, intent(in)  :: dt
+    integer,          intent(in)  :: AB_order, niter0
+
+    character(10)  :: num
+    logical        :: lex
+
+    write(num, '(i10.10)') niter0
+    INQUIRE(file='checkpoints/time.'//num, exist=lex)
+
+    if (lex) then
+      open(unit=10, status='old', file='checkpoints/time.'//num, &
+          form='formatted')
+      read(10, *) model_time
+      read(10, *) dt_history
+      close(10)
+    else
+      model_time = dble(niter0)*dt
+      dt_history = dt
+    end if
+
+    return
+  end subroutine load_time_checkpoint
+
+  ! ---------------------------------------------------------------------------
+  !> Load the checkpoint at time step niter0 when restarting a
+  !! simulation. The header is checked against the run, and the
+  !! checksum against the contents, so that the run stops rather than
+  !! starting from a checkpoint that was cut short or does not fit.
+  !! Checkpoints with more tendencies than the time stepping scheme
+  !! needs may be used, as the newest are first. A checkpoint written
+  !! with another time stepping scheme is used with a warning. The
+  !! checksums of version 1 checkpoints do not cover their header.
 
   subroutine load_checkpoint_files(dhdt, dudt, dvdt, h, u, v, eta, &
+            model_time, dt_history, dt, RedGrav, niter0, nx, ny, layers, &
+            AB_order)
+    implicit none
+
+    real(wp),         intent(out) :: dhdt(0:nx+1, 0:ny+1, layers, AB_order)
+    real(wp),         intent(out) :: dudt(0:nx+1, 0:ny+1, layers, AB_order)
+    real(wp),         intent(out) :: dvdt(0:nx+1, 0:ny+1, layers, AB_order)
+    real(wp),         intent(out) :: h(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(out) :: u(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(out) :: v(0:nx+1, 0:ny+1, layers)
+    double precision, intent(out) :: eta(0:nx+1, 0:ny+1)
+    double precision, intent(out) :: model_time
+    double precision, intent(out) :: dt_history(AB_order)
+    double precision, intent(in)  :: dt
+    logical,          intent(in)  :: RedGrav
+    integer,          intent(in)  :: niter0
+    integer,          intent(in)  :: nx, ny, layers, AB_order
+
+    character(10)  :: num
+    character(36)  :: name
+    logical        :: lex
+    character(len(checkpoint_magic)) :: magic
+    integer        :: version, file_nx, file_ny, file_layers
+    integer        :: file_AB_order, file_TS_algorithm, file_n
+    logical        :: has_eta
+    integer        :: ios
+    integer(int64) :: checksum(2), file_checksum(2)
+    double precision, allocatable :: history(:)
+    ! the checkpoints are in double precision, whatever the model uses
+    double precision, allocatable :: buffer(:,:,:,:)
+
+    write(num, '(i10.10)') niter0
+    name = 'checkpoints/checkpoint.'//num
+
+    INQUIRE(file=name, exist=lex)
+    if (.not. lex) then
+      call load_separate_checkpoint_files(dhdt, dudt, dvdt, h, u, v, eta, &
+          RedGrav, niter0, nx, ny, layers, AB_order)
+      call load_time_checkpoint(model_time, dt_history, dt, AB_order, niter0)
+      return
+    end if
+
+    open(unit=10, status='old', form='unformatted', file=name)
+    read(10, iostat=ios) magic, version, file_nx, file_ny, file_layers, &
+        file_AB_order, file_TS_algorithm, file_n, has_eta, model_time
+    if (ios .ne. 0 .or. magic .ne. checkpoint_magic) then
+      call stop_on_bad_checkpoint(name, "is not an Aronnax checkpoint.")
+    else if (version .lt. 1 .or. version .gt. checkpoint_version) then
+      call stop_on_bad_checkpoint(name, "has an unknown format.")
+    else if (file_nx .ne. nx_global .or. file_ny .ne. ny_global &
+        .or. file_layers .ne. layers) then
+      call stop_on_bad_checkpoint(name, &
+          "was written for a different grid or number of layers.")
+    else if (file_n .ne. niter0) then
+      call stop_on_bad_checkpoint(name, "is for a different time step.")
+    else if (file_AB_order .lt. AB_order) then
+      call stop_on_bad_checkpoint(name, "does not have enough "// &
+          "tendencies for the time stepping scheme.")
+    else if (.not. (RedGrav .or. has_eta)) then
+      call stop_on_bad_checkpoint(name, "does not have a free surface.")
+    end if
+
+    if (file_TS_algorithm .ne. checkpoint_TS_algorithm &
+        .and. decomp_rank .eq. 0) then
+      write(17, "(A, I0, A, I0, A)") "Warning: Checkpoint "//trim(name)// &
+          " was written with TS_algorithm ", file_TS_algorithm, &
+          ", but the run uses ", checkpoint_TS_algorithm, "."
+    end if
+
+    checksum = 0
+    if (version .ge. 2) then
+      call update_checksum(checksum, checkpoint_header(version, file_nx, &
+          file_ny, file_layers, file_AB_order, file_TS_algorithm, file_n, &
+          has_eta, model_time), header_length)
+    end if
+    allocate(history(file_AB_order))
+    read(10, iostat=ios) history
+    if (ios .ne. 0) call stop_on_bad_checkpoint(name, "is incomplete.")
+    call update_checksum(checksum, history, file_AB_order)
+    dt_history = history(1:AB_order)
+
+    allocate(buffer(0:nx+1, 0:ny+1, layers, file_AB_order))
+    call read_checkpoint_field(buffer, nx, ny, layers, name, checksum)
+    h = buffer(:,:,:,1)
+    call read_checkpoint_field(buffer, nx, ny, layers, name, checksum)
+    u = buffer(:,:,:,1)
+    call read_checkpoint_field(buffer, nx, ny, layers, name, checksum)
+    v = buffer(:,:,:,1)
+    call read_checkpoint_field(buffer, nx, ny, layers*file_AB_order, name, &
+        checksum)
+    dhdt = buffer(:,:,:,1:AB_order)
+    call read_checkpoint_field(buffer, nx, ny, layers*file_AB_order, name, &
+        checksum)
+    dudt = buffer(:,:,:,1:AB_order)
+    call read_checkpoint_field(buffer, nx, ny, layers*file_AB_order, name, &
+        checksum)
+    dvdt = buffer(:,:,:,1:AB_order)
+    if (has_eta) then
+      call read_checkpoint_field(buffer, nx, ny, 1, name, checksum)
+      if (.not. RedGrav) eta = buffer(:,:,1,1)
+    end if
+
+    read(10, iostat=ios) file_checksum
+    if (ios .ne. 0) call stop_on_bad_checkpoint(name, "is incomplete.")
+    if (any(file_checksum .ne. checksum)) then
+      call stop_on_bad_checkpoint(name, "is corrupt: its checksum "// &
+          "does not match its contents.")
+    end if
+    close(10)
+
+    return
+  end subroutine load_checkpoint_files
+
+  ! ---------------------------------------------------------------------------
+  !> Read a field on the global grid from the open checkpoint file, and
+  !! keep this process's tile of it
+
+  subroutine read_checkpoint_field(array, nx, ny, nz, name, checksum)
+    implicit none
+
+    double precision, intent(out)   :: array(0:nx+1, 0:ny+1, nz)
+    integer,          intent(in)    :: nx, ny, nz
+    character(*),     intent(in)    :: name
+    integer(int64),   intent(inout) :: checksum(2)
+
+    double precision, allocatable :: global(:,:,:)
+    integer :: ios
+
+    allocate(global(0:nx_global+1, 0:ny_global+1, nz))
+
+    read(10, iostat=ios) global
+    if (ios .ne. 0) call stop_on_bad_checkpoint(name, "is incomplete.")
+    call update_checksum(checksum, global, size(global))
+
+    call get_tile(array, global, nx, ny, nz)
+
+    return
+  end subroutine read_checkpoint_field
+
+  !-----------------------------------------------------------------
+  !> Stop the run because a checkpoint cannot be used
+
+  subroutine stop_on_bad_checkpoint(name, problem)
+    implicit none
+
+    character(*), intent(in) :: name, problem
+
+    write(17, "(A)") "Checkpoint "//trim(name)//" "//problem
+    call clean_stop(0, .FALSE.)
+
+    return
+  end subroutine stop_on_bad_checkpoint
+
+  ! ---------------------------------------------------------------------------
+  !> Load checkpoints written before they were kept in one file, with a
+  !! file for each field
+
+  subroutine load_separate_checkpoint_files(dhdt, dudt, dvdt, h, u, v, eta, &
             RedGrav, niter0, nx, ny, layers, AB_order)
+    implicit none
 
-    double precision, intent(out) :: dhdt(0:nx+1, 0:ny+1, layers, AB_order)
-    double precision, intent(out) :: dudt(0:nx+1, 0:ny+1, layers, AB_order)
-    double precision, intent(out) :: dvdt(0:nx+1, 0:ny+1, layers, AB_order)
-    double precision, intent(out) :: h(0:nx+1, 0:ny+1, layers)
-    double precision, intent(out) :: u(0:nx+1, 0:ny+1, layers)
-    double precision, intent(out) :: v(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(out) :: dhdt(0:nx+1, 0:ny+1, layers, AB_order)
+    real(wp),         intent(out) :: dudt(0:nx+1, 0:ny+1, layers, AB_order)
+    real(wp),         intent(out) :: dvdt(0:nx+1, 0:ny+1, layers, AB_order)
+    real(wp),         intent(out) :: h(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(out) :: u(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(out) :: v(0:nx+1, 0:ny+1, layers)
     double precision, intent(out) :: eta(0:nx+1, 0:ny+1)
     logical,          intent(in)  :: RedGrav
     integer,          intent(in) :: niter0
@@ -363,37 +851,58 @@ module io
 
     ! dummy variable for loading checkpoints
     character(10)    :: num
+    ! the checkpoints are in double precision, whatever the model uses
+    double precision :: buffer(0:nx+1, 0:ny+1, layers, AB_order)
 
     ! load in the state and derivative arrays
     write(num, '(i10.10)') niter0
 
-    open(unit=10, form='unformatted', file='checkpoints/h.'//num)
-    read(10) h
-    close(10)
-    open(unit=10, form='unformatted', file='checkpoints/u.'//num)
-    read(10) u
-    close(10)
-    open(unit=10, form='unformatted', file='checkpoints/v.'//num)
-    read(10) v
-    close(10)
-
-    open(unit=10, form='unformatted', file='checkpoints/dhdt.'//num)
-    read(10) dhdt
-    close(10)
-    open(unit=10, form='unformatted', file='checkpoints/dudt.'//num)
-    read(10) dudt
-    close(10)
-    open(unit=10, form='unformatted', file='checkpoints/dvdt.'//num)
-    read(10) dvdt
-    close(10)
+    call read_checkpoint_file(buffer, nx, ny, layers, 'checkpoints/h.'//num)
+    h = buffer(:,:,:,1)
+    call read_checkpoint_file(buffer, nx, ny, layers, 'checkpoints/u.'//num)
+    u = buffer(:,:,:,1)
+    call read_checkpoint_file(buffer, nx, ny, layers, 'checkpoints/v.'//num)
+    v = buffer(:,:,:,1)
+
+    call read_checkpoint_file(buffer, nx, ny, layers*AB_order, &
+        'checkpoints/dhdt.'//num)
+    dhdt = buffer
+    call read_checkpoint_file(buffer, nx, ny, layers*AB_order, &
+        'checkpoints/dudt.'//num)
+    dudt = buffer
+    call read_checkpoint_file(buffer, nx, ny, layers*AB_order, &
+        'checkpoints/dvdt.'//num)
+    dvdt = buffer
 
     if (.not. RedGrav) then
-      open(unit=10, form='unformatted', file='checkpoints/eta.'//num)
-      read(10) eta
-      close(10)
+      call read_checkpoint_file(eta, nx, ny, 1, 'checkpoints/eta.'//num)
     end if
 
-  end subroutine load_checkpoint_files
+  end subroutine load_separate_checkpoint_files
+
+  ! ---------------------------------------------------------------------------
+  !> Read a field on the global grid from a checkpoint file of its own,
+  !! and keep this process's tile of it
+
+  subroutine read_checkpoint_file(array, nx, ny, nz, name)
+    implicit none
+
+    double precision, intent(out) :: array(0:nx+1, 0:ny+1, nz)
+    integer,          intent(in)  :: nx, ny, nz
+    character(*),     intent(in)  :: name
+
+    double precision, allocatable :: global(:,:,:)
+
+    allocate(global(0:nx_global+1, 0:ny_global+1, nz))
+
+    open(unit=10, form='unformatted', file=name)
+    read(10) global
+    close(10)
+
+    call get_tile(array, global, nx, ny, nz)
+
+    return
+  end subroutine read_checkpoint_file
 
 
   !-----------------------------------------------------------------
@@ -409,29 +918,109 @@ module io
     character(*),     intent(in) :: name
 
     character(10)  :: num
-    
+    double precision, allocatable :: global(:,:)
+    integer        :: field
+
+    ! the first process writes the whole field
+    allocate(global(0:nx_global+1, 0:ny_global+1))
+    call gather_tiles(global, array, nx, ny, 1)
+    if (decomp_rank .ne. 0) return
+
     write(num, '(i10.10)') n
 
-    ! Output the data to a file
-    open(unit=10, status='replace', file=name//num, &
-        form='unformatted')
-    write(10) array(1:nx+xstep, 1:ny+ystep)
-    close(10)
+    if (is_netcdf_field(name, field)) then
+      call write_netcdf_field(field, global(1:nx_global+xstep, &
+          1:ny_global+ystep), nx_global+xstep, ny_global+ystep, 1)
+      return
+    end if
+
+    call queue_output(reshape(global(1:nx_global+xstep, &
+        1:ny_global+ystep), [(nx_global+xstep)*(ny_global+ystep)]), &
+        name//num)
 
     return
   end subroutine write_output_2d
 
+  !-----------------------------------------------------------------
+  !> Start writing a field to a file of the given name, without
+  !! waiting for the write to finish. The file holds one record, as if
+  !! the field had been written with a plain unformatted write.
+
+  subroutine queue_output(values, name)
+    implicit none
+
+    double precision, intent(in) :: values(:)
+    character(*),     intent(in) :: name
+
+    integer :: slot, unit
+
+    slot = next_output_slot
+    next_output_slot = mod(slot, output_slots) + 1
+    unit = first_output_unit + slot - 1
+
+    ! the buffer is still being written from
+    if (output_queue(slot)%pending) then
+      wait(unit)
+      close(unit)
+    end if
+
+    output_queue(slot)%data = values
+    open(unit=unit, status='replace', file=name, form='unformatted', &
+        asynchronous='yes')
+    call start_output_write(unit, output_queue(slot)%data, size(values))
+    output_queue(slot)%pending = .TRUE.
+
+    return
+  end subroutine queue_output
+
+  !-----------------------------------------------------------------
+  !> Start an asynchronous write of a buffer. The buffer is passed as a
+  !! plain array because gfortran writes a component of a derived type
+  !! asynchronously one element at a time, which is much slower.
+
+  subroutine start_output_write(unit, values, count)
+    implicit none
+
+    integer,          intent(in) :: unit, count
+    double precision, asynchronous, intent(in) :: values(count)
+
+    write(unit, asynchronous='yes') values
+
+    return
+  end subroutine start_output_write
+
+  !-----------------------------------------------------------------
+  !> Wait for all of the output started by queue_output to be written
+
+  subroutine flush_output()
+    implicit none
+
+    integer :: slot
+
+    do slot = 1, output_slots
+      if (output_queue(slot)%pending) then
+        wait(first_output_unit + slot - 1)
+        close(first_output_unit + slot - 1)
+        output_queue(slot)%pending = .FALSE.
+      end if
+    end do
+
+    return
+  end subroutine flush_output
+
 
   !-----------------------------------------------------------------
-  !> create a diagnostics file
+  !> Open a diagnostics file, creating it if needed. It stays open on
+  !! the given unit until close_diag_files is called.
 
-  subroutine create_diag_file(layers, filename, arrayname, niter0)
+  subroutine create_diag_file(layers, filename, arrayname, niter0, unit)
     implicit none
 
     integer,          intent(in) :: layers
     character(*),     intent(in) :: filename
     character(*),     intent(in) :: arrayname
     integer,          intent(in) :: niter0
+    integer,          intent(in) :: unit
 
     integer        :: k
     logical        :: lex
@@ -439,6 +1028,8 @@ module io
     character(17)   :: header((4*layers)+1)
 
 
+    if (decomp_rank .ne. 0) return
+
     ! prepare header for file
     header(1) = 'timestep'
     do k = 1, layers
@@ -462,24 +1053,24 @@ module io
           "Diagnostics file for "//arrayname//" does not exist. Creating it now."
       end if
 
-      open(unit=10, status='replace', file=filename, &
+      open(unit=unit, status='replace', file=filename, &
         form='formatted')
-      write (10,'(*(G0.4,:,","))') header
-      close(10)
+      write (unit,'(*(G0.4,:,","))') header
 
     else if (niter0 .ne. 0) then
       ! restarting from checkpoint, diagnostics file may or may not exist.
       if (lex) then
         print "(A)", &
           "Diagnostics file for "//arrayname//" already exists. Appending to it."
+        open(unit=unit, status='old', file=filename, &
+          form='formatted', position='append')
       else if (.not. lex) then
         print "(A)", &
           "Diagnostics file for "//arrayname//" does not exist. Creating it now."
 
-        open(unit=10, status='new', file=filename, &
+        open(unit=unit, status='new', file=filename, &
           form='formatted')
-        write (10,'(*(G0.4,:,","))') header
-        close(10)
+        write (unit,'(*(G0.4,:,","))') header
       end if
     end if
 
@@ -487,36 +1078,303 @@ module io
   end subroutine create_diag_file
 
   !-----------------------------------------------------------------
-  !> Save diagnostistics of given fields
-
-  subroutine write_diag_output(array, nx, ny, layers, &
-      n, filename)
+  !> Save the mean, maximum, minimum and standard deviation of each
+  !! layer of a field over the wet points of the domain. xstep and
+  !! ystep are 1 for fields on the cell faces, which are wet when the
+  !! cells on both sides of them are. Each process summarises its own
+  !! tile, and the summaries are combined on the first process, so the
+  !! field is never gathered.
+
+  subroutine write_diag_output(array, wetmask, nx, ny, layers, &
+      xstep, ystep, n, unit)
     implicit none
 
     double precision, intent(in) :: array(0:nx+1, 0:ny+1, layers)
+    double precision, intent(in) :: wetmask(0:nx+1, 0:ny+1)
     integer,          intent(in) :: nx, ny, layers
+    integer,          intent(in) :: xstep, ystep
     integer,          intent(in) :: n
-    character(*),     intent(in) :: filename
+    integer,          intent(in) :: unit
 
     double precision :: diag_out(4*layers)
-    integer          :: k
+    ! number of points, mean, sum of squared deviations from the mean,
+    ! maximum and minimum of each layer of the tile
+    double precision :: stats(5, layers)
+    double precision, allocatable :: all_stats(:,:,:)
+    double precision :: total(5)
+    integer          :: k, r
+
+    do k = 1, layers
+      call layer_statistics(stats(:,k), array(:,:,k), wetmask, nx, ny, &
+          xstep, ystep)
+    end do
+
+    allocate(all_stats(5, layers, 0:decomp_size-1))
+    call gather_values(all_stats, stats, 5*layers)
+    if (decomp_rank .ne. 0) return
 
     ! prepare data for file
     do k = 1, layers
-      diag_out(1+(4*(k-1))) = sum(array(:,:,k))/dble(size(array(:,:,k))) ! mean
-      diag_out(2+(4*(k-1))) = maxval(array(:,:,k))
-      diag_out(3+(4*(k-1))) = minval(array(:,:,k))
-      diag_out(4+(4*(k-1))) = sqrt( sum( (array(:,:,k) - diag_out(1+(4*(k-1))))**2)/ &
-                            dble(size(array(:,:,k))))
+      total = all_stats(:, k, 0)
+      do r = 1, decomp_size - 1
+        call merge_statistics(total, all_stats(:, k, r))
+      end do
+      diag_out(1+(4*(k-1))) = total(2) ! mean
+      diag_out(2+(4*(k-1))) = total(4)
+      diag_out(3+(4*(k-1))) = total(5)
+      diag_out(4+(4*(k-1))) = sqrt(total(3)/max(total(1), 1d0))
     end do
 
     ! Output the data to a file
-    open(unit=10, status='old', file=filename, &
-        form='formatted', position='append')
-    write (10,'(i10.10, ",", *(G22.15,:,","))') n, diag_out
-    close(10)
+    write (unit,'(i10.10, ",", *(G22.15,:,","))') n, diag_out
 
     return
   end subroutine write_diag_output
 
+  !-----------------------------------------------------------------
+  !> Find the number of wet points in the interior of one layer, and
+  !! the mean, sum of squared deviations from the mean, maximum and
+  !! minimum of the field over them. The layer is read from memory
+  !! once: each row is summarised while it is in cache, and the rows
+  !! are merged into the running totals, which keeps the sum of squared
+  !! deviations accurate however large the mean.
+
+  subroutine layer_statistics(stats, array, wetmask, nx, ny, xstep, ystep)
+    implicit none
+
+    double precision, intent(out) :: stats(5)
+    double precision, intent(in)  :: array(0:nx+1, 0:ny+1)
+    double precision, intent(in)  :: wetmask(0:nx+1, 0:ny+1)
+    integer,          intent(in)  :: nx, ny
+    integer,          intent(in)  :: xstep, ystep
+
+    double precision :: row(5)
+    integer :: i, j
+
+    stats = [0d0, 0d0, 0d0, -huge(1d0), huge(1d0)]
+
+    do j = 1, ny
+      row = [0d0, 0d0, 0d0, -huge(1d0), huge(1d0)]
+      do i = 1, nx
+        if (wetmask(i,j)*wetmask(i-xstep,j-ystep) .ne. 0d0) then
+          row(1) = row(1) + 1d0
+          row(2) = row(2) + array(i,j)
+          row(4) = max(row(4), array(i,j))
+          row(5) = min(row(5), array(i,j))
+        end if
+      end do
+      if (row(1) .eq. 0d0) cycle
+      row(2) = row(2)/row(1)
+      do i = 1, nx
+        if (wetmask(i,j)*wetmask(i-xstep,j-ystep) .ne. 0d0) then
+          row(3) = row(3) + (array(i,j) - row(2))**2
+        end if
+      end do
+      call merge_statistics(stats, row)
+    end do
+
+    return
+  end subroutine layer_statistics
+
+  !-----------------------------------------------------------------
+  !> Combine the statistics of two sets of points, as found by
+  !! layer_statistics, into those of their union (Chan et al., 1979)
+
+  subroutine merge_statistics(stats, other)
+    implicit none
+
+    double precision, intent(inout) :: stats(5)
+    double precision, intent(in)    :: other(5)
+
+    double precision :: count, delta
+
+    if (other(1) .eq. 0d0) return
+
+    count = stats(1) + other(1)
+    delta = other(2) - stats(2)
+    stats(2) = stats(2) + delta*other(1)/count
+    stats(3) = stats(3) + other(3) + delta**2*stats(1)*other(1)/count
+    stats(1) = count
+    stats(4) = max(stats(4), other(4))
+    stats(5) = min(stats(5), other(5))
+
+    return
+  end subroutine merge_statistics
+
+  !-----------------------------------------------------------------
+  !> Write out the buffered lines of the diagnostics files
+
+  subroutine flush_diag_files(RedGrav)
+    implicit none
+
+    logical, intent(in) :: RedGrav
+
+    if (decomp_rank .ne. 0) return
+
+    flush(h_diag_unit)
+    flush(u_diag_unit)
+    flush(v_diag_unit)
+    if (.not. RedGrav) then
+      flush(eta_diag_unit)
+    end if
+
+    return
+  end subroutine flush_diag_files
+
+  !-----------------------------------------------------------------
+  !> Close the diagnostics files at the end of the run
+
+  subroutine close_diag_files(RedGrav)
+    implicit none
+
+    logical, intent(in) :: RedGrav
+
+    if (decomp_rank .ne. 0) return
+
+    close(h_diag_unit)
+    close(u_diag_unit)
+    close(v_diag_unit)
+    if (.not. RedGrav) then
+      close(eta_diag_unit)
+    end if
+
+    return
+  end subroutine close_diag_files
+
+  !-----------------------------------------------------------------
+  !> Open the pressure solver diagnostics file, creating it if needed
+
+  subroutine create_solver_diag_file(filename, niter0)
+    implicit none
+
+    character(*),     intent(in) :: filename
+    integer,          intent(in) :: niter0
+
+    logical        :: lex
+
+    if (decomp_rank .ne. 0) return
+
+    INQUIRE(file=filename, exist=lex)
+
+    if (niter0 .eq. 0 .or. .not. lex) then
+      if (lex) then
+        print "(A)", &
+          "Starting a new run (niter0=0), but diagnostics file for solver already exists. Overwriting old file."
+      else
+        print "(A)", &
+          "Diagnostics file for solver does not exist. Creating it now."
+      end if
+
+      open(unit=solver_diag_unit, status='replace', file=filename, &
+        form='formatted')
+      write (solver_diag_unit, '(A)') &
+        'timestep,iterations,initial_residual,final_residual,solve_time,'// &
+        'guess_residual'
+    else
+      ! restarting from checkpoint
+      print "(A)", &
+        "Diagnostics file for solver already exists. Appending to it."
+      open(unit=solver_diag_unit, status='old', file=filename, &
+        form='formatted', position='append')
+    end if
+
+    return
+  end subroutine create_solver_diag_file
+
+  !-----------------------------------------------------------------
+  !> Record the convergence and cost of one pressure solve. The initial
+  !! residual is that of etastar, which the solvers reduce by a factor
+  !! of eps, and the guess residual is that of their first guess.
+
+  subroutine write_solver_diag_output(n, iterations, initial_residual, &
+      final_residual, solve_time, guess_residual)
+    implicit none
+
+    integer,          intent(in) :: n
+    integer,          intent(in) :: iterations
+    double precision, intent(in) :: initial_residual, final_residual
+    double precision, intent(in) :: solve_time
+    double precision, intent(in) :: guess_residual
+
+    if (decomp_rank .ne. 0) return
+
+    write (solver_diag_unit, '(i10.10, ",", i0, 4(",", ES11.5))') &
+        n, iterations, initial_residual, final_residual, solve_time, &
+        guess_residual
+
+    return
+  end subroutine write_solver_diag_output
+
+  !-----------------------------------------------------------------
+  !> Open the record of the time step lengths, creating it if needed
+
+  subroutine create_time_diag_file(filename, niter0)
+    implicit none
+
+    character(*),     intent(in) :: filename
+    integer,          intent(in) :: niter0
+
+    logical        :: lex
+
+    if (decomp_rank .ne. 0) return
+
+    INQUIRE(file=filename, exist=lex)
+
+    if (niter0 .eq. 0 .or. .not. lex) then
+      open(unit=time_diag_unit, status='replace', file=filename, &
+        form='formatted')
+      write (time_diag_unit, '(A)') 'timestep,time,dt,cfl'
+    else
+      ! restarting from checkpoint
+      open(unit=time_diag_unit, status='old', file=filename, &
+        form='formatted', position='append')
+    end if
+
+    return
+  end subroutine create_time_diag_file
+
+  !-----------------------------------------------------------------
+  !> Record the model time at the end of a time step, the length of
+  !! the step and its Courant number
+
+  subroutine write_time_diag_output(n, model_time, dt, cfl)
+    implicit none
+
+    integer,          intent(in) :: n
+    double precision, intent(in) :: model_time, dt, cfl
+
+    if (decomp_rank .ne. 0) return
+
+    write (time_diag_unit, '(i10.10, 3(",", ES23.16))') &
+        n, model_time, dt, cfl
+
+    return
+  end subroutine write_time_diag_output
+
+  !-----------------------------------------------------------------
+  !> Close the record of the time step lengths at the end of the run
+
+  subroutine close_time_diag_file()
+    implicit none
+
+    if (decomp_rank .ne. 0) return
+
+    close(time_diag_unit)
+
+    return
+  end subroutine close_time_diag_file
+
+  !-----------------------------------------------------------------
+  !> Close the pressure solver diagnostics file at the end of the run
+
+  subroutine close_solver_diag_file()
+    implicit none
+
+    if (decomp_rank .ne. 0) return
+
+    close(solver_diag_unit)
+
+    return
+  end subroutine close_solver_diag_file
+
 end module io
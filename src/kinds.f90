@@ -0,0 +1,17 @@
+module kinds
+
+  implicit none
+
+  !> Kind of the prognostic fields (h, u and v) and their tendencies.
+  !! The mixed precision executables hold these in single precision,
+  !! which halves the memory traffic of the tendency kernels and the
+  !! time stepping. The parameters, forcing, sponges, averages,
+  !! free surface and pressure solver stay in double precision, as do
+  !! the input and output files.
+#ifdef useSinglePrecision
+  integer, parameter :: wp = kind(1.0)
+#else
+  integer, parameter :: wp = kind(1d0)
+#endif
+
+end module kinds
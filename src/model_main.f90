@@ -2,9 +2,12 @@ module model_main
   use end_run
   use boundaries
   use barotropic_mode
+  use multigrid
+  use spectral_solver
   use state_deriv
   use time_stepping
   use enforce_thickness
+  use time_step_control
   implicit none
 
   contains
@@ -12,28 +15,32 @@ module model_main
   ! ------------------------------ Primary routine ----------------------------
   !> Run the model
 
-  subroutine model_run(h, u, v, eta, depth, dx, dy, wetmask, fu, fv, &
+  subroutine model_run(h_init, u_init, v_init, eta_init, depth, dx, dy, wetmask, fu, fv, &
       dt, au, ar, botDrag, kh, kv, slip, hmin, niter0, nTimeSteps, &
-      dumpFreq, avFreq, checkpointFreq, diagFreq, &
+      dumpFreq, avFreq, checkpointFreq, diagFreq, keep_checkpoints, &
+      output_format, deflate_level, &
+      adaptive_dt, dt_min, dt_max, max_cfl, &
+      solver_algorithm, solver_first_guess, barotropic_substeps, &
       maxits, eps, freesurfFac, thickness_error, &
       debug_level, g_vec, rho0, &
       base_wind_x, base_wind_y, wind_mag_time_series, &
       spongeHTimeScale, spongeUTimeScale, spongeVTimeScale, &
       spongeH, spongeU, spongeV, &
-      nx, ny, layers, RedGrav, hAdvecScheme, TS_algorithm, AB_order, &
+      nx, ny, layers, RedGrav, hAdvecScheme, tendency_algorithm, &
+      TS_algorithm, AB_order, &
       DumpWind, RelativeWind, Cd, &
       MPI_COMM_WORLD, myid, num_procs, ilower, iupper, &
-      hypre_grid)
+      hypre_grid, write_output, h_final, u_final, v_final, eta_final)
     implicit none
 
-    ! Layer thickness (h)
-    double precision, intent(inout) :: h(0:nx+1, 0:ny+1, layers)
-    ! Velocity component (u)
-    double precision, intent(inout) :: u(0:nx+1, 0:ny+1, layers)
-    ! Velocity component (v)
-    double precision, intent(inout) :: v(0:nx+1, 0:ny+1, layers)
-    ! Free surface (eta)
-    double precision, intent(inout) :: eta(0:nx+1, 0:ny+1)
+    ! Initial layer thickness (h)
+    double precision, intent(in)    :: h_init(0:nx+1, 0:ny+1, layers)
+    ! Initial velocity component (u)
+    double precision, intent(in)    :: u_init(0:nx+1, 0:ny+1, layers)
+    ! Initial velocity component (v)
+    double precision, intent(in)    :: v_init(0:nx+1, 0:ny+1, layers)
+    ! Initial free surface (eta)
+    double precision, intent(in)    :: eta_init(0:nx+1, 0:ny+1)
     ! Bathymetry
     double precision, intent(in) :: depth(0:nx+1, 0:ny+1)
     ! Grid
@@ -48,6 +55,17 @@ module model_main
     double precision, intent(in) :: slip, hmin
     integer,          intent(in) :: niter0, nTimeSteps
     double precision, intent(in) :: dumpFreq, avFreq, checkpointFreq, diagFreq
+    ! Number of its checkpoints that the run keeps, or 0 to keep them all
+    integer,          intent(in) :: keep_checkpoints
+    ! Raw files (1) or NetCDF (2) for snapshots, averages and debugging
+    ! output, and the level of compression of the NetCDF files
+    integer,          intent(in) :: output_format, deflate_level
+    ! Varying the time step to keep the Courant number below max_cfl
+    logical,          intent(in) :: adaptive_dt
+    double precision, intent(in) :: dt_min, dt_max, max_cfl
+    integer,          intent(in) :: solver_algorithm
+    integer,          intent(in) :: solver_first_guess
+    integer,          intent(in) :: barotropic_substeps
     integer,          intent(in) :: maxits
     double precision, intent(in) :: eps, freesurfFac, thickness_error
     integer,          intent(in) :: debug_level
@@ -70,34 +88,63 @@ module model_main
     ! Reduced gravity vs n-layer physics
     logical,          intent(in) :: RedGrav
     integer,          intent(in) :: hAdvecScheme
+    integer,          intent(in) :: tendency_algorithm
     integer,          intent(in) :: TS_algorithm
     integer,          intent(in) :: AB_order
     ! Whether to write computed wind in the output
     logical,          intent(in) :: DumpWind
     logical,          intent(in) :: RelativeWind
     double precision,  intent(in) :: Cd
-
-    double precision :: dhdt(0:nx+1, 0:ny+1, layers, AB_order)
-    double precision :: h_new(0:nx+1, 0:ny+1, layers)
+    ! Whether to write output, diagnostics and checkpoints to disk. A
+    ! run that does not can hand back its final state instead.
+    logical,          intent(in) :: write_output
+    double precision, intent(out), optional :: &
+        h_final(0:nx+1, 0:ny+1, layers), &
+        u_final(0:nx+1, 0:ny+1, layers), &
+        v_final(0:nx+1, 0:ny+1, layers), &
+        eta_final(0:nx+1, 0:ny+1)
+
+    ! The model state, in the precision of the build. The present and
+    ! new states are swapped at the end of each time step rather than
+    ! copied, so they are allocatable.
+    real(wp), allocatable :: h(:,:,:), h_new(:,:,:)
+    real(wp), allocatable :: u(:,:,:), u_new(:,:,:)
+    real(wp), allocatable :: v(:,:,:), v_new(:,:,:)
+
+    real(wp)         :: dhdt(0:nx+1, 0:ny+1, layers, AB_order)
     ! for saving average fields
     double precision :: hav(0:nx+1, 0:ny+1, layers)
 
-    double precision :: dudt(0:nx+1, 0:ny+1, layers, AB_order)
-    double precision :: u_new(0:nx+1, 0:ny+1, layers)
+    real(wp)         :: dudt(0:nx+1, 0:ny+1, layers, AB_order)
     ! for saving average fields
     double precision :: uav(0:nx+1, 0:ny+1, layers)
 
-    double precision :: dvdt(0:nx+1, 0:ny+1, layers, AB_order)
-    double precision :: v_new(0:nx+1, 0:ny+1, layers)
+    real(wp)         :: dvdt(0:nx+1, 0:ny+1, layers, AB_order)
+    ! which of the tendency arrays holds which time step
+    integer          :: AB_slot(AB_order)
     ! for saving average fields
     double precision :: vav(0:nx+1, 0:ny+1, layers)
 
-    double precision :: etanew(0:nx+1, 0:ny+1)
+    ! Free surface at the present and next time steps, and from the
+    ! previous time step, for the solver's first guess
+    double precision, allocatable :: eta(:,:), etanew(:,:), eta_prev(:,:)
     ! for saving average fields
     double precision :: etaav(0:nx+1, 0:ny+1)
 
     ! Pressure solver variables
     double precision :: a(5, nx, ny)
+    ! the same on the whole domain, for the solvers that need it
+    double precision, allocatable :: a_global(:,:,:)
+    double precision, allocatable :: wetmask_global(:,:)
+    type(mg_level), allocatable :: mg_levels(:)
+    type(spectral_plan) :: fft
+    integer          :: substeps
+    integer          :: solver_iterations
+    integer*8        :: total_solver_iterations
+    integer          :: max_solver_iterations
+    double precision :: solver_initial_residual, solver_final_residual
+    double precision :: solver_guess_residual
+    double precision :: solver_time, total_solver_time
 
     ! Geometry
     double precision :: hfacW(0:nx+1, 0:ny+1)
@@ -111,6 +158,28 @@ module model_main
 
     ! dumping output
     integer :: nwrite, avwrite, checkpointwrite, diagwrite
+    logical :: dump_snapshot, dump_average, dump_checkpoint, dump_diagnostics
+    ! weight of each time step in the averages, and their sum
+    double precision :: av_weight, av_time
+
+    ! Time step, which is dt unless the time step varies
+    double precision :: dt_step
+    ! when it does, the model time in seconds, its value at the start
+    ! and end of the run, and when the next outputs are due
+    double precision :: model_time, start_model_time, end_model_time
+    double precision :: next_dump_time, next_av_time
+    double precision :: next_checkpoint_time, next_diag_time
+    double precision :: next_output
+    logical          :: landing
+    ! Courant number of the time step and the rate it is calculated from
+    double precision :: cfl, wave_rate
+    ! lengths of the time steps for the tendency history, newest first,
+    ! and the weights that the Adams-Bashforth schemes give them
+    double precision :: dt_history(AB_order)
+    double precision :: AB_weights(AB_order)
+    ! model time and recent time steps read from a checkpoint
+    double precision :: checkpoint_time, checkpoint_dt(AB_order)
+    integer          :: last_step
 
     ! External solver variables
     integer          :: offsets(2,5)
@@ -120,6 +189,10 @@ module model_main
     integer*8        :: hypre_grid
     integer*8        :: stencil
     integer*8        :: hypre_A
+    integer*8        :: hypre_solver
+    integer*8        :: hypre_precond
+    integer*8        :: hypre_b
+    integer*8        :: hypre_x
     integer          :: ilower(0:num_procs-1,2), iupper(0:num_procs-1,2)
     integer          :: ierr
     integer          :: MPI_COMM_WORLD
@@ -138,23 +211,58 @@ module model_main
 
 
     start_time = time()
-    if (RedGrav) then
-      print "(A, I0, A, I0, A, I0, A, I0, A)", &
-          "Running a reduced-gravity configuration of size ", &
-          nx, "x", ny, "x", layers, " by ", nTimeSteps, " time steps."
-    else
-      print "(A, I0, A, I0, A, I0, A, I0, A)", &
-          "Running an n-layer configuration of size ", &
-          nx, "x", ny, "x", layers, " by ", nTimeSteps, " time steps."
-    end if
-
     if (myid .eq. 0) then
+      if (RedGrav) then
+        print "(A, I0, A, I0, A, I0, A, I0, A)", &
+            "Running a reduced-gravity configuration of size ", &
+            nx_global, "x", ny_global, "x", layers, " by ", nTimeSteps, &
+            " time steps."
+      else
+        print "(A, I0, A, I0, A, I0, A, I0, A)", &
+            "Running an n-layer configuration of size ", &
+            nx_global, "x", ny_global, "x", layers, " by ", nTimeSteps, &
+            " time steps."
+      end if
+
       ! Show the domain decomposition
       print "(A)", "Domain decomposition:"
-      print "(A, I0)", 'ilower (x) = ', ilower(:,1)
-      print "(A, I0)", 'ilower (y) = ', ilower(:,2)
-      print "(A, I0)", 'iupper (x) = ', iupper(:,1)
-      print "(A, I0)", 'iupper (y) = ', iupper(:,2)
+      print "(A, *(I0, :, ' '))", 'ilower (x) = ', ilower(:,1)
+      print "(A, *(I0, :, ' '))", 'ilower (y) = ', ilower(:,2)
+      print "(A, *(I0, :, ' '))", 'iupper (x) = ', iupper(:,1)
+      print "(A, *(I0, :, ' '))", 'iupper (y) = ', iupper(:,2)
+    end if
+
+    if (tendency_algorithm .ne. 1 .and. tendency_algorithm .ne. 2) then
+      write(17, "(A, I0)") "Unknown tendency_algorithm: ", tendency_algorithm
+      call clean_stop(0, .FALSE.)
+    end if
+
+    if (adaptive_dt) then
+      if (.not. RedGrav) then
+        ! The pressure solvers are set up for a single time step
+        write(17, "(A)") "adaptive_dt needs reduced gravity physics."
+        call clean_stop(0, .FALSE.)
+      end if
+      if (dt_min .le. 0d0 .or. dt_max .lt. dt_min .or. max_cfl .le. 0d0) then
+        write(17, "(A)") "adaptive_dt needs 0 < dt_min <= dt_max "// &
+            "and max_cfl > 0."
+        call clean_stop(0, .FALSE.)
+      end if
+    end if
+
+    if (output_format .ne. 1 .and. output_format .ne. 2) then
+      write(17, "(A, I0)") "Unknown output_format: ", output_format
+      call clean_stop(0, .FALSE.)
+    end if
+
+    if (deflate_level .lt. 0 .or. deflate_level .gt. 9) then
+      write(17, "(A)") "deflate_level must be between 0 and 9."
+      call clean_stop(0, .FALSE.)
+    end if
+
+    if (keep_checkpoints .lt. 0) then
+      write(17, "(A)") "keep_checkpoints must not be negative."
+      call clean_stop(0, .FALSE.)
     end if
 
     last_report_time = start_time
@@ -171,16 +279,35 @@ module model_main
     wind_x = base_wind_x*wind_mag_time_series(1)
     wind_y = base_wind_y*wind_mag_time_series(1)
 
-    ! Initialise the diagnostic files
-    call create_diag_file(layers, 'output/diagnostic.h.csv', 'h', niter0)
-    call create_diag_file(layers, 'output/diagnostic.u.csv', 'u', niter0)
-    call create_diag_file(layers, 'output/diagnostic.v.csv', 'v', niter0)
-    if (.not. RedGrav) then
-      call create_diag_file(1, 'output/diagnostic.eta.csv', 'eta', niter0)
+    call init_checkpoints(keep_checkpoints, TS_algorithm)
+
+    if (write_output) then
+      ! Initialise the diagnostic files
+      call create_diag_file(layers, 'output/diagnostic.h.csv', 'h', &
+          niter0, h_diag_unit)
+      call create_diag_file(layers, 'output/diagnostic.u.csv', 'u', &
+          niter0, u_diag_unit)
+      call create_diag_file(layers, 'output/diagnostic.v.csv', 'v', &
+          niter0, v_diag_unit)
+      if (.not. RedGrav) then
+        call create_diag_file(1, 'output/diagnostic.eta.csv', 'eta', &
+            niter0, eta_diag_unit)
+        call create_solver_diag_file('output/diagnostic.solver.csv', niter0)
+      end if
+
+      if (adaptive_dt) then
+        call create_time_diag_file('output/diagnostic.time.csv', niter0)
+      end if
+
+      if (output_format .eq. 2) then
+        call create_netcdf_files(nx_global, ny_global, layers, dx, dy, &
+            niter0, RedGrav, DumpWind, avwrite .ne. 0, debug_level, &
+            deflate_level)
+      end if
     end if
 
     ! Initialise the average fields
-    if (avwrite .ne. 0) then
+    if (avwrite .ne. 0 .or. adaptive_dt) then
       hav = 0.0
       uav = 0.0
       vav = 0.0
@@ -188,11 +315,26 @@ module model_main
         etaav = 0.0
       end if
     end if
+    av_time = 0d0
+
+    allocate(h(0:nx+1, 0:ny+1, layers), h_new(0:nx+1, 0:ny+1, layers))
+    allocate(u(0:nx+1, 0:ny+1, layers), u_new(0:nx+1, 0:ny+1, layers))
+    allocate(v(0:nx+1, 0:ny+1, layers), v_new(0:nx+1, 0:ny+1, layers))
+    allocate(eta(0:nx+1, 0:ny+1), etanew(0:nx+1, 0:ny+1))
+    allocate(eta_prev(0:nx+1, 0:ny+1))
 
     ! initialise etanew
     etanew = 0d0
 
+    h = h_init
+    u = u_init
+    v = v_init
+    eta = eta_init
+
     call calc_boundary_masks(wetmask, hfacW, hfacE, hfacS, hfacN, nx, ny)
+    ! List the points for the kernels and the SOR solvers to iterate
+    ! over. The debug output includes the land, so keep it then.
+    call calc_wet_spans(wetmask, debug_level .lt. 4, nx, ny)
 
     call apply_boundary_conditions(u, hfacW, wetmask, nx, ny, layers)
     call apply_boundary_conditions(v, hfacS, wetmask, nx, ny, layers)
@@ -203,20 +345,73 @@ module model_main
       ! a = derivatives of the depth field
         call calc_A_matrix(a, depth, g_vec(1), dx, dy, nx, ny, freesurfFac, dt, &
             hfacW, hfacE, hfacS, hfacN)
+      ! Only red-black SOR and split-explicit subcycling work on a
+      ! single tile. The other solvers are given the whole domain.
+      allocate(a_global(5, nx_global, ny_global))
+      call calc_global_A_matrix(a_global, depth, g_vec(1), dx, dy, nx, ny, &
+          freesurfFac, dt, hfacW, hfacE, hfacS, hfacN)
 
 #ifndef useExtSolver
       ! Calculate the spectral radius of the grid for use by the
       ! successive over-relaxation scheme
-      rjac = (cos(pi/real(nx))*dy**2+cos(pi/real(ny))*dx**2) &
+      rjac = (cos(pi/real(nx_global))*dy**2+cos(pi/real(ny_global))*dx**2) &
              /(dx**2+dy**2)
       ! If peridodic boundary conditions are ever implemented, then pi ->
       ! 2*pi in this calculation
+
+      allocate(wetmask_global(0:nx_global+1, 0:ny_global+1))
+      call gather_tiles(wetmask_global, wetmask, nx, ny, 1)
+
+      if (solver_algorithm .eq. 4) then
+        call create_spectral_plan(fft, a_global, wetmask_global, &
+            nx_global, ny_global)
+        if (myid .ne. 0) then
+          ! only the first process reports the choice
+        else if (fft%usable) then
+          print "(A)", "Using the FFT pressure solver."
+        else
+          print "(A)", "The FFT pressure solver needs a flat bottom and a "// &
+              "rectangular or periodic basin. Using multigrid instead."
+        end if
+      end if
+
+      if (solver_algorithm .eq. 3 .or. &
+          (solver_algorithm .eq. 4 .and. .not. fft%usable)) then
+        ! A is fixed for the whole run, so build the multigrid levels once
+        call create_multigrid_hierarchy(mg_levels, a_global, wetmask_global, &
+            nx_global, ny_global)
+      end if
+
+      if (num_procs .gt. 1 .and. myid .eq. 0 .and. &
+          solver_algorithm .ne. 2 .and. solver_algorithm .ne. 5) then
+        write(17, "(A, I0, A)") 'Warning: solver_algorithm ', &
+            solver_algorithm, ' gathers the whole domain onto every '// &
+            'process at each time step. Use 2 or 5 to solve on the tiles.'
+      end if
 #else
       ! use the external pressure solver
       call create_Hypre_A_matrix(MPI_COMM_WORLD, hypre_grid, hypre_A, &
             a, nx, ny, ierr)
+      ! A is fixed for the whole run, so set the solver up once
+      call create_Hypre_solver(MPI_COMM_WORLD, hypre_grid, hypre_A, &
+            hypre_solver, hypre_precond, hypre_b, hypre_x, maxits, eps, ierr)
 #endif
 
+      substeps = 0
+      if (solver_algorithm .eq. 5) then
+        if (freesurfFac .eq. 0d0) then
+          write(17, "(A)") "Split-explicit subcycling needs a free "// &
+              "surface, so freesurfFac must not be zero."
+          call clean_stop(0, .FALSE.)
+        end if
+        call calc_barotropic_substeps(substeps, barotropic_substeps, &
+            depth, wetmask, g_vec(1), dx, dy, dt, nx, ny)
+        if (myid .eq. 0) then
+          print "(A, I0, A)", "Using split-explicit subcycling with ", &
+              substeps, " barotropic substeps per time step."
+        end if
+      end if
+
       ! Check that the supplied free surface anomaly and layer
       ! thicknesses are consistent with the supplied depth field.
       ! If they are not, then scale the layer thicknesses to make
@@ -228,13 +423,18 @@ module model_main
     !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
     !!!  Initialisation of the model STARTS HERE                            !!!
     !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+    ! The tendency history starts in order, both when it is calculated
+    ! and when it is read from a checkpoint
+    AB_slot = (/ (i, i = 1, AB_order) /)
+
     if (niter0 .eq. 0) then
 
       n = 0
       call initialise_tendencies(dhdt, dudt, dvdt, h, u, v, depth, &
           dx, dy, dt, wetmask, hfacW, hfacE, hfacN, hfacS, fu, fv, &
           au, ar, botDrag, kh, kv, slip, &
-          RedGrav, hAdvecScheme, AB_order, g_vec, rho0, wind_x, wind_y, &
+          RedGrav, hAdvecScheme, tendency_algorithm, &
+          AB_order, g_vec, rho0, wind_x, wind_y, &
           RelativeWind, Cd, &
           spongeHTimeScale, spongeH, &
           spongeUTimeScale, spongeU, &
@@ -245,10 +445,46 @@ module model_main
       n = niter0
 
       call load_checkpoint_files(dhdt, dudt, dvdt, h, u, v, eta, &
-            RedGrav, niter0, nx, ny, layers, AB_order)
+            checkpoint_time, checkpoint_dt, dt, RedGrav, niter0, &
+            nx, ny, layers, AB_order)
+
+    end if
 
+    dt_step = dt
+    dt_history = dt
+    AB_weights = 0d0
+    cfl = 0d0
+    landing = .false.
+    if (adaptive_dt .and. niter0 .ne. 0) then
+      model_time = checkpoint_time
+      dt_history = checkpoint_dt
+      dt_step = dt_history(1)
+    else
+      model_time = dble(niter0)*dt
+    end if
+    ! A run with a varying time step covers the same model time as
+    ! nTimeSteps steps of dt, and stops when it gets there rather than
+    ! after a number of steps
+    start_model_time = model_time
+    end_model_time = model_time + dble(nTimeSteps)*dt
+    next_dump_time = next_output_time(model_time, dumpFreq)
+    next_av_time = next_output_time(model_time, avFreq)
+    next_checkpoint_time = next_output_time(model_time, checkpointFreq)
+    next_diag_time = next_output_time(model_time, diagFreq)
+    if (adaptive_dt) then
+      last_step = huge(last_step) - 1
+      av_weight = 0d0
+    else
+      last_step = niter0 + nTimeSteps
+      av_weight = 1d0
     end if
 
+    ! There is no older solution to extrapolate from yet
+    eta_prev = eta
+    total_solver_iterations = 0
+    max_solver_iterations = 0
+    total_solver_time = 0d0
+
     ! Now the model is ready to start.
     ! - We have h, u, v at the zeroth time step, and the tendencies at
     !   two older time steps.
@@ -256,7 +492,9 @@ module model_main
     !   before solving for the fields at the next time step.
 
     cur_time = time()
-    if (cur_time - start_time .eq. 1) then
+    if (myid .ne. 0) then
+      ! only the first process reports progress
+    else if (cur_time - start_time .eq. 1) then
       print "(A)", "Initialized in 1 second."
     else
       print "(A, I0, A)", "Initialized in " , cur_time - start_time, " seconds."
@@ -267,16 +505,40 @@ module model_main
     !!! MAIN LOOP OF THE MODEL STARTS HERE                                  !!!
     !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
 
-    do n = niter0+1, niter0+nTimeSteps
-
-      wind_x = base_wind_x*wind_mag_time_series(n-niter0)
-      wind_y = base_wind_y*wind_mag_time_series(n-niter0)
+    do n = niter0+1, last_step
+
+      if (adaptive_dt) then
+        if (model_time .ge. end_model_time) exit
+
+        ! Choose the time step from the Courant number, and shorten it
+        ! to land on the time of the next output
+        call calc_wave_rate(wave_rate, h, u, v, g_vec, dx, dy, wetmask, &
+            nx, ny, layers)
+        call choose_time_step(dt_step, wave_rate, max_cfl, dt_min, dt_max)
+        next_output = min(next_dump_time, next_av_time, &
+            next_checkpoint_time, next_diag_time, end_model_time)
+        call land_on_output_time(dt_step, landing, model_time, next_output)
+        cfl = wave_rate*dt_step
+
+        dt_history = cshift(dt_history, -1)
+        dt_history(1) = dt_step
+        call variable_AB_weights(AB_weights, dt_history, AB_order)
+
+        wind_x = base_wind_x*wind_magnitude_at(wind_mag_time_series, &
+            model_time - start_model_time, dt, nTimeSteps)
+        wind_y = base_wind_y*wind_magnitude_at(wind_mag_time_series, &
+            model_time - start_model_time, dt, nTimeSteps)
+      else
+        wind_x = base_wind_x*wind_mag_time_series(n-niter0)
+        wind_y = base_wind_y*wind_mag_time_series(n-niter0)
+      end if
 
-      call timestep(h_new, u_new, v_new, dhdt, dudt, dvdt, &
-          h, u, v, depth, &
-          dx, dy, dt, wetmask, hfacW, hfacE, hfacN, hfacS, fu, fv, &
+      call timestep(h_new, u_new, v_new, dhdt, dudt, dvdt, AB_slot, &
+          adaptive_dt, AB_weights, h, u, v, depth, &
+          dx, dy, dt_step, wetmask, hfacW, hfacE, hfacN, hfacS, fu, fv, &
           au, ar, botDrag, kh, kv, slip, &
-          RedGrav, hAdvecScheme, TS_algorithm, AB_order, &
+          RedGrav, hAdvecScheme, tendency_algorithm, &
+          TS_algorithm, AB_order, &
           g_vec, rho0, wind_x, wind_y, &
           RelativeWind, Cd, &
           spongeHTimeScale, spongeH, &
@@ -284,18 +546,40 @@ module model_main
           spongeVTimeScale, spongeV, &
           nx, ny, layers, n, debug_level)
 
+      ! The tendencies just calculated become the previous ones, and
+      ! the oldest are overwritten on the next time step
+      call cycle_AB_slots(AB_slot, AB_order)
+
       ! Apply the boundary conditions
       call apply_boundary_conditions(u_new, hfacW, wetmask, nx, ny, layers)
       call apply_boundary_conditions(v_new, hfacS, wetmask, nx, ny, layers)
 
       ! Do the isopycnal layer physics
       if (.not. RedGrav) then
-        call barotropic_correction(h_new, u_new, v_new, eta, etanew, depth, a, &
-            dx, dy, wetmask, hfacW, hfacS, dt, &
+        ! The barotropic flow through the edges of the tile needs the
+        ! halos of the new state
+        call update_halos_3D(u_new, nx, ny, layers)
+        call update_halos_3D(v_new, nx, ny, layers)
+        call update_halos_3D(h_new, nx, ny, layers)
+
+        call barotropic_correction(h_new, u_new, v_new, eta, eta_prev, etanew, &
+            depth, a, a_global, dx, dy, wetmask, hfacW, hfacS, dt, &
+            solver_algorithm, solver_first_guess, solver_iterations, &
+            solver_initial_residual, solver_guess_residual, &
+            solver_final_residual, solver_time, &
+            mg_levels, fft, substeps, &
             maxits, eps, rjac, freesurfFac, thickness_error, &
             debug_level, g_vec, nx, ny, layers, n, &
             MPI_COMM_WORLD, myid, num_procs, ilower, iupper, &
-            hypre_grid, hypre_A, ierr)
+            hypre_grid, hypre_A, hypre_solver, hypre_b, hypre_x, ierr)
+        total_solver_iterations = total_solver_iterations + solver_iterations
+        max_solver_iterations = max(max_solver_iterations, solver_iterations)
+        total_solver_time = total_solver_time + solver_time
+        if (write_output) then
+          call write_solver_diag_output(n, solver_iterations, &
+              solver_initial_residual, solver_final_residual, solver_time, &
+              solver_guess_residual)
+        end if
 
       end if
 
@@ -303,46 +587,95 @@ module model_main
       ! Stop layers from getting too thin
       call enforce_minimum_layer_thickness(h_new, hmin, nx, ny, layers, n)
 
-      ! Wrap fields around for periodic simulations
-      call wrap_fields_3D(u_new, nx, ny, layers)
-      call wrap_fields_3D(v_new, nx, ny, layers)
-      call wrap_fields_3D(h_new, nx, ny, layers)
-      if (.not. RedGrav) then
-        call wrap_fields_2D(etanew, nx, ny)
-      end if    
-
-      ! Apply the boundary conditions
-      call apply_boundary_conditions(u_new, hfacW, wetmask, nx, ny, layers)
-      call apply_boundary_conditions(v_new, hfacS, wetmask, nx, ny, layers)
+      ! Fill the halos from the neighbouring tiles. The boundary
+      ! conditions have already been applied, and the halos of the
+      ! masks match the tiles they come from, so they hold here too.
+      ! barotropic_correction fills the halo of etanew.
+      call update_halos_3D(u_new, nx, ny, layers)
+      call update_halos_3D(v_new, nx, ny, layers)
+      call update_halos_3D(h_new, nx, ny, layers)
+
+      if (adaptive_dt) then
+        ! Outputs are due when the model time reaches them, and it
+        ! lands on them exactly
+        if (landing) then
+          model_time = next_output
+        else
+          model_time = model_time + dt_step
+        end if
+        dump_snapshot = model_time .ge. next_dump_time
+        dump_average = model_time .ge. next_av_time
+        dump_checkpoint = model_time .ge. next_checkpoint_time
+        dump_diagnostics = model_time .ge. next_diag_time
+        if (dump_snapshot) then
+          next_dump_time = next_output_time(model_time, dumpFreq)
+        end if
+        if (dump_average) then
+          next_av_time = next_output_time(model_time, avFreq)
+        end if
+        if (dump_checkpoint) then
+          next_checkpoint_time = next_output_time(model_time, checkpointFreq)
+        end if
+        if (dump_diagnostics) then
+          next_diag_time = next_output_time(model_time, diagFreq)
+        end if
+        ! the averages are weighted by the length of each step
+        av_weight = dt_step
+        if (write_output) then
+          call write_time_diag_output(n, model_time, dt_step, cfl)
+        end if
+      else
+        dump_snapshot = mod(n-1, nwrite) .eq. 0
+        ! There is no average after the first time step, so it starts
+        ! from the second
+        dump_average = avwrite .ne. 0 .and. n .ne. 1
+        if (dump_average) then
+          dump_average = mod(n-1, avwrite) .eq. 0
+        end if
+        dump_checkpoint = checkpointwrite .ne. 0
+        if (dump_checkpoint) then
+          dump_checkpoint = mod(n-1, checkpointwrite) .eq. 0
+        end if
+        dump_diagnostics = diagwrite .ne. 0
+        if (dump_diagnostics) then
+          dump_diagnostics = mod(n-1, diagwrite) .eq. 0
+        end if
+      end if
 
       ! Accumulate average fields
-      if (avwrite .ne. 0) then
-        hav = hav + h_new
-        uav = uav + u_new
-        vav = vav + v_new
+      if ((avwrite .ne. 0 .and. n .ne. 1) .or. &
+          (adaptive_dt .and. avFreq .gt. 0d0)) then
+        hav = hav + av_weight*h_new
+        uav = uav + av_weight*u_new
+        vav = vav + av_weight*v_new
         if (.not. RedGrav) then
           etaav = eta + etanew
         end if
+        av_time = av_time + av_weight
       end if
 
       ! Shuffle arrays: old -> very old,  present -> old, new -> present
-      ! Height and velocity fields
-      h = h_new
-      u = u_new
-      v = v_new
+      ! by swapping the buffers, which copies nothing. The new state is
+      ! written in full on the next time step.
+      call swap_fields_3D(h, h_new)
+      call swap_fields_3D(u, u_new)
+      call swap_fields_3D(v, v_new)
       if (.not. RedGrav) then
-        eta = etanew
+        call rotate_fields_2D(eta_prev, eta, etanew)
       end if
 
-      call maybe_dump_output(h, hav, u, uav, v, vav, eta, etaav, &
-          dudt, dvdt, dhdt, AB_order, &
-          wind_x, wind_y, nx, ny, layers, &
-          n, nwrite, avwrite, checkpointwrite, diagwrite, &
-          RedGrav, DumpWind, debug_level)
+      if (write_output) then
+        call maybe_dump_output(h, hav, u, uav, v, vav, eta, etaav, av_time, &
+            dudt, dvdt, dhdt, AB_order, AB_slot, &
+            wind_x, wind_y, wetmask, nx, ny, layers, &
+            n, model_time, dt_history, &
+            dump_snapshot, dump_average, dump_checkpoint, dump_diagnostics, &
+            RedGrav, DumpWind, debug_level)
+      end if
 
 
       cur_time = time()
-      if (cur_time - last_report_time > 3) then
+      if (cur_time - last_report_time > 3 .and. myid .eq. 0) then
         ! Three seconds passed since last report
         last_report_time = cur_time
         print "(A, I0, A, I0, A)", "Completed time step ", &
@@ -352,17 +685,91 @@ module model_main
     end do
 
     cur_time = time()
-    print "(A, I0, A, I0, A)", "Run finished at time step ", &
-        n, ", in ", cur_time - start_time, " seconds."
+    if (myid .eq. 0) then
+      print "(A, I0, A, I0, A)", "Run finished at time step ", &
+          n, ", in ", cur_time - start_time, " seconds."
+      if (adaptive_dt .and. n .gt. niter0+1) then
+        print "(A, G0.4, A)", "Average time step: ", &
+            (model_time - start_model_time)/dble(n - niter0 - 1), " seconds."
+      end if
+    end if
+    if (.not. RedGrav .and. nTimeSteps .gt. 0 .and. myid .eq. 0) then
+      print "(A, G0.4)", "Average pressure solver iterations per time step: ", &
+          dble(total_solver_iterations)/dble(nTimeSteps)
+      print "(A, I0)", "Maximum pressure solver iterations in a time step: ", &
+          max_solver_iterations
+      print "(A, G0.4, A, G0.4, A)", "Time spent in the pressure solver: ", &
+          total_solver_time, " seconds, ", &
+          1d3*total_solver_time/dble(nTimeSteps), " ms per time step"
+    end if
 
-    ! save checkpoint at end of every simulation
-    call maybe_dump_output(h, hav, u, uav, v, vav, eta, etaav, &
-        dudt, dvdt, dhdt, AB_order, &
-        wind_x, wind_y, nx, ny, layers, &
-        n, n, n, n-1, n, &
-        RedGrav, DumpWind, 0)
+    if (write_output) then
+      if (.not. RedGrav) then
+        call close_solver_diag_file()
+      end if
+
+      ! save checkpoint at end of every simulation
+      call maybe_dump_output(h, hav, u, uav, v, vav, eta, etaav, av_time, &
+          dudt, dvdt, dhdt, AB_order, AB_slot, &
+          wind_x, wind_y, wetmask, nx, ny, layers, &
+          n, model_time, dt_history, .false., .false., .true., .false., &
+          RedGrav, DumpWind, 0)
+      call flush_output()
+      call close_netcdf_files()
+      call close_diag_files(RedGrav)
+      if (adaptive_dt) then
+        call close_time_diag_file()
+      end if
+    end if
+
+    if (present(h_final)) h_final = h
+    if (present(u_final)) u_final = u
+    if (present(v_final)) v_final = v
+    if (present(eta_final)) eta_final = eta
+
+#ifdef useExtSolver
+    if (.not. RedGrav) then
+      call destroy_Hypre_solver(hypre_solver, hypre_precond, &
+          hypre_b, hypre_x, ierr)
+    end if
+#endif
 
     return
   end subroutine model_run
 
+  ! ---------------------------------------------------------------------------
+  !> Exchange the memory of two fields
+
+  subroutine swap_fields_3D(a, b)
+    implicit none
+
+    real(wp), allocatable, intent(inout) :: a(:,:,:), b(:,:,:)
+
+    real(wp), allocatable :: tmp(:,:,:)
+
+    call move_alloc(a, tmp)
+    call move_alloc(b, a)
+    call move_alloc(tmp, b)
+
+    return
+  end subroutine swap_fields_3D
+
+  ! ---------------------------------------------------------------------------
+  !> Move b into a and c into b, and reuse the memory of a for c
+
+  subroutine rotate_fields_2D(a, b, c)
+    implicit none
+
+    double precision, allocatable, intent(inout) :: a(:,:), b(:,:), c(:,:)
+
+    double precision, allocatable :: tmp(:,:)
+
+    call move_alloc(a, tmp)
+    call move_alloc(b, a)
+    call move_alloc(c, b)
+    call move_alloc(tmp, c)
+
+    return
+  end subroutine rotate_fields_2D
+
 end module model_main
@@ -0,0 +1,214 @@
+module model_setup
+  use model_main
+  use declarations
+  use mpi
+
+  implicit none
+
+  contains
+
+  ! ---------------------------------------------------------------------------
+  !> Divide the domain among the MPI processes, and allocate the fields
+  !! of the whole domain. The parameters must have been read.
+
+  subroutine init_model()
+    implicit none
+
+    ! set timestepping order for linear multi-step methods
+    ! based on TS_algorithm
+    call set_AB_order(TS_algorithm, AB_order)
+
+    call MPI_COMM_RANK(MPI_COMM_WORLD, myid, ierr)
+    call MPI_COMM_SIZE(MPI_COMM_WORLD, num_procs, ierr)
+
+    if (num_procs .ne. nProcX * nProcY) then
+      if (myid .eq. 0) then
+         write(17, "(A)") "number of processors in run command must equal nProcX * nProcY - fix this and try again"
+         write(17, "(A, I0)") 'num_procs = ', num_procs
+         write(17, "(A, I0)") 'nProcX = ', nProcX
+         write(17, "(A, I0)") 'nProcY = ', nProcY
+      end if
+      call clean_stop(0, .FALSE.)
+    end if
+
+    if (nx .lt. nProcX .or. ny .lt. nProcY) then
+      if (myid .eq. 0) then
+         write(17, "(A)") "nProcX and nProcY must not be larger than nx and ny"
+      end if
+      call clean_stop(0, .FALSE.)
+    end if
+
+    ! myid starts at zero, so index these variables from zero.
+    ! i__(:,1) = indicies for x locations
+    ! i__(:,2) = indicies for y locations
+    allocate(ilower(0:num_procs-1, 2))
+    allocate(iupper(0:num_procs-1, 2))
+
+    ! process i + j*nProcX owns tile (i, j), counting from the south west
+    do j = 0, nProcY - 1
+      do i = 0, nProcX - 1
+        ilower(i + j*nProcX, 1) = i*nx/nProcX + 1
+        iupper(i + j*nProcX, 1) = (i+1)*nx/nProcX
+        ilower(i + j*nProcX, 2) = j*ny/nProcY + 1
+        iupper(i + j*nProcX, 2) = (j+1)*ny/nProcY
+      end do
+    end do
+
+    call init_decomposition(MPI_COMM_WORLD, myid, num_procs, nProcX, nProcY, &
+        periodicX, periodicY, ilower, iupper, nx, ny)
+    nx_tile = iupper(myid, 1) - ilower(myid, 1) + 1
+    ny_tile = iupper(myid, 2) - ilower(myid, 2) + 1
+
+#ifdef useExtSolver
+    call create_Hypre_grid(MPI_COMM_WORLD, hypre_grid, ilower, iupper, &
+            num_procs, myid, nx, ny, ierr)
+#endif
+
+    allocate(h(0:nx+1, 0:ny+1, layers))
+    allocate(u(0:nx+1, 0:ny+1, layers))
+    allocate(v(0:nx+1, 0:ny+1, layers))
+    allocate(eta(0:nx+1, 0:ny+1))
+    allocate(depth(0:nx+1, 0:ny+1))
+
+    allocate(wetmask(0:nx+1, 0:ny+1))
+    allocate(fu(0:nx+1, 0:ny+1))
+    allocate(fv(0:nx+1, 0:ny+1))
+
+    allocate(zeros(layers))
+
+    allocate(base_wind_x(0:nx+1, 0:ny+1))
+    allocate(base_wind_y(0:nx+1, 0:ny+1))
+    allocate(wind_mag_time_series(nTimeSteps))
+
+    allocate(spongeHTimeScale(0:nx+1, 0:ny+1, layers))
+    allocate(spongeUTimeScale(0:nx+1, 0:ny+1, layers))
+    allocate(spongeVTimeScale(0:nx+1, 0:ny+1, layers))
+    allocate(spongeH(0:nx+1, 0:ny+1, layers))
+    allocate(spongeU(0:nx+1, 0:ny+1, layers))
+    allocate(spongeV(0:nx+1, 0:ny+1, layers))
+
+    ! Zero vector - for internal use only
+    zeros = 0d0
+
+    return
+  end subroutine init_model
+
+  ! ---------------------------------------------------------------------------
+  !> Read in the fields of the whole domain from the input files
+
+  subroutine read_inputs()
+    implicit none
+
+    call read_input_fileU(initUfile, u, 0.d0, nx, ny, layers)
+    call read_input_fileV(initVfile, v, 0.d0, nx, ny, layers)
+    call read_input_fileH(initHfile, h, hmean, nx, ny, layers)
+
+    call read_input_fileU(fUfile, fu, 0.d0, nx, ny, 1)
+    call read_input_fileV(fVfile, fv, 0.d0, nx, ny, 1)
+
+    call read_input_fileU(zonalWindFile, base_wind_x, 0.d0, nx, ny, 1)
+    call read_input_fileV(meridionalWindFile, base_wind_y, 0.d0, nx, ny, 1)
+
+    call read_input_file_time_series(wind_mag_time_series_file, &
+        wind_mag_time_series, 1d0, nTimeSteps)
+
+    call read_input_fileH(spongeHTimeScaleFile, spongeHTimeScale, &
+        zeros, nx, ny, layers)
+    call read_input_fileH(spongeHfile, spongeH, hmean, nx, ny, layers)
+    call read_input_fileU(spongeUTimeScaleFile, spongeUTimeScale, &
+        0.d0, nx, ny, layers)
+    call read_input_fileU(spongeUfile, spongeU, 0.d0, nx, ny, layers)
+    call read_input_fileV(spongeVTimeScaleFile, spongeVTimeScale, &
+        0.d0, nx, ny, layers)
+    call read_input_fileV(spongeVfile, spongeV, 0.d0, nx, ny, layers)
+    call read_input_fileH_2D(wetMaskFile, wetmask, 1.d0, nx, ny)
+
+    if (.not. RedGrav) then
+      call read_input_fileH_2D(depthFile, depth, H0, nx, ny)
+      call read_input_fileH_2D(initEtaFile, eta, 0.d0, nx, ny)
+    end if
+
+    return
+  end subroutine read_inputs
+
+  ! ---------------------------------------------------------------------------
+  !> Run the model from the fields of the whole domain. A run that
+  !! writes no output can hand back the final state of this process's
+  !! tile instead.
+
+  subroutine run_model(write_output, h_final, u_final, v_final, eta_final)
+    implicit none
+
+    logical, intent(in) :: write_output
+    double precision, intent(out), optional :: &
+        h_final(0:nx_tile+1, 0:ny_tile+1, layers), &
+        u_final(0:nx_tile+1, 0:ny_tile+1, layers), &
+        v_final(0:nx_tile+1, 0:ny_tile+1, layers), &
+        eta_final(0:nx_tile+1, 0:ny_tile+1)
+
+    call close_domain_edges(wetmask, nx, ny)
+
+    if (.not. RedGrav) then
+      ! Check that depth is positive - it must be greater than zero
+      if (minval(depth) .lt. 0) then
+        write(17, "(A)") "Depths must be positive."
+        call clean_stop(0, .FALSE.)
+      end if
+    end if
+
+    ! Every process has the whole domain. Keep only the tile that
+    ! this process steps forward.
+    call restrict_to_tile_3D(h, nx_tile, ny_tile, layers)
+    call restrict_to_tile_3D(u, nx_tile, ny_tile, layers)
+    call restrict_to_tile_3D(v, nx_tile, ny_tile, layers)
+    call restrict_to_tile_2D(eta, nx_tile, ny_tile)
+    call restrict_to_tile_2D(depth, nx_tile, ny_tile)
+    call restrict_to_tile_2D(wetmask, nx_tile, ny_tile)
+    call restrict_to_tile_2D(fu, nx_tile, ny_tile)
+    call restrict_to_tile_2D(fv, nx_tile, ny_tile)
+    call restrict_to_tile_2D(base_wind_x, nx_tile, ny_tile)
+    call restrict_to_tile_2D(base_wind_y, nx_tile, ny_tile)
+    call restrict_to_tile_3D(spongeHTimeScale, nx_tile, ny_tile, layers)
+    call restrict_to_tile_3D(spongeUTimeScale, nx_tile, ny_tile, layers)
+    call restrict_to_tile_3D(spongeVTimeScale, nx_tile, ny_tile, layers)
+    call restrict_to_tile_3D(spongeH, nx_tile, ny_tile, layers)
+    call restrict_to_tile_3D(spongeU, nx_tile, ny_tile, layers)
+    call restrict_to_tile_3D(spongeV, nx_tile, ny_tile, layers)
+
+    call model_run(h, u, v, eta, depth, dx, dy, wetmask, fu, fv, &
+        dt, au, ar, botDrag, kh, kv, slip, hmin, niter0, nTimeSteps, &
+        dumpFreq, avFreq, checkpointFreq, diagFreq, keep_checkpoints, &
+        output_format, deflate_level, &
+        adaptive_dt, dt_min, dt_max, max_cfl, &
+        solver_algorithm, solver_first_guess, barotropic_substeps, &
+        maxits, eps, freesurfFac, thickness_error, &
+        debug_level, g_vec, rho0, &
+        base_wind_x, base_wind_y, wind_mag_time_series, &
+        spongeHTimeScale, spongeUTimeScale, spongeVTimeScale, &
+        spongeH, spongeU, spongeV, &
+        nx_tile, ny_tile, layers, RedGrav, hAdvecScheme, tendency_algorithm, &
+        TS_algorithm, &
+        AB_order, DumpWind, RelativeWind, Cd, &
+        MPI_COMM_WORLD, myid, num_procs, ilower, iupper, &
+        hypre_grid, write_output, h_final, u_final, v_final, eta_final)
+
+    return
+  end subroutine run_model
+
+  ! ---------------------------------------------------------------------------
+  !> Free the fields allocated by init_model, so that another run can
+  !! be set up in the same process
+
+  subroutine release_model()
+    implicit none
+
+    deallocate(ilower, iupper)
+    deallocate(h, u, v, eta, depth, wetmask, fu, fv, zeros)
+    deallocate(base_wind_x, base_wind_y, wind_mag_time_series)
+    deallocate(spongeHTimeScale, spongeUTimeScale, spongeVTimeScale)
+    deallocate(spongeH, spongeU, spongeV)
+
+    return
+  end subroutine release_model
+
+end module model_setup
@@ -0,0 +1,482 @@
+module multigrid
+  use boundaries
+
+  implicit none
+
+  !> One level of the multigrid hierarchy. Each level stores a five
+  !! point operator in the same layout as the `a` array built by
+  !! calc_A_matrix, along with a mask of the cells that take part in
+  !! the solve and work arrays for the V-cycle.
+  type mg_level
+    integer :: nx, ny
+    double precision, allocatable :: a(:,:,:)
+    double precision, allocatable :: mask(:,:)
+    double precision, allocatable :: x(:,:)
+    double precision, allocatable :: b(:,:)
+    double precision, allocatable :: r(:,:)
+  end type mg_level
+
+  !> Number of red-black Gauss-Seidel sweeps before and after the
+  !! coarse grid correction
+  integer, parameter :: mg_sweeps = 2
+  !> Number of symmetric sweep pairs used on the coarsest level
+  integer, parameter :: mg_coarse_sweeps = 20
+  !> Stop coarsening once a level has no more cells than this
+  integer, parameter :: mg_coarsest_size = 16
+
+  contains
+
+  ! ---------------------------------------------------------------------------
+  !> Build the multigrid hierarchy for the pressure solver. Coarse
+  !! cells are made by merging blocks of 2x2 fine cells and the coarse
+  !! operators are formed from the fine ones by the Galerkin product
+  !! (with piecewise constant interpolation), so every level keeps the
+  !! five point stencil. Dry cells are left out of the aggregates, and
+  !! couplings across the periodic boundary are carried down to the
+  !! coarse levels. Since A does not change during a run, this only
+  !! needs to be done once.
+
+  subroutine create_multigrid_hierarchy(levels, a, wetmask, nx, ny)
+    implicit none
+
+    type(mg_level), allocatable, intent(out) :: levels(:)
+    double precision, intent(in) :: a(5, nx, ny)
+    double precision, intent(in) :: wetmask(0:nx+1, 0:ny+1)
+    integer, intent(in) :: nx, ny
+
+    integer :: nlevels, l
+    integer :: mx, my
+
+    ! Count the levels
+    nlevels = 1
+    mx = nx
+    my = ny
+    do while (mx*my .gt. mg_coarsest_size)
+      mx = (mx+1)/2
+      my = (my+1)/2
+      nlevels = nlevels + 1
+    end do
+
+    allocate(levels(nlevels))
+
+    call allocate_mg_level(levels(1), nx, ny)
+    levels(1)%a = a
+    levels(1)%mask = wetmask
+    ! A wet cell that is cut off from all of its neighbours has no
+    ! equation to solve in the rigid lid case
+    where (levels(1)%a(5,:,:) .eq. 0d0) levels(1)%mask(1:nx,1:ny) = 0d0
+    call wrap_fields_2D(levels(1)%mask, nx, ny)
+
+    do l = 2, nlevels
+      call allocate_mg_level(levels(l), (levels(l-1)%nx+1)/2, &
+          (levels(l-1)%ny+1)/2)
+      call coarsen_operator(levels(l-1)%a, levels(l-1)%mask, &
+          levels(l-1)%nx, levels(l-1)%ny, &
+          levels(l)%a, levels(l)%mask, levels(l)%nx, levels(l)%ny)
+    end do
+
+    return
+  end subroutine create_multigrid_hierarchy
+
+  ! ---------------------------------------------------------------------------
+  !> Allocate the arrays for one level of the hierarchy
+
+  subroutine allocate_mg_level(level, nx, ny)
+    implicit none
+
+    type(mg_level), intent(inout) :: level
+    integer, intent(in) :: nx, ny
+
+    level%nx = nx
+    level%ny = ny
+    allocate(level%a(5, nx, ny))
+    allocate(level%mask(0:nx+1, 0:ny+1))
+    allocate(level%x(0:nx+1, 0:ny+1))
+    allocate(level%b(0:nx+1, 0:ny+1))
+    allocate(level%r(0:nx+1, 0:ny+1))
+
+    level%a = 0d0
+    level%mask = 0d0
+    level%x = 0d0
+    level%b = 0d0
+    level%r = 0d0
+
+    return
+  end subroutine allocate_mg_level
+
+  ! ---------------------------------------------------------------------------
+  !> Form the coarse operator from the fine one. Couplings between two
+  !! fine cells in the same coarse cell are added to the coarse
+  !! diagonal, and couplings that cross into a neighbouring coarse cell
+  !! are added to the matching coarse off-diagonal.
+
+  subroutine coarsen_operator(af, maskf, nxf, nyf, ac, maskc, nxc, nyc)
+    implicit none
+
+    double precision, intent(in)  :: af(5, nxf, nyf)
+    double precision, intent(in)  :: maskf(0:nxf+1, 0:nyf+1)
+    integer, intent(in) :: nxf, nyf
+    double precision, intent(out) :: ac(5, nxc, nyc)
+    double precision, intent(out) :: maskc(0:nxc+1, 0:nyc+1)
+    integer, intent(in) :: nxc, nyc
+
+    integer :: i, j, ic, jc
+    integer :: ie, iw, jn, js
+    double precision :: diag_scale(nxc, nyc)
+
+    ac = 0d0
+    maskc = 0d0
+    diag_scale = 0d0
+
+    do j = 1, nyf
+      jc = (j+1)/2
+      ! neighbouring rows, wrapped for periodicity
+      jn = mod(j, nyf) + 1
+      js = mod(j+nyf-2, nyf) + 1
+      do i = 1, nxf
+        if (maskf(i,j) .eq. 0d0) cycle
+        ic = (i+1)/2
+        ie = mod(i, nxf) + 1
+        iw = mod(i+nxf-2, nxf) + 1
+
+        maskc(ic,jc) = 1d0
+        ac(5,ic,jc) = ac(5,ic,jc) + af(5,i,j)
+        diag_scale(ic,jc) = diag_scale(ic,jc) + abs(af(5,i,j))
+
+        ! east
+        if ((ie+1)/2 .eq. ic) then
+          ac(5,ic,jc) = ac(5,ic,jc) + af(1,i,j)*maskf(ie,j)
+        else
+          ac(1,ic,jc) = ac(1,ic,jc) + af(1,i,j)*maskf(ie,j)
+        end if
+        ! north
+        if ((jn+1)/2 .eq. jc) then
+          ac(5,ic,jc) = ac(5,ic,jc) + af(2,i,j)*maskf(i,jn)
+        else
+          ac(2,ic,jc) = ac(2,ic,jc) + af(2,i,j)*maskf(i,jn)
+        end if
+        ! west
+        if ((iw+1)/2 .eq. ic) then
+          ac(5,ic,jc) = ac(5,ic,jc) + af(3,i,j)*maskf(iw,j)
+        else
+          ac(3,ic,jc) = ac(3,ic,jc) + af(3,i,j)*maskf(iw,j)
+        end if
+        ! south
+        if ((js+1)/2 .eq. jc) then
+          ac(5,ic,jc) = ac(5,ic,jc) + af(4,i,j)*maskf(i,js)
+        else
+          ac(4,ic,jc) = ac(4,ic,jc) + af(4,i,j)*maskf(i,js)
+        end if
+      end do
+    end do
+
+    ! With a rigid lid, a coarse cell that covers a whole closed basin
+    ! only sees the null space of the operator, so drop it from the
+    ! solve.
+    do jc = 1, nyc
+      do ic = 1, nxc
+        if (abs(ac(5,ic,jc)) .le. 1d-12*diag_scale(ic,jc)) then
+          maskc(ic,jc) = 0d0
+        end if
+      end do
+    end do
+
+    call wrap_fields_2D(maskc, nxc, nyc)
+
+    return
+  end subroutine coarsen_operator
+
+  ! ---------------------------------------------------------------------------
+  !> Solve A etanew = -etastar/dt**2 with the conjugate gradient method,
+  !! preconditioned by one multigrid V-cycle per iteration. The
+  !! iterations stop once the sum of the absolute residuals has fallen
+  !! by a factor of eps, as in SOR_solver.
+
+  subroutine multigrid_solver(levels, etanew, etastar, etaguess, nx, ny, dt, &
+      eps, maxits, n, iterations)
+    implicit none
+
+    type(mg_level), intent(inout) :: levels(:)
+    double precision, intent(out) :: etanew(0:nx+1, 0:ny+1)
+    double precision, intent(in)  :: etastar(0:nx+1, 0:ny+1)
+    double precision, intent(in)  :: etaguess(0:nx+1, 0:ny+1)
+    integer, intent(in) :: nx, ny
+    double precision, intent(in) :: dt
+    double precision, intent(in) :: eps
+    integer, intent(in) :: maxits, n
+    integer, intent(out) :: iterations
+
+    integer :: nit
+    double precision :: rhs(0:nx+1, 0:ny+1)
+    double precision :: res(0:nx+1, 0:ny+1)
+    double precision :: p(0:nx+1, 0:ny+1)
+    double precision :: q(0:nx+1, 0:ny+1)
+    double precision :: norm, norm0
+    double precision :: rz, rz_old, alpha, beta
+
+    rhs = -etastar/dt**2
+    ! first guess for etanew
+    etanew = etaguess*levels(1)%mask
+
+    ! The stopping criterion is relative to the residual of etastar, as
+    ! in SOR_solver, so that a better first guess means fewer iterations.
+    call mg_residual(levels(1)%a, etastar, rhs, res, levels(1)%mask, nx, ny)
+    norm0 = sum(abs(res(1:nx,1:ny)))
+
+    call mg_residual(levels(1)%a, etanew, rhs, res, levels(1)%mask, nx, ny)
+    iterations = 0
+    if (norm0 .eq. 0d0 .or. sum(abs(res(1:nx,1:ny))) .lt. eps*norm0) then
+      return
+    end if
+
+    call mg_precondition(levels, res, p, nx, ny)
+    rz = sum(res(1:nx,1:ny)*p(1:nx,1:ny))
+
+    do nit = 1, maxits
+      call mg_apply_operator(levels(1)%a, p, q, levels(1)%mask, nx, ny)
+      alpha = rz/sum(p(1:nx,1:ny)*q(1:nx,1:ny))
+
+      etanew = etanew + alpha*p
+      res = res - alpha*q
+
+      norm = sum(abs(res(1:nx,1:ny)))
+      if (norm .lt. eps*norm0) then
+        call wrap_fields_2D(etanew, nx, ny)
+        iterations = nit
+        return
+      end if
+
+      ! q holds the preconditioned residual from here on
+      call mg_precondition(levels, res, q, nx, ny)
+      rz_old = rz
+      rz = sum(res(1:nx,1:ny)*q(1:nx,1:ny))
+      beta = rz/rz_old
+      p = q + beta*p
+    end do
+
+    call wrap_fields_2D(etanew, nx, ny)
+
+    iterations = maxits
+    write(17, "(A, I0)") &
+        'Warning: maximum multigrid iterations exceeded at time step ', n
+
+    return
+  end subroutine multigrid_solver
+
+  ! ---------------------------------------------------------------------------
+  !> Apply one V-cycle, starting from zero, to approximately solve
+  !! A z = res on the finest level
+
+  subroutine mg_precondition(levels, res, z, nx, ny)
+    implicit none
+
+    type(mg_level), intent(inout) :: levels(:)
+    double precision, intent(in)  :: res(0:nx+1, 0:ny+1)
+    double precision, intent(out) :: z(0:nx+1, 0:ny+1)
+    integer, intent(in) :: nx, ny
+
+    levels(1)%b = res
+    call mg_v_cycle(levels, 1)
+    z = levels(1)%x
+
+    return
+  end subroutine mg_precondition
+
+  ! ---------------------------------------------------------------------------
+  !> Multigrid V-cycle on level l, with levels(l)%b as the right hand
+  !! side and zero as the initial guess. The post-smoothing sweeps run
+  !! the colours in the opposite order to the pre-smoothing sweeps, so
+  !! the cycle is a symmetric preconditioner.
+
+  recursive subroutine mg_v_cycle(levels, l)
+    implicit none
+
+    type(mg_level), intent(inout) :: levels(:)
+    integer, intent(in) :: l
+
+    integer :: sweep
+
+    levels(l)%x = 0d0
+
+    if (l .eq. size(levels)) then
+      ! coarsest level: smooth until the error is small
+      do sweep = 1, mg_coarse_sweeps
+        call mg_smooth(levels(l)%a, levels(l)%x, levels(l)%b, &
+            levels(l)%mask, levels(l)%nx, levels(l)%ny, 0)
+      end do
+      do sweep = 1, mg_coarse_sweeps
+        call mg_smooth(levels(l)%a, levels(l)%x, levels(l)%b, &
+            levels(l)%mask, levels(l)%nx, levels(l)%ny, 1)
+      end do
+      return
+    end if
+
+    do sweep = 1, mg_sweeps
+      call mg_smooth(levels(l)%a, levels(l)%x, levels(l)%b, &
+          levels(l)%mask, levels(l)%nx, levels(l)%ny, 0)
+    end do
+
+    call mg_residual(levels(l)%a, levels(l)%x, levels(l)%b, levels(l)%r, &
+        levels(l)%mask, levels(l)%nx, levels(l)%ny)
+    call mg_restrict(levels(l)%r, levels(l)%mask, levels(l)%nx, &
+        levels(l)%ny, levels(l+1)%b, levels(l+1)%nx, levels(l+1)%ny)
+
+    call mg_v_cycle(levels, l+1)
+
+    call mg_prolong(levels(l+1)%x, levels(l+1)%nx, levels(l+1)%ny, &
+        levels(l)%x, levels(l)%mask, levels(l)%nx, levels(l)%ny)
+
+    do sweep = 1, mg_sweeps
+      call mg_smooth(levels(l)%a, levels(l)%x, levels(l)%b, &
+          levels(l)%mask, levels(l)%nx, levels(l)%ny, 1)
+    end do
+
+    return
+  end subroutine mg_v_cycle
+
+  ! ---------------------------------------------------------------------------
+  !> One red-black Gauss-Seidel sweep over the cells included in the
+  !! solve. first_colour selects which colour is updated first.
+
+  subroutine mg_smooth(a, x, b, mask, nx, ny, first_colour)
+    implicit none
+
+    double precision, intent(in)    :: a(5, nx, ny)
+    double precision, intent(inout) :: x(0:nx+1, 0:ny+1)
+    double precision, intent(in)    :: b(0:nx+1, 0:ny+1)
+    double precision, intent(in)    :: mask(0:nx+1, 0:ny+1)
+    integer, intent(in) :: nx, ny
+    integer, intent(in) :: first_colour
+
+    integer :: i, j, k, colour
+
+    do k = 0, 1
+      colour = mod(first_colour+k, 2)
+      !$omp parallel do private(i)
+      do j = 1, ny
+        do i = 1 + mod(j+1+colour, 2), nx, 2
+          if (mask(i,j) .ne. 0d0) then
+            x(i,j) = x(i,j) - ( &
+                a(1,i,j)*x(i+1,j) &
+                + a(2,i,j)*x(i,j+1) &
+                + a(3,i,j)*x(i-1,j) &
+                + a(4,i,j)*x(i,j-1) &
+                + a(5,i,j)*x(i,j) &
+                - b(i,j))/a(5,i,j)
+          end if
+        end do
+      end do
+      !$omp end parallel do
+      call wrap_fields_2D(x, nx, ny)
+    end do
+
+    return
+  end subroutine mg_smooth
+
+  ! ---------------------------------------------------------------------------
+  !> Calculate y = A x over the cells included in the solve. x must
+  !! have its halo filled.
+
+  subroutine mg_apply_operator(a, x, y, mask, nx, ny)
+    implicit none
+
+    double precision, intent(in)  :: a(5, nx, ny)
+    double precision, intent(in)  :: x(0:nx+1, 0:ny+1)
+    double precision, intent(out) :: y(0:nx+1, 0:ny+1)
+    double precision, intent(in)  :: mask(0:nx+1, 0:ny+1)
+    integer, intent(in) :: nx, ny
+
+    integer :: i, j
+
+    y = 0d0
+
+    !$omp parallel do private(i)
+    do j = 1, ny
+      do i = 1, nx
+        y(i,j) = mask(i,j)*( &
+            a(1,i,j)*x(i+1,j) &
+            + a(2,i,j)*x(i,j+1) &
+            + a(3,i,j)*x(i-1,j) &
+            + a(4,i,j)*x(i,j-1) &
+            + a(5,i,j)*x(i,j))
+      end do
+    end do
+    !$omp end parallel do
+
+    call wrap_fields_2D(y, nx, ny)
+
+    return
+  end subroutine mg_apply_operator
+
+  ! ---------------------------------------------------------------------------
+  !> Calculate res = b - A x over the cells included in the solve
+
+  subroutine mg_residual(a, x, b, res, mask, nx, ny)
+    implicit none
+
+    double precision, intent(in)  :: a(5, nx, ny)
+    double precision, intent(in)  :: x(0:nx+1, 0:ny+1)
+    double precision, intent(in)  :: b(0:nx+1, 0:ny+1)
+    double precision, intent(out) :: res(0:nx+1, 0:ny+1)
+    double precision, intent(in)  :: mask(0:nx+1, 0:ny+1)
+    integer, intent(in) :: nx, ny
+
+    call mg_apply_operator(a, x, res, mask, nx, ny)
+    res = mask*(b - res)
+
+    return
+  end subroutine mg_residual
+
+  ! ---------------------------------------------------------------------------
+  !> Sum the fine residual over each coarse cell
+
+  subroutine mg_restrict(rf, maskf, nxf, nyf, bc, nxc, nyc)
+    implicit none
+
+    double precision, intent(in)  :: rf(0:nxf+1, 0:nyf+1)
+    double precision, intent(in)  :: maskf(0:nxf+1, 0:nyf+1)
+    integer, intent(in) :: nxf, nyf
+    double precision, intent(out) :: bc(0:nxc+1, 0:nyc+1)
+    integer, intent(in) :: nxc, nyc
+
+    integer :: i, j
+
+    bc = 0d0
+
+    do j = 1, nyf
+      do i = 1, nxf
+        bc((i+1)/2,(j+1)/2) = bc((i+1)/2,(j+1)/2) + maskf(i,j)*rf(i,j)
+      end do
+    end do
+
+    call wrap_fields_2D(bc, nxc, nyc)
+
+    return
+  end subroutine mg_restrict
+
+  ! ---------------------------------------------------------------------------
+  !> Add the coarse correction to every fine cell it covers
+
+  subroutine mg_prolong(xc, nxc, nyc, xf, maskf, nxf, nyf)
+    implicit none
+
+    double precision, intent(in)    :: xc(0:nxc+1, 0:nyc+1)
+    integer, intent(in) :: nxc, nyc
+    double precision, intent(inout) :: xf(0:nxf+1, 0:nyf+1)
+    double precision, intent(in)    :: maskf(0:nxf+1, 0:nyf+1)
+    integer, intent(in) :: nxf, nyf
+
+    integer :: i, j
+
+    do j = 1, nyf
+      do i = 1, nxf
+        xf(i,j) = xf(i,j) + maskf(i,j)*xc((i+1)/2,(j+1)/2)
+      end do
+    end do
+
+    call wrap_fields_2D(xf, nxf, nyf)
+
+    return
+  end subroutine mg_prolong
+
+end module multigrid
@@ -0,0 +1,379 @@
+module netcdf_output
+#ifdef useNetCDF
+  use netcdf
+#endif
+  use boundaries
+  use end_run
+  implicit none
+
+  !> NetCDF output, for executables built with -DuseNetCDF. Each output
+  !! stream (snapshots, averages, and the debugging tendencies) goes
+  !! into one NetCDF-4 file in netcdf-output/, with a record for every
+  !! time it is written. The first process writes the files.
+  integer, parameter :: n_streams = 3
+  integer, parameter :: snap_stream = 1, av_stream = 2, debug_stream = 3
+  character(5), parameter :: stream_names(n_streams) = &
+      ['snap ', 'av   ', 'debug']
+
+  !> The fields written to NetCDF, found by the name their raw output
+  !! files would have. Any other field is written to a raw file.
+  integer, parameter :: n_fields = 13
+  character(18), parameter :: field_files(n_fields) = [ &
+      'output/snap.h.    ', 'output/snap.u.    ', 'output/snap.v.    ', &
+      'output/snap.eta.  ', 'output/wind_x.    ', 'output/wind_y.    ', &
+      'output/av.h.      ', 'output/av.u.      ', 'output/av.v.      ', &
+      'output/av.eta.    ', 'output/debug.dhdt.', 'output/debug.dudt.', &
+      'output/debug.dvdt.']
+  integer, parameter :: field_streams(n_fields) = [ &
+      snap_stream, snap_stream, snap_stream, &
+      snap_stream, snap_stream, snap_stream, &
+      av_stream, av_stream, av_stream, &
+      av_stream, debug_stream, debug_stream, &
+      debug_stream]
+  character(6), parameter :: field_names(n_fields) = [ &
+      'h     ', 'u     ', 'v     ', 'eta   ', 'wind_x', 'wind_y', &
+      'h     ', 'u     ', 'v     ', 'eta   ', &
+      'dhdt  ', 'dudt  ', 'dvdt  ']
+
+  logical, save :: netcdf_enabled = .FALSE.
+  integer, save :: ncid(n_streams) = -1
+  !> the record being written in each stream, and its time step
+  integer, save :: record(n_streams) = 0
+  integer, save :: record_iter(n_streams) = -1
+  !> time step and model time of the output being written
+  integer,          save :: output_iter = 0
+  double precision, save :: output_time = 0d0
+
+  contains
+
+  ! ---------------------------------------------------------------------------
+  !> Create the NetCDF files for the output streams that the run will
+  !! write, or open them to append to when continuing a run
+
+  subroutine create_netcdf_files(nx, ny, layers, dx, dy, niter0, &
+      RedGrav, DumpWind, write_averages, debug_level, deflate_level)
+    implicit none
+
+    integer,          intent(in) :: nx, ny, layers
+    double precision, intent(in) :: dx, dy
+    integer,          intent(in) :: niter0
+    logical,          intent(in) :: RedGrav, DumpWind, write_averages
+    integer,          intent(in) :: debug_level, deflate_level
+
+#ifdef useNetCDF
+    netcdf_enabled = .TRUE.
+    if (decomp_rank .ne. 0) return
+
+    call create_stream_file(snap_stream, nx, ny, layers, dx, dy, niter0, &
+        .not. RedGrav, DumpWind, deflate_level)
+    if (write_averages) then
+      call create_stream_file(av_stream, nx, ny, layers, dx, dy, niter0, &
+          .not. RedGrav, .FALSE., deflate_level)
+    end if
+    if (debug_level .ge. 1) then
+      call create_stream_file(debug_stream, nx, ny, layers, dx, dy, niter0, &
+          .FALSE., .FALSE., deflate_level)
+    end if
+#else
+    write(17, "(A)") "NetCDF output needs an executable built with "// &
+        "NetCDF, such as aronnax_netcdf."
+    call clean_stop(0, .FALSE.)
+#endif
+
+    return
+  end subroutine create_netcdf_files
+
+  ! ---------------------------------------------------------------------------
+  !> Set the time step and model time of the output that follows
+
+  subroutine set_netcdf_output_time(n, model_time)
+    implicit none
+
+    integer,          intent(in) :: n
+    double precision, intent(in) :: model_time
+
+    output_iter = n
+    output_time = model_time
+
+    return
+  end subroutine set_netcdf_output_time
+
+  ! ---------------------------------------------------------------------------
+  !> Whether the output file of the given name is written to NetCDF, and
+  !! if so, which field it is
+
+  logical function is_netcdf_field(name, field)
+    implicit none
+
+    character(*), intent(in)  :: name
+    integer,      intent(out) :: field
+
+    is_netcdf_field = .FALSE.
+    field = 0
+    if (.not. netcdf_enabled) return
+
+    do field = 1, n_fields
+      if (trim(field_files(field)) .eq. name) then
+        is_netcdf_field = ncid(field_streams(field)) .ge. 0
+        return
+      end if
+    end do
+    field = 0
+
+    return
+  end function is_netcdf_field
+
+  ! ---------------------------------------------------------------------------
+  !> Write a field on the global grid, without its halo, to its NetCDF
+  !! file. The first field of each output time starts a new record.
+  !! 2D fields are passed with nz = 1.
+
+  subroutine write_netcdf_field(field, values, nx, ny, nz)
+    implicit none
+
+    integer,          intent(in) :: field
+    integer,          intent(in) :: nx, ny, nz
+    double precision, intent(in) :: values(nx, ny, nz)
+
+#ifdef useNetCDF
+    integer :: stream, varid, ndims
+
+    stream = field_streams(field)
+
+    if (record_iter(stream) .ne. output_iter) then
+      record(stream) = record(stream) + 1
+      record_iter(stream) = output_iter
+      call check_netcdf(nf90_inq_varid(ncid(stream), 'time', varid))
+      call check_netcdf(nf90_put_var(ncid(stream), varid, output_time, &
+          start=[record(stream)]))
+      call check_netcdf(nf90_inq_varid(ncid(stream), 'iter', varid))
+      call check_netcdf(nf90_put_var(ncid(stream), varid, output_iter, &
+          start=[record(stream)]))
+    end if
+
+    call check_netcdf(nf90_inq_varid(ncid(stream), &
+        trim(field_names(field)), varid))
+    call check_netcdf(nf90_inquire_variable(ncid(stream), varid, &
+        ndims=ndims))
+    if (ndims .eq. 4) then
+      call check_netcdf(nf90_put_var(ncid(stream), varid, values, &
+          start=[1, 1, 1, record(stream)], count=[nx, ny, nz, 1]))
+    else
+      call check_netcdf(nf90_put_var(ncid(stream), varid, values(:,:,1), &
+          start=[1, 1, record(stream)], count=[nx, ny, 1]))
+    end if
+#endif
+
+    return
+  end subroutine write_netcdf_field
+
+  ! ---------------------------------------------------------------------------
+  !> Close the NetCDF files
+
+  subroutine close_netcdf_files()
+    implicit none
+
+#ifdef useNetCDF
+    integer :: stream
+
+    do stream = 1, n_streams
+      if (ncid(stream) .ge. 0) then
+        call check_netcdf(nf90_close(ncid(stream)))
+        ncid(stream) = -1
+      end if
+    end do
+#endif
+
+    return
+  end subroutine close_netcdf_files
+
+#ifdef useNetCDF
+  ! ---------------------------------------------------------------------------
+  !> Create the file for one output stream, with the coordinates of the
+  !! tracer and velocity points and a variable for each field in it
+
+  subroutine create_stream_file(stream, nx, ny, layers, dx, dy, niter0, &
+      with_eta, with_wind, deflate_level)
+    implicit none
+
+    integer,          intent(in) :: stream
+    integer,          intent(in) :: nx, ny, layers
+    double precision, intent(in) :: dx, dy
+    integer,          intent(in) :: niter0
+    logical,          intent(in) :: with_eta, with_wind
+    integer,          intent(in) :: deflate_level
+
+    character(64) :: filename
+    logical       :: lex
+    integer       :: id, x_dim, xp1_dim, y_dim, yp1_dim, layer_dim, time_dim
+    integer       :: varid, i
+    integer       :: n_records
+    integer, allocatable :: iters(:)
+
+    filename = 'netcdf-output/'//trim(stream_names(stream))//'.nc'
+    inquire(file=trim(filename), exist=lex)
+
+    if (niter0 .ne. 0 .and. lex) then
+      print "(A)", "NetCDF file "//trim(filename)// &
+          " already exists. Appending to it."
+      call check_netcdf(nf90_open(trim(filename), NF90_WRITE, id))
+      call check_netcdf(nf90_inq_dimid(id, 'time', time_dim))
+      call check_netcdf(nf90_inquire_dimension(id, time_dim, len=n_records))
+      allocate(iters(n_records))
+      if (n_records .gt. 0) then
+        call check_netcdf(nf90_inq_varid(id, 'iter', varid))
+        call check_netcdf(nf90_get_var(id, varid, iters))
+      end if
+      ! Records written after the checkpoint, by the run that saved it,
+      ! would be left past the end of the restarted run's output, since
+      ! the time dimension cannot be shortened
+      if (any(iters .gt. niter0)) then
+        write(17, "(A, I0, A)") "NetCDF file "//trim(filename)// &
+            " holds output from after time step ", niter0, &
+            ". Remove those records, or the file, to restart from it."
+        call clean_stop(0, .FALSE.)
+      end if
+      deallocate(iters)
+      ncid(stream) = id
+      record(stream) = n_records
+      return
+    end if
+
+    call check_netcdf(nf90_create(trim(filename), &
+        ior(NF90_CLOBBER, NF90_NETCDF4), id))
+    call check_netcdf(nf90_put_att(id, NF90_GLOBAL, 'title', &
+        'Aronnax '//trim(stream_names(stream))//' output'))
+
+    call check_netcdf(nf90_def_dim(id, 'x', nx, x_dim))
+    call check_netcdf(nf90_def_dim(id, 'xp1', nx+1, xp1_dim))
+    call check_netcdf(nf90_def_dim(id, 'y', ny, y_dim))
+    call check_netcdf(nf90_def_dim(id, 'yp1', ny+1, yp1_dim))
+    call check_netcdf(nf90_def_dim(id, 'layers', layers, layer_dim))
+    call check_netcdf(nf90_def_dim(id, 'time', NF90_UNLIMITED, time_dim))
+
+    call define_coordinate(id, 'x', x_dim, 'm', &
+        'x location of the tracer points')
+    call define_coordinate(id, 'xp1', xp1_dim, 'm', &
+        'x location of the u velocity points')
+    call define_coordinate(id, 'y', y_dim, 'm', &
+        'y location of the tracer points')
+    call define_coordinate(id, 'yp1', yp1_dim, 'm', &
+        'y location of the v velocity points')
+    call define_coordinate(id, 'time', time_dim, 's', 'model time')
+    call check_netcdf(nf90_def_var(id, 'iter', NF90_INT, [time_dim], varid))
+    call check_netcdf(nf90_put_att(id, varid, 'long_name', 'time step'))
+
+    select case (stream)
+    case (debug_stream)
+      call define_field(id, 'dhdt', [x_dim, y_dim, layer_dim, time_dim], &
+          [nx, ny, 1, 1], deflate_level, 'm s-1', 'tendency of h')
+      call define_field(id, 'dudt', [xp1_dim, y_dim, layer_dim, time_dim], &
+          [nx+1, ny, 1, 1], deflate_level, 'm s-2', 'tendency of u')
+      call define_field(id, 'dvdt', [x_dim, yp1_dim, layer_dim, time_dim], &
+          [nx, ny+1, 1, 1], deflate_level, 'm s-2', 'tendency of v')
+    case default
+      call define_field(id, 'h', [x_dim, y_dim, layer_dim, time_dim], &
+          [nx, ny, 1, 1], deflate_level, 'm', 'layer thickness')
+      call define_field(id, 'u', [xp1_dim, y_dim, layer_dim, time_dim], &
+          [nx+1, ny, 1, 1], deflate_level, 'm s-1', 'zonal velocity')
+      call define_field(id, 'v', [x_dim, yp1_dim, layer_dim, time_dim], &
+          [nx, ny+1, 1, 1], deflate_level, 'm s-1', 'meridional velocity')
+      if (with_eta) then
+        call define_field(id, 'eta', [x_dim, y_dim, time_dim], &
+            [nx, ny, 1], deflate_level, 'm', 'free surface elevation')
+      end if
+      if (with_wind) then
+        call define_field(id, 'wind_x', [xp1_dim, y_dim, time_dim], &
+            [nx+1, ny, 1], deflate_level, '', 'zonal wind forcing')
+        call define_field(id, 'wind_y', [x_dim, yp1_dim, time_dim], &
+            [nx, ny+1, 1], deflate_level, '', 'meridional wind forcing')
+      end if
+    end select
+
+    call check_netcdf(nf90_enddef(id))
+
+    ! the same axes as aronnax.Grid, with the domain starting at 0
+    call check_netcdf(nf90_inq_varid(id, 'x', varid))
+    call check_netcdf(nf90_put_var(id, varid, &
+        [((dble(i) - 0.5d0)*dx, i = 1, nx)]))
+    call check_netcdf(nf90_inq_varid(id, 'xp1', varid))
+    call check_netcdf(nf90_put_var(id, varid, [(dble(i)*dx, i = 0, nx)]))
+    call check_netcdf(nf90_inq_varid(id, 'y', varid))
+    call check_netcdf(nf90_put_var(id, varid, &
+        [((dble(i) - 0.5d0)*dy, i = 1, ny)]))
+    call check_netcdf(nf90_inq_varid(id, 'yp1', varid))
+    call check_netcdf(nf90_put_var(id, varid, [(dble(i)*dy, i = 0, ny)]))
+
+    ncid(stream) = id
+    record(stream) = 0
+
+    return
+  end subroutine create_stream_file
+
+  ! ---------------------------------------------------------------------------
+  !> Define a coordinate variable of one dimension
+
+  subroutine define_coordinate(id, name, dim, units, long_name)
+    implicit none
+
+    integer,      intent(in) :: id, dim
+    character(*), intent(in) :: name, units, long_name
+
+    integer :: varid
+
+    call check_netcdf(nf90_def_var(id, name, NF90_DOUBLE, [dim], varid))
+    call check_netcdf(nf90_put_att(id, varid, 'units', units))
+    call check_netcdf(nf90_put_att(id, varid, 'long_name', long_name))
+
+    return
+  end subroutine define_coordinate
+
+  ! ---------------------------------------------------------------------------
+  !> Define a field, chunked so that each chunk holds one layer at one
+  !! time, and compressed if deflate_level is above zero
+
+  subroutine define_field(id, name, dims, chunks, deflate_level, units, &
+      long_name)
+    implicit none
+
+    integer,      intent(in) :: id
+    character(*), intent(in) :: name
+    integer,      intent(in) :: dims(:), chunks(:)
+    integer,      intent(in) :: deflate_level
+    character(*), intent(in) :: units, long_name
+
+    integer :: varid
+
+    if (deflate_level .gt. 0) then
+      call check_netcdf(nf90_def_var(id, name, NF90_DOUBLE, dims, varid, &
+          chunksizes=chunks, shuffle=.TRUE., deflate_level=deflate_level))
+    else
+      call check_netcdf(nf90_def_var(id, name, NF90_DOUBLE, dims, varid, &
+          chunksizes=chunks))
+    end if
+    if (len(units) .gt. 0) then
+      call check_netcdf(nf90_put_att(id, varid, 'units', units))
+    end if
+    call check_netcdf(nf90_put_att(id, varid, 'long_name', long_name))
+
+    return
+  end subroutine define_field
+
+  ! ---------------------------------------------------------------------------
+  !> Stop the model if a NetCDF call failed
+
+  subroutine check_netcdf(status)
+    implicit none
+
+    integer, intent(in) :: status
+
+    if (status .ne. NF90_NOERR) then
+      write(17, "(A)") "NetCDF error: "//trim(nf90_strerror(status))
+      call clean_stop(0, .FALSE.)
+    end if
+
+    return
+  end subroutine check_netcdf
+#endif
+
+end module netcdf_output
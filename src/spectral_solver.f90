@@ -0,0 +1,631 @@
+module spectral_solver
+  use boundaries
+
+  implicit none
+
+  integer, parameter :: max_fft_factors = 40
+  !> number of vectors transformed together
+  integer, parameter :: fft_block_size = 16
+
+  !> Plan for a batch of complex FFTs of length n. Lengths whose prime
+  !! factors are all small are transformed directly. Other lengths use
+  !! Bluestein's algorithm, which turns the transform into a
+  !! convolution that can be done with power of two FFTs.
+  type fft_plan
+    integer :: n = 0
+    integer :: nfactors = 0
+    integer :: factors(max_fft_factors)
+    complex*16, allocatable :: twiddles(:)
+    ! Bluestein's algorithm
+    logical :: bluestein = .FALSE.
+    integer :: nb = 0
+    integer :: nbfactors = 0
+    integer :: bfactors(max_fft_factors)
+    complex*16, allocatable :: btwiddles(:)
+    complex*16, allocatable :: chirp(:)
+    complex*16, allocatable :: chirp_filter(:)
+  end type fft_plan
+
+  !> Plan for a real transform along one direction. Its basis vectors
+  !! are the eigenvectors of the second difference operator, which are
+  !! cosines (a DCT) between walls, or cas functions (a discrete
+  !! Hartley transform) for a periodic direction.
+  type transform_plan
+    integer :: n = 0
+    logical :: periodic = .FALSE.
+    type(fft_plan) :: fft
+    !> exp(-i pi k/(2n)), used to build the DCT from an FFT
+    complex*16, allocatable :: shift(:)
+    !> eigenvalues of the second difference operator with unit
+    !! coefficients
+    double precision, allocatable :: eig(:)
+  end type transform_plan
+
+  !> Everything the FFT pressure solver needs that does not change
+  !! during a run. The wet region is the box [i0,i1] x [j0,j1].
+  type spectral_plan
+    logical :: usable = .FALSE.
+    integer :: i0, i1, j0, j1
+    integer :: mx, my
+    type(transform_plan) :: x, y
+    !> reciprocal of the eigenvalues of A, zero for the null space
+    double precision, allocatable :: inv_eig(:,:)
+  end type spectral_plan
+
+  contains
+
+  ! ---------------------------------------------------------------------------
+  !> Check whether A can be inverted with FFTs and, if it can, set up
+  !! the solver. This needs the wet cells to form a rectangle, possibly
+  !! spanning the whole domain in a periodic direction, with the same
+  !! coefficients at every wet cell. A flat bottom with a
+  !! rectangular_pool or fully wet mask satisfies this.
+
+  subroutine create_spectral_plan(plan, a, wetmask, nx, ny)
+    implicit none
+
+    type(spectral_plan), intent(out) :: plan
+    double precision, intent(in) :: a(5, nx, ny)
+    double precision, intent(in) :: wetmask(0:nx+1, 0:ny+1)
+    integer, intent(in) :: nx, ny
+
+    integer :: i, j, k
+    logical :: wraps_x, wraps_y
+    double precision :: ax, ay, c, tol, eig
+    double precision :: expected(4)
+
+    plan%usable = .FALSE.
+
+    ! Find the box spanned by the wet cells
+    plan%i0 = nx+1
+    plan%i1 = 0
+    plan%j0 = ny+1
+    plan%j1 = 0
+    do j = 1, ny
+      do i = 1, nx
+        if (wetmask(i,j) .ne. 0d0) then
+          plan%i0 = min(plan%i0, i)
+          plan%i1 = max(plan%i1, i)
+          plan%j0 = min(plan%j0, j)
+          plan%j1 = max(plan%j1, j)
+        end if
+      end do
+    end do
+    if (plan%i1 .eq. 0) then
+      return
+    end if
+
+    ! and check that every cell in the box is wet
+    do j = plan%j0, plan%j1
+      do i = plan%i0, plan%i1
+        if (wetmask(i,j) .eq. 0d0) then
+          return
+        end if
+      end do
+    end do
+
+    ! A box that spans a periodic domain is periodic in that direction
+    wraps_x = (plan%i0 .eq. 1 .and. plan%i1 .eq. nx .and. periodic_x)
+    wraps_y = (plan%j0 .eq. 1 .and. plan%j1 .eq. ny .and. periodic_y)
+
+    ! The coefficients must be the same everywhere, apart from the
+    ! couplings across walls, which must be zero.
+    ax = maxval(a(1, plan%i0:plan%i1, plan%j0:plan%j1))
+    ay = maxval(a(2, plan%i0:plan%i1, plan%j0:plan%j1))
+    c = -sum(a(:, plan%i0, plan%j0))
+    tol = 1d-12*maxval(abs(a(5, plan%i0:plan%i1, plan%j0:plan%j1)))
+
+    do j = plan%j0, plan%j1
+      do i = plan%i0, plan%i1
+        expected = (/ ax, ay, ax, ay /)
+        if (i .eq. plan%i1 .and. .not. wraps_x) expected(1) = 0d0
+        if (j .eq. plan%j1 .and. .not. wraps_y) expected(2) = 0d0
+        if (i .eq. plan%i0 .and. .not. wraps_x) expected(3) = 0d0
+        if (j .eq. plan%j0 .and. .not. wraps_y) expected(4) = 0d0
+        do k = 1, 4
+          if (abs(a(k,i,j) - expected(k)) .gt. tol) then
+            return
+          end if
+        end do
+        if (abs(sum(a(:,i,j)) + c) .gt. tol) then
+          return
+        end if
+      end do
+    end do
+
+    plan%usable = .TRUE.
+
+    plan%mx = plan%i1 - plan%i0 + 1
+    plan%my = plan%j1 - plan%j0 + 1
+    call create_transform_plan(plan%x, plan%mx, wraps_x)
+    call create_transform_plan(plan%y, plan%my, wraps_y)
+
+    allocate(plan%inv_eig(plan%mx, plan%my))
+    do j = 1, plan%my
+      do i = 1, plan%mx
+        eig = ax*plan%x%eig(i-1) + ay*plan%y%eig(j-1) - c
+        if (abs(eig) .gt. tol) then
+          plan%inv_eig(i,j) = 1d0/eig
+        else
+          ! With a rigid lid the mean is arbitrary, so set it to zero
+          plan%inv_eig(i,j) = 0d0
+        end if
+      end do
+    end do
+
+    return
+  end subroutine create_spectral_plan
+
+  ! ---------------------------------------------------------------------------
+  !> Solve A etanew = -etastar/dt**2 directly, by transforming to the
+  !! eigenvectors of A and dividing by the eigenvalues
+
+  subroutine FFT_solver(plan, etanew, etastar, nx, ny, dt)
+    implicit none
+
+    type(spectral_plan), intent(in) :: plan
+    double precision, intent(out) :: etanew(0:nx+1, 0:ny+1)
+    double precision, intent(in)  :: etastar(0:nx+1, 0:ny+1)
+    integer, intent(in) :: nx, ny
+    double precision, intent(in) :: dt
+
+    double precision, allocatable :: field(:,:), field_t(:,:)
+
+    allocate(field(plan%mx, plan%my))
+    allocate(field_t(plan%my, plan%mx))
+
+    field = -etastar(plan%i0:plan%i1, plan%j0:plan%j1)/dt**2
+
+    ! The transforms work along the second index, for a batch of
+    ! vectors along the first index.
+    field_t = transpose(field)
+    call real_transform(plan%x, field_t, plan%my, .FALSE.)
+    field = transpose(field_t)
+    call real_transform(plan%y, field, plan%mx, .FALSE.)
+
+    field = field*plan%inv_eig
+
+    call real_transform(plan%y, field, plan%mx, .TRUE.)
+    field_t = transpose(field)
+    call real_transform(plan%x, field_t, plan%my, .TRUE.)
+
+    etanew = 0d0
+    etanew(plan%i0:plan%i1, plan%j0:plan%j1) = transpose(field_t)
+
+    call wrap_fields_2D(etanew, nx, ny)
+
+    return
+  end subroutine FFT_solver
+
+  ! ---------------------------------------------------------------------------
+  !> Set up the transform along one direction of length n
+
+  subroutine create_transform_plan(plan, n, periodic)
+    implicit none
+
+    type(transform_plan), intent(out) :: plan
+    integer, intent(in) :: n
+    logical, intent(in) :: periodic
+
+    integer :: k
+    double precision :: pi
+
+    pi = 4d0*atan(1d0)
+
+    plan%n = n
+    plan%periodic = periodic
+    call create_fft_plan(plan%fft, n)
+
+    allocate(plan%shift(0:n-1))
+    allocate(plan%eig(0:n-1))
+    do k = 0, n-1
+      plan%shift(k) = exp(cmplx(0d0, -pi*k/(2d0*n), kind=8))
+      if (periodic) then
+        plan%eig(k) = 2d0*(cos(2d0*pi*k/n) - 1d0)
+      else
+        plan%eig(k) = 2d0*(cos(pi*k/n) - 1d0)
+      end if
+    end do
+
+    return
+  end subroutine create_transform_plan
+
+  ! ---------------------------------------------------------------------------
+  !> Apply the real transform, or its inverse, to each of the nbatch
+  !! vectors x(b,:). The DCT is calculated from an FFT of the same
+  !! length (Makhoul, 1980), and the Hartley transform from the real
+  !! and imaginary parts of an FFT.
+
+  subroutine real_transform(plan, x, nbatch, inverse)
+    implicit none
+
+    type(transform_plan), intent(in) :: plan
+    integer, intent(in) :: nbatch
+    double precision, intent(inout) :: x(nbatch, 0:plan%n-1)
+    logical, intent(in) :: inverse
+
+    complex*16, allocatable :: c(:,:)
+    integer :: n, k
+
+    n = plan%n
+    allocate(c(nbatch, 0:n-1))
+
+    if (plan%periodic) then
+      ! The Hartley transform is its own inverse, up to a factor of n
+      c = cmplx(x, 0d0, kind=8)
+      call fft(plan%fft, c, nbatch)
+      x = real(c, kind=8) - aimag(c)
+      if (inverse) then
+        x = x/dble(n)
+      end if
+
+    else if (.not. inverse) then
+      ! DCT-II: reorder, transform, and rotate
+      do k = 0, (n+1)/2 - 1
+        c(:,k) = cmplx(x(:,2*k), 0d0, kind=8)
+      end do
+      do k = 0, n/2 - 1
+        c(:,n-1-k) = cmplx(x(:,2*k+1), 0d0, kind=8)
+      end do
+      call fft(plan%fft, c, nbatch)
+      do k = 0, n-1
+        x(:,k) = real(plan%shift(k)*c(:,k), kind=8)
+      end do
+
+    else
+      ! Inverse of the DCT-II: undo each step in reverse order
+      c(:,0) = cmplx(x(:,0), 0d0, kind=8)
+      do k = 1, n-1
+        c(:,k) = conjg(plan%shift(k))*cmplx(x(:,k), -x(:,n-k), kind=8)
+      end do
+      ! inverse FFT by conjugating the forward FFT
+      c = conjg(c)
+      call fft(plan%fft, c, nbatch)
+      do k = 0, (n+1)/2 - 1
+        x(:,2*k) = real(c(:,k), kind=8)/dble(n)
+      end do
+      do k = 0, n/2 - 1
+        x(:,2*k+1) = real(c(:,n-1-k), kind=8)/dble(n)
+      end do
+    end if
+
+    return
+  end subroutine real_transform
+
+  ! ---------------------------------------------------------------------------
+  !> Set up the FFT of length n
+
+  subroutine create_fft_plan(plan, n)
+    implicit none
+
+    type(fft_plan), intent(out) :: plan
+    integer, intent(in) :: n
+
+    integer :: k
+    double precision :: pi
+    complex*16, allocatable :: filter(:,:), work(:,:)
+
+    pi = 4d0*atan(1d0)
+
+    plan%n = n
+    call factorise(n, plan%nfactors, plan%factors)
+
+    ! Large prime factors make the direct transform slow
+    plan%bluestein = (plan%factors(plan%nfactors) .gt. 13)
+
+    if (.not. plan%bluestein) then
+      call create_twiddles(n, plan%nfactors, plan%factors, plan%twiddles)
+      return
+    end if
+
+    plan%nb = 1
+    do while (plan%nb .lt. 2*n - 1)
+      plan%nb = 2*plan%nb
+    end do
+    call factorise(plan%nb, plan%nbfactors, plan%bfactors)
+    call create_twiddles(plan%nb, plan%nbfactors, plan%bfactors, &
+        plan%btwiddles)
+
+    allocate(plan%chirp(0:n-1))
+    do k = 0, n-1
+      ! reduce k**2 first to keep the phase accurate
+      plan%chirp(k) = exp(cmplx(0d0, &
+          -pi*dble(mod(int(k, 8)**2, int(2*n, 8)))/n, kind=8))
+    end do
+
+    allocate(filter(1, 0:plan%nb-1), work(1, 0:plan%nb-1))
+    filter = (0d0, 0d0)
+    filter(1,0) = conjg(plan%chirp(0))
+    do k = 1, n-1
+      filter(1,k) = conjg(plan%chirp(k))
+      filter(1,plan%nb-k) = conjg(plan%chirp(k))
+    end do
+    call fft_stockham(filter, work, 1, plan%nb, plan%nbfactors, &
+        plan%bfactors, plan%btwiddles)
+
+    allocate(plan%chirp_filter(0:plan%nb-1))
+    ! include the normalisation of the inverse transform
+    plan%chirp_filter = filter(1,:)/dble(plan%nb)
+
+    return
+  end subroutine create_fft_plan
+
+  ! ---------------------------------------------------------------------------
+  !> Forward FFT of each of the nbatch vectors x(b,:). The vectors are
+  !! transformed a block at a time, so that the working arrays stay in
+  !! cache.
+
+  subroutine fft(plan, x, nbatch)
+    implicit none
+
+    type(fft_plan), intent(in) :: plan
+    integer, intent(in) :: nbatch
+    complex*16, intent(inout) :: x(nbatch, 0:plan%n-1)
+
+    integer :: b0, b1, k
+    complex*16, allocatable :: y(:,:), work(:,:)
+
+    do b0 = 1, nbatch, fft_block_size
+      b1 = min(b0 + fft_block_size - 1, nbatch)
+
+      if (.not. plan%bluestein) then
+        allocate(y(b1-b0+1, 0:plan%n-1), work(b1-b0+1, 0:plan%n-1))
+        y = x(b0:b1,:)
+        call fft_stockham(y, work, b1-b0+1, plan%n, plan%nfactors, &
+            plan%factors, plan%twiddles)
+        x(b0:b1,:) = y
+        deallocate(y, work)
+        cycle
+      end if
+
+      ! Bluestein's algorithm: the transform is a convolution with a
+      ! chirp, which we do with FFTs of the padded length nb.
+      allocate(y(b1-b0+1, 0:plan%nb-1), work(b1-b0+1, 0:plan%nb-1))
+      y = (0d0, 0d0)
+      do k = 0, plan%n-1
+        y(:,k) = x(b0:b1,k)*plan%chirp(k)
+      end do
+
+      call fft_stockham(y, work, b1-b0+1, plan%nb, plan%nbfactors, &
+          plan%bfactors, plan%btwiddles)
+      do k = 0, plan%nb-1
+        y(:,k) = conjg(y(:,k)*plan%chirp_filter(k))
+      end do
+      call fft_stockham(y, work, b1-b0+1, plan%nb, plan%nbfactors, &
+          plan%bfactors, plan%btwiddles)
+
+      do k = 0, plan%n-1
+        x(b0:b1,k) = conjg(y(:,k))*plan%chirp(k)
+      end do
+      deallocate(y, work)
+    end do
+
+    return
+  end subroutine fft
+
+  ! ---------------------------------------------------------------------------
+  !> Split n into factors, using 4s where possible, in increasing order
+
+  subroutine factorise(n, nfactors, factors)
+    implicit none
+
+    integer, intent(in) :: n
+    integer, intent(out) :: nfactors
+    integer, intent(out) :: factors(max_fft_factors)
+
+    integer :: m, p
+
+    nfactors = 0
+    factors = 1
+    m = n
+
+    do while (mod(m, 4) .eq. 0)
+      nfactors = nfactors + 1
+      factors(nfactors) = 4
+      m = m/4
+    end do
+
+    p = 2
+    do while (m .gt. 1)
+      if (mod(m, p) .eq. 0) then
+        nfactors = nfactors + 1
+        factors(nfactors) = p
+        m = m/p
+      else
+        p = p + 1
+      end if
+    end do
+
+    if (nfactors .eq. 0) then
+      ! n = 1
+      nfactors = 1
+    end if
+
+    ! sort so that the largest factor comes last
+    call sort_factors(factors, nfactors)
+
+    return
+  end subroutine factorise
+
+  ! ---------------------------------------------------------------------------
+  !> Insertion sort of the factors into increasing order
+
+  subroutine sort_factors(factors, nfactors)
+    implicit none
+
+    integer, intent(inout) :: factors(max_fft_factors)
+    integer, intent(in) :: nfactors
+
+    integer :: i, j, f
+
+    do i = 2, nfactors
+      f = factors(i)
+      j = i - 1
+      do while (j .ge. 1)
+        if (factors(j) .le. f) exit
+        factors(j+1) = factors(j)
+        j = j - 1
+      end do
+      factors(j+1) = f
+    end do
+
+    return
+  end subroutine sort_factors
+
+  ! ---------------------------------------------------------------------------
+  !> Twiddle factors for every stage of the Stockham FFT. For a stage
+  !! of radix p that follows stages with combined length l, they are
+  !! exp(-2 pi i j s/(l p)) for j = 0, ..., l-1 and s = 1, ..., p-1.
+
+  subroutine create_twiddles(n, nfactors, factors, twiddles)
+    implicit none
+
+    integer, intent(in) :: n, nfactors
+    integer, intent(in) :: factors(max_fft_factors)
+    complex*16, allocatable, intent(out) :: twiddles(:)
+
+    integer :: q, l, p, j, s, offset, total
+    double precision :: pi
+
+    pi = 4d0*atan(1d0)
+
+    total = 0
+    l = 1
+    do q = 1, nfactors
+      total = total + l*(factors(q) - 1)
+      l = l*factors(q)
+    end do
+    allocate(twiddles(max(total, 1)))
+    twiddles = (1d0, 0d0)
+
+    offset = 0
+    l = 1
+    do q = 1, nfactors
+      p = factors(q)
+      do j = 0, l-1
+        do s = 1, p-1
+          twiddles(offset + j*(p-1) + s) = &
+              exp(cmplx(0d0, -2d0*pi*dble(j*s)/dble(l*p), kind=8))
+        end do
+      end do
+      offset = offset + l*(p-1)
+      l = l*p
+    end do
+
+    return
+  end subroutine create_twiddles
+
+  ! ---------------------------------------------------------------------------
+  !> Stockham autosort FFT of each of the nbatch vectors x(b,:). Each
+  !! stage combines p transforms of length l into transforms of length
+  !! l*p, so no bit reversal is needed. The batch index is innermost,
+  !! so the butterflies vectorise across the batch.
+
+  subroutine fft_stockham(x, work, nbatch, n, nfactors, factors, twiddles)
+    implicit none
+
+    integer, intent(in) :: nbatch, n, nfactors
+    complex*16, intent(inout) :: x(nbatch, 0:n-1)
+    complex*16, intent(out) :: work(nbatch, 0:n-1)
+    integer, intent(in) :: factors(max_fft_factors)
+    complex*16, intent(in) :: twiddles(:)
+
+    integer :: q, l, p, offset
+    logical :: in_work
+
+    if (n .eq. 1) then
+      return
+    end if
+
+    in_work = .FALSE.
+    offset = 0
+    l = 1
+    do q = 1, nfactors
+      p = factors(q)
+      if (in_work) then
+        call fft_stage(work, x, nbatch, n, l, p, twiddles(offset+1:))
+      else
+        call fft_stage(x, work, nbatch, n, l, p, twiddles(offset+1:))
+      end if
+      in_work = .not. in_work
+      offset = offset + l*(p-1)
+      l = l*p
+    end do
+
+    if (in_work) then
+      x = work
+    end if
+
+    return
+  end subroutine fft_stockham
+
+  ! ---------------------------------------------------------------------------
+  !> One radix p stage of the Stockham FFT, from a to y
+
+  subroutine fft_stage(a, y, nbatch, n, l, p, tw)
+    implicit none
+
+    integer, intent(in) :: nbatch, n, l, p
+    complex*16, intent(in)  :: a(nbatch, 0:n-1)
+    complex*16, intent(out) :: y(nbatch, 0:n-1)
+    complex*16, intent(in)  :: tw(0:l*(p-1)-1)
+
+    integer :: r, k, j, s, m
+    complex*16 :: t(nbatch, 0:p-1)
+    complex*16 :: u0(nbatch), u1(nbatch), u2(nbatch), u3(nbatch)
+    complex*16 :: roots(0:p-1)
+    double precision :: pi, sin60
+
+    pi = 4d0*atan(1d0)
+    sin60 = sqrt(3d0)/2d0
+    r = n/(l*p)
+
+    do m = 0, p-1
+      roots(m) = exp(cmplx(0d0, -2d0*pi*m/p, kind=8))
+    end do
+
+    do k = 0, r-1
+      do j = 0, l-1
+        ! gather the twiddled inputs
+        t(:,0) = a(:, j + l*k)
+        do s = 1, p-1
+          t(:,s) = tw(j*(p-1) + s - 1)*a(:, j + l*(k + r*s))
+        end do
+
+        select case (p)
+        case (2)
+          y(:, j + l*p*k)     = t(:,0) + t(:,1)
+          y(:, j + l + l*p*k) = t(:,0) - t(:,1)
+        case (3)
+          u0 = t(:,1) + t(:,2)
+          u1 = t(:,0) - 0.5d0*u0
+          u2 = cmplx(0d0, -sin60, kind=8)*(t(:,1) - t(:,2))
+          y(:, j + l*p*k)       = t(:,0) + u0
+          y(:, j + l + l*p*k)   = u1 + u2
+          y(:, j + 2*l + l*p*k) = u1 - u2
+        case (4)
+          u0 = t(:,0) + t(:,2)
+          u1 = t(:,0) - t(:,2)
+          u2 = t(:,1) + t(:,3)
+          u3 = cmplx(0d0, -1d0, kind=8)*(t(:,1) - t(:,3))
+          y(:, j + l*p*k)       = u0 + u2
+          y(:, j + l + l*p*k)   = u1 + u3
+          y(:, j + 2*l + l*p*k) = u0 - u2
+          y(:, j + 3*l + l*p*k) = u1 - u3
+        case default
+          ! direct DFT of length p
+          do m = 0, p-1
+            u0 = t(:,0)
+            do s = 1, p-1
+              u0 = u0 + roots(mod(m*s, p))*t(:,s)
+            end do
+            y(:, j + m*l + l*p*k) = u0
+          end do
+        end select
+      end do
+    end do
+
+    return
+  end subroutine fft_stage
+
+end module spectral_solver
@@ -4,18 +4,23 @@ module state_deriv
   use bernoulli
   use vorticity
   use momentum
+  use fused_tendencies
 
   implicit none
 
   contains
 
   ! ----------------------------- Auxiliary routines --------------------------
-  !> Compute the forward state derivative
+  !> Compute the forward state derivative on this process's tile. The
+  !! halos of h, u and v must be up to date. Those of the tendencies are
+  !! not filled, so a state stepped forward with them needs its halos
+  !! updated before the tendencies are calculated from it.
 
   subroutine state_derivative(dhdt, dudt, dvdt, h, u, v, depth, &
       dx, dy, wetmask, hfacW, hfacE, hfacN, hfacS, fu, fv, &
       au, ar, botDrag, kh, kv, slip, &
-      RedGrav, hAdvecScheme, g_vec, rho0, wind_x, wind_y, &
+      RedGrav, hAdvecScheme, tendency_algorithm, &
+      g_vec, rho0, wind_x, wind_y, &
       RelativeWind, Cd, &
       spongeHTimeScale, spongeH, &
       spongeUTimeScale, spongeU, &
@@ -23,12 +28,12 @@ module state_deriv
       nx, ny, layers, n, debug_level)
     implicit none
 
-    double precision, intent(out) :: dhdt(0:nx+1, 0:ny+1, layers)
-    double precision, intent(out) :: dudt(0:nx+1, 0:ny+1, layers)
-    double precision, intent(out) :: dvdt(0:nx+1, 0:ny+1, layers)
-    double precision, intent(in) :: h(0:nx+1, 0:ny+1, layers)
-    double precision, intent(in) :: u(0:nx+1, 0:ny+1, layers)
-    double precision, intent(in) :: v(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(out) :: dhdt(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(out) :: dudt(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(out) :: dvdt(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in) :: h(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in) :: u(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in) :: v(0:nx+1, 0:ny+1, layers)
     double precision, intent(in) :: depth(0:nx+1, 0:ny+1, layers)
     double precision, intent(in) :: dx, dy
     double precision, intent(in) :: wetmask(0:nx+1, 0:ny+1)
@@ -43,6 +48,7 @@ module state_deriv
     double precision, intent(in) :: slip
     logical,          intent(in) :: RedGrav
     integer,          intent(in) :: hAdvecScheme
+    integer,          intent(in) :: tendency_algorithm
     double precision, intent(in) :: g_vec(layers)
     double precision, intent(in) :: rho0
     double precision, intent(in) :: wind_x(0:nx+1, 0:ny+1)
@@ -60,43 +66,59 @@ module state_deriv
     integer, intent(in) :: debug_level
 
     ! Bernoulli potential
-    double precision :: b(0:nx+1, 0:ny+1, layers)
+    real(wp)         :: b(0:nx+1, 0:ny+1, layers)
     ! Relative vorticity
-    double precision :: zeta(0:nx+1, 0:ny+1, layers)
+    real(wp)         :: zeta(0:nx+1, 0:ny+1, layers)
+
+    ! The fused kernel does not keep the Bernoulli potential or the
+    ! vorticity, so use the separate kernels when they are to be output
+    if (tendency_algorithm .eq. 2 .and. debug_level .lt. 4) then
+      call evaluate_tendencies_fused(dhdt, dudt, dvdt, h, u, v, depth, &
+          dx, dy, wetmask, hfacW, hfacE, hfacN, hfacS, fu, fv, &
+          au, ar, botDrag, kh, kv, slip, &
+          RedGrav, hAdvecScheme, g_vec, rho0, wind_x, wind_y, &
+          RelativeWind, Cd, &
+          spongeHTimeScale, spongeH, &
+          spongeUTimeScale, spongeU, &
+          spongeVTimeScale, spongeV, &
+          wet_margin, nx, ny, layers, n)
+      return
+    end if
 
     ! Calculate Bernoulli potential
     if (RedGrav) then
-      call evaluate_b_RedGrav(b, h, u, v, nx, ny, layers, g_vec)
+      call evaluate_b_RedGrav(b, h, u, v, nx, ny, layers, g_vec, wet_margin)
       if (debug_level .ge. 4) then
-        call write_output_3d(b, nx, ny, layers, 0, 0, &
+        call write_output_3d(dble(b), nx, ny, layers, 0, 0, &
           n, 'output/snap.BP.')
       end if
     else
-      call evaluate_b_iso(b, h, u, v, nx, ny, layers, g_vec, depth)
+      call evaluate_b_iso(b, h, u, v, nx, ny, layers, g_vec, depth, wet_margin)
       if (debug_level .ge. 4) then
-        call write_output_3d(b, nx, ny, layers, 0, 0, &
+        call write_output_3d(dble(b), nx, ny, layers, 0, 0, &
           n, 'output/snap.BP.')
       end if
     end if
 
     ! Calculate relative vorticity
-    call evaluate_zeta(zeta, u, v, nx, ny, layers, dx, dy)
+    call evaluate_zeta(zeta, u, v, nx, ny, layers, dx, dy, wet_margin)
     if (debug_level .ge. 4) then
-      call write_output_3d(zeta, nx, ny, layers, 1, 1, &
+      call write_output_3d(dble(zeta), nx, ny, layers, 1, 1, &
         n, 'output/snap.zeta.')
     end if
 
     ! Calculate dhdt, dudt, dvdt at current time step
     call evaluate_dhdt(dhdt, h, u, v, kh, kv, dx, dy, nx, ny, layers, &
-        spongeHTimeScale, spongeH, wetmask, RedGrav, hAdvecScheme, n)
+        spongeHTimeScale, spongeH, wetmask, wet_margin, RedGrav, &
+        hAdvecScheme, n)
 
     call evaluate_dudt(dudt, h, u, v, b, zeta, wind_x, wind_y, fu, au, ar, slip, &
         dx, dy, hfacN, hfacS, nx, ny, layers, rho0, RelativeWind, Cd, &
-        spongeUTimeScale, spongeU, RedGrav, botDrag)
+        spongeUTimeScale, spongeU, RedGrav, botDrag, wet_margin)
 
     call evaluate_dvdt(dvdt, h, u, v, b, zeta, wind_x, wind_y, fv, au, ar, slip, &
         dx, dy, hfacW, hfacE, nx, ny, layers, rho0, RelativeWind, Cd, &
-        spongeVTimeScale, spongeV, RedGrav, botDrag)
+        spongeVTimeScale, spongeV, RedGrav, botDrag, wet_margin)
 
     return
   end subroutine state_derivative
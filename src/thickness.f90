@@ -10,45 +10,46 @@ module thickness
   !> Calculate the tendency of layer thickness for each of the active layers
   !! dh/dt is in the centre of each grid point.
   subroutine evaluate_dhdt(dhdt, h, u, v, kh, kv, dx, dy, nx, ny, layers, &
-      spongeTimeScale, spongeH, wetmask, RedGrav, hAdvecScheme, n)
+      spongeTimeScale, spongeH, wetmask, wet, RedGrav, hAdvecScheme, n)
     implicit none
 
     ! dhdt is evaluated at the centre of the grid box
-    double precision, intent(out) :: dhdt(0:nx+1, 0:ny+1, layers)
-    double precision, intent(in)  :: h(0:nx+1, 0:ny+1, layers)
-    double precision, intent(in)  :: u(0:nx+1, 0:ny+1, layers)
-    double precision, intent(in)  :: v(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(out) :: dhdt(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in)  :: h(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in)  :: u(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in)  :: v(0:nx+1, 0:ny+1, layers)
     double precision, intent(in)  :: kh(layers), kv
     double precision, intent(in)  :: dx, dy
     integer, intent(in) :: nx, ny, layers
     double precision, intent(in)  :: spongeTimeScale(0:nx+1, 0:ny+1, layers)
     double precision, intent(in)  :: spongeH(0:nx+1, 0:ny+1, layers)
     double precision, intent(in)  :: wetmask(0:nx+1, 0:ny+1)
+    type(wet_spans), intent(in) :: wet
     logical, intent(in) :: RedGrav
     integer, intent(in) :: hAdvecScheme
     integer, intent(in) :: n
 
-    integer i, j, k
+    integer i, j, k, s
     ! Thickness tendency due to thickness diffusion (equivalent to Gent
     ! McWilliams in a z coordinate model)
-    double precision dhdt_kh(0:nx+1, 0:ny+1, layers)
+    real(wp) dhdt_kh(0:nx+1, 0:ny+1, layers)
 
     ! Thickness tendency due to vertical diffusion of mass
-    double precision dhdt_kv(0:nx+1, 0:ny+1, layers)
+    real(wp) dhdt_kv(0:nx+1, 0:ny+1, layers)
 
     ! Thickness tendency due to thickness advection
-    double precision dhdt_advec(0:nx+1, 0:ny+1, layers)
+    real(wp) dhdt_advec(0:nx+1, 0:ny+1, layers)
 
     ! Calculate tendency due to thickness diffusion (equivalent
     ! to GM in z coordinate model with the same diffusivity).
     dhdt_kh = 0d0
 
     call dhdt_hor_diff(dhdt_kh, h, kh, dx, dy, nx, ny, layers, &
-      wetmask, RedGrav)
+      wetmask, wet, RedGrav)
 
     ! Calculate thickness tendency due to vertical diffusion
     dhdt_kv = 0d0
-    call dhdt_vert_diff(dhdt_kv, h, kv, nx, ny, layers, RedGrav)
+    call dhdt_vert_diff(dhdt_kv, h, kv, nx, ny, layers, wet, RedGrav)
 
 
     ! Calculate the thickness tendency due to the flow field
@@ -56,10 +57,12 @@ module thickness
 
     if (hAdvecScheme .eq. 1) then
       ! first-order centered
-      call h_advec_1_centered(dhdt_advec, h, u, v, dx, dy, nx, ny, layers)
+      call h_advec_1_centered(dhdt_advec, h, u, v, dx, dy, nx, ny, layers, &
+          wet)
     else if (hAdvecScheme .eq. 2) then
       ! first-order upwind
-      call h_advec_1_upwind(dhdt_advec, h, u, v, dx, dy, nx, ny, layers)
+      call h_advec_1_upwind(dhdt_advec, h, u, v, dx, dy, nx, ny, layers, &
+          wet)
     else
       call clean_stop(n, .FALSE.)
     end if
@@ -67,24 +70,23 @@ module thickness
     ! Now add these together, along with the sponge contribution
     dhdt = 0d0
 
+    !$omp parallel do collapse(2) private(i, s)
     do k = 1, layers
       do j = 1, ny
-        do i = 1, nx
-          dhdt(i,j,k) = &
-              dhdt_kh(i,j,k) & ! horizontal thickness diffusion
-              + dhdt_kv(i,j,k) & ! vetical thickness diffusion 
-              + dhdt_advec(i,j,k) & ! thickness advection
-              + spongeTimeScale(i,j,k)*(spongeH(i,j,k)-h(i,j,k)) ! forced relaxtion in the sponge regions.
+        do s = wet%first(j), wet%first(j+1) - 1
+          do i = max(wet%lo(s), 1), min(wet%hi(s), nx)
+            dhdt(i,j,k) = &
+                dhdt_kh(i,j,k) & ! horizontal thickness diffusion
+                + dhdt_kv(i,j,k) & ! vetical thickness diffusion 
+                + dhdt_advec(i,j,k) & ! thickness advection
+                + spongeTimeScale(i,j,k)*(spongeH(i,j,k)-h(i,j,k)) ! forced relaxtion in the sponge regions.
+            ! Make sure the dynamics are only happening in the wet grid points.
+            dhdt(i,j,k) = dhdt(i,j,k) * wetmask(i,j)
+          end do
         end do
       end do
     end do
-
-    ! Make sure the dynamics are only happening in the wet grid points.
-    do k = 1, layers
-      dhdt(:, :, k) = dhdt(:, :, k) * wetmask
-    end do
-
-    call wrap_fields_3D(dhdt, nx, ny, layers)
+    !$omp end parallel do
 
     return
   end subroutine evaluate_dhdt
@@ -93,19 +95,20 @@ module thickness
   !> Calculate the tendency of layer thickness for each of the active layers
   !! due to horizontal thickness diffusion
   subroutine dhdt_hor_diff(dhdt_GM, h, kh, dx, dy, nx, ny, layers, &
-      wetmask, RedGrav)
+      wetmask, wet, RedGrav)
     implicit none
 
     ! dhdt is evaluated at the centre of the grid box
-    double precision, intent(out) :: dhdt_GM(0:nx+1, 0:ny+1, layers)
-    double precision, intent(in)  :: h(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(out) :: dhdt_GM(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in)  :: h(0:nx+1, 0:ny+1, layers)
     double precision, intent(in)  :: kh(layers)
     double precision, intent(in)  :: dx, dy
     integer, intent(in) :: nx, ny, layers
     double precision, intent(in)  :: wetmask(0:nx+1, 0:ny+1)
+    type(wet_spans), intent(in) :: wet
     logical, intent(in) :: RedGrav
 
-    integer i, j, k
+    integer i, j, k, s
 
     ! Calculate tendency due to thickness diffusion (equivalent
     ! to GM in z coordinate model with the same diffusivity).
@@ -113,24 +116,28 @@ module thickness
 
     ! Loop through all layers except lowest and calculate
     ! thickness tendency due to horizontal diffusive mass fluxes
+    !$omp parallel do collapse(2) private(i, s)
     do k = 1, layers-1
       do j = 1, ny
-        do i = 1, nx
-          dhdt_GM(i,j,k) = &
-              kh(k)*(h(i+1,j,k)*wetmask(i+1,j)    &
-                + (1d0 - wetmask(i+1,j))*h(i,j,k) & ! reflect around boundary
-                + h(i-1,j,k)*wetmask(i-1,j)       &
-                + (1d0 - wetmask(i-1,j))*h(i,j,k) & ! refelct around boundary
-                - 2*h(i,j,k))/(dx*dx)             & ! x-component
-
-              + kh(k)*(h(i,j+1,k)*wetmask(i,j+1) &
-                + (1d0 - wetmask(i,j+1))*h(i,j,k) & ! reflect value around boundary
-                + h(i,j-1,k)*wetmask(i,j-1)       &
-                + (1d0 - wetmask(i,j-1))*h(i,j,k) & ! reflect value around boundary
-                - 2*h(i,j,k))/(dy*dy)               ! y-component horizontal diffusion
+        do s = wet%first(j), wet%first(j+1) - 1
+          do i = max(wet%lo(s), 1), min(wet%hi(s), nx)
+            dhdt_GM(i,j,k) = &
+                kh(k)*(h(i+1,j,k)*wetmask(i+1,j)    &
+                  + (1d0 - wetmask(i+1,j))*h(i,j,k) & ! reflect around boundary
+                  + h(i-1,j,k)*wetmask(i-1,j)       &
+                  + (1d0 - wetmask(i-1,j))*h(i,j,k) & ! refelct around boundary
+                  - 2*h(i,j,k))/(dx*dx)             & ! x-component
+
+                + kh(k)*(h(i,j+1,k)*wetmask(i,j+1) &
+                  + (1d0 - wetmask(i,j+1))*h(i,j,k) & ! reflect value around boundary
+                  + h(i,j-1,k)*wetmask(i,j-1)       &
+                  + (1d0 - wetmask(i,j-1))*h(i,j,k) & ! reflect value around boundary
+                  - 2*h(i,j,k))/(dy*dy)               ! y-component horizontal diffusion
+          end do
         end do
       end do
     end do
+    !$omp end parallel do
 
 
     ! Now do the lowest active layer, k = layers. If using reduced
@@ -138,22 +145,26 @@ module thickness
     ! using n-layer physics it is constrained to balance the layers
     ! above it.
     if (RedGrav) then
+      !$omp parallel do private(i, s)
       do j = 1, ny
-        do i = 1, nx
-          dhdt_GM(i,j,layers) = &
-              kh(layers)*(h(i+1,j,layers)*wetmask(i+1,j)   &
-                + (1d0 - wetmask(i+1,j))*h(i,j,layers)     & ! boundary
-                + h(i-1,j,layers)*wetmask(i-1,j)           &
-                + (1d0 - wetmask(i-1,j))*h(i,j,layers)     & ! boundary
-                - 2*h(i,j,layers))/(dx*dx)                 & ! x-component
-
-              + kh(layers)*(h(i,j+1,layers)*wetmask(i,j+1) &
-                + (1d0 - wetmask(i,j+1))*h(i,j,layers)     & ! reflect value around boundary
-                + h(i,j-1,layers)*wetmask(i,j-1)           &
-                + (1d0 - wetmask(i,j-1))*h(i,j,layers)     & ! reflect value around boundary
-                - 2*h(i,j,layers))/(dy*dy) ! y-component horizontal diffusion
+        do s = wet%first(j), wet%first(j+1) - 1
+          do i = max(wet%lo(s), 1), min(wet%hi(s), nx)
+            dhdt_GM(i,j,layers) = &
+                kh(layers)*(h(i+1,j,layers)*wetmask(i+1,j)   &
+                  + (1d0 - wetmask(i+1,j))*h(i,j,layers)     & ! boundary
+                  + h(i-1,j,layers)*wetmask(i-1,j)           &
+                  + (1d0 - wetmask(i-1,j))*h(i,j,layers)     & ! boundary
+                  - 2*h(i,j,layers))/(dx*dx)                 & ! x-component
+
+                + kh(layers)*(h(i,j+1,layers)*wetmask(i,j+1) &
+                  + (1d0 - wetmask(i,j+1))*h(i,j,layers)     & ! reflect value around boundary
+                  + h(i,j-1,layers)*wetmask(i,j-1)           &
+                  + (1d0 - wetmask(i,j-1))*h(i,j,layers)     & ! reflect value around boundary
+                  - 2*h(i,j,layers))/(dy*dy) ! y-component horizontal diffusion
+          end do
         end do
       end do
+      !$omp end parallel do
     else if (.not. RedGrav) then ! using n-layer physics
       ! Calculate bottom layer thickness tendency to balance layers above.
       ! In the flat-bottomed case this will give the same answer.
@@ -166,17 +177,18 @@ module thickness
   ! ---------------------------------------------------------------------------
   !> Calculate the tendency of layer thickness for each of the active layers
   !! due to vertical thickness diffusion
-  subroutine dhdt_vert_diff(dhdt_kv, h, kv, nx, ny, layers, RedGrav)
+  subroutine dhdt_vert_diff(dhdt_kv, h, kv, nx, ny, layers, wet, RedGrav)
     implicit none
 
     ! dhdt is evaluated at the centre of the grid box
-    double precision, intent(out) :: dhdt_kv(0:nx+1, 0:ny+1, layers)
-    double precision, intent(in)  :: h(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(out) :: dhdt_kv(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in)  :: h(0:nx+1, 0:ny+1, layers)
     double precision, intent(in)  :: kv
     integer, intent(in) :: nx, ny, layers
+    type(wet_spans), intent(in) :: wet
     logical, intent(in) :: RedGrav
 
-    integer i, j, k
+    integer i, j, k, s
 
     dhdt_kv = 0d0
 
@@ -184,28 +196,36 @@ module thickness
     ! only evaluate vertical mass diff flux if more than 1 layer, or reduced gravity
     if (layers .eq. 1) then
       if (RedGrav) then
+        !$omp parallel do private(i, s)
         do j = 1, ny
-          do i = 1, nx
-            dhdt_kv(i,j,1) = kv/h(i,j,1)
+          do s = wet%first(j), wet%first(j+1) - 1
+            do i = max(wet%lo(s), 1), min(wet%hi(s), nx)
+              dhdt_kv(i,j,1) = kv/h(i,j,1)
+            end do
           end do
         end do
+        !$omp end parallel do
       end if
     else if (layers .gt. 1) then
       ! if more than one layer, need to have multiple fluxes
+      !$omp parallel do collapse(2) private(i, s)
       do k = 1, layers
         do j = 1, ny
-          do i = 1, nx
-            if (k .eq. 1) then ! in top layer
-              dhdt_kv(i,j,k) = kv/h(i,j,k) - kv/h(i,j,k+1)
-            else if (k .eq. layers) then ! bottom layer
-              dhdt_kv(i,j,k) = kv/h(i,j,k) - kv/h(i,j,k-1)
-            else ! mid layer/s
-              dhdt_kv(i,j,k) = 2d0*kv/h(i,j,k) -  &
-                  kv/h(i,j,k-1) - kv/h(i,j,k+1)
-            end if
+          do s = wet%first(j), wet%first(j+1) - 1
+            do i = max(wet%lo(s), 1), min(wet%hi(s), nx)
+              if (k .eq. 1) then ! in top layer
+                dhdt_kv(i,j,k) = kv/h(i,j,k) - kv/h(i,j,k+1)
+              else if (k .eq. layers) then ! bottom layer
+                dhdt_kv(i,j,k) = kv/h(i,j,k) - kv/h(i,j,k-1)
+              else ! mid layer/s
+                dhdt_kv(i,j,k) = 2d0*kv/h(i,j,k) -  &
+                    kv/h(i,j,k-1) - kv/h(i,j,k+1)
+              end if
+            end do
           end do
         end do
       end do
+      !$omp end parallel do
     end if
 
     return
@@ -0,0 +1,173 @@
+module time_step_control
+  use kinds
+  use boundaries
+  implicit none
+
+  !> The time step grows by at most this factor from one step to the
+  !! next, which keeps the variable step Adams-Bashforth schemes stable
+  double precision, parameter :: dt_growth_limit = 1.2d0
+
+  contains
+
+  ! ---------------------------------------------------------------------------
+  !> Find the largest rate at which information crosses a grid cell,
+  !! from the flow and the internal gravity waves, over the whole
+  !! domain. The Courant number of a time step dt is this rate times dt.
+  !! The wave speed is bounded above by the square root of the trace of
+  !! the matrix that couples the layers, which is the sum of the reduced
+  !! gravity at each interface times the thickness above it.
+
+  subroutine calc_wave_rate(rate, h, u, v, g_vec, dx, dy, wetmask, &
+      nx, ny, layers)
+    implicit none
+
+    double precision, intent(out) :: rate
+    real(wp),         intent(in) :: h(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in) :: u(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in) :: v(0:nx+1, 0:ny+1, layers)
+    double precision, intent(in) :: g_vec(layers)
+    double precision, intent(in) :: dx, dy
+    double precision, intent(in) :: wetmask(0:nx+1, 0:ny+1)
+    integer,          intent(in) :: nx, ny, layers
+
+    double precision :: c_squared, h_above, speed_x, speed_y
+    integer :: i, j, k
+
+    rate = 0d0
+
+    !$omp parallel do private(i, k, c_squared, h_above, speed_x, speed_y) &
+    !$omp reduction(max:rate)
+    do j = 1, ny
+      do i = 1, nx
+        if (wetmask(i,j) .eq. 0d0) cycle
+
+        c_squared = 0d0
+        h_above = 0d0
+        do k = 1, layers
+          h_above = h_above + h(i,j,k)
+          c_squared = c_squared + g_vec(k)*h_above
+        end do
+
+        speed_x = 0d0
+        speed_y = 0d0
+        do k = 1, layers
+          speed_x = max(speed_x, abs(dble(u(i,j,k))), abs(dble(u(i+1,j,k))))
+          speed_y = max(speed_y, abs(dble(v(i,j,k))), abs(dble(v(i,j+1,k))))
+        end do
+
+        rate = max(rate, (speed_x + sqrt(c_squared))/dx &
+            + (speed_y + sqrt(c_squared))/dy)
+      end do
+    end do
+    !$omp end parallel do
+
+    rate = global_max(rate)
+
+    return
+  end subroutine calc_wave_rate
+
+  ! ---------------------------------------------------------------------------
+  !> Choose the next time step from the Courant number limit, without
+  !! growing too quickly from the last one, and keep it within the
+  !! bounds set by the user
+
+  subroutine choose_time_step(dt_step, rate, max_cfl, dt_min, dt_max)
+    implicit none
+
+    double precision, intent(inout) :: dt_step
+    double precision, intent(in)    :: rate, max_cfl, dt_min, dt_max
+
+    double precision :: dt_cfl
+
+    dt_cfl = dt_growth_limit*dt_step
+    if (rate .gt. 0d0) then
+      dt_cfl = min(dt_cfl, max_cfl/rate)
+    else if (rate .ne. rate) then
+      ! NaNs in the state, which will stop the model when it next
+      ! writes output
+      dt_cfl = dt_min
+    end if
+
+    dt_step = max(dt_min, min(dt_cfl, dt_max))
+
+    return
+  end subroutine choose_time_step
+
+  ! ---------------------------------------------------------------------------
+  !> Shorten the time step so that the model lands on the time of the
+  !! next output. If the output is less than two steps away, the
+  !! remaining time is split between two equal steps, so that the time
+  !! step never falls by more than half at once.
+
+  subroutine land_on_output_time(dt_step, landing, model_time, &
+      next_output_time)
+    implicit none
+
+    double precision, intent(inout) :: dt_step
+    logical,          intent(out)   :: landing
+    double precision, intent(in)    :: model_time, next_output_time
+
+    double precision :: remaining
+
+    remaining = next_output_time - model_time
+    landing = .false.
+
+    if (remaining .le. dt_step) then
+      dt_step = remaining
+      landing = .true.
+    else if (remaining .lt. 2d0*dt_step) then
+      dt_step = 0.5d0*remaining
+    end if
+
+    return
+  end subroutine land_on_output_time
+
+  ! ---------------------------------------------------------------------------
+  !> Time of the next output after model_time, for output every freq
+  !! seconds. If freq is zero there is no output.
+
+  double precision function next_output_time(model_time, freq)
+    implicit none
+
+    double precision, intent(in) :: model_time, freq
+
+    if (freq .le. 0d0) then
+      next_output_time = huge(1d0)
+    else
+      next_output_time = (aint(model_time/freq) + 1d0)*freq
+    end if
+
+    return
+  end function next_output_time
+
+  ! ---------------------------------------------------------------------------
+  !> Interpolate the wind magnitude time series, which has one value
+  !! for each time step of length dt from the start of the run, to
+  !! elapsed_time seconds after the start of the run
+
+  double precision function wind_magnitude_at(wind_mag_time_series, &
+      elapsed_time, dt, nTimeSteps)
+    implicit none
+
+    double precision, intent(in) :: wind_mag_time_series(nTimeSteps)
+    double precision, intent(in) :: elapsed_time, dt
+    integer,          intent(in) :: nTimeSteps
+
+    double precision :: position, weight
+    integer :: m
+
+    position = min(max(elapsed_time/dt + 1d0, 1d0), dble(nTimeSteps))
+    m = min(int(position), nTimeSteps - 1)
+
+    if (m .lt. 1) then
+      wind_magnitude_at = wind_mag_time_series(1)
+    else
+      weight = position - dble(m)
+      wind_magnitude_at = (1d0 - weight)*wind_mag_time_series(m) &
+          + weight*wind_mag_time_series(m+1)
+    end if
+
+    return
+  end function wind_magnitude_at
+
+end module time_step_control
@@ -4,6 +4,24 @@ module time_stepping
   use adams_bashforth
   implicit none
 
+  !> Coefficients of the low-storage Runge-Kutta schemes. Each stage
+  !! sets dq = A dq + dt F(q) and then q = q + B dq.
+  double precision, parameter :: RK3_A(3) = (/ 0d0, -5d0/9d0, &
+      -153d0/128d0 /)
+  double precision, parameter :: RK3_B(3) = (/ 1d0/3d0, 15d0/16d0, &
+      8d0/15d0 /)
+  double precision, parameter :: RK4_A(5) = (/ 0d0, &
+      -567301805773d0/1357537059087d0, &
+      -2404267990393d0/2016746695238d0, &
+      -3550918686646d0/2091501179385d0, &
+      -1275806237668d0/842570457699d0 /)
+  double precision, parameter :: RK4_B(5) = (/ &
+      1432997174477d0/9575080441755d0, &
+      5161836677717d0/13612068292357d0, &
+      1720146321549d0/2090206949498d0, &
+      3134564353537d0/4481467310338d0, &
+      2277821191437d0/14882151754819d0 /)
+
   contains
 
   
@@ -60,7 +78,8 @@ module time_stepping
   subroutine initialise_tendencies(dhdt, dudt, dvdt, h, u, v, depth, &
           dx, dy, dt, wetmask, hfacW, hfacE, hfacN, hfacS, fu, fv, &
           au, ar, botDrag, kh, kv, slip, &
-          RedGrav, hAdvecScheme, AB_order, g_vec, rho0, wind_x, wind_y, &
+          RedGrav, hAdvecScheme, tendency_algorithm, &
+          AB_order, g_vec, rho0, wind_x, wind_y, &
           RelativeWind, Cd, &
           spongeHTimeScale, spongeH, &
           spongeUTimeScale, spongeU, &
@@ -68,12 +87,12 @@ module time_stepping
           nx, ny, layers, debug_level)
     implicit none
 
-    double precision, intent(out) :: dhdt(0:nx+1, 0:ny+1, layers, AB_order)
-    double precision, intent(out) :: dudt(0:nx+1, 0:ny+1, layers, AB_order)
-    double precision, intent(out) :: dvdt(0:nx+1, 0:ny+1, layers, AB_order)
-    double precision, intent(inout) :: h(0:nx+1, 0:ny+1, layers)
-    double precision, intent(inout) :: u(0:nx+1, 0:ny+1, layers)
-    double precision, intent(inout) :: v(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(out) :: dhdt(0:nx+1, 0:ny+1, layers, AB_order)
+    real(wp),         intent(out) :: dudt(0:nx+1, 0:ny+1, layers, AB_order)
+    real(wp),         intent(out) :: dvdt(0:nx+1, 0:ny+1, layers, AB_order)
+    real(wp),         intent(inout) :: h(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(inout) :: u(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(inout) :: v(0:nx+1, 0:ny+1, layers)
     double precision, intent(in) :: depth(0:nx+1, 0:ny+1, layers)
     double precision, intent(in) :: dx, dy, dt
     double precision, intent(in) :: wetmask(0:nx+1, 0:ny+1)
@@ -88,6 +107,7 @@ module time_stepping
     double precision, intent(in) :: slip
     logical,          intent(in) :: RedGrav
     integer,          intent(in) :: hAdvecScheme
+    integer,          intent(in) :: tendency_algorithm
     integer,          intent(in) :: AB_order
     double precision, intent(in) :: g_vec(layers)
     double precision, intent(in) :: rho0
@@ -106,9 +126,9 @@ module time_stepping
 
 
 
-    double precision :: h_new(0:nx+1, 0:ny+1, layers)
-    double precision :: u_new(0:nx+1, 0:ny+1, layers)
-    double precision :: v_new(0:nx+1, 0:ny+1, layers)
+    real(wp)         :: h_new(0:nx+1, 0:ny+1, layers)
+    real(wp)         :: u_new(0:nx+1, 0:ny+1, layers)
+    real(wp)         :: v_new(0:nx+1, 0:ny+1, layers)
     integer          :: t
 
     ! Do some initial time steps with Runge-Kutta second-order.
@@ -121,7 +141,8 @@ module time_stepping
           h, u, v, depth, &
           dx, dy, dt, wetmask, hfacW, hfacE, hfacN, hfacS, fu, fv, &
           au, ar, botDrag, kh, kv, slip, &
-          RedGrav, hAdvecScheme, g_vec, rho0, wind_x, wind_y, &
+          RedGrav, hAdvecScheme, tendency_algorithm, &
+          g_vec, rho0, wind_x, wind_y, &
           RelativeWind, Cd, &
           spongeHTimeScale, spongeH, &
           spongeUTimeScale, spongeU, &
@@ -132,10 +153,10 @@ module time_stepping
       call apply_boundary_conditions(u_new, hfacW, wetmask, nx, ny, layers)
       call apply_boundary_conditions(v_new, hfacS, wetmask, nx, ny, layers)
 
-      ! Wrap fields around for periodic simulations
-      call wrap_fields_3D(u_new, nx, ny, layers)
-      call wrap_fields_3D(v_new, nx, ny, layers)
-      call wrap_fields_3D(h_new, nx, ny, layers)
+      ! Fill the halos from the neighbouring tiles
+      call update_halos_3D(u_new, nx, ny, layers)
+      call update_halos_3D(v_new, nx, ny, layers)
+      call update_halos_3D(h_new, nx, ny, layers)
 
       ! Shuffle arrays: new -> present
       ! thickness and velocity fields
@@ -153,11 +174,12 @@ module time_stepping
   !> Step the model forward one timestep. The timestepping scheme is set by the 
   !! TS_algorithm parameter
 
-  subroutine timestep(h_new, u_new, v_new, dhdt, dudt, dvdt, &
-      h, u, v, depth, &
+  subroutine timestep(h_new, u_new, v_new, dhdt, dudt, dvdt, AB_slot, &
+      variable_dt, AB_weights, h, u, v, depth, &
       dx, dy, dt, wetmask, hfacW, hfacE, hfacN, hfacS, fu, fv, &
       au, ar, botDrag, kh, kv, slip, &
-      RedGrav, hAdvecScheme, TS_algorithm, AB_order, &
+      RedGrav, hAdvecScheme, tendency_algorithm, &
+      TS_algorithm, AB_order, &
       g_vec, rho0, wind_x, wind_y, &
       RelativeWind, Cd, &
       spongeHTimeScale, spongeH, &
@@ -167,15 +189,21 @@ module time_stepping
     implicit none
 
 
-    double precision, intent(out)   :: h_new(0:nx+1, 0:ny+1, layers)
-    double precision, intent(out)   :: u_new(0:nx+1, 0:ny+1, layers)
-    double precision, intent(out)   :: v_new(0:nx+1, 0:ny+1, layers)
-    double precision, intent(inout) :: dhdt(0:nx+1, 0:ny+1, layers, AB_order)
-    double precision, intent(inout) :: dudt(0:nx+1, 0:ny+1, layers, AB_order)
-    double precision, intent(inout) :: dvdt(0:nx+1, 0:ny+1, layers, AB_order)
-    double precision, intent(in)    :: h(0:nx+1, 0:ny+1, layers)
-    double precision, intent(in)    :: u(0:nx+1, 0:ny+1, layers)
-    double precision, intent(in)    :: v(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(out)   :: h_new(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(out)   :: u_new(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(out)   :: v_new(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(inout) :: dhdt(0:nx+1, 0:ny+1, layers, AB_order)
+    real(wp),         intent(inout) :: dudt(0:nx+1, 0:ny+1, layers, AB_order)
+    real(wp),         intent(inout) :: dvdt(0:nx+1, 0:ny+1, layers, AB_order)
+    ! where each tendency is kept in dhdt, dudt and dvdt
+    integer,          intent(in)    :: AB_slot(AB_order)
+    ! whether the step length varies, and if so the weights of the
+    ! tendencies for the Adams-Bashforth schemes
+    logical,          intent(in)    :: variable_dt
+    double precision, intent(in)    :: AB_weights(AB_order)
+    real(wp),         intent(in)    :: h(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in)    :: u(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in)    :: v(0:nx+1, 0:ny+1, layers)
     double precision, intent(in)    :: depth(0:nx+1, 0:ny+1, layers)
     double precision, intent(in)    :: dx, dy, dt
     double precision, intent(in)    :: wetmask(0:nx+1, 0:ny+1)
@@ -190,6 +218,7 @@ module time_stepping
     double precision, intent(in)    :: slip
     logical,          intent(in)    :: RedGrav
     integer,          intent(in)    :: hAdvecScheme, TS_algorithm, AB_order
+    integer,          intent(in)    :: tendency_algorithm
     double precision, intent(in)    :: g_vec(layers)
     double precision, intent(in)    :: rho0
     double precision, intent(in)    :: wind_x(0:nx+1, 0:ny+1)
@@ -208,12 +237,35 @@ module time_stepping
 
 
 
-    if (TS_algorithm .eq. 1) then
+    if (variable_dt .and. TS_algorithm .ge. 2 .and. TS_algorithm .le. 5) then
+      ! Adams-Bashforth with steps of varying length
+      call state_derivative(dhdt(:,:,:,AB_slot(1)), dudt(:,:,:,AB_slot(1)), &
+          dvdt(:,:,:,AB_slot(1)), h, u, v, depth, &
+          dx, dy, wetmask, hfacW, hfacE, hfacN, hfacS, fu, fv, &
+          au, ar, botDrag, kh, kv, slip, &
+          RedGrav, hAdvecScheme, tendency_algorithm, &
+          g_vec, rho0, wind_x, wind_y, &
+          RelativeWind, Cd, &
+          spongeHTimeScale, spongeH, &
+          spongeUTimeScale, spongeU, &
+          spongeVTimeScale, spongeV, &
+          nx, ny, layers, n, debug_level)
+
+      call AB_variable(h_new, dhdt, h, AB_weights, nx, ny, layers, &
+          AB_order, AB_slot)
+      call AB_variable(u_new, dudt, u, AB_weights, nx, ny, layers, &
+          AB_order, AB_slot)
+      call AB_variable(v_new, dvdt, v, AB_weights, nx, ny, layers, &
+          AB_order, AB_slot)
+
+    else if (TS_algorithm .eq. 1) then
       ! Forward Euler
-      call state_derivative(dhdt(:,:,:,1), dudt(:,:,:,1), dvdt(:,:,:,1), h, u, v, depth, &
+      call state_derivative(dhdt(:,:,:,AB_slot(1)), dudt(:,:,:,AB_slot(1)), &
+          dvdt(:,:,:,AB_slot(1)), h, u, v, depth, &
           dx, dy, wetmask, hfacW, hfacE, hfacN, hfacS, fu, fv, &
           au, ar, botDrag, kh, kv, slip, &
-          RedGrav, hAdvecScheme, g_vec, rho0, wind_x, wind_y, &
+          RedGrav, hAdvecScheme, tendency_algorithm, &
+          g_vec, rho0, wind_x, wind_y, &
           RelativeWind, Cd, &
           spongeHTimeScale, spongeH, &
           spongeUTimeScale, spongeU, &
@@ -221,17 +273,19 @@ module time_stepping
           nx, ny, layers, n, debug_level)
 
       ! Use dh/dt, du/dt and dv/dt to step h, u and v forward in time
-      call ForwardEuler(h_new, dhdt, h, dt, nx, ny, layers, AB_order)
-      call ForwardEuler(u_new, dudt, u, dt, nx, ny, layers, AB_order)
-      call ForwardEuler(v_new, dvdt, v, dt, nx, ny, layers, AB_order)
+      call ForwardEuler(h_new, dhdt, h, dt, nx, ny, layers, AB_order, AB_slot)
+      call ForwardEuler(u_new, dudt, u, dt, nx, ny, layers, AB_order, AB_slot)
+      call ForwardEuler(v_new, dvdt, v, dt, nx, ny, layers, AB_order, AB_slot)
 
 
     else if (TS_algorithm .eq. 2) then
       ! Second-order AB
-      call state_derivative(dhdt(:,:,:,1), dudt(:,:,:,1), dvdt(:,:,:,1), h, u, v, depth, &
+      call state_derivative(dhdt(:,:,:,AB_slot(1)), dudt(:,:,:,AB_slot(1)), &
+          dvdt(:,:,:,AB_slot(1)), h, u, v, depth, &
           dx, dy, wetmask, hfacW, hfacE, hfacN, hfacS, fu, fv, &
           au, ar, botDrag, kh, kv, slip, &
-          RedGrav, hAdvecScheme, g_vec, rho0, wind_x, wind_y, &
+          RedGrav, hAdvecScheme, tendency_algorithm, &
+          g_vec, rho0, wind_x, wind_y, &
           RelativeWind, Cd, &
           spongeHTimeScale, spongeH, &
           spongeUTimeScale, spongeU, &
@@ -239,16 +293,18 @@ module time_stepping
           nx, ny, layers, n, debug_level)
 
       ! Use dh/dt, du/dt and dv/dt to step h, u and v forward in time
-      call AB2(h_new, dhdt, h, dt, nx, ny, layers, AB_order)
-      call AB2(u_new, dudt, u, dt, nx, ny, layers, AB_order)
-      call AB2(v_new, dvdt, v, dt, nx, ny, layers, AB_order)
+      call AB2(h_new, dhdt, h, dt, nx, ny, layers, AB_order, AB_slot)
+      call AB2(u_new, dudt, u, dt, nx, ny, layers, AB_order, AB_slot)
+      call AB2(v_new, dvdt, v, dt, nx, ny, layers, AB_order, AB_slot)
 
     else if (TS_algorithm .eq. 3) then
       ! Third-order AB
-      call state_derivative(dhdt(:,:,:,1), dudt(:,:,:,1), dvdt(:,:,:,1), h, u, v, depth, &
+      call state_derivative(dhdt(:,:,:,AB_slot(1)), dudt(:,:,:,AB_slot(1)), &
+          dvdt(:,:,:,AB_slot(1)), h, u, v, depth, &
           dx, dy, wetmask, hfacW, hfacE, hfacN, hfacS, fu, fv, &
           au, ar, botDrag, kh, kv, slip, &
-          RedGrav, hAdvecScheme, g_vec, rho0, wind_x, wind_y, &
+          RedGrav, hAdvecScheme, tendency_algorithm, &
+          g_vec, rho0, wind_x, wind_y, &
           RelativeWind, Cd, &
           spongeHTimeScale, spongeH, &
           spongeUTimeScale, spongeU, &
@@ -257,17 +313,19 @@ module time_stepping
 
       ! Use dh/dt, du/dt and dv/dt to step h, u and v forward in time with
       ! the Adams-Bashforth third order linear multistep method
-      call AB3(h_new, dhdt, h, dt, nx, ny, layers, AB_order)
-      call AB3(u_new, dudt, u, dt, nx, ny, layers, AB_order)
-      call AB3(v_new, dvdt, v, dt, nx, ny, layers, AB_order)
+      call AB3(h_new, dhdt, h, dt, nx, ny, layers, AB_order, AB_slot)
+      call AB3(u_new, dudt, u, dt, nx, ny, layers, AB_order, AB_slot)
+      call AB3(v_new, dvdt, v, dt, nx, ny, layers, AB_order, AB_slot)
 
     else if (TS_algorithm .eq. 4) then
       ! Fourth-order AB
 
-      call state_derivative(dhdt(:,:,:,1), dudt(:,:,:,1), dvdt(:,:,:,1), h, u, v, depth, &
+      call state_derivative(dhdt(:,:,:,AB_slot(1)), dudt(:,:,:,AB_slot(1)), &
+          dvdt(:,:,:,AB_slot(1)), h, u, v, depth, &
           dx, dy, wetmask, hfacW, hfacE, hfacN, hfacS, fu, fv, &
           au, ar, botDrag, kh, kv, slip, &
-          RedGrav, hAdvecScheme, g_vec, rho0, wind_x, wind_y, &
+          RedGrav, hAdvecScheme, tendency_algorithm, &
+          g_vec, rho0, wind_x, wind_y, &
           RelativeWind, Cd, &
           spongeHTimeScale, spongeH, &
           spongeUTimeScale, spongeU, &
@@ -275,17 +333,19 @@ module time_stepping
           nx, ny, layers, n, debug_level)
 
       ! Use dh/dt, du/dt and dv/dt to step h, u and v forward in time
-      call AB4(h_new, dhdt, h, dt, nx, ny, layers, AB_order)
-      call AB4(u_new, dudt, u, dt, nx, ny, layers, AB_order)
-      call AB4(v_new, dvdt, v, dt, nx, ny, layers, AB_order)
+      call AB4(h_new, dhdt, h, dt, nx, ny, layers, AB_order, AB_slot)
+      call AB4(u_new, dudt, u, dt, nx, ny, layers, AB_order, AB_slot)
+      call AB4(v_new, dvdt, v, dt, nx, ny, layers, AB_order, AB_slot)
 
     else if (TS_algorithm .eq. 5) then
       ! Fifth-order AB
 
-      call state_derivative(dhdt(:,:,:,1), dudt(:,:,:,1), dvdt(:,:,:,1), h, u, v, depth, &
+      call state_derivative(dhdt(:,:,:,AB_slot(1)), dudt(:,:,:,AB_slot(1)), &
+          dvdt(:,:,:,AB_slot(1)), h, u, v, depth, &
           dx, dy, wetmask, hfacW, hfacE, hfacN, hfacS, fu, fv, &
           au, ar, botDrag, kh, kv, slip, &
-          RedGrav, hAdvecScheme, g_vec, rho0, wind_x, wind_y, &
+          RedGrav, hAdvecScheme, tendency_algorithm, &
+          g_vec, rho0, wind_x, wind_y, &
           RelativeWind, Cd, &
           spongeHTimeScale, spongeH, &
           spongeUTimeScale, spongeU, &
@@ -293,16 +353,17 @@ module time_stepping
           nx, ny, layers, n, debug_level)
 
       ! Use dh/dt, du/dt and dv/dt to step h, u and v forward in time
-      call AB5(h_new, dhdt, h, dt, nx, ny, layers, AB_order)
-      call AB5(u_new, dudt, u, dt, nx, ny, layers, AB_order)
-      call AB5(v_new, dvdt, v, dt, nx, ny, layers, AB_order)
+      call AB5(h_new, dhdt, h, dt, nx, ny, layers, AB_order, AB_slot)
+      call AB5(u_new, dudt, u, dt, nx, ny, layers, AB_order, AB_slot)
+      call AB5(v_new, dvdt, v, dt, nx, ny, layers, AB_order, AB_slot)
 
     else if (TS_algorithm .eq. 12) then
       ! Second-order RK
       call RK2(h_new, u_new, v_new, dhdt, dudt, dvdt, h, u, v, depth, &
           dx, dy, dt, wetmask, hfacW, hfacE, hfacN, hfacS, fu, fv, &
           au, ar, botDrag, kh, kv, slip, &
-          RedGrav, hAdvecScheme, g_vec, rho0, wind_x, wind_y, &
+          RedGrav, hAdvecScheme, tendency_algorithm, &
+          g_vec, rho0, wind_x, wind_y, &
           RelativeWind, Cd, &
           spongeHTimeScale, spongeH, &
           spongeUTimeScale, spongeU, &
@@ -310,12 +371,33 @@ module time_stepping
           nx, ny, layers, n, debug_level)
 
     else if (TS_algorithm .eq. 13) then
-      ! Third-order RK
-      call clean_stop(0, .FALSE.)
+      ! Third-order RK, with the coefficients of Williamson (1980)
+      call low_storage_RK(h_new, u_new, v_new, dhdt, dudt, dvdt, &
+          RK3_A, RK3_B, 3, h, u, v, depth, &
+          dx, dy, dt, wetmask, hfacW, hfacE, hfacN, hfacS, fu, fv, &
+          au, ar, botDrag, kh, kv, slip, &
+          RedGrav, hAdvecScheme, tendency_algorithm, &
+          g_vec, rho0, wind_x, wind_y, &
+          RelativeWind, Cd, &
+          spongeHTimeScale, spongeH, &
+          spongeUTimeScale, spongeU, &
+          spongeVTimeScale, spongeV, &
+          nx, ny, layers, n, debug_level)
 
     else if (TS_algorithm .eq. 14) then
-      ! Fourth-order RK
-      call clean_stop(0, .FALSE.)
+      ! Fourth-order RK, with the five stage scheme of Carpenter and
+      ! Kennedy (1994)
+      call low_storage_RK(h_new, u_new, v_new, dhdt, dudt, dvdt, &
+          RK4_A, RK4_B, 5, h, u, v, depth, &
+          dx, dy, dt, wetmask, hfacW, hfacE, hfacN, hfacS, fu, fv, &
+          au, ar, botDrag, kh, kv, slip, &
+          RedGrav, hAdvecScheme, tendency_algorithm, &
+          g_vec, rho0, wind_x, wind_y, &
+          RelativeWind, Cd, &
+          spongeHTimeScale, spongeH, &
+          spongeUTimeScale, spongeU, &
+          spongeVTimeScale, spongeV, &
+          nx, ny, layers, n, debug_level)
 
     else
       ! TS_algorithm not set correctly
@@ -332,7 +414,8 @@ module time_stepping
   subroutine RK2(h_new, u_new, v_new, dhdt, dudt, dvdt, h, u, v, depth, &
           dx, dy, dt, wetmask, hfacW, hfacE, hfacN, hfacS, fu, fv, &
           au, ar, botDrag, kh, kv, slip, &
-          RedGrav, hAdvecScheme, g_vec, rho0, wind_x, wind_y, &
+          RedGrav, hAdvecScheme, tendency_algorithm, &
+          g_vec, rho0, wind_x, wind_y, &
           RelativeWind, Cd, &
           spongeHTimeScale, spongeH, &
           spongeUTimeScale, spongeU, &
@@ -340,15 +423,15 @@ module time_stepping
           nx, ny, layers, n, debug_level)
     implicit none
 
-    double precision, intent(out) :: h_new(0:nx+1, 0:ny+1, layers)
-    double precision, intent(out) :: u_new(0:nx+1, 0:ny+1, layers)
-    double precision, intent(out) :: v_new(0:nx+1, 0:ny+1, layers)
-    double precision, intent(out) :: dhdt(0:nx+1, 0:ny+1, layers)
-    double precision, intent(out) :: dudt(0:nx+1, 0:ny+1, layers)
-    double precision, intent(out) :: dvdt(0:nx+1, 0:ny+1, layers)
-    double precision, intent(in) :: h(0:nx+1, 0:ny+1, layers)
-    double precision, intent(in) :: u(0:nx+1, 0:ny+1, layers)
-    double precision, intent(in) :: v(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(out) :: h_new(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(out) :: u_new(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(out) :: v_new(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(out) :: dhdt(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(out) :: dudt(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(out) :: dvdt(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in) :: h(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in) :: u(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in) :: v(0:nx+1, 0:ny+1, layers)
     double precision, intent(in) :: depth(0:nx+1, 0:ny+1, layers)
     double precision, intent(in) :: dx, dy, dt
     double precision, intent(in) :: wetmask(0:nx+1, 0:ny+1)
@@ -363,6 +446,7 @@ module time_stepping
     double precision, intent(in) :: slip
     logical,          intent(in) :: RedGrav
     integer,          intent(in) :: hAdvecScheme
+    integer,          intent(in) :: tendency_algorithm
     double precision, intent(in) :: g_vec(layers)
     double precision, intent(in) :: rho0
     double precision, intent(in) :: wind_x(0:nx+1, 0:ny+1)
@@ -380,16 +464,17 @@ module time_stepping
     integer, intent(in) :: debug_level
 
 
-    double precision :: hhalf(0:nx+1, 0:ny+1, layers)
-    double precision :: uhalf(0:nx+1, 0:ny+1, layers)
-    double precision :: vhalf(0:nx+1, 0:ny+1, layers)
+    real(wp)         :: hhalf(0:nx+1, 0:ny+1, layers)
+    real(wp)         :: uhalf(0:nx+1, 0:ny+1, layers)
+    real(wp)         :: vhalf(0:nx+1, 0:ny+1, layers)
 
 
       call state_derivative(dhdt, dudt, dvdt, &
           h, u, v, depth, &
           dx, dy, wetmask, hfacW, hfacE, hfacN, hfacS, fu, fv, &
           au, ar, botDrag, kh, kv, slip, &
-          RedGrav, hAdvecScheme, g_vec, rho0, wind_x, wind_y, &
+          RedGrav, hAdvecScheme, tendency_algorithm, &
+          g_vec, rho0, wind_x, wind_y, &
           RelativeWind, Cd, &
           spongeHTimeScale, spongeH, &
           spongeUTimeScale, spongeU, &
@@ -401,11 +486,17 @@ module time_stepping
       uhalf = u+0.5d0*dt*dudt
       vhalf = v+0.5d0*dt*dvdt
 
+      ! The tendencies are only calculated on the tile
+      call update_halos_3D(uhalf, nx, ny, layers)
+      call update_halos_3D(vhalf, nx, ny, layers)
+      call update_halos_3D(hhalf, nx, ny, layers)
+
       call state_derivative(dhdt, dudt, dvdt, &
           hhalf, uhalf, vhalf, depth, &
           dx, dy, wetmask, hfacW, hfacE, hfacN, hfacS, fu, fv, &
           au, ar, botDrag, kh, kv, slip, &
-          RedGrav, hAdvecScheme, g_vec, rho0, wind_x, wind_y, &
+          RedGrav, hAdvecScheme, tendency_algorithm, &
+          g_vec, rho0, wind_x, wind_y, &
           RelativeWind, Cd, &
           spongeHTimeScale, spongeH, &
           spongeUTimeScale, spongeU, &
@@ -419,4 +510,155 @@ module time_stepping
 
   end subroutine RK2
 
+  ! ---------------------------------------------------------------------------
+  !> A low-storage (2N register) Runge-Kutta algorithm, with the
+  !! coefficients of each stage given in rk_A and rk_B. The state is
+  !! advanced in place in h_new, u_new and v_new, and the weighted sum
+  !! of the stage tendencies is kept in dhdt_sum, dudt_sum and dvdt_sum,
+  !! so the cost in memory does not grow with the number of stages.
+  !! On return dhdt, dudt and dvdt hold the tendencies of the last stage.
+
+  subroutine low_storage_RK(h_new, u_new, v_new, dhdt, dudt, dvdt, &
+          rk_A, rk_B, stages, h, u, v, depth, &
+          dx, dy, dt, wetmask, hfacW, hfacE, hfacN, hfacS, fu, fv, &
+          au, ar, botDrag, kh, kv, slip, &
+          RedGrav, hAdvecScheme, tendency_algorithm, &
+          g_vec, rho0, wind_x, wind_y, &
+          RelativeWind, Cd, &
+          spongeHTimeScale, spongeH, &
+          spongeUTimeScale, spongeU, &
+          spongeVTimeScale, spongeV, &
+          nx, ny, layers, n, debug_level)
+    implicit none
+
+    real(wp),         intent(out) :: h_new(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(out) :: u_new(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(out) :: v_new(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(out) :: dhdt(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(out) :: dudt(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(out) :: dvdt(0:nx+1, 0:ny+1, layers)
+    integer,          intent(in) :: stages
+    double precision, intent(in) :: rk_A(stages), rk_B(stages)
+    real(wp),         intent(in) :: h(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in) :: u(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in) :: v(0:nx+1, 0:ny+1, layers)
+    double precision, intent(in) :: depth(0:nx+1, 0:ny+1, layers)
+    double precision, intent(in) :: dx, dy, dt
+    double precision, intent(in) :: wetmask(0:nx+1, 0:ny+1)
+    double precision, intent(in) :: hfacW(0:nx+1, 0:ny+1)
+    double precision, intent(in) :: hfacE(0:nx+1, 0:ny+1)
+    double precision, intent(in) :: hfacN(0:nx+1, 0:ny+1)
+    double precision, intent(in) :: hfacS(0:nx+1, 0:ny+1)
+    double precision, intent(in) :: fu(0:nx+1, 0:ny+1)
+    double precision, intent(in) :: fv(0:nx+1, 0:ny+1)
+    double precision, intent(in) :: au, ar, botDrag
+    double precision, intent(in) :: kh(layers), kv
+    double precision, intent(in) :: slip
+    logical,          intent(in) :: RedGrav
+    integer,          intent(in) :: hAdvecScheme
+    integer,          intent(in) :: tendency_algorithm
+    double precision, intent(in) :: g_vec(layers)
+    double precision, intent(in) :: rho0
+    double precision, intent(in) :: wind_x(0:nx+1, 0:ny+1)
+    double precision, intent(in) :: wind_y(0:nx+1, 0:ny+1)
+    logical,          intent(in) :: RelativeWind
+    double precision, intent(in) :: Cd
+    double precision, intent(in) :: spongeHTimeScale(0:nx+1, 0:ny+1, layers)
+    double precision, intent(in) :: spongeH(0:nx+1, 0:ny+1, layers)
+    double precision, intent(in) :: spongeUTimeScale(0:nx+1, 0:ny+1, layers)
+    double precision, intent(in) :: spongeU(0:nx+1, 0:ny+1, layers)
+    double precision, intent(in) :: spongeVTimeScale(0:nx+1, 0:ny+1, layers)
+    double precision, intent(in) :: spongeV(0:nx+1, 0:ny+1, layers)
+    integer, intent(in) :: nx, ny, layers
+    integer, intent(in) :: n
+    integer, intent(in) :: debug_level
+
+
+    real(wp)         :: dhdt_sum(0:nx+1, 0:ny+1, layers)
+    real(wp)         :: dudt_sum(0:nx+1, 0:ny+1, layers)
+    real(wp)         :: dvdt_sum(0:nx+1, 0:ny+1, layers)
+    integer          :: stage
+
+    h_new = h
+    u_new = u
+    v_new = v
+
+    do stage = 1, stages
+
+      call state_derivative(dhdt, dudt, dvdt, &
+          h_new, u_new, v_new, depth, &
+          dx, dy, wetmask, hfacW, hfacE, hfacN, hfacS, fu, fv, &
+          au, ar, botDrag, kh, kv, slip, &
+          RedGrav, hAdvecScheme, tendency_algorithm, &
+          g_vec, rho0, wind_x, wind_y, &
+          RelativeWind, Cd, &
+          spongeHTimeScale, spongeH, &
+          spongeUTimeScale, spongeU, &
+          spongeVTimeScale, spongeV, &
+          nx, ny, layers, n, debug_level)
+
+      call low_storage_RK_stage(h_new, dhdt_sum, dhdt, rk_A(stage), &
+          rk_B(stage), dt, stage .eq. 1, nx, ny, layers)
+      call low_storage_RK_stage(u_new, dudt_sum, dudt, rk_A(stage), &
+          rk_B(stage), dt, stage .eq. 1, nx, ny, layers)
+      call low_storage_RK_stage(v_new, dvdt_sum, dvdt, rk_A(stage), &
+          rk_B(stage), dt, stage .eq. 1, nx, ny, layers)
+
+      ! The caller applies these to the state at the end of the step
+      if (stage .lt. stages) then
+        call apply_boundary_conditions(u_new, hfacW, wetmask, nx, ny, layers)
+        call apply_boundary_conditions(v_new, hfacS, wetmask, nx, ny, layers)
+
+        call update_halos_3D(u_new, nx, ny, layers)
+        call update_halos_3D(v_new, nx, ny, layers)
+        call update_halos_3D(h_new, nx, ny, layers)
+      end if
+    end do
+
+  end subroutine low_storage_RK
+
+  ! ---------------------------------------------------------------------------
+  !> Update one field and its sum of tendencies for a stage of
+  !! low_storage_RK, in a single pass over the arrays. The sum is not
+  !! read on the first stage, so it need not be initialised.
+
+  subroutine low_storage_RK_stage(X, dXdt_sum, dXdt, rk_A, rk_B, dt, &
+      first_stage, nx, ny, layers)
+    implicit none
+
+    real(wp),         intent(inout) :: X(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(inout) :: dXdt_sum(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in) :: dXdt(0:nx+1, 0:ny+1, layers)
+    double precision, intent(in) :: rk_A, rk_B, dt
+    logical,          intent(in) :: first_stage
+    integer,          intent(in) :: nx, ny, layers
+
+    integer :: i, j, k
+
+    if (first_stage) then
+      !$omp parallel do collapse(2) private(i)
+      do k = 1, layers
+        do j = 0, ny+1
+          do i = 0, nx+1
+            dXdt_sum(i,j,k) = dt*dXdt(i,j,k)
+            X(i,j,k) = X(i,j,k) + rk_B*dXdt_sum(i,j,k)
+          end do
+        end do
+      end do
+      !$omp end parallel do
+    else
+      !$omp parallel do collapse(2) private(i)
+      do k = 1, layers
+        do j = 0, ny+1
+          do i = 0, nx+1
+            dXdt_sum(i,j,k) = rk_A*dXdt_sum(i,j,k) + dt*dXdt(i,j,k)
+            X(i,j,k) = X(i,j,k) + rk_B*dXdt_sum(i,j,k)
+          end do
+        end do
+      end do
+      !$omp end parallel do
+    end if
+
+  end subroutine low_storage_RK_stage
+
 end module time_stepping
@@ -8,29 +8,35 @@ module vorticity
 
   ! ---------------------------------------------------------------------------
   !> Evaluate relative vorticity at lower left grid boundary (du/dy
-  !! and dv/dx are at lower left corner as well)
-  subroutine evaluate_zeta(zeta, u, v, nx, ny, layers, dx, dy)
+  !! and dv/dx are at lower left corner as well). This includes the
+  !! corners on the north and east edges of the tile, which are all
+  !! that the momentum tendencies read beyond it, so the halo is not
+  !! exchanged.
+  subroutine evaluate_zeta(zeta, u, v, nx, ny, layers, dx, dy, wet)
     implicit none
 
-    double precision, intent(out) :: zeta(0:nx+1, 0:ny+1, layers)
-    double precision, intent(in)  :: u(0:nx+1, 0:ny+1, layers)
-    double precision, intent(in)  :: v(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(out) :: zeta(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in)  :: u(0:nx+1, 0:ny+1, layers)
+    real(wp),         intent(in)  :: v(0:nx+1, 0:ny+1, layers)
     integer, intent(in) :: nx, ny, layers
     double precision, intent(in)  :: dx, dy
+    type(wet_spans), intent(in) :: wet
 
-    integer i, j, k
+    integer i, j, k, s
 
     zeta = 0d0
 
+    !$omp parallel do collapse(2) private(i, s)
     do k = 1, layers
       do j = 1, ny+1
-        do i = 1, nx+1
-          zeta(i,j,k) = (v(i,j,k)-v(i-1,j,k))/dx-(u(i,j,k)-u(i,j-1,k))/dy
+        do s = wet%first(j), wet%first(j+1) - 1
+          do i = max(wet%lo(s), 1), min(wet%hi(s), nx+1)
+            zeta(i,j,k) = (v(i,j,k)-v(i-1,j,k))/dx-(u(i,j,k)-u(i,j-1,k))/dy
+          end do
         end do
       end do
     end do
-
-    call wrap_fields_3D(zeta, nx, ny, layers)
+    !$omp end parallel do
 
     return
   end subroutine evaluate_zeta
@@ -1,13 +1,17 @@
 '''Unit tests for Aronnax'''
 
 from contextlib import contextmanager
+import glob
 import os.path as p
 import re
+import shutil
 
 import numpy as np
 from scipy.io import FortranFile
 
 import aronnax as aro
+import aronnax.driver as drv
+import aronnax.postprocess as post
 
 import pytest
 
@@ -60,5 +64,115 @@ def test_time_series_generator_const():
                                 [const_value, const_value])
 
 
-
-
+def test_rectangular_pool():
+    '''Test that the rectangular pool is laid out as the other
+    generators lay out fields, with y first, on a non-square grid.'''
+
+    grid = aro.Grid(10, 20, 1, 1e3, 1e3)
+    wetmask = aro.rectangular_pool(grid, 1)
+    assert wetmask.shape == (20, 10)
+
+    X, Y = np.meshgrid(grid.x, grid.y)
+    expected = np.where((X > X.min()) & (X < X.max())
+                        & (Y > Y.min()) & (Y < Y.max()), 1., 0.)
+    np.testing.assert_array_equal(wetmask, expected)
+
+
+def test_memmap_raw_file():
+    '''Test that memory-mapped output matches output read in full.'''
+
+    outdir = p.join(p.dirname(p.abspath(__file__)),
+                    'beta_plane_bump', 'good-output')
+    nx = 10; ny = 10; layers = 2
+
+    for name in ['snap.h.0000000201', 'snap.u.0000000201',
+                 'snap.v.0000000201', 'snap.eta.0000000201']:
+        outfile = p.join(outdir, name)
+        mapped = aro.memmap_raw_file(outfile, nx, ny, layers)
+        read = aro.interpret_raw_file(outfile, nx, ny, layers)
+        assert mapped.shape == read.shape
+        np.testing.assert_array_equal(mapped, read)
+        np.testing.assert_array_equal(mapped[:, 4, -1], read[:, 4, -1])
+
+    # the output file does not hold an array of this size
+    with pytest.raises(ValueError):
+        aro.memmap_raw_file(p.join(outdir, 'snap.h.0000000201'),
+                            nx, ny+1, layers)
+
+
+def test_open_output():
+    '''Test lazy reading of all the output of a run.'''
+
+    work_dir = p.join(p.dirname(p.abspath(__file__)), 'beta_plane_bump')
+    run = aro.open_output(work_dir, config_path='aronnax.conf',
+                          output_path='good-output', cache_size=4)
+    assert 'snap.h' in run and 'debug.dudt' in run
+
+    u = run['snap.u']
+    np.testing.assert_array_equal(u.iter, [1, 201, 401])
+    np.testing.assert_array_equal(u.time, u.iter*600.)
+
+    outfiles = sorted(glob.glob(p.join(work_dir, 'good-output', 'snap.u.*')))
+    full = np.array([aro.interpret_raw_file(outfile, 10, 10, 2)
+                     for outfile in outfiles])
+    assert u.shape == full.shape
+    for key in [(slice(None),), (1,), (slice(None), 3, 4, 1),
+                (-1, slice(2, 5), 4), ([0, 2], 3)]:
+        np.testing.assert_array_equal(u[key], full[key])
+    assert len(u._cache) == 4
+
+    assert run['snap.eta'].shape == (3, 10, 10, 1)
+
+
+def layer_means(infile, outfile, grid):
+    h = aro.interpret_raw_file(infile, grid.nx, grid.ny, grid.layers)
+    np.save(outfile, np.mean(h, axis=(0, 1)))
+
+def copy_run(tmpdir, pattern):
+    '''Copy some of the blessed output of a test into a fresh run directory.'''
+    test_dir = p.join(p.dirname(p.abspath(__file__)), 'beta_plane_bump')
+    work_dir = str(tmpdir)
+    shutil.copy(p.join(test_dir, 'aronnax.conf'),
+                p.join(work_dir, 'aronnax-merged.conf'))
+    tmpdir.mkdir('output')
+    for outfile in glob.glob(p.join(test_dir, 'good-output', pattern)):
+        shutil.copy(outfile, p.join(work_dir, 'output'))
+    return work_dir
+
+def test_postprocess(tmpdir):
+    '''Test that post-processing is ordered and skips finished work.'''
+
+    work_dir = copy_run(tmpdir, 'snap.h.*')
+    task = post.Task(layer_means, 'output/snap.h.*', 'means/{name}.npy')
+    [targets] = post.postprocess([task], work_dir, processes=2)
+
+    hfiles = sorted(glob.glob(p.join(work_dir, 'output', 'snap.h.*')))
+    assert [p.basename(t) for t in targets] == \
+        [p.basename(f) + '.npy' for f in hfiles]
+    for hfile, target in zip(hfiles, targets):
+        h = aro.interpret_raw_file(hfile, 10, 10, 2)
+        np.testing.assert_allclose(np.load(target), np.mean(h, axis=(0, 1)))
+    assert sorted(tmpdir.join('means').listdir()) == \
+        sorted(tmpdir.join('means', p.basename(t)) for t in targets)
+
+    # Running again only redoes the work that is missing
+    mtimes = [p.getmtime(t) for t in targets]
+    tmpdir.join('means', p.basename(targets[1])).remove()
+    post.postprocess([task], work_dir, processes=2)
+    assert [p.getmtime(t) for t in targets[::2]] == mtimes[::2]
+    assert p.exists(targets[1])
+
+def test_convert_output_to_NetCDF(tmpdir):
+    '''Test conversion of raw output to NetCDF.'''
+    netCDF4 = pytest.importorskip('netCDF4')
+
+    work_dir = copy_run(tmpdir, 'snap.*.0000000201')
+    drv.convert_output_to_netcdf(work_dir)
+    for name in ['h', 'u', 'v', 'eta']:
+        outfile = p.join(work_dir, 'output', 'snap.%s.0000000201' % name)
+        with netCDF4.Dataset(p.join(work_dir, 'netcdf-output',
+                             p.basename(outfile) + '.nc')) as ds:
+            assert ds.variables['iter'][0] == 201
+            ans = ds.variables[name][0].transpose()
+        good_ans = aro.interpret_raw_file(outfile, 10, 10, 2)
+        np.testing.assert_array_equal(ans, good_ans.reshape(ans.shape))
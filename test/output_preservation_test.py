@@ -1,11 +1,15 @@
+import ConfigParser as par
 import os
 import os.path as p
+import shutil
 import subprocess as sub
 import time
 
 import glob
+from distutils.spawn import find_executable
 
 import numpy as np
+import pytest
 
 import matplotlib
 matplotlib.use("Agg")
@@ -71,6 +75,60 @@ def assert_outputs_close(nx, ny, layers, rtol):
 
     assert test_passes
 
+def assert_netcdf_outputs_close(stream, rtol):
+    """Compare each record of a stream written to NetCDF by the core
+    with the raw output files in good-output."""
+    import netCDF4
+
+    test_passes = True
+    with netCDF4.Dataset(p.join("netcdf-output", stream + ".nc")) as ds:
+        nx = len(ds.dimensions["x"])
+        ny = len(ds.dimensions["y"])
+        layers = len(ds.dimensions["layers"])
+        good_hfiles = sorted(glob.glob("good-output/%s.h.*" % stream))
+        assert len(ds.dimensions["time"]) == len(good_hfiles)
+        for record, n in enumerate(ds.variables["iter"][:]):
+            for name, var in ds.variables.iteritems():
+                if "time" not in var.dimensions or name in ["time", "iter"]:
+                    continue
+                if name.startswith("wind"):
+                    good_file = "good-output/%s.%010d" % (name, n)
+                else:
+                    good_file = "good-output/%s.%s.%010d" % (stream, name, n)
+                ans = var[record].transpose()
+                good_ans = aro.interpret_raw_file(good_file, nx, ny, layers)
+                relerr = np.amax(array_relative_error(
+                    ans, good_ans.reshape(ans.shape)))
+                if (relerr >= rtol or np.isnan(relerr)):
+                    print "test failed at " + good_file
+                    test_passes = False
+
+    assert test_passes
+
+def assert_netcdf_outputs_identical(reference):
+    """Check that the NetCDF output files are the same, record for
+    record and bit for bit, as those in the directory reference."""
+    import netCDF4
+
+    outfiles = sorted(glob.glob("netcdf-output/*.nc"))
+    assert [p.basename(f) for f in outfiles] == sorted(
+        p.basename(f) for f in glob.glob(p.join(reference, "*.nc")))
+    for outfile in outfiles:
+        with netCDF4.Dataset(outfile) as ds, \
+             netCDF4.Dataset(p.join(reference, p.basename(outfile))) as good:
+            assert sorted(ds.variables) == sorted(good.variables)
+            for name in ds.variables:
+                np.testing.assert_array_equal(ds.variables[name][:],
+                                              good.variables[name][:])
+
+def skip_without_netcdf():
+    """Skip a test that needs the NetCDF build of the core, or netCDF4
+    to read its output, if they are not available."""
+    pytest.importorskip("netCDF4")
+    if (find_executable("nf-config") is None
+            and find_executable("nc-config") is None):
+        pytest.skip("NetCDF (nf-config or nc-config) is not installed")
+
 def assert_volume_conservation(nx,ny,layers,rtol):
     hfiles = sorted(glob.glob("output/snap.h.*"))
 
@@ -101,6 +159,102 @@ def assert_diagnostics_similar(variables, rtol):
             (diags[variable]+1e-10)) < rtol
     
 
+def assert_solver_diagnostics(iterative=True):
+    """Check that the pressure solver recorded every time step, and
+    reduced the residual by the run's `eps` on each of them. A direct
+    solve must take no iterations, so that a fall back to an iterative
+    solver is caught."""
+    config = par.RawConfigParser()
+    config.read('aronnax-merged.conf')
+    nTimeSteps = config.getint('numerics', 'nTimeSteps')
+    eps = config.getfloat('numerics', 'eps')
+    diag = np.loadtxt('output/diagnostic.solver.csv', delimiter=',',
+                      skiprows=1, ndmin=2)
+    assert diag.shape == (nTimeSteps, 6)
+    np.testing.assert_array_equal(diag[:,0], np.arange(1, nTimeSteps + 1))
+    if iterative:
+        assert np.all(diag[:,1] > 0)
+    else:
+        assert np.all(diag[:,1] == 0)
+    assert np.all(diag[:,3] <= eps*diag[:,2])
+    assert np.all(diag[:,4] >= 0)
+    assert np.all(diag[:,5] >= 0)
+
+def keep_output(name):
+    """Copy the output of a run to the directory name, to compare a
+    later run against."""
+    if p.exists(name):
+        shutil.rmtree(name)
+    shutil.copytree("output", name)
+
+def interrupt_output(niter0):
+    """Leave the output as a run interrupted just after the checkpoint
+    at niter0 would have left it."""
+    for f in glob.glob("output/*.0*"):
+        if int(f.split('.')[-1]) > niter0:
+            os.remove(f)
+    for f in glob.glob("output/diagnostic.*.csv"):
+        with open(f) as csv:
+            lines = csv.readlines()
+        with open(f, 'w') as csv:
+            csv.writelines(lines[:1] + [line for line in lines[1:]
+                                        if int(line.split(',')[0]) <= niter0])
+
+def interrupt_netcdf_output(niter0):
+    """Leave the NetCDF output as a run interrupted just after the
+    checkpoint at niter0 would have left it. The time dimension cannot
+    be shortened, so the records up to niter0 are copied to new files."""
+    import netCDF4
+
+    for f in glob.glob("netcdf-output/*.nc"):
+        with netCDF4.Dataset(f) as old, \
+             netCDF4.Dataset(f + ".tmp", "w") as new:
+            kept = np.count_nonzero(old.variables["iter"][:] <= niter0)
+            new.setncatts(old.__dict__)
+            for name, dim in old.dimensions.iteritems():
+                new.createDimension(
+                    name, None if dim.isunlimited() else len(dim))
+            for name, var in old.variables.iteritems():
+                new_var = new.createVariable(name, var.dtype, var.dimensions)
+                new_var.setncatts(var.__dict__)
+                if "time" not in var.dimensions:
+                    new_var[:] = var[:]
+                elif kept > 0:
+                    new_var[:kept] = var[:kept]
+        os.rename(f + ".tmp", f)
+
+def assert_outputs_identical(reference, nx, ny, layers, diagnostics_rtol=None):
+    """Check that the output files and diagnostics are the same, bit for
+    bit, as those in the directory reference. The time the pressure
+    solver took is left out. With `diagnostics_rtol`, the diagnostics
+    need only agree to that relative tolerance, as when the sums over
+    the domain are taken in a different order."""
+    outfiles = sorted(glob.glob("output/*.0*"))
+    assert [p.basename(f) for f in outfiles] == sorted(
+        p.basename(f) for f in glob.glob(p.join(reference, "*.0*")))
+    for outfile in outfiles:
+        ans = aro.interpret_raw_file(outfile, nx, ny, layers)
+        good_ans = aro.interpret_raw_file(
+            p.join(reference, p.basename(outfile)), nx, ny, layers)
+        np.testing.assert_array_equal(ans, good_ans)
+    def read_diagnostics(name):
+        with open(name) as csv:
+            rows = [line.rstrip().split(',') for line in csv]
+        if "solve_time" in rows[0]:
+            column = rows[0].index("solve_time")
+            rows = [row[:column] + row[column+1:] for row in rows]
+        return rows
+    for outfile in sorted(glob.glob("output/diagnostic.*.csv")):
+        rows = read_diagnostics(outfile)
+        good_rows = read_diagnostics(p.join(reference, p.basename(outfile)))
+        if diagnostics_rtol is None:
+            assert rows == good_rows
+        else:
+            assert rows[0] == good_rows[0]
+            np.testing.assert_allclose(np.array(rows[1:], dtype=float),
+                                       np.array(good_rows[1:], dtype=float),
+                                       rtol=diagnostics_rtol, atol=1e-15)
+
 ### The test cases themselves
 
 test_executable = "aronnax_test"
@@ -138,6 +292,20 @@ def test_gaussian_bump_red_grav():
         assert_volume_conservation(10, 10, 1, 1e-5)
         assert_diagnostics_similar(['h', 'u', 'v'], 1e-10)
 
+def test_gaussian_bump_red_grav_keep_checkpoints():
+    xlen = 1e6
+    ylen = 1e6
+    with working_directory(p.join(self_path, "beta_plane_bump_red_grav")):
+        for f in glob.glob("checkpoints/checkpoint.*"):
+            os.remove(f)
+        drv.simulate(initHfile=[bump], exe=test_executable,
+                     nx=10, ny=10, dx=xlen/10, dy=ylen/10,
+                     checkpointFreq=6e4, keep_checkpoints=2)
+        assert_outputs_close(10, 10, 1, 1.5e-13)
+        # the last regular checkpoint and the one at the end of the run
+        assert sorted(os.listdir("checkpoints")) == [
+            "checkpoint.0000000501", "checkpoint.0000000503"]
+
 
 def test_gaussian_bump():
     xlen = 1e6
@@ -160,6 +328,86 @@ def test_gaussian_bump_continuation():
         assert_volume_conservation(10, 10, 2, 1e-5)
         assert_diagnostics_similar(['h', 'u', 'v', 'eta'], 1e-10)
 
+def test_gaussian_bump_restart():
+    """Restart from a checkpoint part way through a run, and check that
+    the rest of the run is the same as the uninterrupted run."""
+    xlen = 1e6
+    ylen = 1e6
+    with working_directory(p.join(self_path, "beta_plane_bump_restart")):
+        for f in glob.glob("checkpoints/checkpoint.*"):
+            os.remove(f)
+        drv.simulate(initHfile=[bump, lambda X, Y: 2000. - bump(X, Y)],
+                     nx=10, ny=10, exe=test_executable,
+                     dx=xlen/10, dy=ylen/10)
+        keep_output("uninterrupted-output")
+        assert p.exists("checkpoints/checkpoint.0000000201")
+        interrupt_output(201)
+        drv.simulate(initHfile=[bump, lambda X, Y: 2000. - bump(X, Y)],
+                     nx=10, ny=10, exe=test_executable,
+                     dx=xlen/10, dy=ylen/10,
+                     niter0=201, nTimeSteps=301)
+        assert_outputs_identical("uninterrupted-output", 10, 10, 2)
+
+def test_gaussian_bump_restart_NetCDF():
+    """Restart from a checkpoint with NetCDF output, which must stop
+    while the files hold records from after the checkpoint, and check
+    that the files are then the same as those of the uninterrupted run."""
+    skip_without_netcdf()
+    xlen = 1e6
+    ylen = 1e6
+    with working_directory(p.join(self_path, "beta_plane_bump_restart")):
+        for f in glob.glob("checkpoints/checkpoint.*"):
+            os.remove(f)
+        if p.exists("netcdf-output"):
+            shutil.rmtree("netcdf-output")
+        drv.simulate(initHfile=[bump, lambda X, Y: 2000. - bump(X, Y)],
+                     nx=10, ny=10, exe="aronnax_netcdf_test",
+                     dx=xlen/10, dy=ylen/10, output_format=2)
+        if p.exists("uninterrupted-netcdf-output"):
+            shutil.rmtree("uninterrupted-netcdf-output")
+        shutil.copytree("netcdf-output", "uninterrupted-netcdf-output")
+        with pytest.raises(sub.CalledProcessError):
+            drv.simulate(initHfile=[bump, lambda X, Y: 2000. - bump(X, Y)],
+                         nx=10, ny=10, exe="aronnax_netcdf_test",
+                         dx=xlen/10, dy=ylen/10, output_format=2,
+                         niter0=201, nTimeSteps=301)
+        interrupt_netcdf_output(201)
+        drv.simulate(initHfile=[bump, lambda X, Y: 2000. - bump(X, Y)],
+                     nx=10, ny=10, exe="aronnax_netcdf_test",
+                     dx=xlen/10, dy=ylen/10, output_format=2,
+                     niter0=201, nTimeSteps=301)
+        assert_netcdf_outputs_identical("uninterrupted-netcdf-output")
+
+def test_gaussian_bump_bad_checkpoint():
+    """Check that a run stops rather than restart from a checkpoint that
+    has been cut short, or whose fields or header have been changed."""
+    xlen = 1e6
+    ylen = 1e6
+    with working_directory(p.join(self_path, "beta_plane_bump_restart")):
+        for f in glob.glob("checkpoints/checkpoint.*"):
+            os.remove(f)
+        drv.simulate(initHfile=[bump, lambda X, Y: 2000. - bump(X, Y)],
+                     nx=10, ny=10, exe=test_executable,
+                     dx=xlen/10, dy=ylen/10, nTimeSteps=201)
+        with open("checkpoints/checkpoint.0000000201", "rb") as f:
+            good = bytearray(f.read())
+        # The header record starts with a 4 byte length, and the model
+        # time is its last 8 bytes
+        header_end = 4 + 18 + 4*8 + 8
+        truncated = good[:len(good)//2]
+        bad_field = bytearray(good)
+        bad_field[len(good)//2] ^= 1
+        bad_header = bytearray(good)
+        bad_header[header_end - 1] ^= 1
+        for bad in [truncated, bad_field, bad_header]:
+            with open("checkpoints/checkpoint.0000000201", "wb") as f:
+                f.write(bad)
+            with pytest.raises(sub.CalledProcessError):
+                drv.simulate(initHfile=[bump, lambda X, Y: 2000. - bump(X, Y)],
+                             nx=10, ny=10, exe=test_executable,
+                             dx=xlen/10, dy=ylen/10,
+                             niter0=201, nTimeSteps=10)
+
 def test_gaussian_bump_debug_test():
     xlen = 1e6
     ylen = 1e6
@@ -185,6 +433,173 @@ def test_beta_plane_gyre_red_grav():
         assert_volume_conservation(nx, ny, layers, 1e-5)
         assert_diagnostics_similar(['h', 'u', 'v'], 1e-10)
 
+
+def test_beta_plane_gyre_red_grav_NetCDF():
+    skip_without_netcdf()
+    xlen = 1e6
+    ylen = 2e6
+    nx = 10; ny = 20
+    layers = 1
+    grid = aro.Grid(nx, ny, layers, xlen / nx, ylen / ny)
+    def wind(_, Y):
+        return 0.05 * (1 - np.cos(2*np.pi * Y/np.max(grid.y)))
+    with working_directory(p.join(self_path, "beta_plane_gyre_red_grav")):
+        drv.simulate(zonalWindFile=[wind], valgrind=False,
+                     nx=nx, ny=ny, exe="aronnax_netcdf_test",
+                     dx=xlen/nx, dy=ylen/ny,
+                     output_format=2, deflate_level=4)
+        assert_netcdf_outputs_close("snap", 4e-13)
+        assert_netcdf_outputs_close("av", 4e-13)
+        assert_diagnostics_similar(['h', 'u', 'v'], 1e-10)
+
+def test_beta_plane_gyre_red_grav_fused():
+    xlen = 1e6
+    ylen = 2e6
+    nx = 10; ny = 20
+    layers = 1
+    grid = aro.Grid(nx, ny, layers, xlen / nx, ylen / ny)
+    def wind(_, Y):
+        return 0.05 * (1 - np.cos(2*np.pi * Y/np.max(grid.y)))
+    with working_directory(p.join(self_path, "beta_plane_gyre_red_grav")):
+        drv.simulate(zonalWindFile=[wind], valgrind=False,
+                     nx=nx, ny=ny, exe=test_executable, dx=xlen/nx, dy=ylen/ny,
+                     tendency_algorithm=2)
+        assert_outputs_close(nx, ny, layers, 4e-13)
+        assert_volume_conservation(nx, ny, layers, 1e-5)
+        assert_diagnostics_similar(['h', 'u', 'v'], 1e-10)
+
+def assert_fused_matches_unfused(directory, layers):
+    """Run the wind driven gyre on a grid wider than one block of the
+fused tendency loops, once with the separate kernels and once with
+`tendency_algorithm = 2`, and check that they agree."""
+    xlen = 1e6
+    ylen = 2e6
+    nx = 70; ny = 20
+    grid = aro.Grid(nx, ny, layers, xlen / nx, ylen / ny)
+    def wind(_, Y):
+        return 0.05 * (1 - np.cos(2*np.pi * Y/np.max(grid.y)))
+    with working_directory(p.join(self_path, directory)):
+        # Output from runs on other grids would not be read correctly
+        if p.exists("output"):
+            shutil.rmtree("output")
+        drv.simulate(zonalWindFile=[wind], valgrind=False,
+                     nx=nx, ny=ny, exe=test_executable, dx=xlen/nx, dy=ylen/ny,
+                     tendency_algorithm=1)
+        unfused_outputs = {p.basename(outfile):
+            aro.interpret_raw_file(outfile, nx, ny, layers)
+            for outfile in glob.glob("output/*.0*")}
+        drv.simulate(zonalWindFile=[wind], valgrind=False,
+                     nx=nx, ny=ny, exe=test_executable, dx=xlen/nx, dy=ylen/ny,
+                     tendency_algorithm=2)
+        outfiles = sorted(glob.glob("output/*.0*"))
+        assert sorted(p.basename(f) for f in outfiles) == sorted(unfused_outputs)
+        for outfile in outfiles:
+            ans = aro.interpret_raw_file(outfile, nx, ny, layers)
+            relerr = np.amax(array_relative_error(ans,
+                unfused_outputs[p.basename(outfile)]))
+            assert relerr < 1e-12, outfile
+        assert_volume_conservation(nx, ny, layers, 1e-5)
+        # The next test in this directory runs on the usual grid
+        shutil.rmtree("output")
+
+def test_beta_plane_gyre_red_grav_fused_wide():
+    assert_fused_matches_unfused("beta_plane_gyre_red_grav", 1)
+
+def test_beta_plane_gyre_free_surf_fused_wide():
+    assert_fused_matches_unfused("beta_plane_gyre_free_surf", 2)
+
+def test_beta_plane_gyre_red_grav_RK3():
+    xlen = 1e6
+    ylen = 2e6
+    nx = 10; ny = 20
+    layers = 1
+    grid = aro.Grid(nx, ny, layers, xlen / nx, ylen / ny)
+    def wind(_, Y):
+        return 0.05 * (1 - np.cos(2*np.pi * Y/np.max(grid.y)))
+    with working_directory(p.join(self_path, "beta_plane_gyre_red_grav_RK3")):
+        drv.simulate(zonalWindFile=[wind], valgrind=False,
+                     nx=nx, ny=ny, exe=test_executable, dx=xlen/nx, dy=ylen/ny)
+        assert_outputs_close(nx, ny, layers, 4e-13)
+        assert_volume_conservation(nx, ny, layers, 1e-5)
+        assert_diagnostics_similar(['h', 'u', 'v'], 1e-10)
+
+def test_beta_plane_gyre_red_grav_RK4():
+    xlen = 1e6
+    ylen = 2e6
+    nx = 10; ny = 20
+    layers = 1
+    grid = aro.Grid(nx, ny, layers, xlen / nx, ylen / ny)
+    def wind(_, Y):
+        return 0.05 * (1 - np.cos(2*np.pi * Y/np.max(grid.y)))
+    with working_directory(p.join(self_path, "beta_plane_gyre_red_grav_RK4")):
+        drv.simulate(zonalWindFile=[wind], valgrind=False,
+                     nx=nx, ny=ny, exe=test_executable, dx=xlen/nx, dy=ylen/ny)
+        assert_outputs_close(nx, ny, layers, 4e-13)
+        assert_volume_conservation(nx, ny, layers, 1e-5)
+        assert_diagnostics_similar(['h', 'u', 'v'], 1e-10)
+
+def test_beta_plane_gyre_red_grav_adaptive():
+    xlen = 1e6
+    ylen = 2e6
+    nx = 10; ny = 20
+    layers = 1
+    grid = aro.Grid(nx, ny, layers, xlen / nx, ylen / ny)
+    def wind(_, Y):
+        return 0.05 * (1 - np.cos(2*np.pi * Y/np.max(grid.y)))
+    with working_directory(p.join(self_path, "beta_plane_gyre_red_grav_adaptive")):
+        drv.simulate(zonalWindFile=[wind], valgrind=False,
+                     nx=nx, ny=ny, exe=test_executable, dx=xlen/nx, dy=ylen/ny)
+        assert_outputs_close(nx, ny, layers, 4e-13)
+        assert_volume_conservation(nx, ny, layers, 1e-5)
+        assert_diagnostics_similar(['h', 'u', 'v'], 1e-10)
+
+def test_beta_plane_gyre_red_grav_adaptive_restart():
+    """Restart an adaptive run from a checkpoint half way through it, and
+    check that it finishes as the uninterrupted run does, with the same
+    time steps. Averages are not kept in checkpoints, so the averaging
+    period ends at the checkpoint."""
+    xlen = 1e6
+    ylen = 2e6
+    nx = 10; ny = 20
+    layers = 1
+    grid = aro.Grid(nx, ny, layers, xlen / nx, ylen / ny)
+    def wind(_, Y):
+        return 0.05 * (1 - np.cos(2*np.pi * Y/np.max(grid.y)))
+    with working_directory(p.join(self_path,
+                                  "beta_plane_gyre_red_grav_adaptive_restart")):
+        for f in glob.glob("checkpoints/checkpoint.*"):
+            os.remove(f)
+        drv.simulate(zonalWindFile=[wind], valgrind=False,
+                     nx=nx, ny=ny, exe=test_executable, dx=xlen/nx, dy=ylen/ny)
+        keep_output("uninterrupted-output")
+        times = np.loadtxt("output/diagnostic.time.csv", delimiter=',',
+                           skiprows=1)
+        niter0 = int(times[times[:,1] == 24e5, 0][0])
+        assert p.exists("checkpoints/checkpoint.{0:010d}".format(niter0))
+
+        interrupt_output(niter0)
+        # The rest of the run is 4001 steps of length dt
+        drv.simulate(zonalWindFile=[wind], valgrind=False,
+                     nx=nx, ny=ny, exe=test_executable, dx=xlen/nx, dy=ylen/ny,
+                     niter0=niter0, nTimeSteps=4001)
+        assert_outputs_identical("uninterrupted-output", nx, ny, layers)
+
+def test_beta_plane_gyre_red_grav_mixed_precision():
+    xlen = 1e6
+    ylen = 2e6
+    nx = 10; ny = 20
+    layers = 1
+    grid = aro.Grid(nx, ny, layers, xlen / nx, ylen / ny)
+    def wind(_, Y):
+        return 0.05 * (1 - np.cos(2*np.pi * Y/np.max(grid.y)))
+    with working_directory(p.join(self_path, "beta_plane_gyre_red_grav")):
+        drv.simulate(zonalWindFile=[wind], valgrind=False,
+                     nx=nx, ny=ny, exe="aronnax_mixed_test",
+                     dx=xlen/nx, dy=ylen/ny)
+        # single precision state, compared with the double precision run
+        assert_outputs_close(nx, ny, layers, 1e-3)
+        assert_volume_conservation(nx, ny, layers, 1e-5)
+
 def test_beta_plane_gyre():
     xlen = 1e6
     ylen = 2e6
@@ -214,6 +629,324 @@ def test_beta_plane_gyre_free_surf():
         assert_outputs_close(nx, ny, layers, 3e-12)
         assert_volume_conservation(nx, ny, layers, 1e-5)
         assert_diagnostics_similar(['h', 'u', 'v', 'eta'], 1e-8)
+        assert_solver_diagnostics()
+
+def test_beta_plane_gyre_free_surf_decomposed(monkeypatch):
+    xlen = 1e6
+    ylen = 2e6
+    nx = 10; ny = 20
+    layers = 2
+    grid = aro.Grid(nx, ny, layers, xlen / nx, ylen / ny)
+    def wind(_, Y):
+        return 0.05 * (1 - np.cos(2*np.pi * Y/np.max(grid.y)))
+    # Let Open MPI start more processes than there are cores
+    monkeypatch.setenv("OMPI_MCA_rmaps_base_oversubscribe", "1")
+    with working_directory(p.join(self_path, "beta_plane_gyre_free_surf")):
+        drv.simulate(zonalWindFile=[wind], valgrind=False,
+                     nx=nx, ny=ny, exe=test_executable, dx=xlen/nx, dy=ylen/ny,
+                     nProcX=2, nProcY=3)
+        assert_outputs_close(nx, ny, layers, 3e-12)
+        assert_volume_conservation(nx, ny, layers, 1e-5)
+        assert_diagnostics_similar(['h', 'u', 'v', 'eta'], 1e-8)
+        assert_solver_diagnostics()
+
+def assert_decomposition_matches_serial(directory, monkeypatch, **options):
+    """Run the free surface gyre on one process and on 2x2 tiles with the
+    given options, and check that the outputs are the same bit for bit.
+    This is for the pressure solvers that work on the tiles, rather
+    than gathering the whole domain."""
+    xlen = 1e6
+    ylen = 2e6
+    nx = 10; ny = 20
+    layers = 2
+    grid = aro.Grid(nx, ny, layers, xlen / nx, ylen / ny)
+    def wind(_, Y):
+        return 0.05 * (1 - np.cos(2*np.pi * Y/np.max(grid.y)))
+    # Let Open MPI start more processes than there are cores
+    monkeypatch.setenv("OMPI_MCA_rmaps_base_oversubscribe", "1")
+    with working_directory(p.join(self_path, directory)):
+        drv.simulate(zonalWindFile=[wind], valgrind=False,
+                     nx=nx, ny=ny, exe=test_executable, dx=xlen/nx, dy=ylen/ny,
+                     nProcX=1, nProcY=1, **options)
+        keep_output("serial-output")
+        drv.simulate(zonalWindFile=[wind], valgrind=False,
+                     nx=nx, ny=ny, exe=test_executable, dx=xlen/nx, dy=ylen/ny,
+                     nProcX=2, nProcY=2, **options)
+        # The fields are the same bit for bit, but the diagnostics sum
+        # over the tiles in a different order
+        assert_outputs_identical("serial-output", nx, ny, layers,
+                                 diagnostics_rtol=1e-8)
+
+def test_beta_plane_gyre_free_surf_red_black_SOR_decomposed(monkeypatch):
+    assert_decomposition_matches_serial("beta_plane_gyre_free_surf",
+                                        monkeypatch, solver_algorithm=2)
+
+def test_beta_plane_gyre_free_surf_split_explicit_decomposed(monkeypatch):
+    assert_decomposition_matches_serial(
+        "beta_plane_gyre_free_surf_split_explicit", monkeypatch,
+        solver_algorithm=5)
+
+def test_beta_plane_gyre_free_surf_threaded():
+    xlen = 1e6
+    ylen = 2e6
+    nx = 10; ny = 20
+    layers = 2
+    grid = aro.Grid(nx, ny, layers, xlen / nx, ylen / ny)
+    def wind(_, Y):
+        return 0.05 * (1 - np.cos(2*np.pi * Y/np.max(grid.y)))
+    with working_directory(p.join(self_path, "beta_plane_gyre_free_surf")):
+        drv.simulate(zonalWindFile=[wind], valgrind=False,
+                     nx=nx, ny=ny, exe=test_executable, dx=xlen/nx, dy=ylen/ny,
+                     threads=3)
+        assert_outputs_close(nx, ny, layers, 3e-12)
+        assert_volume_conservation(nx, ny, layers, 1e-5)
+        assert_diagnostics_similar(['h', 'u', 'v', 'eta'], 1e-8)
+        assert_solver_diagnostics()
+
+def assert_gyre_free_surf_in_process(**options):
+    """Run the free surface gyre in process, and compare the final state
+    and diagnostics with the snapshots blessed from the executable."""
+    xlen = 1e6
+    ylen = 2e6
+    nx = 10; ny = 20
+    layers = 2
+    grid = aro.Grid(nx, ny, layers, xlen / nx, ylen / ny)
+    def wind(_, Y):
+        return 0.05 * (1 - np.cos(2*np.pi * Y/np.max(grid.y)))
+    # The initial thicknesses are given as an array
+    h_init = np.ones((layers, ny, nx))
+    h_init[0] = 600.; h_init[1] = 1400.
+    result = drv.simulate_in_process(zonalWindFile=[wind], initHfile=h_init,
+                 nx=nx, ny=ny, dx=xlen/nx, dy=ylen/ny)
+    for name in ["h", "u", "v", "eta"]:
+        good_ans = aro.interpret_raw_file(
+            "good-output/snap.{}.0000000801".format(name), nx, ny, layers)
+        assert np.amax(array_relative_error(result[name], good_ans)) < 1e-10
+    for name in ["h", "u", "v"]:
+        good_diags = np.loadtxt("good-output/diagnostic.{}.csv".format(name),
+            delimiter=',', skiprows=1)[-1, 1:]
+        np.testing.assert_allclose(result["diagnostics"][name].ravel(),
+                                   good_diags, rtol=1e-8, atol=1e-12)
+
+def test_beta_plane_gyre_free_surf_in_process():
+    with working_directory(p.join(self_path, "beta_plane_gyre_free_surf")):
+        assert_gyre_free_surf_in_process()
+
+def test_in_process_invalid_configuration():
+    """Configurations that the core would stop on raise an exception
+    instead, so that the Python process carries on."""
+    with working_directory(p.join(self_path, "beta_plane_gyre_free_surf")):
+        with pytest.raises(ValueError):
+            drv.simulate_in_process(nProcX=2, nProcY=2)
+        with pytest.raises(ValueError):
+            drv.simulate_in_process(H0=-1000.)
+        with pytest.raises(ValueError):
+            drv.simulate_in_process(depthFile=[lambda X, Y: 1000. - X])
+        # The core is left ready for the next run, which may name the
+        # single process explicitly
+        assert_gyre_free_surf_in_process(nProcX=1, nProcY=1)
+
+def test_beta_plane_gyre_free_surf_fused():
+    xlen = 1e6
+    ylen = 2e6
+    nx = 10; ny = 20
+    layers = 2
+    grid = aro.Grid(nx, ny, layers, xlen / nx, ylen / ny)
+    def wind(_, Y):
+        return 0.05 * (1 - np.cos(2*np.pi * Y/np.max(grid.y)))
+    with working_directory(p.join(self_path, "beta_plane_gyre_free_surf")):
+        drv.simulate(zonalWindFile=[wind], valgrind=False,
+                     nx=nx, ny=ny, exe=test_executable, dx=xlen/nx, dy=ylen/ny,
+                     tendency_algorithm=2)
+        assert_outputs_close(nx, ny, layers, 3e-12)
+        assert_volume_conservation(nx, ny, layers, 1e-5)
+        assert_diagnostics_similar(['h', 'u', 'v', 'eta'], 1e-8)
+        assert_solver_diagnostics()
+
+def test_beta_plane_gyre_free_surf_mixed_precision():
+    xlen = 1e6
+    ylen = 2e6
+    nx = 10; ny = 20
+    layers = 2
+    grid = aro.Grid(nx, ny, layers, xlen / nx, ylen / ny)
+    def wind(_, Y):
+        return 0.05 * (1 - np.cos(2*np.pi * Y/np.max(grid.y)))
+    with working_directory(p.join(self_path, "beta_plane_gyre_free_surf")):
+        drv.simulate(zonalWindFile=[wind], valgrind=False,
+                     nx=nx, ny=ny, exe="aronnax_mixed_test",
+                     dx=xlen/nx, dy=ylen/ny)
+        # single precision state, compared with the double precision run
+        assert_outputs_close(nx, ny, layers, 2e-3)
+        assert_volume_conservation(nx, ny, layers, 1e-5)
+        assert_solver_diagnostics()
+
+def test_beta_plane_gyre_free_surf_split_explicit():
+    xlen = 1e6
+    ylen = 2e6
+    nx = 10; ny = 20
+    layers = 2
+    grid = aro.Grid(nx, ny, layers, xlen / nx, ylen / ny)
+    def wind(_, Y):
+        return 0.05 * (1 - np.cos(2*np.pi * Y/np.max(grid.y)))
+    with working_directory(p.join(self_path,
+                                  "beta_plane_gyre_free_surf_split_explicit")):
+        drv.simulate(zonalWindFile=[wind], valgrind=False,
+                     nx=nx, ny=ny, exe=test_executable, dx=xlen/nx, dy=ylen/ny)
+        assert_outputs_close(nx, ny, layers, 3e-12)
+        assert_volume_conservation(nx, ny, layers, 1e-5)
+        assert_diagnostics_similar(['h', 'u', 'v', 'eta'], 1e-8)
+        # Subcycling should also reproduce the implicit free surface
+        # solution. The implicit solver damps barotropic gravity waves far
+        # more strongly than subcycling does, so only the layer
+        # thicknesses and the time averages of the other fields are
+        # close to it.
+        implicit_output = p.join(self_path, "beta_plane_gyre_free_surf",
+                                 "good-output")
+        for outfile in sorted(glob.glob("output/*.h.0*")):
+            ans = aro.interpret_raw_file(outfile, nx, ny, layers)
+            good_ans = aro.interpret_raw_file(
+                p.join(implicit_output, p.basename(outfile)), nx, ny, layers)
+            assert np.amax(array_relative_error(ans, good_ans)) < 1e-4
+        for outfile in sorted(glob.glob("output/av.*.0*")):
+            ans = aro.interpret_raw_file(outfile, nx, ny, layers)
+            good_ans = aro.interpret_raw_file(
+                p.join(implicit_output, p.basename(outfile)), nx, ny, layers)
+            assert np.amax(array_relative_error(ans, good_ans)) < 0.1
+
+def assert_solver_matches_SOR(directory, nx, ny, layers, skip_eta=False,
+                              wetmask=None, **solver_options):
+    """Run the wind driven gyre with the default SOR pressure solver and
+with the given `solver_options`, both with a tight tolerance, and check
+that they agree. With a rigid lid the surface pressure is only defined
+up to a constant, so set `skip_eta` to leave it out of the comparison.
+A `wetmask` function replaces the wet mask of the configuration in both
+runs."""
+    xlen = 1e6
+    ylen = 2e6
+    grid = aro.Grid(nx, ny, layers, xlen / nx, ylen / ny)
+    def wind(_, Y):
+        return 0.05 * (1 - np.cos(2*np.pi * Y/np.max(grid.y)))
+    mask_options = {} if wetmask is None else {"wetMaskFile": [wetmask]}
+    with working_directory(p.join(self_path, directory)):
+        # Output from runs on other grids would not be read correctly
+        if p.exists("output"):
+            shutil.rmtree("output")
+        drv.simulate(zonalWindFile=[wind], valgrind=False, eps=1e-10,
+                     nx=nx, ny=ny, exe=test_executable, dx=xlen/nx, dy=ylen/ny,
+                     **mask_options)
+        assert_solver_diagnostics()
+        SOR_outputs = {p.basename(outfile):
+            aro.interpret_raw_file(outfile, nx, ny, layers)
+            for outfile in glob.glob("output/*.0*")}
+
+        solver_options.update(mask_options)
+        drv.simulate(zonalWindFile=[wind], valgrind=False, eps=1e-10,
+                     nx=nx, ny=ny, exe=test_executable, dx=xlen/nx, dy=ylen/ny,
+                     **solver_options)
+        # including the warm-started solves, which must still reduce the
+        # residual of etastar by eps
+        assert_solver_diagnostics(
+            iterative=solver_options.get("solver_algorithm") != 4)
+        for outfile in sorted(glob.glob("output/*.0*")):
+            if skip_eta and ".eta." in outfile:
+                continue
+            ans = aro.interpret_raw_file(outfile, nx, ny, layers)
+            relerr = np.amax(array_relative_error(ans,
+                SOR_outputs[p.basename(outfile)]))
+            assert relerr < 1e-8, outfile
+        assert_volume_conservation(nx, ny, layers, 1e-5)
+
+def test_beta_plane_gyre_free_surf_red_black_SOR():
+    assert_solver_matches_SOR("beta_plane_gyre_free_surf", 10, 20, 2,
+                              solver_algorithm=2)
+
+def test_beta_plane_gyre_free_surf_multigrid():
+    assert_solver_matches_SOR("beta_plane_gyre_free_surf", 10, 20, 2,
+                              solver_algorithm=3)
+
+def pool_with_island(X, Y):
+    """Wet mask for a rectangular pool with an island in the middle"""
+    wetmask = np.where((X > X.min()) & (X < X.max())
+                       & (Y > Y.min()) & (Y < Y.max()), 1., 0.)
+    island = ((np.abs(X - X.mean()) < 0.2*(X.max() - X.min()))
+              & (np.abs(Y - Y.mean()) < 0.15*(Y.max() - Y.min())))
+    wetmask[island] = 0
+    return wetmask
+
+def test_beta_plane_gyre_free_surf_island_multigrid():
+    assert_solver_matches_SOR("beta_plane_gyre_free_surf", 10, 20, 2,
+                              wetmask=pool_with_island, solver_algorithm=3)
+
+def test_periodic_BC_multigrid():
+    # Doubly periodic, with no land
+    assert_solver_matches_SOR("periodic_BC", 20, 10, 2, solver_algorithm=3)
+
+def assert_span_loops_match_full_loops(directory, layers):
+    """Run the wind driven gyre in a pool with an island, so that some
+rows hold more than one span of wet points, once with the loops that
+skip the land and once with debug_level = 4, which visits every point.
+The snapshots and averages must be the same bit for bit."""
+    xlen = 1e6
+    ylen = 2e6
+    nx = 10; ny = 20
+    grid = aro.Grid(nx, ny, layers, xlen / nx, ylen / ny)
+    def wind(_, Y):
+        return 0.05 * (1 - np.cos(2*np.pi * Y/np.max(grid.y)))
+    with working_directory(p.join(self_path, directory)):
+        if p.exists("output"):
+            shutil.rmtree("output")
+        drv.simulate(zonalWindFile=[wind], wetMaskFile=[pool_with_island],
+                     valgrind=False, nx=nx, ny=ny, exe=test_executable,
+                     dx=xlen/nx, dy=ylen/ny)
+        keep_output("span-output")
+        shutil.rmtree("output")
+        drv.simulate(zonalWindFile=[wind], wetMaskFile=[pool_with_island],
+                     valgrind=False, nx=nx, ny=ny, exe=test_executable,
+                     dx=xlen/nx, dy=ylen/ny, debug_level=4)
+        # The debug run also writes a snapshot every time step
+        for reference in sorted(glob.glob("span-output/*.0*")):
+            outfile = p.join("output", p.basename(reference))
+            np.testing.assert_array_equal(
+                aro.interpret_raw_file(outfile, nx, ny, layers),
+                aro.interpret_raw_file(reference, nx, ny, layers))
+        # The extra debug output would be read by the next test to run
+        # in this directory
+        shutil.rmtree("output")
+
+def test_beta_plane_gyre_red_grav_island_span_loops():
+    assert_span_loops_match_full_loops("beta_plane_gyre_red_grav", 1)
+
+def test_beta_plane_gyre_free_surf_island_span_loops():
+    assert_span_loops_match_full_loops("beta_plane_gyre_free_surf", 2)
+
+def test_beta_plane_gyre_multigrid():
+    assert_solver_matches_SOR("beta_plane_gyre", 10, 10, 2, skip_eta=True,
+                              solver_algorithm=3)
+
+def test_beta_plane_gyre_free_surf_extrapolated_first_guess():
+    assert_solver_matches_SOR("beta_plane_gyre_free_surf", 10, 20, 2,
+                              solver_first_guess=3)
+
+def test_beta_plane_gyre_multigrid_previous_first_guess():
+    assert_solver_matches_SOR("beta_plane_gyre", 10, 10, 2, skip_eta=True,
+                              solver_algorithm=3, solver_first_guess=2)
+
+def test_beta_plane_gyre_FFT():
+    assert_solver_matches_SOR("beta_plane_gyre", 10, 10, 2, skip_eta=True,
+                              solver_algorithm=4)
+
+def test_beta_plane_gyre_free_surf_FFT():
+    assert_solver_matches_SOR("beta_plane_gyre_free_surf", 10, 20, 2,
+                              solver_algorithm=4)
+
+def zonal_channel(X, Y):
+    """Wet mask for a channel that is closed to the north and south, and
+    periodic in x"""
+    return np.where((Y > Y.min()) & (Y < Y.max()), 1., 0.)
+
+def test_periodic_channel_FFT():
+    assert_solver_matches_SOR("periodic_BC", 20, 10, 2,
+                              wetmask=zonal_channel, solver_algorithm=4)
 
 def test_periodic_BC_red_grav():
     nx = 50
@@ -249,6 +982,42 @@ def test_periodic_BC_red_grav():
         assert_volume_conservation(nx, ny, layers, 1e-5)
         assert_diagnostics_similar(['h', 'u', 'v'], 1e-10)
 
+def test_closed_basin():
+    xlen = 1e6
+    ylen = 2e6
+    nx = 10; ny = 20
+    layers = 2
+    grid = aro.Grid(nx, ny, layers, xlen / nx, ylen / ny)
+    def wind(_, Y):
+        return 0.05 * (1 - np.cos(2*np.pi * Y/np.max(grid.y)))
+    # No wet mask: the walls come from the domain not being periodic
+    with working_directory(p.join(self_path, "closed_basin")):
+        drv.simulate(zonalWindFile=[wind], valgrind=False,
+                     nx=nx, ny=ny, exe=test_executable, dx=xlen/nx, dy=ylen/ny)
+        assert_outputs_close(nx, ny, layers, 3e-12)
+        assert_volume_conservation(nx, ny, layers, 1e-5)
+        assert_diagnostics_similar(['h', 'u', 'v', 'eta'], 1e-8)
+        assert_solver_diagnostics()
+
+def test_closed_basin_decomposed(monkeypatch):
+    xlen = 1e6
+    ylen = 2e6
+    nx = 10; ny = 20
+    layers = 2
+    grid = aro.Grid(nx, ny, layers, xlen / nx, ylen / ny)
+    def wind(_, Y):
+        return 0.05 * (1 - np.cos(2*np.pi * Y/np.max(grid.y)))
+    # Let Open MPI start more processes than there are cores
+    monkeypatch.setenv("OMPI_MCA_rmaps_base_oversubscribe", "1")
+    with working_directory(p.join(self_path, "closed_basin")):
+        drv.simulate(zonalWindFile=[wind], valgrind=False,
+                     nx=nx, ny=ny, exe=test_executable, dx=xlen/nx, dy=ylen/ny,
+                     nProcX=2, nProcY=3)
+        assert_outputs_close(nx, ny, layers, 3e-12)
+        assert_volume_conservation(nx, ny, layers, 1e-5)
+        assert_diagnostics_similar(['h', 'u', 'v', 'eta'], 1e-8)
+        assert_solver_diagnostics()
+
 
 def test_relative_wind():
     nx = 320